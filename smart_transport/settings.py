@@ -41,6 +41,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'traffic.middleware.InstrumentationMiddleware',
+    'traffic.middleware.CompressionMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -77,6 +79,10 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # WAL lets readers proceed while telemetry batches are being written
+        'OPTIONS': {
+            'init_command': 'PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL;',
+        },
     }
 }
 
@@ -117,13 +123,180 @@ USE_TZ = True
 
 STATIC_URL = 'static/'
 
+# collectstatic minifies the app's CSS and JS and gives every file a
+# content-hashed name listed in a manifest: those names change whenever the
+# content does, so STATIC_ROOT can be served with
+# "Cache-Control: public, max-age=31536000, immutable". Run it before
+# starting with DEBUG = False.
+STATIC_ROOT = BASE_DIR / 'staticfiles'
+STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'traffic.storage.MinifiedManifestStaticFilesStorage'},
+}
+
+# Seconds the static parts of the dashboard template stay rendered in the
+# cache (not cached while DEBUG)
+DASHBOARD_FRAGMENT_TIMEOUT = 3600
+
 # ML directories
 DATA_ROOT = BASE_DIR / 'data'
 MODELS_ROOT = BASE_DIR / 'models'
+JOBS_ROOT = BASE_DIR / 'jobs'
+
+# Background simulation/training jobs
+TRAINING_WORKERS = 1
+TRAINING_JOB_TIMEOUT = 3600
+# Seconds finished job records are kept before submit_training_job prunes them
+JOB_RETENTION = 7 * 86400
+# Largest n_samples /simulate/ accepts (the request is unauthenticated)
+SIMULATE_MAX_SAMPLES = 1000000
+
+# Incremental training: rows per streamed chunk and cap on the forest size
+TRAINING_CHUNK_SIZE = 1 << 20
+MAX_FOREST_ESTIMATORS = 300
+# Rows buffered while chunks lack a class and none can be borrowed from
+# earlier rows; training fails beyond it (default: 4 chunks)
+TRAINING_MAX_PENDING_ROWS = 4 * TRAINING_CHUNK_SIZE
+
+# Training with model selection (/simulate/?select=1, manage.py train_model
+# --select): among candidates within MODEL_SELECTION_TOLERANCE of the best
+# hold-out accuracy, keep the one with the lowest 'latency' (single row),
+# 'batch_latency' (1000 rows) or 'size'. Candidates default to
+# model_selection.DEFAULT_CANDIDATES; workers default to every core.
+MODEL_SELECTION_OBJECTIVE = 'latency'
+MODEL_SELECTION_TOLERANCE = 0.005
+MODEL_SELECTION_CANDIDATES = None
+MODEL_SELECTION_WORKERS = None
+
+# Hotspots (GeoJSON points or polygons, optional id/name/radius properties)
+# the simulator concentrates congestion around and the model measures
+# distances to; the two built-in Abidjan ones are used while the file is
+# missing. HOTSPOT_RADIUS (metres) applies to hotspots without a radius.
+HOTSPOTS_PATH = DATA_ROOT / 'hotspots.geojson'
+HOTSPOT_RADIUS = 1650
+
+# Regions served by models of their own (empty: one model for the whole map).
+# Each name maps to a 'bbox' (south, west, north, east) and/or a 'polygon' of
+# (lat, lng) vertices, plus the 'hotspots' its data is simulated around, e.g.
+#     'abidjan': {'bbox': (5.30, -4.05, 5.40, -3.95), 'hotspots': [(5.33, -4.02), (5.37, -3.99)]},
+#     'bouake': {'bbox': (7.64, -5.08, 7.74, -4.98)},
+# Artifacts live under DATA_ROOT/regions/<name> and MODELS_ROOT/regions/<name>;
+# build them with /simulate/ or manage.py train_model --all-regions. A worker
+# keeps the regions it serves loaded until they exceed REGION_MEMORY_BUDGET
+# bytes, then drops the least recently used. REGION_INDEX_CELL is the cell
+# size (degrees) of the lookup grid; REGION_BUILD_WORKERS defaults to every core.
+REGIONS = {}
+REGION_MEMORY_BUDGET = 1 << 30
+REGION_INDEX_CELL = 0.25
+REGION_BUILD_WORKERS = None
+
+# Export the flattened forest with float32 thresholds/leaf values and int16 features
+FOREST_QUANTIZED = False
+
+# Micro-batching of concurrent /predict/ calls (ASGI): rows per batch,
+# seconds to wait for a batch to fill, and rows queued before answering 503
+PREDICTION_BATCH_SIZE = 64
+PREDICTION_BATCH_WINDOW = 0.002
+PREDICTION_QUEUE_LIMIT = 1024
+
+# Batches above this size skip the flattened forest for sklearn's compiled traversal
+FOREST_BATCH_LIMIT = 256
+# Rows scored per chunk by /api/predict-batch/
+BATCH_PREDICTION_CHUNK_SIZE = 10000
+
+# Local routing: road graph extract (.npz, .osm or .geojson; a synthetic grid
+# is used when missing), travel-time multiplier per traffic class, and the
+# farthest a requested point may be from the network, in metres
+ROAD_GRAPH_PATH = DATA_ROOT / 'road_graph.npz'
+ROUTING_CONGESTION_FACTORS = (1.0, 1.6, 2.8)
+ROUTING_MAX_SNAP_DISTANCE = 1000
+
+# Scoring of route alternatives (/api/route/score/): metres between sampled
+# points, and caps on the routes per request and on the points sampled
+ROUTE_SCORING_SPACING = 50
+ROUTE_SCORING_MAX_ROUTES = 10
+ROUTE_SCORING_MAX_SAMPLES = 100000
+
+# Geocoding: offline gazetteer (CSV or GeoJSON), cache of upstream answers
+# (in-process LRU entries, SQLite file, TTLs in seconds) and the Nominatim
+# server asked on a miss (None keeps every lookup local)
+GAZETTEER_PATH = DATA_ROOT / 'gazetteer.csv'
+GEOCODING_CACHE_PATH = DATA_ROOT / 'geocode_cache.sqlite3'
+GEOCODING_CACHE_SIZE = 4096
+GEOCODING_CACHE_TTL = 30 * 86400
+GEOCODING_NEGATIVE_TTL = 86400
+GEOCODING_REVERSE_DISTANCE = 1500
+GEOCODING_UPSTREAM_URL = 'https://nominatim.openstreetmap.org'
+
+# Server-side fleet simulation streamed to the dashboard (ASGI only):
+# vehicles, distinct routes they drive, seconds per tick, and frames
+# buffered per client before it is resynchronized with a keyframe
+FLEET_VEHICLES = 2000
+FLEET_ROUTES = 256
+FLEET_TICK = 0.5
+FLEET_CLIENT_QUEUE = 16
+
+# Telemetry ingestion: buffered points written in bulk once FLUSH_SIZE are
+# waiting or every FLUSH_INTERVAL seconds, refused beyond MAX_PENDING.
+# Live stats cover WINDOW seconds in BUCKET-second slices over a grid of
+# CELL_SIZE degrees. Devices send TELEMETRY_TOKEN as X-Telemetry-Token;
+# while it is unset, ingestion is refused unless DEBUG.
+TELEMETRY_FLUSH_SIZE = 5000
+TELEMETRY_FLUSH_INTERVAL = 2.0
+TELEMETRY_MAX_PENDING = 200000
+TELEMETRY_WINDOW = 900
+TELEMETRY_BUCKET = 60
+TELEMETRY_CELL_SIZE = 0.01
+TELEMETRY_TOKEN = None
+
+# Incidents: cell size (degrees) of the in-memory index each worker keeps,
+# seconds between its syncs with the database (and expiry sweeps), seconds
+# expired rows stay in the table, lifetime of a report without ttl, and most
+# incidents returned per viewport. With INCIDENT_OVERRIDE, predictions within
+# INCIDENT_RADII metres (by severity) of an incident are raised to its class.
+INCIDENT_CELL_SIZE = 0.01
+INCIDENT_SYNC_INTERVAL = 5
+INCIDENT_RETENTION = 3600
+INCIDENT_DEFAULT_TTL = 3600
+INCIDENT_QUERY_LIMIT = 1000
+INCIDENT_OVERRIDE = True
+INCIDENT_RADII = {1: 150, 2: 300, 3: 500}
+
+# Map clustering (/api/clusters/): cells per 256 px tile side, zoom from
+# which points are sent one by one, tiles cached per layer snapshot, and the
+# most tiles one viewport may span
+CLUSTER_CELLS_PER_TILE = 4
+CLUSTER_MAX_ZOOM = 16
+CLUSTER_TILE_CACHE = 4096
+CLUSTER_MAX_TILES = 256
+
+# API responses: JSON bodies of at least API_COMPRESS_MIN_SIZE bytes are
+# gzipped (or brotli-compressed when the brotli package is installed, and
+# encoded with orjson when that is). Trends may be reused by the browser for
+# API_CACHE_MAX_AGE seconds; after that, and always for user data and jobs,
+# they are revalidated against their ETag.
+API_COMPRESS_MIN_SIZE = 1024
+API_GZIP_LEVEL = 6
+API_BROTLI_QUALITY = 5
+API_CACHE_MAX_AGE = 60
+
+# Search history is written behind the prediction request, by bulk_create
+# every HISTORY_FLUSH_INTERVAL seconds or HISTORY_FLUSH_SIZE entries.
+HISTORY_FLUSH_SIZE = 500
+HISTORY_FLUSH_INTERVAL = 1.0
+HISTORY_MAX_PENDING = 50000
+
+# Sampling profiler for slow requests (off while None): stacks are sampled
+# every METRICS_PROFILE_INTERVAL seconds and those of requests slower than
+# METRICS_PROFILE_SLOW_MS are written as folded stacks to METRICS_PROFILE_DIR.
+METRICS_PROFILE_SLOW_MS = None
+METRICS_PROFILE_INTERVAL = 0.005
+METRICS_PROFILE_DIR = BASE_DIR / 'profiles'
 
 # Ensure directories exist
 DATA_ROOT.mkdir(exist_ok=True)
 MODELS_ROOT.mkdir(exist_ok=True)
+JOBS_ROOT.mkdir(exist_ok=True)
 
 # Email configuration for development (logs to console)
 EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
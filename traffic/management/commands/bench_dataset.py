@@ -0,0 +1,71 @@
+import multiprocessing
+import os
+import resource
+import tempfile
+import time
+from django.core.management.base import BaseCommand
+from traffic.utils.data_simulator import iter_traffic_chunks, stream_traffic_data
+from traffic.utils.dataset_store import write_dataset
+
+
+def _peak_rss_kb():
+    # ru_maxrss survives exec on Linux, so prefer the high-water mark of this process's own mm
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except FileNotFoundError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def _measure(kind, path):
+    """
+    Load the dataset in a fresh process; returns (seconds, peak extra RSS in MB).
+    """
+    import numpy as np
+    import pandas as pd
+    from traffic.utils.dataset_store import open_dataset, load_dataframe
+
+    baseline = _peak_rss_kb()
+    start = time.perf_counter()
+    if kind == 'csv':
+        df = pd.read_csv(path)
+        total = df['traffic_level'].sum()
+    elif kind == 'columns':
+        df = load_dataframe(path)
+        total = df['traffic_level'].sum()
+    else:
+        arrays = open_dataset(path)
+        total = np.add.reduce(arrays['traffic_level'], dtype=np.int64)
+    elapsed = time.perf_counter() - start
+    peak = _peak_rss_kb()
+    return elapsed, (peak - baseline) / 1024, int(total)
+
+
+class Command(BaseCommand):
+    help = "Compare load time and resident memory of the CSV and columnar training data."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, nargs='+', default=[1000000, 10000000])
+
+    def handle(self, *args, **options):
+        context = multiprocessing.get_context('spawn')
+        for n_rows in options['rows']:
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                csv_path = os.path.join(tmp_dir, 'traffic_data.csv')
+                store_path = os.path.join(tmp_dir, 'traffic_data')
+                stream_traffic_data(n_rows, csv_path)
+                write_dataset(iter_traffic_chunks(n_rows), store_path, seed=42)
+
+                csv_mb = os.path.getsize(csv_path) / 1e6
+                store_mb = sum(
+                    os.path.getsize(os.path.join(store_path, name)) for name in os.listdir(store_path)
+                ) / 1e6
+                self.stdout.write(f"{n_rows:,} rows: csv {csv_mb:,.1f} MB, columns {store_mb:,.1f} MB on disk")
+
+                for kind, path in (('csv', csv_path), ('columns', store_path), ('mmap', store_path)):
+                    with context.Pool(1) as pool:
+                        elapsed, rss_mb, _ = pool.apply(_measure, (kind, path))
+                    self.stdout.write(f"  {kind:<8} load {elapsed:8.3f}s   peak RSS +{rss_mb:,.1f} MB")
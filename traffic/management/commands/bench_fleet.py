@@ -0,0 +1,41 @@
+import time
+import numpy as np
+from django.core.management.base import BaseCommand
+from traffic.utils.fleet_simulation import FleetSimulation, FrameEncoder, FRAME_HEADER
+
+
+class Command(BaseCommand):
+    help = "Measure fleet simulation tick time and position frame size."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--vehicles', type=int, nargs='+', default=[1000, 5000, 20000])
+        parser.add_argument('--ticks', type=int, default=200)
+        parser.add_argument('--tick', type=float, default=0.5, help="Simulated seconds per tick.")
+
+    def handle(self, *args, **options):
+        self.stdout.write(
+            f"{'vehicles':>9}{'step ms':>10}{'encode ms':>11}{'p95 ms':>9}"
+            f"{'delta B':>10}{'key B':>9}{'B/vehicle':>11}"
+        )
+        for n_vehicles in options['vehicles']:
+            simulation = FleetSimulation(n_vehicles, hour=8, day_of_week=0)
+            encoder = FrameEncoder(n_vehicles)
+            encoder.encode(*simulation.positions())
+            steps, encodes, sizes = [], [], []
+            for _ in range(options['ticks']):
+                start = time.perf_counter()
+                simulation.step(options['tick'])
+                positions = simulation.positions()
+                middle = time.perf_counter()
+                _, body = encoder.encode(*positions)
+                end = time.perf_counter()
+                steps.append((middle - start) * 1000)
+                encodes.append((end - middle) * 1000)
+                sizes.append(FRAME_HEADER.size + len(body))
+
+            total = np.add(steps, encodes)
+            keyframe = FRAME_HEADER.size + len(encoder.keyframe()[1])
+            self.stdout.write(
+                f"{n_vehicles:>9}{np.mean(steps):>10.2f}{np.mean(encodes):>11.2f}{np.percentile(total, 95):>9.2f}"
+                f"{np.mean(sizes):>10.0f}{keyframe:>9}{np.mean(sizes) / n_vehicles:>11.2f}"
+            )
@@ -0,0 +1,117 @@
+import os
+import tempfile
+import time
+from datetime import timedelta
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.utils import timezone
+from traffic.models import Incident
+from traffic.utils.incidents import IncidentStore, parse_incidents
+
+BBOX = (5.20, -4.15, 5.50, -3.85)
+# Viewport edge in degrees: a street, a district, the whole city
+VIEWPORTS = {'street': 0.005, 'district': 0.03, 'city': 0.3}
+
+
+def _percentiles(timings):
+    timings = np.asarray(timings) * 1000
+    return float(np.median(timings)), float(np.percentile(timings, 95))
+
+
+class Command(BaseCommand):
+    help = "Measure incident viewport queries, prediction overrides and syncs at a given number of active incidents."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--incidents', type=int, default=100000)
+        parser.add_argument('--queries', type=int, default=200, help="Queries per viewport size.")
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            self.stderr.write("This benchmark targets SQLite.")
+            return
+
+        settings.DEBUG = False
+        scratch = tempfile.mkdtemp()
+        connection.settings_dict.setdefault('TEST', {})['NAME'] = os.path.join(scratch, 'incidents.sqlite3')
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            self._run(options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def _run(self, options):
+        n = options['incidents']
+        rng = np.random.default_rng(0)
+        south, west, north, east = BBOX
+        # Reported over the last half hour, active for up to two more hours
+        now = timezone.now()
+        reported = now - timedelta(minutes=30)
+        ttl = rng.uniform(1800, 9000, n)
+        t0 = time.perf_counter()
+        Incident.objects.bulk_create([
+            Incident(
+                kind='accident', severity=int(s), lat=float(la), lng=float(ln),
+                created_at=reported, updated_at=reported, expires_at=reported + timedelta(seconds=float(t)),
+            )
+            for la, ln, s, t in zip(rng.uniform(south, north, n), rng.uniform(west, east, n), rng.integers(1, 4, n), ttl)
+        ], batch_size=5000)
+        insert_s = time.perf_counter() - t0
+
+        store = IncidentStore()
+        t0 = time.perf_counter()
+        store.load()
+        load_ms = (time.perf_counter() - t0) * 1000
+        self.stdout.write(f"{len(store.index):,} active incidents: inserted in {insert_s:.1f} s, indexed in {load_ms:.0f} ms")
+
+        for name, size in VIEWPORTS.items():
+            timings, found = [], 0
+            for lat, lng in zip(rng.uniform(south, north - size, options['queries']), rng.uniform(west, east - size, options['queries'])):
+                t0 = time.perf_counter()
+                result = store.query(lat, lng, lat + size, lng + size)
+                timings.append(time.perf_counter() - t0)
+                found += result['total']
+            median, p95 = _percentiles(timings)
+            self.stdout.write(
+                f"  query {name:<9}: median {median:.3f} ms, p95 {p95:.3f} ms, "
+                f"{found / options['queries']:,.0f} incidents in view"
+            )
+
+        # Zone trees are built by the first override after a change
+        t0 = time.perf_counter()
+        store.override(np.array([5.3]), np.array([-4.0]), np.zeros(1, dtype=np.int64))
+        self.stdout.write(f"  override trees: built in {(time.perf_counter() - t0) * 1000:.0f} ms")
+        for rows in (1, 1000, 100000):
+            lats, lngs = rng.uniform(south, north, rows), rng.uniform(west, east, rows)
+            levels = np.zeros(rows, dtype=np.int64)
+            timings = []
+            for _ in range(20 if rows > 1000 else 200):
+                t0 = time.perf_counter()
+                overridden = store.override(lats, lngs, levels)
+                timings.append(time.perf_counter() - t0)
+            median, p95 = _percentiles(timings)
+            self.stdout.write(
+                f"  override {rows:>6} rows: median {median:.3f} ms, p95 {p95:.3f} ms "
+                f"({np.count_nonzero(overridden) / rows:.0%} raised)"
+            )
+
+        t0 = time.perf_counter()
+        store.report(parse_incidents({'lat': 5.33, 'lng': -4.02, 'severity': 3, 'kind': 'closure'}))
+        self.stdout.write(f"  report one    : {(time.perf_counter() - t0) * 1000:.1f} ms (insert and reindex)")
+        t0 = time.perf_counter()
+        store.sync()
+        self.stdout.write(f"  sync          : {(time.perf_counter() - t0) * 1000:.1f} ms with no remote change")
+
+        # Expire a tenth, as if their time had passed, then sweep
+        expired = list(Incident.objects.order_by('id').values_list('id', flat=True)[:n // 10])
+        gone = timezone.now() - timedelta(seconds=store.retention + 1)
+        Incident.objects.filter(id__in=expired).update(expires_at=gone, updated_at=timezone.now())
+        t0 = time.perf_counter()
+        changed = store.sync()
+        sync_ms = (time.perf_counter() - t0) * 1000
+        t0 = time.perf_counter()
+        deleted = store.sweep()
+        sweep_ms = (time.perf_counter() - t0) * 1000
+        self.stdout.write(f"  sync          : {sync_ms:.0f} ms for {changed:,} expired elsewhere")
+        self.stdout.write(f"  sweep         : {sweep_ms:.0f} ms, {deleted:,} rows deleted, {len(store.index):,} left")
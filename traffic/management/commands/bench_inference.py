@@ -0,0 +1,52 @@
+import time
+import numpy as np
+from django.core.management.base import BaseCommand
+from traffic.utils.data_simulator import iter_traffic_chunks
+from traffic.utils.features import FEATURE_COLUMNS, as_model_input
+from traffic.utils.forest_engine import FlatForest, flatten_forest
+from traffic.utils.model_registry import get_model
+
+
+def _latency_ms(fn, X, repeat):
+    fn(X)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn(X)
+    return (time.perf_counter() - start) * 1000 / repeat
+
+
+class Command(BaseCommand):
+    help = "Compare sklearn and flat-array forest inference latency, and check they agree."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 64, 1000, 10000])
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def handle(self, *args, **options):
+        model = get_model()
+        if model is None:
+            self.stderr.write("Model not trained yet.")
+            return
+
+        X = next(iter_traffic_chunks(max(options['batch_sizes']), seed=7))[FEATURE_COLUMNS].to_numpy(np.float64)
+        engines = {'sklearn': (lambda X: model.predict(as_model_input(model, X)))}
+        for quantized in (False, True):
+            arrays, max_depth = flatten_forest(model, quantized)
+            forest = FlatForest(arrays, max_depth, schema=getattr(model, 'feature_schema_', None))
+            name = 'flat-q' if quantized else 'flat'
+            engines[name] = forest.predict
+
+            reference = model.predict_proba(as_model_input(model, X))
+            proba = forest.predict_proba(X)
+            self.stdout.write(
+                f"{name}: predict_proba identical={np.array_equal(proba, reference)} "
+                f"max|diff|={np.abs(proba - reference).max():.2e}, "
+                f"{sum(a.nbytes for a in arrays.values()) / 1e6:.1f} MB, depth {max_depth}"
+            )
+
+        self.stdout.write(f"{'batch':>8}" + ''.join(f"{name:>12}" for name in engines) + "   (ms per call)")
+        for batch_size in options['batch_sizes']:
+            batch = X[:batch_size]
+            repeat = max(1, options['repeat'] // max(1, batch_size // 1000))
+            row = ''.join(f"{_latency_ms(fn, batch, repeat):>12.3f}" for fn in engines.values())
+            self.stdout.write(f"{batch_size:>8}" + row)
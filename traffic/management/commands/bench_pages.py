@@ -0,0 +1,154 @@
+import gzip
+import os
+import posixpath
+import re
+import tempfile
+import time
+import numpy as np
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.staticfiles import finders
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client
+
+# (name, path, needs a logged-in user)
+PAGES = [('dashboard', '/dashboard/', True), ('login', '/login/', False), ('home', '/', False)]
+# Preferred first, as a browser that supports them all would pick
+IMAGE_TYPES = ('image/avif', 'image/webp')
+ASSET_RE = re.compile(r'''(?:href|src)=["']([^"']+)["']|url\(\s*["']?([^"')]+)["']?\s*\)''')
+PICTURE_RE = re.compile(r'<picture\b.*?</picture>', re.S)
+SOURCE_RE = re.compile(r'<(source|img)\b([^>]*)>')
+ATTR_RE = re.compile(r'''([\w-]+)=["']([^"']*)["']''')
+
+
+def _gzipped(data):
+    return len(gzip.compress(data, 6))
+
+
+def _candidate(srcset, viewport):
+    """
+    The srcset entry a full-width image gets at this viewport width: the
+    narrowest at least as wide, or the widest.
+    """
+    entries = []
+    for item in srcset.split(','):
+        url, _, width = item.strip().partition(' ')
+        entries.append((int(width.rstrip('w') or 0), url))
+    entries.sort()
+    return next((url for width, url in entries if width >= viewport), entries[-1][1])
+
+
+def _pictures(html, viewport):
+    """
+    The file each <picture> downloads: its first supported source, or its
+    <img>. Returns those URLs and the markup without the pictures.
+    """
+    urls = []
+    for picture in PICTURE_RE.findall(html):
+        chosen = None
+        for tag, attrs in SOURCE_RE.findall(picture):
+            attrs = dict(ATTR_RE.findall(attrs))
+            if tag == 'source' and attrs.get('type') not in IMAGE_TYPES:
+                continue
+            chosen = _candidate(attrs['srcset'], viewport) if attrs.get('srcset') else attrs.get('src')
+            break
+        if chosen:
+            urls.append(chosen)
+    return urls, PICTURE_RE.sub('', html)
+
+
+class Command(BaseCommand):
+    help = "Measure the weight (HTML and local static assets) and server time of the dashboard and landing pages."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--renders', type=int, default=100, help="Requests per page for the timing.")
+        parser.add_argument('--viewport', type=int, default=1280, help="Viewport width, in pixels, for srcset.")
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            self.stderr.write("This benchmark targets SQLite.")
+            return
+
+        # Served as in production: collected (and hashed) files, no debug
+        settings.DEBUG = False
+        settings.ALLOWED_HOSTS = [*settings.ALLOWED_HOSTS, 'localhost']
+        scratch = tempfile.mkdtemp()
+        settings.STATIC_ROOT = os.path.join(scratch, 'static')
+        call_command('collectstatic', interactive=False, verbosity=0)
+        connection.settings_dict.setdefault('TEST', {})['NAME'] = os.path.join(scratch, 'pages.sqlite3')
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            self._run(options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def _asset(self, url):
+        path = posixpath.normpath(url.split('?')[0].split('#')[0])
+        if not path.startswith('/' + settings.STATIC_URL.lstrip('/')):
+            return None
+        name = path[len(settings.STATIC_URL.lstrip('/')) + 1:]
+        full = os.path.join(settings.STATIC_ROOT, name)
+        if not os.path.exists(full):
+            full = finders.find(name)
+        if not full:
+            return None
+        with open(full, 'rb') as f:
+            return f.read()
+
+    def _assets(self, html, viewport, seen=None):
+        """
+        Local static files the page loads, CSS imports and url()s included.
+        """
+        seen = set() if seen is None else seen
+        urls, html = _pictures(html, viewport)
+        urls += [a or b for a, b in ASSET_RE.findall(html)]
+        assets = {}
+        for url in urls:
+            if url in seen:
+                continue
+            seen.add(url)
+            data = self._asset(url)
+            if data is None:
+                continue
+            assets[url] = data
+            if url.split('?')[0].endswith('.css'):
+                base = url.rsplit('/', 1)[0]
+                nested = re.sub(r'''url\(\s*["']?(?![/a-z]+:|/|data:)''', lambda m: m.group(0) + base + '/', data.decode())
+                assets.update(self._assets(nested, viewport, seen))
+        return assets
+
+    def _run(self, options):
+        user = User.objects.create_user('pages', password=None)
+        anonymous = Client(HTTP_HOST='localhost')
+        logged_in = Client(HTTP_HOST='localhost')
+        logged_in.force_login(user)
+
+        self.stdout.write(
+            f"{'page':<10} {'html':>9} {'gzip':>8} {'assets':>9} {'gzip':>8} {'images':>9} "
+            f"{'first visit':>12} {'repeat':>8} {'p50 ms':>8} {'p95 ms':>8}"
+        )
+        for name, path, login in PAGES:
+            client = logged_in if login else anonymous
+            response = client.get(path)
+            html = response.content
+            assets = self._assets(html.decode(), options['viewport'])
+            images = {url: data for url, data in assets.items() if re.search(r'\.(jpe?g|png|webp|avif)$', url)}
+            text = [data for url, data in assets.items() if url not in images]
+            html_gz = _gzipped(html)
+            text_gz = sum(_gzipped(data) for data in text)
+            image_bytes = sum(len(data) for data in images.values())
+
+            timings = []
+            for _ in range(options['renders']):
+                start = time.perf_counter()
+                client.get(path)
+                timings.append((time.perf_counter() - start) * 1000)
+            p50, p95 = np.percentile(timings, [50, 95])
+            # Static files are cached between visits; the HTML is not
+            self.stdout.write(
+                f"{name:<10} {len(html) / 1024:>7.1f}KB {html_gz / 1024:>6.1f}KB "
+                f"{sum(len(data) for data in text) / 1024:>7.1f}KB {text_gz / 1024:>6.1f}KB {image_bytes / 1024:>7.1f}KB "
+                f"{(html_gz + text_gz + image_bytes) / 1024:>10.1f}KB {html_gz / 1024:>6.1f}KB {p50:>8.2f} {p95:>8.2f}"
+            )
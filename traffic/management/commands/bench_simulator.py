@@ -0,0 +1,31 @@
+import os
+import tempfile
+import time
+from django.core.management.base import BaseCommand
+from traffic.utils.data_simulator import iter_traffic_chunks, stream_traffic_data
+
+
+class Command(BaseCommand):
+    help = "Measure traffic data simulator throughput (rows/sec), in memory and streamed to CSV."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, nargs='+', default=[3000, 100000, 1000000])
+        parser.add_argument('--chunk-size', type=int, default=1 << 20)
+        parser.add_argument('--no-csv', action='store_true', help="Skip the CSV streaming pass.")
+
+    def handle(self, *args, **options):
+        for n_rows in options['rows']:
+            start = time.perf_counter()
+            generated = sum(len(chunk) for chunk in iter_traffic_chunks(n_rows, chunk_size=options['chunk_size']))
+            elapsed = time.perf_counter() - start
+            self.stdout.write(f"generate  {n_rows:>11,} rows  {elapsed:8.3f}s  {generated / elapsed:>14,.0f} rows/s")
+
+            if options['no_csv']:
+                continue
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                path = os.path.join(tmp_dir, 'traffic_data.csv')
+                start = time.perf_counter()
+                written = stream_traffic_data(n_rows, path, chunk_size=options['chunk_size'])
+                elapsed = time.perf_counter() - start
+                size_mb = os.path.getsize(path) / 1e6
+            self.stdout.write(f"csv       {n_rows:>11,} rows  {elapsed:8.3f}s  {written / elapsed:>14,.0f} rows/s  {size_mb:,.1f} MB")
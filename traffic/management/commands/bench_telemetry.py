@@ -0,0 +1,94 @@
+import os
+import tempfile
+import time
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+from traffic.utils.telemetry import TelemetryStore, BufferFull, parse_points
+
+
+def _batches(n_points, batch_size, n_vehicles, seed=0):
+    """
+    Telemetry batches shaped like the decoded JSON request bodies.
+    """
+    rng = np.random.default_rng(seed)
+    now = time.time()
+    for start in range(0, n_points, batch_size):
+        n = min(batch_size, n_points - start)
+        vehicles = rng.integers(0, n_vehicles, n)
+        lat = rng.uniform(5.30, 5.40, n)
+        lng = rng.uniform(-4.05, -3.95, n)
+        speed = rng.uniform(0, 80, n)
+        stamp = now - rng.uniform(0, 60, n)
+        yield [
+            {'id': f"bus-{v}", 'lat': la, 'lng': ln, 'speed': s, 'timestamp': t}
+            for v, la, ln, s, t in zip(vehicles.tolist(), lat.tolist(), lng.tolist(), speed.tolist(), stamp.tolist())
+        ]
+
+
+class Command(BaseCommand):
+    help = "Measure sustained telemetry ingestion (parse, aggregate, bulk insert) on a scratch SQLite database."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--points', type=int, default=200000)
+        parser.add_argument('--batch', type=int, default=1000, help="Points per request.")
+        parser.add_argument('--vehicles', type=int, default=5000)
+        parser.add_argument('--journal-mode', choices=['wal', 'delete'], default='wal')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            self.stderr.write("This benchmark targets SQLite.")
+            return
+
+        # DEBUG query logging would dominate the insert cost
+        settings.DEBUG = False
+        batches = list(_batches(options['points'], options['batch'], options['vehicles']))
+        scratch = tempfile.mkdtemp()
+        connection.settings_dict.setdefault('TEST', {})['NAME'] = os.path.join(scratch, 'telemetry.sqlite3')
+        connection.settings_dict.setdefault('OPTIONS', {})['init_command'] = (
+            f"PRAGMA journal_mode={options['journal_mode']}; PRAGMA synchronous=NORMAL;"
+        )
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            self._run(batches, options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def _run(self, batches, options):
+        mode = connection.cursor().execute('PRAGMA journal_mode').fetchone()[0]
+        store = TelemetryStore()
+
+        parse_time = 0.0
+        ingest_time = 0.0
+        waits = 0
+        started = time.perf_counter()
+        for batch in batches:
+            t0 = time.perf_counter()
+            df = parse_points(batch)
+            t1 = time.perf_counter()
+            while True:
+                try:
+                    store.ingest(df)
+                    break
+                except BufferFull:
+                    waits += 1
+                    time.sleep(0.01)
+            parse_time += t1 - t0
+            ingest_time += time.perf_counter() - t1
+        store.buffer.flush()
+        elapsed = time.perf_counter() - started
+
+        n_points = options['points']
+        buffer = store.buffer.stats()
+        t0 = time.perf_counter()
+        stats = store.stats()
+        read_ms = (time.perf_counter() - t0) * 1000
+
+        self.stdout.write(f"journal_mode={mode}, {n_points:,} points in batches of {options['batch']}")
+        self.stdout.write(f"  request side : parse {n_points / parse_time:,.0f} pts/s, buffer+aggregate {n_points / ingest_time:,.0f} pts/s")
+        self.stdout.write(
+            f"  sustained    : {n_points / elapsed:,.0f} pts/s end to end "
+            f"({buffer['flushes']} flushes, last {buffer['last_flush_ms']:.0f} ms, {waits} backpressure waits)"
+        )
+        self.stdout.write(f"  stats read   : {read_ms:.2f} ms for {len(stats['cells'])} cells, {stats['vehicles']:,} vehicles")
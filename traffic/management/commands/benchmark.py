@@ -0,0 +1,252 @@
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from pathlib import Path
+import django
+import numpy as np
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+from traffic.models import SearchHistory, Favorite
+from traffic.utils import jobs
+from traffic.utils.benchmark import ClientTransport, ServerTransport, run_load, compare_results, load_results
+from traffic.utils.data_simulator import generate_traffic_data, iter_traffic_chunks
+from traffic.utils.features import FEATURE_COLUMNS
+from traffic.utils.history import get_history_buffer
+from traffic.utils.inference import predict_levels
+from traffic.utils.model_registry import ModelRegistry, MODEL_FILENAME
+from traffic.utils.model_trainer import train_model
+
+SCENARIOS = ['predict', 'trend', 'user-data', 'simulate']
+DEFAULT_OUTPUT = settings.BASE_DIR / 'benchmarks' / 'latest.json'
+DEFAULT_BASELINE = settings.BASE_DIR / 'benchmarks' / 'baseline.json'
+
+
+def _scenario(name, transport, rng, size):
+    """
+    A send(i) callable for the scenario, with its request parameters drawn
+    up front so that generating them is not measured.
+    """
+    lat = rng.uniform(5.25, 5.45, size).round(5)
+    lng = rng.uniform(-4.10, -3.90, size).round(5)
+    hour = rng.integers(0, 24, size)
+    day = rng.integers(0, 7, size)
+
+    if name == 'predict':
+        return lambda i: transport.request('POST', '/predict/', {
+            'coords-display': f"{lat[i]},{lng[i]}", 'hour': hour[i], 'day_of_week': day[i],
+            'source_name': 'Cocody', 'dest_name': 'Plateau',
+        })
+    if name == 'trend':
+        return lambda i: transport.request('GET', '/api/predict-trend/', {'lat': lat[i], 'lng': lng[i], 'day_of_week': day[i]})
+    if name == 'user-data':
+        return lambda i: transport.request('GET', '/api/user-data/')
+    # Calls made while a job runs share it, so this mostly times submission
+    return lambda i: transport.request('GET', '/simulate/', {'n_samples': 3000})
+
+
+def _wait_for_training(timeout=600):
+    deadline = time.monotonic() + timeout
+    while jobs._active_job() is not None and time.monotonic() < deadline:
+        time.sleep(0.1)
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = (
+        "Load-test the main endpoints (test client and local WSGI/ASGI server) and time the "
+        "simulator, trainer and inference, on scratch data. Results are saved as JSON and "
+        "can be compared against a baseline."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', choices=['run', 'compare'])
+        parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=SCENARIOS)
+        parser.add_argument('--transports', nargs='+', choices=['client', 'wsgi', 'asgi'], default=['client', 'wsgi'])
+        parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8])
+        parser.add_argument('--requests', type=int, default=200, help="Measured requests per scenario and concurrency.")
+        parser.add_argument('--warmup', type=int, default=10)
+        parser.add_argument('--samples', type=int, default=3000, help="Rows simulated for the training set.")
+        parser.add_argument('--history', type=int, default=10000, help="History rows of the benchmark user.")
+        parser.add_argument('--repeat', type=int, default=20, help="Repetitions of each micro-benchmark.")
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--skip-http', action='store_true')
+        parser.add_argument('--output', default=str(DEFAULT_OUTPUT))
+        parser.add_argument('--baseline', default=str(DEFAULT_BASELINE), help="Results compared against, if the file exists.")
+        parser.add_argument('--threshold', type=float, default=0.1, help="Relative slowdown flagged as a regression.")
+
+    def handle(self, *args, **options):
+        if options['action'] == 'compare':
+            self._compare(load_results(options['output']), options)
+            return
+        if connection.vendor != 'sqlite':
+            raise CommandError("This benchmark targets SQLite.")
+
+        # Everything runs on scratch data: DEBUG query logging off, artifacts,
+        # jobs and database in a temporary directory
+        settings.DEBUG = False
+        settings.ALLOWED_HOSTS = [*settings.ALLOWED_HOSTS, 'localhost', '127.0.0.1']
+        scratch = Path(tempfile.mkdtemp(prefix='smarttrans-bench-'))
+        for name in ('DATA_ROOT', 'MODELS_ROOT', 'JOBS_ROOT'):
+            path = scratch / name.split('_')[0].lower()
+            path.mkdir()
+            setattr(settings, name, path)
+        # Training jobs run in this process, where the settings above apply
+        jobs._executor = ThreadPoolExecutor(max_workers=1)
+
+        connection.settings_dict.setdefault('TEST', {})['NAME'] = str(scratch / 'bench.sqlite3')
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            results = self._run(options)
+        finally:
+            _wait_for_training()
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        output = Path(options['output'])
+        output.parent.mkdir(parents=True, exist_ok=True)
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=2)
+        self.stdout.write(f"Results written to {output}")
+        if os.path.exists(options['baseline']):
+            self._compare(results, options)
+
+    def _run(self, options):
+        results = {
+            'meta': {
+                'created_at': timezone.now().isoformat(),
+                'commit': _git_commit(),
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'machine': platform.machine(),
+                'cpus': os.cpu_count(),
+                'options': {key: options[key] for key in ('scenarios', 'transports', 'concurrency', 'requests', 'samples', 'history', 'seed')},
+            },
+            'micro': self._micro(options),
+        }
+        if not options['skip_http']:
+            results['http'] = self._http(options)
+        return results
+
+    def _timed(self, fn, repeat):
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            fn()
+            timings.append(time.perf_counter() - started)
+        return float(np.median(timings)) * 1000
+
+    def _micro(self, options):
+        n = options['samples']
+        micro = {}
+
+        started = time.perf_counter()
+        generate_traffic_data(n, seed=options['seed'])
+        elapsed = time.perf_counter() - started
+        micro['generate_traffic_data'] = {'rows': n, 'ms': round(elapsed * 1000, 3), 'rows_per_s': round(n / elapsed)}
+
+        started = time.perf_counter()
+        report = train_model()
+        if 'error' in report:
+            raise CommandError(report['error'])
+        micro['train_model'] = {'rows': n, 'ms': round((time.perf_counter() - started) * 1000, 3)}
+
+        path = settings.MODELS_ROOT / MODEL_FILENAME
+        repeat = max(1, options['repeat'] // 4)
+        micro['model_load'] = {
+            'bytes': path.stat().st_size,
+            'ms': round(self._timed(lambda: ModelRegistry(path).get(), repeat), 3),
+        }
+
+        X = next(iter_traffic_chunks(1000, seed=7))[FEATURE_COLUMNS].to_numpy(np.float64)
+        inference = {}
+        for batch_size in (1, 64, 1000):
+            batch = X[:batch_size]
+            predict_levels(batch)
+            ms = self._timed(lambda: predict_levels(batch), options['repeat'])
+            inference[f"batch_{batch_size}"] = {'ms': round(ms, 4), 'per_row_us': round(ms * 1000 / batch_size, 3)}
+        micro['inference'] = inference
+
+        self.stdout.write(
+            f"generate {micro['generate_traffic_data']['rows_per_s']:,} rows/s, "
+            f"train {micro['train_model']['ms']:.0f} ms, load {micro['model_load']['ms']:.1f} ms"
+        )
+        self.stdout.write("inference " + ", ".join(
+            f"{name}: {value['ms']:.3f} ms ({value['per_row_us']:.1f} µs/row)" for name, value in inference.items()
+        ))
+        return micro
+
+    def _seed_user(self, options):
+        user = User.objects.create_user('benchmark', password=None)
+        now = timezone.now()
+        SearchHistory.objects.bulk_create(
+            [SearchHistory(user=user, source=f"Lieu {i}", destination='Plateau', timestamp=now - timedelta(minutes=i))
+             for i in range(options['history'])],
+            batch_size=2000,
+        )
+        Favorite.objects.bulk_create([Favorite(user=user, name=f"Favori {i}", source='Cocody', destination='Plateau') for i in range(20)])
+        return user
+
+    def _http(self, options):
+        user = self._seed_user(options)
+        login = ClientTransport(user)._client()
+        session_key = login.cookies[settings.SESSION_COOKIE_NAME].value
+
+        http = {}
+        for kind in options['transports']:
+            if kind == 'client':
+                transport = ClientTransport(user)
+            else:
+                try:
+                    transport = ServerTransport(kind, session_key)
+                except ImportError:
+                    self.stderr.write(f"Skipping {kind}: no server installed (pip install uvicorn).")
+                    continue
+
+            rows = http[kind] = {}
+            self.stdout.write(f"\n{kind}  {'scenario':<10} {'conc':>5} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errors':>7}")
+            try:
+                for name in options['scenarios']:
+                    for concurrency in options['concurrency']:
+                        rng = np.random.default_rng(options['seed'])
+                        send = _scenario(name, transport, rng, options['warmup'] + options['requests'])
+                        summary = run_load(send, options['requests'], concurrency, options['warmup'])
+                        rows.setdefault(name, {})[f"c{concurrency}"] = summary
+                        self.stdout.write(
+                            f"{'':<{len(kind)}}  {name:<10} {concurrency:>5} {summary['throughput_per_s']:>9,.1f} "
+                            f"{summary.get('p50_ms', 0):>9.2f} {summary.get('p95_ms', 0):>9.2f} "
+                            f"{summary.get('p99_ms', 0):>9.2f} {summary['errors']:>7}"
+                        )
+                        if name == 'simulate':
+                            _wait_for_training()
+            finally:
+                transport.close()
+                get_history_buffer().flush()
+        return http
+
+    def _compare(self, results, options):
+        rows = compare_results(results, load_results(options['baseline']), options['threshold'])
+        regressions = [row for row in rows if row[4]]
+        self.stdout.write(f"\nAgainst {options['baseline']} ({len(rows)} metrics, threshold {options['threshold']:.0%}):")
+        for name, before, after, change, regressed in rows:
+            if regressed or options['verbosity'] > 1:
+                flag = 'REGRESSION' if regressed else ''
+                self.stdout.write(f"  {name:<48} {before:>12,.3f} -> {after:>12,.3f}  {change:+7.1%}  {flag}")
+        if regressions:
+            raise CommandError(f"{len(regressions)} metric(s) regressed by more than {options['threshold']:.0%}")
+        self.stdout.write("  no regression")
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+from traffic.utils.responsive_images import build_variants, DEFAULT_WIDTHS, FORMATS
+
+DEFAULT_IMAGES = [f"traffic/images/slide{i}.jpg" for i in range(1, 5)]
+
+
+class Command(BaseCommand):
+    help = "Build the resized AVIF/WebP/JPEG variants the {% picture %} tag offers for static images (needs Pillow)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('images', nargs='*', default=DEFAULT_IMAGES, help="Static names (default: the slides).")
+        parser.add_argument('--widths', type=int, nargs='+', default=list(DEFAULT_WIDTHS))
+        parser.add_argument('--formats', nargs='+', choices=list(FORMATS), help="Default: AVIF (if supported) and WebP.")
+
+    def handle(self, *args, **options):
+        for name in options['images']:
+            try:
+                entry = build_variants(name, options['widths'], options['formats'])
+            except ImportError:
+                raise CommandError("Pillow is required to build image variants (pip install Pillow).")
+            except FileNotFoundError:
+                raise CommandError(f"No static file {name}")
+            self.stdout.write(f"{name} ({entry['width']}x{entry['height']})")
+            for mime, variants in entry['sources'].items():
+                sizes = ', '.join(f"{width}w {nbytes / 1024:.0f} KB" for _, width, nbytes in variants)
+                self.stdout.write(f"  {mime:<11} {sizes}")
@@ -0,0 +1,49 @@
+import time
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from traffic.utils.routing import find_routes, get_road_graph, load_road_graph, synthetic_grid
+
+
+class Command(BaseCommand):
+    help = "Compile a road extract (OSM XML or GeoJSON) for the router, show it, or time route queries."
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', choices=['build', 'info', 'bench'])
+        parser.add_argument('--source', help="OSM/GeoJSON extract to compile (synthetic grid if omitted).")
+        parser.add_argument('--queries', type=int, default=50)
+        parser.add_argument('--alternatives', type=int, default=3)
+        parser.add_argument('--hour', type=int, default=8)
+        parser.add_argument('--day', type=int, default=0)
+
+    def handle(self, *args, **options):
+        action = options['action']
+        if action == 'build':
+            graph = load_road_graph(options['source']) if options['source'] else synthetic_grid()
+            graph.save(settings.ROAD_GRAPH_PATH)
+            self.stdout.write(f"Saved {settings.ROAD_GRAPH_PATH}")
+        else:
+            graph = get_road_graph()
+
+        nbytes = sum(a.nbytes for a in (graph.lat, graph.lng, graph.indptr, graph.indices, graph.length, graph.speed))
+        self.stdout.write(f"{graph.node_count:,} nodes, {graph.edge_count:,} edges, {nbytes / 1e6:.2f} MB")
+        if action != 'bench':
+            return
+
+        start = time.perf_counter()
+        version, _ = graph.travel_times(options['hour'], options['day'])
+        self.stdout.write(f"Edge weights for version {version}: {(time.perf_counter() - start) * 1000:.1f} ms")
+
+        rng = np.random.default_rng(0)
+        pairs = rng.integers(0, graph.node_count, size=(options['queries'], 2))
+        for alternatives in sorted({1, options['alternatives']}):
+            timings = []
+            for a, b in pairs:
+                start = time.perf_counter()
+                find_routes(
+                    (graph.lat[a], graph.lng[a]), (graph.lat[b], graph.lng[b]),
+                    options['hour'], options['day'], alternatives, graph=graph,
+                )
+                timings.append((time.perf_counter() - start) * 1000)
+            p50, p95 = np.percentile(timings, [50, 95])
+            self.stdout.write(f"alternatives={alternatives}: p50 {p50:.2f} ms, p95 {p95:.2f} ms")
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+from traffic.utils.data_simulator import write_traffic_dataset
+from traffic.utils.dataset_store import import_csv, export_csv, read_manifest
+
+
+class Command(BaseCommand):
+    help = "Generate the training dataset, or convert it from/to CSV."
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', choices=['generate', 'import', 'export', 'info'])
+        parser.add_argument('--csv', help="CSV path (defaults to DATA_ROOT/traffic_data.csv).")
+        parser.add_argument('--rows', type=int, default=3000)
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        action = options['action']
+        if action == 'generate':
+            manifest = write_traffic_dataset(options['rows'], seed=options['seed'])
+        elif action == 'import':
+            manifest = import_csv(options['csv'])
+        elif action == 'export':
+            rows = export_csv(options['csv'])
+            self.stdout.write(f"Exported {rows:,} rows")
+            return
+        else:
+            manifest = read_manifest()
+            if manifest is None:
+                self.stdout.write("No dataset")
+                return
+        self.stdout.write(f"{manifest['rows']:,} rows, seed={manifest['seed']}")
+        for column, spec in manifest['columns'].items():
+            self.stdout.write(f"  {column:<14} {spec['dtype']}")
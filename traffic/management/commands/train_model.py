@@ -0,0 +1,72 @@
+import json
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from traffic.utils.model_selection import OBJECTIVES, SELECTION_FILENAME, format_selection_table
+from traffic.utils.model_trainer import train_model
+from traffic.utils.regions import build_regions, load_regions
+
+
+class Command(BaseCommand):
+    help = (
+        "Train and publish the model on the stored dataset, optionally choosing it among candidate "
+        "configurations. With --region/--all-regions, simulate, train and grid regions in parallel instead."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--select', action='store_true', help="Fit every candidate and keep the fastest accurate one.")
+        parser.add_argument('--objective', choices=list(OBJECTIVES), help="Overrides MODEL_SELECTION_OBJECTIVE.")
+        parser.add_argument('--tolerance', type=float, help="Overrides MODEL_SELECTION_TOLERANCE (accuracy lost at most).")
+        parser.add_argument('--workers', type=int, help="Overrides MODEL_SELECTION_WORKERS.")
+        parser.add_argument('--region', action='append', help="Region of settings.REGIONS to build (repeatable).")
+        parser.add_argument('--all-regions', action='store_true')
+        parser.add_argument('--samples', type=int, default=3000, help="Rows simulated per region.")
+        parser.add_argument('--incremental', action='store_true', help="Append the rows and grow each region's forest.")
+        parser.add_argument('--build-workers', type=int, help="Regions built at once (REGION_BUILD_WORKERS).")
+
+    def handle(self, *args, **options):
+        for option in ('objective', 'tolerance', 'workers'):
+            if options[option] is not None:
+                setattr(settings, f"MODEL_SELECTION_{option.upper()}", options[option])
+
+        if options['region'] or options['all_regions']:
+            self._build_regions(options)
+            return
+
+        started = time.perf_counter()
+        report = train_model(select=options['select'])
+        if 'error' in report:
+            raise CommandError(report['error'])
+        self.stdout.write(f"Trained in {time.perf_counter() - started:.1f}s, accuracy {report['accuracy']:.4f}")
+        if options['select']:
+            self._show_selection(settings.MODELS_ROOT)
+
+    def _build_regions(self, options):
+        regions = {region.name: region for region in load_regions()}
+        names = list(regions) if options['all_regions'] else options['region']
+        unknown = [name for name in names if name not in regions]
+        if unknown or not names:
+            raise CommandError(f"Unknown region(s) {', '.join(unknown)}; settings.REGIONS has: {', '.join(regions) or 'none'}")
+
+        started = time.perf_counter()
+        failed = []
+        for name, report, error in build_regions(
+            names, options['samples'], options['incremental'], options['select'], options['build_workers'],
+        ):
+            elapsed = time.perf_counter() - started
+            if error is not None:
+                failed.append(name)
+                self.stderr.write(f"{name}: failed after {elapsed:.1f}s: {error}")
+                continue
+            self.stdout.write(f"{name}: built in {elapsed:.1f}s, accuracy {report['accuracy']:.4f}")
+            if options['select']:
+                self._show_selection(regions[name].models_root)
+        if failed:
+            raise CommandError(f"{len(failed)} region(s) failed: {', '.join(failed)}")
+
+    def _show_selection(self, models_root):
+        path = models_root / SELECTION_FILENAME
+        with open(path) as f:
+            table = json.load(f)
+        self.stdout.write(format_selection_table(table))
+        self.stdout.write(f"Selected {table['selected']}, trade-off table in {path}")
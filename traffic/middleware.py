@@ -0,0 +1,88 @@
+import time
+from datetime import datetime
+from pathlib import Path
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from .utils.metrics import observe, inc, SamplingProfiler, write_folded
+from .utils.responses import compress_response
+
+
+class InstrumentationMiddleware:
+    """
+    Records how long each view takes into a per-view latency histogram, and
+    counts responses by status. Works in both sync and async stacks, so async
+    views stay async under ASGI. Streaming responses are timed up to the
+    response object, not to the last byte.
+
+    With METRICS_PROFILE_SLOW_MS set, every request is sampled and the stacks
+    of those slower than that are written to METRICS_PROFILE_DIR.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+        self.slow_ms = getattr(settings, 'METRICS_PROFILE_SLOW_MS', None)
+        self.profiler = None
+        if self.slow_ms is not None:
+            self.profiler = SamplingProfiler(getattr(settings, 'METRICS_PROFILE_INTERVAL', 0.005))
+            self.profile_dir = Path(getattr(settings, 'METRICS_PROFILE_DIR', settings.BASE_DIR / 'profiles'))
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        token = self.profiler.begin() if self.profiler else None
+        started = time.perf_counter()
+        response = self.get_response(request)
+        self._record(request, response, time.perf_counter() - started, token)
+        return response
+
+    async def __acall__(self, request):
+        token = self.profiler.begin() if self.profiler else None
+        started = time.perf_counter()
+        response = await self.get_response(request)
+        self._record(request, response, time.perf_counter() - started, token)
+        return response
+
+    def _record(self, request, response, elapsed, token):
+        match = request.resolver_match
+        # URL names keep the label set bounded, whatever the path parameters
+        view = (match.url_name or match.view_name) if match else 'unmatched'
+        observe('request_duration_seconds', elapsed, view=view, method=request.method)
+        inc('requests_total', view=view, method=request.method, status=response.status_code)
+
+        if token is not None:
+            stacks = self.profiler.end(token)
+            if elapsed * 1000 >= self.slow_ms and stacks:
+                self.profile_dir.mkdir(parents=True, exist_ok=True)
+                name = f"{datetime.now():%Y%m%d-%H%M%S-%f}-{view}-{elapsed * 1000:.0f}ms.folded"
+                write_folded(stacks, self.profile_dir / name)
+                inc('profiles_written_total', view=view)
+
+
+class CompressionMiddleware:
+    """
+    Compresses JSON responses with gzip, or brotli when installed, if the
+    client accepts it and the body is at least API_COMPRESS_MIN_SIZE bytes.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        return compress_response(request, self.get_response(request))
+
+    async def __acall__(self, request):
+        return compress_response(request, await self.get_response(request))
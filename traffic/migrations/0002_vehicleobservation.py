@@ -0,0 +1,31 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('traffic', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VehicleObservation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('vehicle_id', models.CharField(max_length=64)),
+                ('lat', models.FloatField()),
+                ('lng', models.FloatField()),
+                ('speed', models.FloatField(help_text='km/h')),
+                ('timestamp', models.DateTimeField()),
+                ('cell', models.IntegerField()),
+            ],
+            options={
+                'ordering': ['-timestamp'],
+                'indexes': [
+                    models.Index(fields=['timestamp'], name='observation_time_idx'),
+                    models.Index(fields=['vehicle_id', '-timestamp'], name='observation_vehicle_idx'),
+                    models.Index(fields=['cell', 'timestamp'], name='observation_cell_idx'),
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,37 @@
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('traffic', '0003_history_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Incident',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('accident', 'Accident'), ('roadworks', 'Travaux'), ('closure', 'Route fermée'), ('congestion', 'Embouteillage'), ('other', 'Autre')], default='other', max_length=20)),
+                ('severity', models.PositiveSmallIntegerField(choices=[(1, 'Mineur'), (2, 'Majeur'), (3, 'Critique')], default=2)),
+                ('lat', models.FloatField()),
+                ('lng', models.FloatField()),
+                ('description', models.CharField(blank=True, max_length=255)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('expires_at', models.DateTimeField()),
+                ('updated_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('reported_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+                'indexes': [
+                    models.Index(fields=['expires_at'], name='incident_expiry_idx'),
+                    models.Index(fields=['updated_at'], name='incident_updated_idx'),
+                ],
+            },
+        ),
+    ]
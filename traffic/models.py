@@ -1,15 +1,20 @@
 from django.db import models
 from django.contrib.auth.models import User
+from django.utils import timezone
 
 class SearchHistory(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     source = models.CharField(max_length=255)
     destination = models.CharField(max_length=255)
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # Set by the caller: entries are written behind, after the search itself
+    timestamp = models.DateTimeField(default=timezone.now)
 
     class Meta:
         ordering = ['-timestamp']
         verbose_name_plural = "Search Histories"
+        indexes = [
+            models.Index(fields=['user', '-timestamp', '-id'], name='history_user_time_idx'),
+        ]
 
     def __str__(self):
         return f"{self.user.username} - {self.source} to {self.destination}"
@@ -21,5 +26,61 @@ class Favorite(models.Model):
     destination = models.CharField(max_length=255)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', '-created_at', '-id'], name='favorite_user_created_idx'),
+        ]
+
     def __str__(self):
         return f"{self.user.username} - {self.name}"
+
+class VehicleObservation(models.Model):
+    vehicle_id = models.CharField(max_length=64)
+    lat = models.FloatField()
+    lng = models.FloatField()
+    speed = models.FloatField(help_text="km/h")
+    timestamp = models.DateTimeField()
+    # Telemetry grid cell (-1 outside the covered area)
+    cell = models.IntegerField()
+
+    class Meta:
+        ordering = ['-timestamp']
+        indexes = [
+            models.Index(fields=['timestamp'], name='observation_time_idx'),
+            models.Index(fields=['vehicle_id', '-timestamp'], name='observation_vehicle_idx'),
+            models.Index(fields=['cell', 'timestamp'], name='observation_cell_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.vehicle_id} @ {self.timestamp:%Y-%m-%d %H:%M:%S}"
+
+class Incident(models.Model):
+    KIND_CHOICES = [
+        ('accident', 'Accident'),
+        ('roadworks', 'Travaux'),
+        ('closure', 'Route fermée'),
+        ('congestion', 'Embouteillage'),
+        ('other', 'Autre'),
+    ]
+    SEVERITY_CHOICES = [(1, 'Mineur'), (2, 'Majeur'), (3, 'Critique')]
+
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES, default='other')
+    severity = models.PositiveSmallIntegerField(choices=SEVERITY_CHOICES, default=2)
+    lat = models.FloatField()
+    lng = models.FloatField()
+    description = models.CharField(max_length=255, blank=True)
+    reported_by = models.ForeignKey(User, null=True, blank=True, on_delete=models.SET_NULL)
+    created_at = models.DateTimeField(default=timezone.now)
+    expires_at = models.DateTimeField()
+    # Set on every change (including by update()), so workers can pull what moved since their last sync
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['expires_at'], name='incident_expiry_idx'),
+            models.Index(fields=['updated_at'], name='incident_updated_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_kind_display()} ({self.lat:.4f}, {self.lng:.4f})"
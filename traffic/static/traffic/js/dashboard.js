@@ -0,0 +1,1428 @@
+// Global variables
+// Read from the page: this script is static and cached across sessions
+const CSRF_TOKEN = document.querySelector('meta[name="csrf-token"]').content;
+let map;
+let userMarker = null;
+let vehicleMarkers = [];
+let placeMarkers = [];
+let routingLayer = null;
+let routeStartMarker = null;
+let routeEndMarker = null;
+let trendChart = null;
+let mainChart = null;
+
+document.addEventListener('DOMContentLoaded', function () {
+    // Init Map (Google Maps Style)
+    map = L.map('map', { zoomControl: false }).setView([5.3600, -4.0083], 15);
+
+    // ... (keep layer init)
+    const esriSatellite = L.tileLayer('https://server.arcgisonline.com/ArcGIS/rest/services/World_Imagery/MapServer/tile/{z}/{y}/{x}', {
+        attribution: 'Tiles &copy; Esri &mdash; Source: Esri, i-cubed, USDA, USGS, AEX, GeoEye, Getmapping, Aerogrid, IGN, IGP, UPR-EGP, and the GIS User Community',
+        maxZoom: 19
+    });
+    const esriLabels = L.tileLayer('https://server.arcgisonline.com/ArcGIS/rest/services/Reference/World_Boundaries_and_Places/MapServer/tile/{z}/{y}/{x}', {
+        maxZoom: 19
+    });
+    const esriHybrid = L.layerGroup([esriSatellite, esriLabels]);
+    const osmMap = L.tileLayer('https://{s}.tile.openstreetmap.org/{z}/{x}/{y}.png', {
+        attribution: '&copy; OpenStreetMap contributors',
+        maxZoom: 19
+    });
+    esriHybrid.addTo(map);
+    const baseMaps = { "Satellite (Hybride)": esriHybrid, "Plan (Classique)": osmMap };
+    L.control.layers(baseMaps, null, { position: 'bottomleft' }).addTo(map);
+    L.control.zoom({ position: 'topright' }).addTo(map);
+
+    // Init Main Chart
+    initMainChart();
+    if (typeof initRealTime === 'function') initRealTime();
+    if (typeof locateUser === 'function') locateUser();
+    if (typeof animate === 'function') animate();
+    if (typeof fetchUserData === 'function') fetchUserData();
+    refreshTelemetryStats();
+    setInterval(refreshTelemetryStats, 30000);
+    map.on('moveend', refreshIncidents);
+    refreshIncidents();
+    setInterval(refreshIncidents, 30000);
+
+    // Card Toggle Listener
+    const header = document.getElementById('route-card-header');
+    if (header) {
+        header.addEventListener('click', toggleRouteCard);
+    }
+
+    // Init Map Interaction
+    initMapInteraction();
+
+    // Initialize Lucide Icons
+    lucide.createIcons();
+});
+
+function toggleRouteCard() {
+    const container = document.getElementById('route-card-container');
+    container.classList.toggle('collapsed');
+}
+
+function switchAppSection(sectionId) {
+    // Update Sidebar UI
+    document.querySelectorAll('.nav-item').forEach(item => {
+        item.classList.remove('active');
+        if (item.getAttribute('onclick').includes(sectionId)) {
+            item.classList.add('active');
+        }
+    });
+
+    // Update Sections
+    document.querySelectorAll('.app-section').forEach(section => {
+        section.classList.remove('active');
+    });
+    const activeSection = document.getElementById(`section-${sectionId}`);
+    if (activeSection) {
+        activeSection.classList.add('active');
+    }
+
+    // Special layout for map
+    const contentArea = document.querySelector('.content-area');
+    if (contentArea) {
+        contentArea.classList.toggle('full-bleed', sectionId === 'itineraires');
+    }
+
+    // Update Header Title
+    const titles = {
+        'principal': 'Tableau de Bord',
+        'itineraires': 'Carte & Itinéraires',
+        'analyse': 'Analyse Prédictive IA',
+        'autres': 'Paramètres & Favoris'
+    };
+    document.getElementById('section-title-display').innerText = titles[sectionId] || 'Tableau de Bord';
+
+    // Special actions
+    if (sectionId === 'itineraires') {
+        setTimeout(() => map.invalidateSize(), 100);
+    }
+    if (sectionId === 'autres') {
+        fetchUserData();
+    }
+}
+
+function initMainChart() {
+    const ctx = document.getElementById('mainTrafficChart').getContext('2d');
+    const data = {
+        labels: ['Lun', 'Mar', 'Mer', 'Jeu', 'Ven', 'Sam', 'Dim'],
+        datasets: [{
+            label: 'Volume de Trafic',
+            data: [65, 59, 80, 81, 56, 40, 30],
+            borderColor: '#2D6A4F',
+            backgroundColor: 'rgba(45, 106, 79, 0.1)',
+            fill: true,
+            tension: 0.4,
+            borderWidth: 3,
+            pointRadius: 4,
+            pointBackgroundColor: '#fff',
+            pointBorderColor: '#2D6A4F',
+            pointBorderWidth: 2
+        }]
+    };
+
+    mainChart = new Chart(ctx, {
+        type: 'line',
+        data: data,
+        options: {
+            responsive: true,
+            maintainAspectRatio: false,
+            plugins: {
+                legend: { display: false }
+            },
+            scales: {
+                y: {
+                    beginAtZero: true,
+                    grid: { color: '#f1f3f5' },
+                    ticks: { color: '#adb5bd' }
+                },
+                x: {
+                    grid: { display: false },
+                    ticks: { color: '#adb5bd' }
+                }
+            }
+        }
+    });
+}
+
+async function setStartToCurrent() {
+    const startInput = document.getElementById('start-input');
+    startInput.value = "Localisation...";
+    if ("geolocation" in navigator) {
+        navigator.geolocation.getCurrentPosition(async (position) => {
+            const lat = position.coords.latitude;
+            const lng = position.coords.longitude;
+            const name = await getPlaceName(lat, lng);
+            startInput.value = name;
+        }, () => {
+            startInput.value = "Abidjan, Côte d'Ivoire";
+        });
+    } else {
+        startInput.value = "Abidjan, Côte d'Ivoire";
+    }
+}
+
+async function geocode(query) {
+    if (!query || query.trim() === "") return null;
+    try {
+        const res = await fetch(`/api/geocode/?q=${encodeURIComponent(query)}&limit=1`);
+        const data = await res.json();
+        if (data.length > 0) return [parseFloat(data[0].lat), parseFloat(data[0].lon)];
+    } catch (e) {
+        console.error("Geocode error:", e);
+    }
+    return null;
+}
+
+// Congestion along each alternative, adjusted ETAs and ranking, scored server-side
+async function scoreRoutes(routes) {
+    const body = { routes };
+    const hrInput = document.getElementById('hour');
+    const dayInput = document.getElementById('day_of_week');
+    if (hrInput && hrInput.value !== '') body.hour = parseInt(hrInput.value);
+    if (dayInput && dayInput.value !== '') body.day_of_week = parseInt(dayInput.value);
+    const res = await fetch('/api/route/score/', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+            'X-CSRFToken': CSRF_TOKEN
+        },
+        body: JSON.stringify(body)
+    });
+    const data = await res.json();
+    if (!res.ok) throw new Error(data.error || "Route scoring failed");
+    return data;
+}
+
+function displayRoute(route, segments = null) {
+    if (routingLayer) map.removeLayer(routingLayer);
+    if (routeStartMarker) map.removeLayer(routeStartMarker);
+    if (routeEndMarker) map.removeLayer(routeEndMarker);
+
+    const latlngs = route.geometry.coordinates.map(c => [c[1], c[0]]);
+    if (segments) {
+        // One polyline per run of equal congestion, coloured like the fleet
+        routingLayer = L.featureGroup(segments.map(seg => L.polyline(seg.coordinates.map(c => [c[1], c[0]]), {
+            color: FLEET_COLORS[seg.level] || '#4285F4',
+            weight: 6,
+            opacity: 0.8,
+            lineJoin: 'round'
+        }))).addTo(map);
+    } else {
+        routingLayer = L.polyline(latlngs, {
+            color: '#4285F4',
+            weight: 6,
+            opacity: 0.8,
+            lineJoin: 'round'
+        }).addTo(map);
+    }
+
+    routeStartMarker = L.marker(latlngs[0], {
+        icon: L.divIcon({ className: 'traffic-marker-icon', html: '🏁', iconSize: [16, 16] })
+    }).addTo(map).bindPopup("Départ");
+
+    routeEndMarker = L.marker(latlngs[latlngs.length - 1], {
+        icon: L.divIcon({ className: 'traffic-marker-icon', html: '📍', iconSize: [16, 16] })
+    }).addTo(map).bindPopup("Arrivée");
+
+    map.fitBounds(routingLayer.getBounds(), { padding: [50, 50] });
+}
+
+async function calculateSmartRoute() {
+    const startQuery = document.getElementById('start-input').value;
+    const endQuery = document.getElementById('end-input').value;
+    const summaryEl = document.getElementById('route-summary');
+    const infoBox = document.getElementById('route-info');
+
+    if (!startQuery || !endQuery) {
+        alert("Veuillez entrer un départ et une destination.");
+        return;
+    }
+
+    infoBox.style.display = 'block';
+    summaryEl.innerHTML = "<span class='loader'></span> Recherche des lieux...";
+
+    const startCoords = await geocode(startQuery);
+    const endCoords = await geocode(endQuery);
+
+    if (!startCoords || !endCoords) {
+        summaryEl.innerHTML = "❌ Impossible de localiser les adresses.";
+        return;
+    }
+
+    summaryEl.innerHTML = "🧠 Analyse des routes et du trafic IA...";
+
+    try {
+        // Congestion-aware alternatives from the local router
+        const data = await fetchRoutes(startCoords[0], startCoords[1], endCoords[0], endCoords[1], 3);
+
+        if (!data.routes || data.routes.length === 0) {
+            summaryEl.innerHTML = "❌ Aucun itinéraire trouvé.";
+            return;
+        }
+
+        let bestRoute = data.routes[0];
+        let scored = null;
+        try {
+            const ranking = await scoreRoutes(data.routes);
+            scored = ranking.routes[ranking.ranking[0]];
+            bestRoute = data.routes[scored.index];
+        } catch (err) {
+            console.warn("Route scoring unavailable:", err);
+        }
+
+        displayRoute(bestRoute, scored ? scored.segments : null);
+        const durationMin = Math.round((scored ? scored.duration : bestRoute.duration) / 60);
+        const distKm = (bestRoute.distance / 1000).toFixed(1);
+        const delayMin = scored ? Math.round(scored.delay / 60) : 0;
+        summaryEl.innerHTML = `✅ <b>Trajet intelligent calculé !</b><br>
+            <div style="margin-top: 8px; display: flex; gap: 12px; font-size: 1rem;">
+                <span>⏱️ ${durationMin} min</span>
+                <span>🛣️ ${distKm} km</span>
+                ${delayMin > 0 ? `<span>🚦 +${delayMin} min</span>` : ''}
+            </div>
+            <div style="color: var(--secondary); font-size: 0.8rem; margin-top: 8px; font-weight: 500;">
+                ✨ L'IA a optimisé le trajet pour éviter les zones de forte congestion.
+            </div>`;
+
+    } catch (err) {
+        console.error("Routing error:", err);
+        summaryEl.innerHTML = "❌ Erreur lors du calcul de l'itinéraire.";
+    }
+}
+
+// Dashboard figures from the telemetry rolling aggregates
+async function refreshTelemetryStats() {
+    try {
+        const res = await fetch('/api/telemetry/stats/');
+        const stats = await res.json();
+        document.getElementById('stat-vehicles').innerText = stats.vehicles.toLocaleString('fr-FR');
+        document.getElementById('stat-speed').innerText = stats.avg_speed === null ? '–' : `${Math.round(stats.avg_speed)} km/h`;
+        document.getElementById('stat-window').innerText = `sur ${Math.round(stats.window / 60)} min`;
+        document.getElementById('stat-observations').innerText = `${stats.observations.toLocaleString('fr-FR')} relevés`;
+    } catch (err) {
+        console.warn("Telemetry stats error:", err);
+    }
+}
+
+// Real-time Initialization
+function initRealTime() {
+    const now = new Date();
+    const hrInput = document.getElementById('hour');
+    if (hrInput) hrInput.value = now.getHours();
+
+    const dayInput = document.getElementById('day_of_week');
+    if (dayInput) {
+        let day = now.getDay() - 1;
+        if (day === -1) day = 6; // Sunday
+        dayInput.value = day;
+    }
+}
+
+// UI Helpers
+function toggleSidePanel() {
+    const panel = document.getElementById('side-panel');
+    panel.classList.toggle('hidden');
+}
+
+async function getPlaceName(lat, lng) {
+    try {
+        const response = await fetch(`/api/geocode/reverse/?lat=${lat}&lng=${lng}`);
+        const data = await response.json();
+        return data.display_name.split(',')[0] + ', ' + (data.address.suburb || data.address.neighbourhood || data.address.city || "");
+    } catch (error) {
+        return "Lieu inconnu";
+    }
+}
+
+async function searchLocation(query) {
+    if (!query) return;
+    try {
+        const response = await fetch(`/api/geocode/?q=${encodeURIComponent(query)}&limit=1`);
+        const data = await response.json();
+        if (data.length > 0) {
+            const { lat, lon } = data[0];
+            const latLng = [parseFloat(lat), parseFloat(lon)];
+            map.setView(latLng, 15);
+            await updatePositionInfo(latLng[0], latLng[1]);
+            // Auto-predict after search
+            performPrediction();
+        }
+    } catch (err) {
+        console.error("Search error:", err);
+    }
+}
+
+async function fetchNearbyPlaces(lat, lng) {
+    const listEl = document.getElementById('nearby-places-list');
+    listEl.innerHTML = "Scan des environs...";
+
+    // Clear old markers
+    placeMarkers.forEach(m => map.removeLayer(m));
+    placeMarkers = [];
+
+    const points = [
+        { name: "Station-Service", off: [0.003, 0.003] },
+        { name: "Marché local", off: [-0.002, 0.005] },
+        { name: "Gare routière", off: [0.004, -0.002] }
+    ];
+
+    listEl.innerHTML = "";
+    for (const p of points) {
+        const pLat = lat + p.off[0];
+        const pLng = lng + p.off[1];
+        const name = await getPlaceName(pLat, pLng);
+        const displayName = name !== "Lieu inconnu" ? name : p.name;
+
+        const marker = L.marker([pLat, pLng], {
+            icon: L.divIcon({ className: 'traffic-marker-icon', html: '🏢', iconSize: [12, 12] })
+        }).addTo(map);
+
+        marker.bindPopup(`<b>${displayName}</b>`);
+        placeMarkers.push(marker);
+        listEl.innerHTML += `<div style="padding: 4px 0;">📍 ${displayName}</div>`;
+    }
+}
+
+async function updatePositionInfo(lat, lng) {
+    const panel = document.getElementById('side-panel');
+    panel.classList.remove('hidden');
+
+    document.getElementById('place-name-display').innerText = "Analyse du lieu...";
+    const name = await getPlaceName(lat, lng);
+    document.getElementById('place-name-display').innerText = name;
+    document.getElementById('coords-display').value = `${lat},${lng}`;
+
+    if (userMarker) {
+        userMarker.setLatLng([lat, lng]);
+    } else {
+        userMarker = L.marker([lat, lng], {
+            zIndexOffset: 1000,
+            icon: L.divIcon({ className: 'user-marker-icon', iconSize: [16, 16] })
+        }).addTo(map);
+    }
+
+    userMarker.bindPopup(`<b>Position actuelle</b><br>${name}`).openPopup();
+    // Default spawn: shared server simulation, local one if the stream is unavailable
+    if (!startFleetStream()) spawnTraffic(lat, lng);
+    fetchNearbyPlaces(lat, lng);
+}
+
+// Real Traffic Simulation with OSRM
+// Local router first (same response shape as OSRM), public OSRM outside its coverage
+async function fetchRoutes(startLat, startLng, endLat, endLng, alternatives = 1) {
+    const params = new URLSearchParams({
+        start: `${startLat},${startLng}`,
+        end: `${endLat},${endLng}`,
+        alternatives: alternatives
+    });
+    const hrInput = document.getElementById('hour');
+    const dayInput = document.getElementById('day_of_week');
+    if (hrInput && hrInput.value !== '') params.set('hour', hrInput.value);
+    if (dayInput && dayInput.value !== '') params.set('day_of_week', dayInput.value);
+    try {
+        const res = await fetch(`/api/route/?${params}`);
+        if (res.ok) {
+            const data = await res.json();
+            if (data.routes && data.routes.length > 0) return data;
+        }
+    } catch (err) {
+        console.warn("Local Route Error:", err);
+    }
+    const url = `https://router.project-osrm.org/route/v1/driving/${startLng},${startLat};${endLng},${endLat}?overview=full&geometries=geojson&alternatives=${alternatives > 1}`;
+    const res = await fetch(url);
+    return await res.json();
+}
+
+async function fetchRoute(startLat, startLng, endLat, endLng) {
+    try {
+        const data = await fetchRoutes(startLat, startLng, endLat, endLng);
+        if (data.routes && data.routes.length > 0) {
+            return data.routes[0].geometry.coordinates.map(c => [c[1], c[0]]); // Swap to LatLng
+        }
+    } catch (err) {
+        console.warn("Route Error:", err);
+    }
+    return null;
+}
+
+// Server-side fleet simulation (/api/fleet/stream/): binary frames, base64 over SSE.
+// Header: kind u8, 3 pad bytes, tick u32, vehicle count u32, tick compute time µs u32.
+const FLEET_COLORS = ['#34A853', '#FBBC05', '#EA4335'];
+const fleet = { source: null, lat: null, lng: null, level: null, markers: [], renderer: null, frames: 0 };
+
+function startFleetStream() {
+    if (!window.EventSource) return false;
+    if (fleet.source) return true;
+    fleet.source = new EventSource('/api/fleet/stream/');
+    fleet.source.addEventListener('frame', (event) => {
+        const bytes = Uint8Array.from(atob(event.data), c => c.charCodeAt(0));
+        applyFleetFrame(bytes.buffer);
+        fleet.frames++;
+    });
+    fleet.source.onerror = () => {
+        // Never connected: fall back to the in-browser simulation
+        if (fleet.frames === 0 && fleet.source.readyState === EventSource.CLOSED) {
+            fleet.source = null;
+            const center = map.getCenter();
+            spawnTraffic(center.lat, center.lng);
+        }
+    };
+    return true;
+}
+
+function applyFleetFrame(buffer) {
+    const view = new DataView(buffer);
+    const kind = view.getUint8(0);
+    const count = view.getUint32(8, true);
+    let offset = 16;
+    const changed = [];
+
+    if (kind === 0) {
+        fleet.lat = new Int32Array(buffer.slice(offset, offset + 4 * count)); offset += 4 * count;
+        fleet.lng = new Int32Array(buffer.slice(offset, offset + 4 * count)); offset += 4 * count;
+        fleet.level = new Uint8Array(buffer.slice(offset, offset + count));
+        for (let i = 0; i < count; i++) changed.push(i);
+    } else {
+        if (!fleet.lat || fleet.lat.length !== count) return;
+        const mask = new Uint8Array(buffer, offset, Math.ceil(count / 8));
+        offset += mask.length;
+        for (let i = 0; i < count; i++) {
+            if (mask[i >> 3] & (1 << (i & 7))) changed.push(i);
+        }
+        const moved = changed.length;
+        const dLat = new Int8Array(buffer, offset, moved); offset += moved;
+        const dLng = new Int8Array(buffer, offset, moved); offset += moved;
+        const level = new Uint8Array(buffer, offset, moved); offset += moved;
+        for (let k = 0; k < moved; k++) {
+            const i = changed[k];
+            fleet.lat[i] += dLat[k];
+            fleet.lng[i] += dLng[k];
+            fleet.level[i] = level[k];
+        }
+        const jumps = view.getUint32(offset, true); offset += 4;
+        const ids = new Uint32Array(buffer.slice(offset, offset + 4 * jumps)); offset += 4 * jumps;
+        const lats = new Int32Array(buffer.slice(offset, offset + 4 * jumps)); offset += 4 * jumps;
+        const lngs = new Int32Array(buffer.slice(offset, offset + 4 * jumps)); offset += 4 * jumps;
+        const levels = new Uint8Array(buffer, offset, jumps);
+        for (let k = 0; k < jumps; k++) {
+            fleet.lat[ids[k]] = lats[k];
+            fleet.lng[ids[k]] = lngs[k];
+            fleet.level[ids[k]] = levels[k];
+            changed.push(ids[k]);
+        }
+    }
+    drawFleet(changed);
+}
+
+function drawFleet(changed) {
+    if (!fleet.renderer) fleet.renderer = L.canvas({ padding: 0.2 });
+    for (const i of changed) {
+        const latLng = [fleet.lat[i] / 1e5, fleet.lng[i] / 1e5];
+        const color = FLEET_COLORS[fleet.level[i]] || FLEET_COLORS[0];
+        let marker = fleet.markers[i];
+        if (!marker) {
+            marker = L.circleMarker(latLng, {
+                renderer: fleet.renderer, radius: 4, weight: 1, color: '#ffffff', fillColor: color, fillOpacity: 0.9
+            }).addTo(map);
+            fleet.markers[i] = marker;
+        } else {
+            marker.setLatLng(latLng);
+            if (marker.options.fillColor !== color) marker.setStyle({ fillColor: color });
+        }
+    }
+}
+
+async function spawnTraffic(lat, lng, forcedLevel = null) {
+    vehicleMarkers.forEach(m => map.removeLayer(m.marker));
+    vehicleMarkers = [];
+
+    // Spawn fewer but smarter vehicles to respect API limits
+    const vehicleCount = 15;
+
+    for (let i = 0; i < vehicleCount; i++) {
+        // Random start VERY close to center (approx 800m radius)
+        const startLat = lat + (Math.random() - 0.5) * 0.008;
+        const startLng = lng + (Math.random() - 0.5) * 0.008;
+        // Random destination further away (approx 4km radius)
+        const endLat = lat + (Math.random() - 0.5) * 0.04;
+        const endLng = lng + (Math.random() - 0.5) * 0.04;
+
+        let path = await fetchRoute(startLat, startLng, endLat, endLng);
+
+        // Fallback if OSRM fails (straight line interpolation)
+        if (!path || path.length < 2) {
+            path = [];
+            const steps = 20;
+            for (let j = 0; j <= steps; j++) {
+                const t = j / steps;
+                path.push([
+                    startLat + (endLat - startLat) * t,
+                    startLng + (endLng - startLng) * t
+                ]);
+            }
+        }
+
+        if (path && path.length > 1) {
+            let status;
+            if (forcedLevel) {
+                // Bias towards forced level
+                const rand = Math.random();
+                if (forcedLevel === 'high') status = rand > 0.2 ? 'high' : (rand > 0.1 ? 'medium' : 'low');
+                else if (forcedLevel === 'medium') status = rand > 0.4 ? 'medium' : (rand > 0.2 ? 'high' : 'low');
+                else status = rand > 0.3 ? 'low' : (rand > 0.1 ? 'medium' : 'high');
+            } else {
+                status = Math.random() > 0.7 ? 'high' : (Math.random() > 0.4 ? 'medium' : 'low');
+            }
+
+            const marker = L.marker(path[0], {
+                icon: L.divIcon({
+                    className: `traffic-marker-icon ${status}`,
+                    iconSize: [12, 12]
+                })
+            }).addTo(map);
+
+            vehicleMarkers.push({
+                marker,
+                path: path,
+                currentIndex: 0,
+                // Realistic speed: approx 0.000001 - 0.000003 degrees per frame (~30-60 km/h)
+                speed: 0.0000015 + Math.random() * 0.0000025,
+                progress: 0
+            });
+
+            // Small delay to prevent API flooding
+            await new Promise(r => setTimeout(r, 200));
+        }
+    }
+}
+
+function locateUser() {
+    if ("geolocation" in navigator) {
+        navigator.geolocation.getCurrentPosition(function (position) {
+            const lat = position.coords.latitude;
+            const lng = position.coords.longitude;
+            map.setView([lat, lng], 15);
+            updatePositionInfo(lat, lng);
+        }, () => {
+            updatePositionInfo(5.3600, -4.0083);
+        });
+    } else {
+        updatePositionInfo(5.3600, -4.0083);
+    }
+}
+
+// Prediction Fallback Logic
+function getTimeBasedTrafficLevel() {
+    const hour = new Date().getHours();
+    // Rush hours: 7-9 and 17-19
+    if ((hour >= 7 && hour <= 9) || (hour >= 17 && hour <= 19)) {
+        return 'Élevé';
+    }
+    // Day time: 9-17
+    if (hour > 9 && hour < 17) {
+        return 'Moyen';
+    }
+    // Night/Early morning
+    return 'Faible';
+}
+
+function showPrediction(status, isFallback, city = "") {
+    const valEl = document.getElementById('prediction-value');
+    const boxEl = document.getElementById('result-box');
+
+    // Style the box
+    if (boxEl) {
+        boxEl.style.border = 'none';
+        boxEl.style.boxShadow = '0 4px 12px rgba(0,0,0,0.05)';
+        boxEl.style.background = '#fff';
+    }
+
+    // Normalize status
+    const normalizedStatus = status.replace(/Eleve/i, 'Élevé');
+
+    // Map status to color and icon
+    let color, icon, bgColor, advice;
+    if (normalizedStatus.toLowerCase().includes('élevé') || normalizedStatus.toLowerCase().includes('eleve')) {
+        color = '#EA4335';
+        bgColor = 'rgba(234, 67, 53, 0.1)';
+        icon = 'alert-circle';
+        advice = "Trafic dense prévu. Privilégiez les transports en commun ou reportez votre déplacement.";
+    } else if (normalizedStatus.toLowerCase().includes('moyen')) {
+        color = '#FBBC05';
+        bgColor = 'rgba(251, 188, 5, 0.1)';
+        icon = 'minus-circle';
+        advice = "Trafic modéré. Temps de trajet légèrement rallongé.";
+    } else {
+        color = '#34A853';
+        bgColor = 'rgba(52, 168, 83, 0.1)';
+        icon = 'check-circle';
+        advice = "Voie libre. C'est le bon moment pour partir !";
+    }
+
+    // Update display in Analyse section
+    if (valEl) {
+        let html = `
+            <div style="display: flex; flex-direction: column; gap: 12px;">
+                ${city ? `<div style="font-size: 1.1rem; font-weight: 600; color: var(--text);">📍 ${city}</div>` : ''}
+                <div style="display: flex; align-items: center; gap: 12px; font-size: 1.4rem; font-weight: 700;">
+                    <i data-lucide="${icon}" style="width: 32px; height: 32px; color: ${color};"></i>
+                    <div style="color: ${color};">${normalizedStatus.toUpperCase()}</div>
+                </div>
+                <div style="padding: 12px; background: ${bgColor}; border-radius: 8px; border-left: 4px solid ${color};">
+                    <div style="font-size: 0.9rem; font-weight: 600; margin-bottom: 4px;">Conseil IA :</div>
+                    <div style="font-size: 0.85rem; color: var(--text-muted); line-height: 1.4;">${advice}</div>
+                </div>
+            </div>
+        `;
+
+        if (isFallback) {
+            html += `<div style="font-size: 0.75rem; color: #94a3b8; margin-top: 12px; text-align: right;">(Basé sur les tendances historiques)</div>`;
+        }
+        valEl.innerHTML = html;
+        lucide.createIcons();
+    }
+
+    // Update Status Card in Itinéraires section (keep sync)
+    const statusCard = document.getElementById('current-status-card');
+    const statusText = document.getElementById('status-text');
+    const statusIcon = document.getElementById('status-icon');
+
+    if (statusCard) {
+        statusText.innerText = normalizedStatus.toUpperCase();
+        statusText.style.color = color;
+        statusIcon.setAttribute('data-lucide', icon);
+        statusIcon.style.color = color;
+        statusCard.style.borderLeft = `4px solid ${color}`;
+        lucide.createIcons();
+    }
+}
+
+async function performPrediction() {
+    const form = document.getElementById('predict-form');
+    const cityInput = document.getElementById('city-input');
+    const coordsInput = document.getElementById('coords-display');
+
+    let city = "";
+
+    // Handle City Input
+    if (cityInput && cityInput.value.trim() !== "") {
+        city = cityInput.value.trim();
+        try {
+            // Geocode city
+            const geoRes = await fetch(`/api/geocode/?q=${encodeURIComponent(city)}&limit=1`);
+            const geoData = await geoRes.json();
+
+            if (geoData && geoData.length > 0) {
+                const lat = parseFloat(geoData[0].lat);
+                const lng = parseFloat(geoData[0].lon);
+                coordsInput.value = `${lat},${lng}`;
+
+                // Center map on result
+                map.flyTo([lat, lng], 13);
+            } else {
+                alert("Ville introuvable. Veuillez vérifier l'orthographe.");
+                return;
+            }
+        } catch (e) {
+            console.error("Geocoding error:", e);
+            alert("Erreur lors de la recherche de la ville.");
+            return;
+        }
+    } else if (!coordsInput.value) {
+        alert("Veuillez entrer une ville ou sélectionner un point sur la carte.");
+        return;
+    }
+
+    // Prepare Data
+    const formData = new FormData(form);
+
+    try {
+        const res = await fetch('/predict/', { method: 'POST', headers: { 'X-CSRFToken': CSRF_TOKEN }, body: formData });
+        const data = await res.json();
+
+        // Get prediction or fallback
+        let prediction = data.prediction;
+        let isFallback = false;
+
+        if (!prediction) {
+            prediction = getTimeBasedTrafficLevel();
+            isFallback = true;
+        }
+
+        showPrediction(prediction, isFallback, city);
+
+        // Spawn traffic visualization
+        if (coordsInput.value) {
+            const latLng = coordsInput.value.split(',').map(Number);
+            const level = prediction.toLowerCase().includes('élevé') || prediction.toLowerCase().includes('eleve') ? 'high' :
+                (prediction.toLowerCase().includes('moyen') ? 'medium' : 'low');
+            spawnTraffic(latLng[0], latLng[1], level);
+            updateTrafficChart(latLng[0], latLng[1]);
+        }
+
+    } catch (err) {
+        console.error('Prediction error:', err);
+        showPrediction(getTimeBasedTrafficLevel(), true, city);
+    }
+}
+
+// Event Listeners
+let selectionMode = null; // 'start' or 'end'
+let selectionMarkers = { start: null, end: null };
+
+function toggleMapSelection(mode) {
+    console.log("toggleMapSelection called with:", mode);
+    selectionMode = (selectionMode === mode) ? null : mode;
+    console.log("New selectionMode:", selectionMode);
+
+    // UI Feedback
+    document.querySelectorAll('.map-select-btn').forEach(btn => btn.classList.remove('active'));
+    if (selectionMode) {
+        const btnIndex = mode === 'start' ? 0 : 1;
+        const btns = document.querySelectorAll('.map-select-btn');
+        if (btns[btnIndex]) btns[btnIndex].classList.add('active');
+        L.DomUtil.addClass(map._container, 'crosshair-cursor');
+        alert(`Cliquez sur la carte pour définir le point de ${mode === 'start' ? 'départ' : 'destination'}.`);
+    } else {
+        L.DomUtil.removeClass(map._container, 'crosshair-cursor');
+    }
+}
+
+
+
+function initMapInteraction() {
+    if (!map) return;
+    map.on('click', async (e) => {
+        // alert("Map Clicked: " + e.latlng); // Debug trigger
+        if (selectionMode) {
+            const lat = e.latlng.lat;
+            const lng = e.latlng.lng;
+
+            // Get approx address
+            const name = await getPlaceName(lat, lng) || `${lat.toFixed(4)}, ${lng.toFixed(4)}`;
+            const inputId = selectionMode === 'start' ? 'start-input' : 'end-input';
+            document.getElementById(inputId).value = name;
+
+            // Visual Marker
+            if (selectionMarkers[selectionMode]) map.removeLayer(selectionMarkers[selectionMode]);
+
+            const color = selectionMode === 'start' ? '#34A853' : '#EA4335';
+            selectionMarkers[selectionMode] = L.circleMarker([lat, lng], {
+                color: color, fillColor: color, fillOpacity: 1, radius: 8
+            }).addTo(map);
+
+            // Reset
+            toggleMapSelection(selectionMode); // Turn off
+            return; // Stop other click handlers
+        }
+
+        await updatePositionInfo(e.latlng.lat, e.latlng.lng);
+        performPrediction();
+    });
+}
+
+
+
+document.getElementById('map-search').addEventListener('keypress', (e) => {
+    if (e.key === 'Enter') searchLocation(e.target.value);
+});
+
+async function trainModel() {
+    const alertBox = document.getElementById('training-alert');
+    const originalContent = alertBox.innerHTML;
+    alertBox.innerHTML = "⌛ Entraînement en cours (Simulation data + ML)...";
+    alertBox.style.background = "#e1f5fe";
+    alertBox.style.color = "#01579b";
+
+    try {
+        const res = await fetch('/simulate/');
+        let job = await res.json();
+        if (!job.job_id) throw new Error(job.message);
+
+        while (job.state !== 'done' && job.state !== 'failed') {
+            await new Promise(resolve => setTimeout(resolve, 1000));
+            const statusRes = await fetch(`/api/jobs/${job.job_id || job.id}/`);
+            job = await statusRes.json();
+            if (job.progress !== undefined) {
+                alertBox.innerHTML = `⌛ Entraînement en cours (${job.phase})... ${Math.round(job.progress * 100)}%`;
+            }
+        }
+
+        if (job.state === 'done') {
+            alertBox.style.display = 'none';
+            alert('Entraînement réussi ! Précision : ' + (job.report.accuracy * 100).toFixed(1) + '%');
+        } else {
+            throw new Error(job.error);
+        }
+    } catch (err) {
+        alert('Erreur lors de l\'entraînement');
+        alertBox.innerHTML = originalContent;
+    }
+}
+
+
+
+// Animation Loop for Real Routes
+function animate() {
+    vehicleMarkers.forEach(v => {
+        if (v.path && v.path.length > 1) {
+
+            // Move towards next point
+            const start = v.path[v.currentIndex];
+            const end = v.path[v.currentIndex + 1];
+
+            if (!start || !end) return;
+
+            const dx = end[0] - start[0];
+            const dy = end[1] - start[1];
+            const dist = Math.sqrt(dx * dx + dy * dy);
+
+            if (dist > 0) {
+                v.progress += v.speed / dist; // Normalize speed
+            } else {
+                v.progress = 1;
+            }
+
+            if (v.progress >= 1) {
+                v.progress = 0;
+                v.currentIndex++;
+                if (v.currentIndex >= v.path.length - 1) {
+                    // Reset when done (or remove)
+                    v.currentIndex = 0;
+                    // reverse for continuous loop or just restart
+                }
+            }
+
+            const currentLat = start[0] + (end[0] - start[0]) * v.progress;
+            const currentLng = start[1] + (end[1] - start[1]) * v.progress;
+            v.marker.setLatLng([currentLat, currentLng]);
+        }
+    });
+    requestAnimationFrame(animate);
+}
+
+let trafficCircles = [];
+let showingTraffic = false;
+
+async function drawCongestionGrid() {
+    const bounds = map.getBounds();
+    const now = new Date();
+    const dayOfWeek = (now.getDay() + 6) % 7; // Monday = 0
+    const bbox = [bounds.getSouth(), bounds.getWest(), bounds.getNorth(), bounds.getEast()].join(',');
+    const res = await fetch(`/api/congestion/?bbox=${bbox}&hour=${now.getHours()}&day_of_week=${dayOfWeek}`);
+    const data = await res.json();
+    if (!data.levels) throw new Error(data.error || "No congestion grid");
+
+    const half = data.step / 2;
+    data.levels.forEach((row, i) => {
+        row.forEach((level, j) => {
+            if (level === 0) return;
+            const lat = data.origin[0] + i * data.step;
+            const lng = data.origin[1] + j * data.step;
+            const color = level === 2 ? '#EA4335' : '#FBBC05';
+            const cell = L.rectangle([[lat - half, lng - half], [lat + half, lng + half]], {
+                color, fillColor: color, fillOpacity: 0.25, weight: 0
+            }).addTo(map);
+            trafficCircles.push(cell);
+        });
+    });
+}
+
+async function toggleTrafficLayer() {
+    showingTraffic = !showingTraffic;
+    if (showingTraffic) {
+        try {
+            await drawCongestionGrid();
+            return;
+        } catch (err) {
+            console.warn("Falling back to static hotspots:", err);
+        }
+        const hotspots = [
+            { lat: 5.33, lng: -4.02, level: 'high' }, // Plateau
+            { lat: 5.37, lng: -3.99, level: 'high' }, // Cocody
+            { lat: 5.31, lng: -4.01, level: 'medium' }, // Treichville
+            { lat: 5.39, lng: -4.03, level: 'high' }  // Adjamé
+        ];
+
+        hotspots.forEach(hs => {
+            const color = hs.level === 'high' ? '#EA4335' : '#FBBC05'; // Red for high
+            const circle = L.circle([hs.lat, hs.lng], {
+                color, fillColor: color, fillOpacity: 0.3, radius: 800, weight: 1
+            }).addTo(map);
+            trafficCircles.push(circle);
+        });
+        alert("Calque de trafic activé (Zones denses affichées)");
+    } else {
+        trafficCircles.forEach(c => map.removeLayer(c));
+        trafficCircles = [];
+    }
+}
+
+async function searchTrafficLevel() {
+    const query = document.getElementById('traffic-search').value.toLowerCase().trim();
+    const validLevels = ['faible', 'moyen', 'élevé', 'eleve'];
+
+    if (!validLevels.includes(query)) {
+        alert("Veuillez entrer : faible, moyen ou élevé");
+        return;
+    }
+
+    // Clean previous search circles
+    trafficCircles.forEach(c => map.removeLayer(c));
+    trafficCircles = [];
+
+    // Determine color and level
+    let levelColor = '#FBBC05'; // Default Orange
+    let levelKey = 'medium';
+
+    if (query === 'faible') {
+        levelColor = '#34A853'; // Green for Low
+        levelKey = 'low';
+    } else if (query === 'élevé' || query === 'eleve') {
+        levelColor = '#EA4335'; // Red for High
+        levelKey = 'high';
+    }
+
+    // Get map center to spawn relevant spots
+    const center = map.getCenter();
+
+    // Generate some simulated spots for this level
+    const spots = [
+        { lat: center.lat + (Math.random() - 0.5) * 0.02, lng: center.lng + (Math.random() - 0.5) * 0.02 },
+        { lat: center.lat + (Math.random() - 0.5) * 0.02, lng: center.lng + (Math.random() - 0.5) * 0.02 },
+        { lat: center.lat + (Math.random() - 0.5) * 0.02, lng: center.lng + (Math.random() - 0.5) * 0.02 }
+    ];
+
+    spots.forEach(spot => {
+        const circle = L.circle([spot.lat, spot.lng], {
+            color: levelColor,
+            fillColor: levelColor,
+            fillOpacity: 0.4,
+            radius: 600,
+            weight: 2
+        }).addTo(map);
+        circle.bindPopup(`Zone de trafic <b>${query.toUpperCase()}</b>`);
+        trafficCircles.push(circle);
+    });
+
+    // Filter existing vehicle markers if any
+    vehicleMarkers.forEach(v => {
+        const vStatus = v.marker.options.icon.options.className.includes('high') ? 'high' :
+            (v.marker.options.icon.options.className.includes('medium') ? 'medium' : 'low');
+
+        const markerEl = v.marker.getElement();
+        if (markerEl) {
+            if (vStatus === levelKey) {
+                v.marker.setOpacity(1.0);
+                markerEl.classList.add('marker-highlight');
+            } else {
+                v.marker.setOpacity(0.3);
+                markerEl.classList.remove('marker-highlight');
+            }
+        }
+    });
+
+    map.flyTo([spots[0].lat, spots[0].lng], 14);
+    showingTraffic = true;
+}
+
+async function updateTrafficChart(lat, lng) {
+    const chartBox = document.getElementById('analytics-box');
+    chartBox.style.display = 'block';
+
+    const ctx = document.getElementById('trafficTrendChart').getContext('2d');
+    const hours = Array.from({ length: 24 }, (_, i) => i + "h");
+
+    let trendValues = [];
+    const dayOfWeek = document.getElementById('day_of_week').value;
+
+    try {
+        const response = await fetch(`/api/predict-trend/?lat=${lat}&lng=${lng}&day_of_week=${dayOfWeek}`);
+        const data = await response.json();
+        if (data.trend) {
+            trendValues = data.trend;
+        } else {
+            throw new Error("No trend data");
+        }
+    } catch (err) {
+        console.warn("Falling back to simulated trend:", err);
+        // Fallback simulation if API fails or model not ready
+        const hotspotData = [
+            { lat: 5.33, lng: -4.02 }, { lat: 5.37, lng: -3.99 }, { lat: 5.39, lng: -4.03 }
+        ];
+        let isHotspot = hotspotData.some(hs => Math.sqrt((lat - hs.lat) ** 2 + (lng - hs.lng) ** 2) < 0.015);
+        trendValues = Array.from({ length: 24 }, (_, h) => {
+            let base = ((h >= 7 && h <= 9) || (h >= 17 && h <= 19)) ? (isHotspot ? 85 : 65) : (isHotspot ? 40 : 20);
+            return base + Math.random() * 10;
+        });
+    }
+
+    if (trendChart) trendChart.destroy();
+
+    trendChart = new Chart(ctx, {
+        type: 'line',
+        data: {
+            labels: hours,
+            datasets: [{
+                label: 'Intensité du trafic',
+                data: trendValues,
+                borderColor: '#4285F4',
+                backgroundColor: (context) => {
+                    const chart = context.chart;
+                    const { ctx, chartArea } = chart;
+                    if (!chartArea) return null;
+                    const gradient = ctx.createLinearGradient(0, chartArea.bottom, 0, chartArea.top);
+                    gradient.addColorStop(0, 'rgba(66, 133, 244, 0)');
+                    gradient.addColorStop(1, 'rgba(66, 133, 244, 0.4)');
+                    return gradient;
+                },
+                fill: true,
+                tension: 0.4,
+                borderWidth: 3,
+                pointRadius: 0,
+                pointHoverRadius: 6,
+                pointHoverBackgroundColor: '#4285F4',
+                pointHoverBorderColor: '#fff',
+                pointHoverBorderWidth: 2
+            }]
+        },
+        options: {
+            responsive: true,
+            maintainAspectRatio: false,
+            plugins: {
+                legend: { display: false },
+                tooltip: {
+                    mode: 'index',
+                    intersect: false,
+                    backgroundColor: 'rgba(15, 23, 42, 0.9)',
+                    titleColor: '#fff',
+                    bodyColor: '#cbd5e1',
+                    borderColor: 'rgba(255, 255, 255, 0.1)',
+                    borderWidth: 1,
+                    padding: 10,
+                    callbacks: {
+                        label: function (context) {
+                            let level = context.parsed.y > 65 ? 'Élevé' : (context.parsed.y > 35 ? 'Moyen' : 'Faible');
+                            return ` Intensité : ${level}`;
+                        }
+                    }
+                }
+            },
+            scales: {
+                y: {
+                    display: false,
+                    min: 0,
+                    max: 100
+                },
+                x: {
+                    grid: { display: false },
+                    ticks: {
+                        color: '#94a3b8',
+                        font: { size: 10 },
+                        maxRotation: 0,
+                        autoSkip: true,
+                        maxTicksLimit: 6
+                    }
+                }
+            },
+            interaction: {
+                mode: 'nearest',
+                axis: 'x',
+                intersect: false
+            }
+        }
+    });
+
+    // Find best time to travel (lowest values in next 6h window or global min)
+    let currentHour = new Date().getHours();
+    let bestHour = (currentHour + 1) % 24;
+    let minVal = Infinity;
+
+    for (let i = 1; i <= 6; i++) {
+        let h = (currentHour + i) % 24;
+        if (trendValues[h] < minVal) {
+            minVal = trendValues[h];
+            bestHour = h;
+        }
+    }
+
+    const hintEl = document.getElementById('best-time-hint');
+    hintEl.innerText = `Partez vers ${bestHour}h pour éviter le trafic.`;
+}
+
+// Notification System
+function showNotification(message, lat, lng, type = 'warning') {
+    const container = document.getElementById('notification-container');
+    const notif = document.createElement('div');
+    notif.className = 'notification';
+
+    const icons = { 'warning': 'alert-triangle', 'error': 'octagon', 'success': 'check-circle', 'info': 'info' };
+
+    notif.innerHTML = `
+        <div style="display: flex; align-items: center; gap: 12px;">
+            <i data-lucide="${icons[type] || 'bell'}" class="notif-icon"></i>
+            <div style="font-size: 0.85rem; line-height: 1.4;">${message}</div>
+        </div>
+        <button class="notif-btn" onclick="goToIncident(${lat}, ${lng}, this.parentElement)">Voir</button>
+    `;
+    container.appendChild(notif);
+    lucide.createIcons();
+
+    // Auto-hide after 8 seconds
+    setTimeout(() => {
+        if (notif.parentElement) {
+            notif.classList.add('exit');
+            setTimeout(() => notif.remove(), 400);
+        }
+    }, 8000);
+}
+
+function goToIncident(lat, lng, notifEl) {
+    map.flyTo([lat, lng], 16, { duration: 1.5 });
+    L.circleMarker([lat, lng], {
+        radius: 20,
+        color: '#EA4335',
+        fillOpacity: 0.3,
+        weight: 2
+    }).addTo(map).fadeOut = function () {
+        let op = 0.3;
+        let timer = setInterval(() => {
+            op -= 0.01;
+            this.setStyle({ fillOpacity: op, opacity: op * 2 });
+            if (op <= 0) {
+                clearInterval(timer);
+                map.removeLayer(this);
+            }
+        }, 50);
+    };
+
+    const pulse = L.circleMarker([lat, lng], { radius: 20, color: '#EA4335' }).addTo(map);
+    let pRadius = 20;
+    let pTimer = setInterval(() => {
+        pRadius += 1;
+        pulse.setRadius(pRadius);
+        pulse.setStyle({ opacity: 1 - (pRadius - 20) / 30, fillOpacity: 0.5 - (pRadius - 20) / 60 });
+        if (pRadius > 50) {
+            clearInterval(pTimer);
+            map.removeLayer(pulse);
+        }
+    }, 20);
+
+    // Remove notification
+    notifEl.classList.add('exit');
+    setTimeout(() => notifEl.remove(), 400);
+}
+
+// Shared incidents in the map viewport, from the server's spatial index
+const seenIncidents = new Set();
+let incidentLayer = null;
+let incidentsLoaded = false;
+
+async function refreshIncidents() {
+    const bounds = map.getBounds();
+    const bbox = [bounds.getSouth(), bounds.getWest(), bounds.getNorth(), bounds.getEast()].join(',');
+    try {
+        const [res, clusterRes] = await Promise.all([
+            fetch(`/api/incidents/?bbox=${bbox}&limit=50`),
+            fetch(`/api/clusters/?layer=incidents&bbox=${bbox}&zoom=${map.getZoom()}`)
+        ]);
+        const data = await res.json();
+        if (!res.ok) throw new Error(data.error || "Incidents unavailable");
+
+        document.getElementById('stat-incidents').innerText = data.active.toLocaleString('fr-FR');
+        document.getElementById('stat-incidents-note').innerText =
+            data.total ? `${data.total.toLocaleString('fr-FR')} dans la zone affichée` : 'Aucun dans la zone affichée';
+
+        // Markers come pre-clustered for this zoom: a bubble per cell, worst class as colour
+        if (clusterRes.ok) {
+            const clusters = (await clusterRes.json()).clusters;
+            if (incidentLayer) map.removeLayer(incidentLayer);
+            incidentLayer = L.layerGroup(clusters.map(cl => {
+                const color = FLEET_COLORS[cl.max_level] || FLEET_COLORS[0];
+                const marker = L.circleMarker([cl.lat, cl.lng], {
+                    radius: cl.count > 1 ? Math.min(8 + 3 * Math.log2(cl.count), 28) : 8,
+                    color,
+                    fillColor: color,
+                    fillOpacity: 0.6,
+                    weight: 2
+                });
+                if (cl.count > 1) {
+                    marker.bindTooltip(String(cl.count), { permanent: true, direction: 'center', className: 'cluster-count' });
+                    marker.on('click', () => map.setView([cl.lat, cl.lng], map.getZoom() + 2));
+                } else {
+                    const inc = data.incidents.find(i => i.id === cl.id);
+                    marker.bindPopup(inc ? `<b>${inc.label}</b>${inc.description ? '<br>' + inc.description : ''}` : '<b>Incident</b>');
+                }
+                return marker;
+            })).addTo(map);
+        }
+
+        // Announce the most severe incident that appeared since the last refresh
+        const fresh = data.incidents.filter(inc => !seenIncidents.has(inc.id));
+        fresh.forEach(inc => seenIncidents.add(inc.id));
+        if (incidentsLoaded && fresh.length > 0) {
+            const inc = fresh[0];
+            showNotification(`${inc.label} : ${inc.description || 'incident signalé'}`, inc.lat, inc.lng,
+                inc.severity === 3 ? 'error' : 'warning');
+        }
+        incidentsLoaded = true;
+    } catch (err) {
+        console.warn("Incidents error:", err);
+    }
+}
+
+document.getElementById('traffic-search').addEventListener('keypress', (e) => {
+    if (e.key === 'Enter') searchTrafficLevel();
+});
+
+// Next-page cursors returned by /api/user-data/
+const userDataCursors = { favorites: null, history: null };
+
+async function fetchUserData() {
+    try {
+        const response = await fetch('/api/user-data/');
+        const data = await response.json();
+
+        if (data.status === 'success') {
+            updateFavoritesList(data.favorites);
+            updateHistoryList(data.history);
+            setUserDataCursor('favorites', data.favorites_next);
+            setUserDataCursor('history', data.history_next);
+        }
+    } catch (error) {
+        console.error('Error fetching user data:', error);
+    }
+}
+
+function setUserDataCursor(list, cursor) {
+    userDataCursors[list] = cursor;
+    document.getElementById(`${list}-more`).style.display = cursor ? 'block' : 'none';
+}
+
+async function loadMoreUserData(list) {
+    const cursor = userDataCursors[list];
+    if (!cursor) return;
+    try {
+        const response = await fetch(`/api/user-data/?${list}_cursor=${encodeURIComponent(cursor)}`);
+        const data = await response.json();
+
+        if (data.status === 'success') {
+            if (list === 'favorites') updateFavoritesList(data.favorites, true);
+            else updateHistoryList(data.history, true);
+            setUserDataCursor(list, data[`${list}_next`]);
+        }
+    } catch (error) {
+        console.error('Error fetching user data:', error);
+    }
+}
+
+function updateFavoritesList(favorites, append = false) {
+    const container = document.getElementById('favorites-list');
+    const section = document.getElementById('favorites-section');
+
+    if (favorites.length === 0 && !append) {
+        section.style.display = 'none';
+        return;
+    }
+
+    section.style.display = 'block';
+    const html = favorites.map(fav => `
+        <div onclick="useRoute('${fav.source}', '${fav.destination}')" style="padding: 8px 12px; background: rgba(255, 255, 255, 0.05); border-radius: 8px; cursor: pointer; transition: background 0.2s; display: flex; justify-content: space-between; align-items: center;">
+            <div style="display: flex; align-items: center; gap: 8px;">
+                <i data-lucide="star" style="width: 14px; height: 14px; color: var(--warning);"></i>
+                <span style="font-size: 0.9rem; font-weight: 500;">${fav.name}</span>
+            </div>
+            <button onclick="deleteFavorite(event, ${fav.id})" style="background: none; border: none; color: var(--text-muted); cursor: pointer; display: flex; align-items: center; justify-content: center; padding: 4px;">
+                <i data-lucide="x" style="width: 14px; height: 14px;"></i>
+            </button>
+        </div>
+    `).join('');
+    if (append) container.insertAdjacentHTML('beforeend', html);
+    else container.innerHTML = html;
+    lucide.createIcons();
+}
+
+function updateHistoryList(history, append = false) {
+    const container = document.getElementById('history-list');
+    const section = document.getElementById('history-section');
+
+    if (history.length === 0 && !append) {
+        section.style.display = 'none';
+        return;
+    }
+
+    section.style.display = 'block';
+    const html = history.map(item => `
+        <div onclick="useRoute('${item.source}', '${item.destination}')" style="padding: 8px 12px; background: rgba(255, 255, 255, 0.03); border-radius: 8px; cursor: pointer; transition: background 0.2s;">
+            <div style="font-size: 0.85rem; color: var(--text-muted); display: flex; align-items: center; gap: 6px;">
+                <i data-lucide="clock" style="width: 12px; height: 12px;"></i>
+                <span>${new Date(item.timestamp).toLocaleDateString()}</span>
+            </div>
+            <div style="font-size: 0.9rem; margin-top: 2px;">${item.source} ➝ ${item.destination}</div>
+        </div>
+    `).join('');
+    if (append) container.insertAdjacentHTML('beforeend', html);
+    else container.innerHTML = html;
+    lucide.createIcons();
+}
+
+function useRoute(source, destination) {
+    document.getElementById('start-input').value = source;
+    document.getElementById('end-input').value = destination;
+}
+
+async function saveFavorite() {
+    const name = prompt("Nom du favori (ex: Maison) :");
+    if (!name) return;
+
+    const source = document.getElementById('start-input').value || "Ma position";
+    const destination = document.getElementById('end-input').value || "Destination";
+
+    try {
+        const response = await fetch('/api/add-favorite/', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+                'X-CSRFToken': CSRF_TOKEN
+            },
+            body: JSON.stringify({ name, source, destination })
+        });
+
+        const data = await response.json();
+        if (data.status === 'success') {
+            fetchUserData(); // Refresh list
+            alert('Favori ajouté !');
+        } else {
+            alert('Erreur: ' + data.message);
+        }
+    } catch (error) {
+        alert('Erreur système');
+    }
+}
+
+async function deleteFavorite(event, id) {
+    event.stopPropagation(); // Prevent clicking the parent div
+    if (!confirm('Supprimer ce favori ?')) return;
+
+    try {
+        const response = await fetch(`/api/delete-favorite/${id}/`, {
+            method: 'POST',
+            headers: {
+                'X-CSRFToken': CSRF_TOKEN
+            }
+        });
+
+        if (response.ok) {
+            fetchUserData();
+        }
+    } catch (error) {
+        console.error('Error deleting:', error);
+    }
+}
+
+// Initial Lucide icons call
+lucide.createIcons();
@@ -0,0 +1,30 @@
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+from django.core.files.base import ContentFile
+from .utils.minify import minify_css, minify_js
+
+MINIFIERS = {'.css': minify_css, '.js': minify_js}
+
+
+class MinifiedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """
+    ManifestStaticFilesStorage that minifies the app's own stylesheets and
+    scripts as they are collected, before they are hashed, so the hashed
+    names are those of the minified files. Files already named .min.* are
+    left alone.
+    """
+
+    def post_process(self, paths, dry_run=False, **options):
+        if not dry_run:
+            paths = dict(paths)
+            for name, (storage, path) in paths.items():
+                minify = MINIFIERS.get(name[name.rfind('.'):])
+                if minify is None or '.min.' in name or not name.startswith('traffic/'):
+                    continue
+                with storage.open(path) as f:
+                    content = f.read().decode('utf-8')
+                if self.exists(name):
+                    self.delete(name)
+                self._save(name, ContentFile(minify(content).encode('utf-8')))
+                # Hash the minified copy rather than the source
+                paths[name] = (self, name)
+        yield from super().post_process(paths, dry_run, **options)
@@ -0,0 +1,47 @@
+from django import template
+from django.templatetags.static import static
+from django.utils.html import format_html, format_html_join
+from ..utils.responsive_images import get_variants, FORMATS
+
+register = template.Library()
+
+# Markup by tag arguments, with the manifest entry it was built from:
+# resolving a dozen hashed static URLs on every render costs about a millisecond
+_rendered = {}
+
+
+def _srcset(variants):
+    return ', '.join(f"{static(name)} {width}w" for name, width, _ in variants)
+
+
+@register.simple_tag
+def picture(name, css_class='', sizes='100vw', alt=''):
+    """
+    A <picture> of a static image offering its AVIF/WebP/JPEG variants by
+    width, for the browser to pick the lightest it can show; just the
+    image while `manage.py responsive_images` has not built them.
+    """
+    entry = get_variants(name)
+    key = (name, css_class, sizes, alt)
+    cached = _rendered.get(key)
+    if cached is not None and cached[0] is entry:
+        return cached[1]
+    _rendered[key] = (entry, _picture(name, entry, css_class, sizes, alt))
+    return _rendered[key][1]
+
+
+def _picture(name, entry, css_class, sizes, alt):
+    if entry is None:
+        return format_html('<picture class="{}"><img src="{}" alt="{}" decoding="async"></picture>', css_class, static(name), alt)
+    sources = entry['sources']
+    return format_html(
+        '<picture class="{}">{}<img src="{}"{} sizes="{}" width="{}" height="{}" alt="{}" decoding="async"></picture>',
+        css_class,
+        format_html_join(
+            '', '<source type="{}" srcset="{}" sizes="{}">',
+            ((mime, _srcset(sources[mime]), sizes) for mime in FORMATS if mime in sources and mime != 'image/jpeg'),
+        ),
+        static(name),
+        format_html(' srcset="{}"', _srcset(sources['image/jpeg'])) if 'image/jpeg' in sources else '',
+        sizes, entry['width'], entry['height'], alt,
+    )
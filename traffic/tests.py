@@ -1,3 +1,914 @@
-from django.test import TestCase
+import asyncio
+import gzip
+import hashlib
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+import uuid
+from pathlib import Path
+from unittest import mock
+import joblib
+import numpy as np
+import pandas as pd
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.template import Context, Template
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra
+from sklearn.ensemble import RandomForestClassifier
+from .models import SearchHistory, VehicleObservation
+from .storage import MinifiedManifestStaticFilesStorage
+from .templatetags import responsive_images as responsive_images_tags
+from .utils import (
+    batch_prediction, dataset_store, fleet_simulation, geocoding, history, incidents, inference, jobs, metrics,
+    model_trainer, prediction_grid, regions, responses, routing, telemetry, trend_engine,
+)
+from .utils.features import LEVELS
+from .utils.forest_engine import FlatForest, flatten_forest
+from .utils.write_behind import WriteBehindBuffer
 
-# Create your tests here.
+
+class DatasetStoreTests(SimpleTestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def _values(self):
+        return list(dataset_store.load_dataframe(self.path)['avg_speed'])
+
+    def test_append_after_abort_drops_aborted_rows(self):
+        dataset_store.write_dataset([pd.DataFrame({'avg_speed': [0, 1, 2]})], self.path)
+        writer = dataset_store.DatasetWriter(self.path, append=True)
+        writer.append(pd.DataFrame({'avg_speed': [100, 101]}))
+        writer.abort()
+        self.assertEqual(self._values(), [0, 1, 2])
+
+        dataset_store.write_dataset([pd.DataFrame({'avg_speed': [7, 8]})], self.path, append=True)
+        self.assertEqual(self._values(), [0, 1, 2, 7, 8])
+        self.assertEqual(dataset_store.read_manifest(self.path)['rows'], 5)
+
+
+class IncrementalTrainingTests(SimpleTestCase):
+    chunk_size = 200
+
+    def setUp(self):
+        self.dataset = tempfile.mkdtemp()
+        self.models_root = Path(tempfile.mkdtemp())
+
+    def _chunk(self, levels, seed):
+        rng = np.random.default_rng(seed)
+        n = len(levels)
+        return pd.DataFrame({
+            'lat': rng.uniform(5.30, 5.40, n), 'lng': rng.uniform(-4.05, -3.95, n),
+            'hour': rng.integers(0, 24, n), 'day_of_week': rng.integers(0, 7, n),
+            'is_weekend': np.zeros(n), 'avg_speed': rng.uniform(5, 60, n), 'traffic_level': levels,
+        })
+
+    def _train(self, **overrides):
+        with override_settings(TRAINING_MAX_PENDING_ROWS=3 * self.chunk_size, **overrides):
+            return model_trainer.train_model_incremental(self.chunk_size, self.models_root, self.dataset)
+
+    def test_single_class_run_borrows_earlier_rows(self):
+        mixed = self._chunk(np.arange(400) % 3, 0)
+        # Far more single-class rows than the pending cap
+        dataset_store.write_dataset([mixed, self._chunk(np.zeros(2000, dtype=int), 1)], self.dataset)
+        report = self._train()
+        self.assertNotIn('error', report)
+        self.assertEqual(model_trainer._read_state(self.models_root)['rows_seen'], 2400)
+
+    def test_resumed_single_class_run_borrows_earlier_rows(self):
+        dataset_store.write_dataset([self._chunk(np.arange(400) % 3, 0), self._chunk(np.zeros(300, dtype=int), 1)], self.dataset)
+        self.assertNotIn('error', self._train())
+        # Read back from before the new rows, which the run did not keep
+        dataset_store.write_dataset([self._chunk(np.ones(1000, dtype=int), 2)], self.dataset, append=True)
+        self.assertNotIn('error', self._train())
+        self.assertEqual(model_trainer._read_state(self.models_root)['rows_seen'], 1700)
+
+    def test_trees_added_after_a_trim_get_new_seeds(self):
+        dataset_store.write_dataset([self._chunk(np.arange(600) % 3, 0)], self.dataset)
+        # 34 trees per chunk, trimmed to 40 after the second and third
+        self.assertNotIn('error', self._train(MAX_FOREST_ESTIMATORS=40))
+
+        model = joblib.load(self.models_root / model_trainer.MODEL_FILENAME)
+        seeds = [tree.random_state for tree in model.estimators_]
+        self.assertEqual(len(seeds), 40)
+        self.assertEqual(len(set(seeds)), len(seeds))
+        self.assertEqual(model_trainer._read_state(self.models_root)['trees_grown'], 3 * 34)
+
+    def test_single_class_start_fails_at_the_cap(self):
+        dataset_store.write_dataset([self._chunk(np.zeros(2000, dtype=int), 0), self._chunk(np.arange(300) % 3, 1)], self.dataset)
+        report = self._train()
+        self.assertIn('error', report)
+        self.assertIn("Medium", report['error'])
+        self.assertIsNone(model_trainer._read_state(self.models_root))
+
+
+def _kill_worker(*args):
+    # A training worker dying under the pool, as on an out-of-memory kill
+    os._exit(1)
+
+
+def _finish_job(job_id, *args):
+    jobs._update_job(job_id, state='done', phase='done', progress=1.0)
+    jobs._release_lock(job_id)
+
+
+class SimulateTests(SimpleTestCase):
+    @override_settings(SIMULATE_MAX_SAMPLES=5000)
+    def test_rejects_out_of_range_sample_counts(self):
+        with mock.patch('traffic.views.submit_training_job') as submit:
+            for n_samples in ('0', '-5', '5001'):
+                response = self.client.get('/simulate/', {'n_samples': n_samples})
+                self.assertEqual(response.status_code, 400)
+            submit.assert_not_called()
+
+    def test_update_of_missing_job_is_dropped(self):
+        with override_settings(JOBS_ROOT=Path(tempfile.mkdtemp())):
+            job_id = str(uuid.uuid4())
+            with self.assertLogs('traffic.utils.jobs', 'WARNING'):
+                self.assertIsNone(jobs._update_job(job_id, state='running'))
+            self.assertIsNone(jobs.get_job(job_id))
+
+    def _wait_for(self, job_id, state):
+        deadline = time.monotonic() + 60
+        while jobs.get_job(job_id)['state'] != state and time.monotonic() < deadline:
+            time.sleep(0.05)
+        return jobs.get_job(job_id)
+
+    def test_broken_pool_fails_the_job_and_is_replaced(self):
+        with override_settings(JOBS_ROOT=Path(tempfile.mkdtemp())), mock.patch.object(jobs, '_executor', None):
+            with mock.patch.object(jobs, 'run_training_pipeline', _kill_worker), self.assertLogs('traffic.utils.jobs', 'ERROR'):
+                job, created = jobs.submit_training_job(100)
+                self.assertTrue(created)
+                job = self._wait_for(job['id'], 'failed')
+            self.assertEqual(job['state'], 'failed')
+            # Lock released and the broken pool dropped: the next job runs at once
+            self.assertIsNone(jobs._active_job())
+            self.assertIsNone(jobs._executor)
+            with mock.patch.object(jobs, 'run_training_pipeline', _finish_job):
+                job, created = jobs.submit_training_job(100)
+                self.assertTrue(created)
+                self.assertEqual(self._wait_for(job['id'], 'done')['state'], 'done')
+            jobs._executor.shutdown()
+
+    def test_submit_to_a_broken_pool_retries_on_a_fresh_one(self):
+        broken = mock.Mock(submit=mock.Mock(side_effect=jobs.BrokenProcessPool))
+        with override_settings(JOBS_ROOT=Path(tempfile.mkdtemp())), mock.patch.object(jobs, '_executor', broken), \
+                mock.patch.object(jobs, 'run_training_pipeline', _finish_job):
+            job, created = jobs.submit_training_job(100)
+            self.assertEqual(self._wait_for(job['id'], 'done')['state'], 'done')
+            broken.shutdown.assert_called_once_with(wait=False)
+            self.assertIsNot(jobs._executor, broken)
+            jobs._executor.shutdown()
+
+    def test_prune_removes_old_finished_jobs(self):
+        with override_settings(JOBS_ROOT=Path(tempfile.mkdtemp())):
+            old, recent, running = (str(uuid.uuid4()) for _ in range(3))
+            jobs._write_job({'id': old, 'state': 'done'})
+            jobs._write_job({'id': recent, 'state': 'failed'})
+            jobs._write_job({'id': running, 'state': 'running'})
+            stamp = time.time() - 3600
+            os.utime(jobs._job_path(old), (stamp, stamp))
+            os.utime(jobs._job_path(running), (stamp, stamp))
+            self.assertEqual(jobs.prune_jobs(max_age=600), 1)
+            self.assertIsNone(jobs.get_job(old))
+            self.assertIsNotNone(jobs.get_job(recent))
+            self.assertIsNotNone(jobs.get_job(running))
+
+
+class HistoryPageTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('history')
+        # No background flush thread: the test decides when rows are written
+        buffer = WriteBehindBuffer(SearchHistory, history.HISTORY_FIELDS, flush_interval=3600)
+        patcher = mock.patch.object(history, '_buffer', buffer)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.buffer = buffer
+
+    def test_pending_searches_are_paged_with_ids(self):
+        with mock.patch.object(WriteBehindBuffer, '_ensure_thread'):
+            for i in range(3):
+                history.record_search(self.user.id, f'A{i}', f'B{i}')
+        self.assertEqual(self.buffer.pending, 3)
+
+        rows, cursor = history.history_page(self.user, limit=2)
+        self.assertEqual(self.buffer.pending, 0)
+        self.assertEqual([row['source'] for row in rows], ['A2', 'A1'])
+        self.assertTrue(all(isinstance(row['id'], int) for row in rows))
+        rows, cursor = history.history_page(self.user, cursor, limit=2)
+        self.assertEqual([row['source'] for row in rows], ['A0'])
+        self.assertIsNone(cursor)
+
+    def test_failed_flush_leaves_pending_rows_out(self):
+        with mock.patch.object(WriteBehindBuffer, '_ensure_thread'):
+            history.record_search(self.user.id, 'A', 'B')
+        with mock.patch.object(self.buffer, 'flush', side_effect=RuntimeError), self.assertLogs('traffic.utils.history'):
+            rows, cursor = history.history_page(self.user)
+        self.assertEqual(rows, [])
+
+
+class ResolveIncidentTests(TestCase):
+    def setUp(self):
+        self.store = incidents.IncidentStore()
+        self.store.load()
+        patcher = mock.patch('traffic.views.get_incident_store', return_value=self.store)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.reporter = User.objects.create_user('reporter')
+        reported = incidents.parse_incidents({'kind': 'accident', 'severity': 3, 'lat': 5.33, 'lng': -4.02})
+        self.incident_id = self.store.report(reported, self.reporter)[0]['id']
+
+    def _resolve(self, user):
+        self.client.force_login(user)
+        return self.client.post(f'/api/incidents/{self.incident_id}/resolve/')
+
+    def test_only_reporter_or_staff_can_resolve(self):
+        self.assertEqual(self._resolve(User.objects.create_user('other')).status_code, 404)
+        self.assertEqual(len(self.store.index), 1)
+        self.assertEqual(self._resolve(self.reporter).status_code, 200)
+        self.assertEqual(len(self.store.index), 0)
+
+    def test_staff_can_resolve(self):
+        self.assertEqual(self._resolve(User.objects.create_user('staff', is_staff=True)).status_code, 200)
+        self.assertEqual(len(self.store.index), 0)
+
+
+class IncidentOverrideTests(TestCase):
+    def setUp(self):
+        self.store = incidents.IncidentStore()
+        self.store.load()
+        reported = incidents.parse_incidents({'kind': 'accident', 'severity': 3, 'lat': 5.33, 'lng': -4.02})
+        self.store.report(reported, User.objects.create_user('reporter'))
+        # The model answers "Faible" everywhere
+        forest = mock.Mock(predict=lambda X: np.zeros(len(X), dtype=np.int64))
+        for patcher in (
+            mock.patch.object(incidents, 'get_incident_store', return_value=self.store),
+            mock.patch.object(inference, 'get_forest', return_value=forest),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _predict(self, coords):
+        response = self.client.post('/predict/', {'coords-display': coords, 'hour': 8, 'day_of_week': 0})
+        self.assertEqual(response.status_code, 200)
+        return response.json()['prediction']
+
+    def test_incident_raises_the_prediction_around_it(self):
+        self.assertEqual(self._predict('5.331,-4.02'), LEVELS[incidents.SEVERITY_LEVELS[3]])
+        # Beyond the 500 m radius of a severity 3 incident
+        self.assertEqual(self._predict('5.34,-4.02'), LEVELS[0])
+
+    @override_settings(INCIDENT_OVERRIDE=False)
+    def test_override_can_be_turned_off(self):
+        self.assertEqual(self._predict('5.331,-4.02'), LEVELS[0])
+
+
+class FlatForestTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        rng = np.random.default_rng(0)
+        X = np.column_stack((rng.uniform(5.30, 5.40, 3000), rng.uniform(-4.05, -3.95, 3000), rng.integers(0, 24, 3000)))
+        y = (X[:, 2] >= 17).astype(int) + (X[:, 0] + rng.normal(0, 0.01, 3000) > 5.35)
+        cls.model = RandomForestClassifier(n_estimators=12, max_depth=8, random_state=0).fit(X, y)
+        cls.X = X[:500]
+
+    def _edge_rows(self):
+        """
+        Rows whose features sit exactly on, just below and just above the
+        float32 split thresholds, where a float64 comparison would disagree.
+        """
+        rows = []
+        for estimator in self.model.estimators_:
+            tree = estimator.tree_
+            for node in np.flatnonzero(tree.children_left != -1)[:20]:
+                t32 = np.float32(tree.threshold[node])
+                for value in (t32, np.nextafter(t32, np.float32(-np.inf)), np.nextafter(t32, np.float32(np.inf)), tree.threshold[node]):
+                    row = self.X[len(rows) % len(self.X)].copy()
+                    row[tree.feature[node]] = value
+                    rows.append(row)
+        return np.array(rows)
+
+    def test_matches_sklearn(self):
+        forest = FlatForest(*flatten_forest(self.model))
+        for X in (self.X, self._edge_rows()):
+            np.testing.assert_array_equal(forest.predict_proba(X), self.model.predict_proba(X))
+            np.testing.assert_array_equal(forest.predict(X), self.model.predict(X))
+
+    def test_quantized_matches_sklearn(self):
+        forest = FlatForest(*flatten_forest(self.model, quantized=True))
+        for X in (self.X, self._edge_rows()):
+            np.testing.assert_allclose(forest.predict_proba(X), self.model.predict_proba(X), rtol=1e-6)
+            np.testing.assert_array_equal(forest.apply(X), FlatForest(*flatten_forest(self.model)).apply(X))
+            np.testing.assert_array_equal(forest.predict(X), self.model.predict(X))
+
+
+class RoutingTests(SimpleTestCase):
+    def setUp(self):
+        self.graph = routing.synthetic_grid(bbox=(5.30, -4.05, 5.33, -4.02), step=0.0025)
+        rng = np.random.default_rng(0)
+        # Free flow slowed down at random, as congestion would
+        free_flow = self.graph.length.astype(np.float64) / self.graph.speed
+        self.weights = (free_flow * rng.choice(routing.DEFAULT_CONGESTION_FACTORS, self.graph.edge_count)).tolist()
+
+    def _cost(self, path):
+        return sum(self.weights[edge] for edge in path)
+
+    def test_astar_matches_dijkstra(self):
+        g = self.graph
+        matrix = csr_matrix((self.weights, g.indices, g.indptr), shape=(g.node_count, g.node_count))
+        target = g.node_count - 1
+        for source in (0, 7, 60, 100):
+            path = g.shortest_path(source, target, self.weights)
+            self.assertEqual(g.sources[path[0]], source)
+            self.assertEqual(g.indices[path[-1]], target)
+            self.assertAlmostEqual(self._cost(path), dijkstra(matrix, indices=source)[target], places=6)
+
+    def test_alternatives_differ_within_penalty_bound(self):
+        alternatives = 3
+        routes = self.graph.routes(0, self.graph.node_count - 1, self.weights, alternatives)
+        self.assertEqual(len(routes), alternatives)
+        self.assertEqual(len({tuple(route['nodes']) for route in routes}), alternatives)
+        best = routes[0]['duration']
+        self.assertAlmostEqual(best, self._cost(self.graph.shortest_path(0, self.graph.node_count - 1, self.weights)))
+        # Each search penalizes the edges it found once, so an alternative
+        # costs at most the best route with all its edges penalized each time
+        bound = best * routing.ALTERNATIVE_PENALTY ** (2 * alternatives - 1)
+        for route in routes:
+            self.assertGreaterEqual(route['duration'], best)
+            self.assertLessEqual(route['duration'], bound)
+
+    def test_unreachable_target(self):
+        # Nodes 0-1 are connected both ways; node 2 only has an outgoing edge
+        graph = routing.RoadGraph.from_edges([5.30, 5.30, 5.31], [-4.0, -3.99, -4.0], [0, 1, 2], [1, 0, 0], [30, 30, 30])
+        weights = (graph.length / graph.speed).tolist()
+        self.assertIsNone(graph.shortest_path(0, 2, weights))
+        self.assertEqual(graph.routes(0, 2, weights, 2), [])
+        with mock.patch.object(graph, 'travel_times', return_value=(None, weights)):
+            with self.assertRaises(routing.NoRoute):
+                routing.find_routes((5.30, -4.0), (5.31, -4.0), 8, 0, graph=graph)
+
+    def test_route_endpoint_returns_osrm_shape(self):
+        with mock.patch.object(routing, 'get_road_graph', return_value=self.graph), \
+                mock.patch.object(self.graph, 'travel_times', return_value=('test', self.weights)):
+            response = self.client.get('/api/route/', {
+                'start': '5.3001,-4.0499', 'end': '5.3299,-4.0201', 'hour': 8, 'day_of_week': 0, 'alternatives': 2,
+            })
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['code'], 'Ok')
+        self.assertEqual(len(data['waypoints']), 2)
+        self.assertEqual(len(data['waypoints'][0]['location']), 2)
+        self.assertTrue(1 <= len(data['routes']) <= 2)
+        for route in data['routes']:
+            self.assertEqual(route['geometry']['type'], 'LineString')
+            lng, lat = route['geometry']['coordinates'][0]
+            self.assertAlmostEqual(lat, 5.30, places=6)
+            self.assertAlmostEqual(lng, -4.05, places=6)
+            self.assertGreater(route['distance'], 0)
+            self.assertEqual(route['weight'], route['duration'])
+            self.assertEqual(route['weight_name'], 'congestion')
+
+    def test_route_endpoint_rejects_bad_hour(self):
+        response = self.client.get('/api/route/', {'start': '5.30,-4.05', 'end': '5.33,-4.02', 'hour': 24})
+        self.assertEqual(response.status_code, 400)
+
+
+class BatchPredictionTests(TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create_user('batch'))
+
+    def _post(self, rows):
+        return self.client.post('/api/predict-batch/', rows, content_type='application/json')
+
+    def test_out_of_range_hour_or_day_rejected(self):
+        for row in ([5.35, -4.0, 24, 0], [5.35, -4.0, -1, 0], [5.35, -4.0, 8, 7], [5.35, -4.0, 8.5, 0]):
+            with self.subTest(row=row), mock.patch.object(batch_prediction, 'predict_by_region') as predict:
+                response = self._post([[5.35, -4.0, 8, 0], row])
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('Heure (0-23) ou jour (0-6)', response.json()['error'])
+                predict.assert_not_called()
+
+    def test_rows_in_range_scored(self):
+        with mock.patch.object(batch_prediction, 'predict_by_region', return_value=np.array([0, 2])):
+            response = self._post([[5.35, -4.0, 0, 0], [5.35, -4.0, 23, 6]])
+        self.assertEqual(response.status_code, 200)
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual([json.loads(line)['level'] for line in lines], [0, 2])
+
+
+class TrendTests(SimpleTestCase):
+    def setUp(self):
+        trend_engine.get_cache().clear()
+
+    def test_invalid_day_rejected_before_the_cache(self):
+        model = mock.Mock()
+        for day_of_week in (-1, 7, 'week', 2.0, True):
+            with self.subTest(day_of_week=day_of_week), self.assertRaises(trend_engine.InvalidDay):
+                trend_engine.get_daily_trend(model, 'v1', 5.35, -4.0, day_of_week)
+        self.assertEqual(len(trend_engine.get_cache()), 0)
+        model.predict_proba.assert_not_called()
+
+
+class PredictionBatcherTests(SimpleTestCase):
+    async def test_rejects_once_the_queue_is_full(self):
+        release = threading.Event()
+
+        def predict(X):
+            release.wait(5)
+            return X[:, 0] * 10
+
+        batcher = inference.PredictionBatcher(predict, max_batch=2, window=0, max_queue=3)
+        tasks = [asyncio.create_task(batcher.predict(np.array([[i]]))) for i in range(3)]
+        await asyncio.sleep(0.05)
+        # The first row is running, the next two wait for it
+        self.assertEqual(batcher.queue_depth, 3)
+        with self.assertRaises(inference.Overloaded):
+            await batcher.predict(np.array([[3]]))
+
+        release.set()
+        self.assertEqual(await asyncio.gather(*tasks), [0, 10, 20])
+        stats = batcher.stats()
+        self.assertEqual((stats['batches'], stats['rows'], stats['rejected'], stats['queue_depth']), (2, 3, 1, 0))
+
+    async def test_one_batcher_per_region(self):
+        self.assertIs(inference.get_batcher('west'), inference.get_batcher('west'))
+        self.assertIsNot(inference.get_batcher('west'), inference.get_batcher('east'))
+        self.assertEqual(inference.get_batcher('east').predict_fn.keywords, {'region': 'east'})
+
+
+class PredictionGridTests(SimpleTestCase):
+    def setUp(self):
+        self.models_root = Path(tempfile.mkdtemp())
+        self.grid_path = self.models_root / prediction_grid.GRID_FILENAME
+        self.meta_path = self.models_root / prediction_grid.META_FILENAME
+
+    def _publish(self, version, level, write_meta=True):
+        """
+        Swap in a 2x2 grid the way build_prediction_grid does, optionally
+        stopping before the meta is rewritten.
+        """
+        partial_path = self.models_root / (prediction_grid.GRID_FILENAME + '.partial')
+        np.save(partial_path, np.full((2, 7, 24, 2, 2), level, dtype=np.uint8))
+        # np.save adds .npy to names without it
+        os.replace(f'{partial_path}.npy', partial_path)
+        meta = {
+            'version': version, 'bbox': [5.30, -4.05, 5.31, -4.04], 'step': 0.01,
+            'lat_count': 2, 'lng_count': 2, 'grid_inode': os.stat(partial_path).st_ino,
+        }
+        os.replace(partial_path, self.grid_path)
+        if write_meta:
+            prediction_grid._write_json(self.meta_path, meta)
+
+    def test_grid_swapped_before_its_meta_is_not_read(self):
+        self._publish('v1', 1)
+        self._publish('v2', 2, write_meta=False)
+        # A fresh reader sees the v1 meta next to the v2 grid
+        loader = prediction_grid.GridLoader(self.models_root)
+        self.assertIsNone(loader.get())
+
+        self._publish('v2', 2)
+        grid = loader.get()
+        self.assertEqual(grid.version, 'v2')
+        self.assertEqual(grid.lookup(5.30, -4.05, 8, 0), (2, 2))
+
+        # A reader holding v2 keeps it while v3 is half published
+        self._publish('v3', 0, write_meta=False)
+        prediction_grid._write_json(self.meta_path, dict(prediction_grid._read_json(self.meta_path)))
+        self.assertIs(loader.get(), grid)
+
+
+class RegionTests(SimpleTestCase):
+    def setUp(self):
+        self.models_root = Path(tempfile.mkdtemp())
+        overrides = override_settings(MODELS_ROOT=self.models_root, REGIONS={
+            'west': {'bbox': (5.30, -4.05, 5.40, -4.00)},
+            'east': {'bbox': (5.30, -4.00, 5.40, -3.95)},
+        })
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        registry = mock.patch.object(regions, '_registry', None)
+        registry.start()
+        self.addCleanup(registry.stop)
+
+    def _publish_grid(self, name, level, bbox=(5.30, -4.05, 5.40, -3.95), step=0.01):
+        """
+        A grid at one congestion class everywhere, as build_prediction_grid lays it out.
+        """
+        root = self.models_root / regions.REGIONS_DIRNAME / name
+        root.mkdir(parents=True)
+        lat_count = int(round((bbox[2] - bbox[0]) / step)) + 1
+        lng_count = int(round((bbox[3] - bbox[1]) / step)) + 1
+        np.save(root / prediction_grid.GRID_FILENAME, np.full((2, 7, 24, lat_count, lng_count), level, dtype=np.uint8))
+        prediction_grid._write_json(root / prediction_grid.META_FILENAME, {
+            'version': f'{name}-v1', 'bbox': list(bbox), 'step': step,
+            'lat_count': lat_count, 'lng_count': lng_count,
+        })
+
+    def test_congestion_reads_the_grid_of_the_region(self):
+        self._publish_grid('west', 1)
+        self._publish_grid('east', 2)
+        response = self.client.get('/api/congestion/', {'bbox': '5.32,-3.99,5.34,-3.97', 'hour': 8, 'day_of_week': 0})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['version'], 'east-v1')
+        self.assertEqual({level for row in data['levels'] for level in row}, {2})
+
+        # Outside every region
+        response = self.client.get('/api/congestion/', {'bbox': '5.50,-3.99,5.52,-3.97', 'hour': 8, 'day_of_week': 0})
+        self.assertEqual(response.status_code, 400)
+
+    def test_congestion_without_the_region_grid(self):
+        self._publish_grid('west', 1)
+        response = self.client.get('/api/congestion/', {'bbox': '5.32,-3.99,5.34,-3.97', 'hour': 8, 'day_of_week': 0})
+        self.assertEqual(response.status_code, 400)
+
+    def test_least_recently_used_regions_evicted_over_budget(self):
+        for name in ('west', 'east'):
+            self._publish_grid(name, 1)
+        grid_bytes = 2 * 7 * 24 * 11 * 11
+        with override_settings(REGION_MEMORY_BUDGET=grid_bytes + grid_bytes // 2):
+            registry = regions.get_region_registry()
+        west = registry.grid('west')
+        self.assertEqual(registry.stats()['memory_bytes'], grid_bytes)
+
+        registry.grid('east')
+        stats = registry.stats()
+        self.assertEqual((stats['loaded'], stats['evictions'], stats['memory_bytes']), (['east'], 1, grid_bytes))
+        # Reloaded on the next use, evicting east in turn
+        self.assertIsNot(registry.grid('west'), west)
+        self.assertEqual(registry.stats()['loaded'], ['west'])
+
+        # The shard just used stays, even alone over budget
+        registry.memory_budget = 1
+        self.assertIsNotNone(registry.grid('east'))
+        self.assertEqual(registry.stats()['loaded'], ['east'])
+
+    def test_rows_scored_by_the_model_of_their_region(self):
+        def predict_levels(X, region=None):
+            return np.full(len(X), {'west': 1, 'east': 2}[region])
+
+        X = np.array([[5.35, -4.02], [5.35, -3.97], [5.36, -4.03]])
+        with mock.patch.object(inference, 'predict_levels', side_effect=predict_levels) as predict:
+            self.assertEqual(inference.predict_by_region(X).tolist(), [1, 2, 1])
+            # One call per region, each with its own rows only
+            calls = sorted((call.args[1], len(call.args[0])) for call in predict.call_args_list)
+            self.assertEqual(calls, [('east', 1), ('west', 2)])
+            with self.assertRaises(regions.OutsideRegions):
+                inference.predict_by_region(np.array([[5.35, -4.02], [5.50, -4.02]]))
+
+    def test_travel_times_use_each_region_grid(self):
+        self._publish_grid('east', 2)
+        graph = routing.RoadGraph.from_edges(
+            [5.35, 5.35, 5.35, 5.35], [-4.04, -4.03, -3.97, -3.96], [0, 2], [1, 3], [36, 36],
+        )
+        version, weights = graph.travel_times(8, 0)
+        self.assertEqual(version, 'east:east-v1')
+        free_flow = graph.length / graph.speed
+        # West has no grid nor model: free flow; east is at class 2
+        self.assertAlmostEqual(weights[0], free_flow[0])
+        self.assertAlmostEqual(weights[1], free_flow[1] * routing.DEFAULT_CONGESTION_FACTORS[2])
+
+
+class TelemetryTests(TestCase):
+    def test_rolling_window_drops_old_buckets(self):
+        aggregates = telemetry.RollingAggregates(4, window=300, bucket=60)
+        now = 10000
+        # Kept, kept, older than the window, too far ahead of the clock
+        aggregates.add(
+            np.array([0, 0, 0, 1]), np.array([20.0, 40.0, 60.0, 80.0]),
+            [now - 10, now - 130, now - 500, now + 100], ['a', 'b', 'c', 'a'], now=now,
+        )
+        counts, speed_sums, vehicles = aggregates.snapshot(now)
+        self.assertEqual(counts.tolist(), [2, 0, 0, 0])
+        self.assertEqual(speed_sums[0], 60.0)
+
+        # Three minutes later the bucket of 'b' has left the window
+        counts, speed_sums, vehicles = aggregates.snapshot(now + 180)
+        self.assertEqual((counts.tolist(), speed_sums[0], vehicles), ([1, 0, 0, 0], 20.0, 1))
+
+        # Reusing the slot of that bucket starts it over
+        aggregates.add(np.array([2]), np.array([30.0]), [now + 180], ['d'], now=now + 180)
+        counts, speed_sums, _ = aggregates.snapshot(now + 180)
+        self.assertEqual(counts.tolist(), [1, 0, 1, 0])
+        self.assertEqual(speed_sums.tolist(), [20.0, 0.0, 30.0, 0.0])
+
+    def _points(self, n, speed):
+        now = time.time()
+        return telemetry.parse_points([
+            {'id': f'v{i}', 'lat': 5.355, 'lng': -3.995, 'speed': speed, 'timestamp': now - i} for i in range(n)
+        ])
+
+    @override_settings(TELEMETRY_MAX_PENDING=5)
+    def test_ingest_is_written_behind_and_aggregated(self):
+        with mock.patch.object(WriteBehindBuffer, '_ensure_thread'):
+            store = telemetry.TelemetryStore()
+            self.assertEqual(store.ingest(self._points(4, 30.0)), 4)
+            # Aggregated at once, in the database only once flushed
+            stats = store.stats()
+            self.assertEqual((stats['observations'], stats['vehicles'], stats['avg_speed']), (4, 4, 30.0))
+            self.assertEqual(len(stats['cells']), 1)
+            self.assertEqual(VehicleObservation.objects.count(), 0)
+
+            # Over max_pending the whole batch is refused, aggregates included
+            with self.assertRaises(telemetry.BufferFull):
+                store.ingest(self._points(2, 90.0))
+            self.assertEqual(store.stats()['observations'], 4)
+
+            self.assertEqual(store.buffer.flush(), 4)
+        self.assertEqual(VehicleObservation.objects.count(), 4)
+        self.assertEqual(store.stats()['buffer']['pending'], 0)
+
+
+class MetricsTests(SimpleTestCase):
+    def test_render_in_prometheus_text_format(self):
+        registry = metrics.Metrics()
+        for value in (0.0004, 0.003, 0.003, 100.0):
+            registry.observe('span_seconds', value, span='inference', engine='forest')
+        registry.inc('requests_total', view='predict', method='POST', status=200)
+        registry.inc('requests_total', 2, status=200, method='POST', view='predict')
+        registry.register_collector(lambda: iter([('batcher_queue_depth', 'gauge', "Rows waiting.", {'loop': 'a"b'}, 3)]))
+        lines = registry.render().splitlines()
+
+        self.assertIn('# TYPE smarttrans_span_seconds histogram', lines)
+        labels = 'engine="forest",span="inference"'
+        self.assertIn(f'smarttrans_span_seconds_bucket{{{labels},le="0.0005"}} 1', lines)
+        self.assertIn(f'smarttrans_span_seconds_bucket{{{labels},le="0.005"}} 3', lines)
+        self.assertIn(f'smarttrans_span_seconds_bucket{{{labels},le="+Inf"}} 4', lines)
+        self.assertIn(f'smarttrans_span_seconds_count{{{labels}}} 4', lines)
+        # Same labels in another order are the same series
+        self.assertIn('smarttrans_requests_total{method="POST",status="200",view="predict"} 3', lines)
+        self.assertIn('# TYPE smarttrans_batcher_queue_depth gauge', lines)
+        self.assertIn('smarttrans_batcher_queue_depth{loop="a\\"b"} 3', lines)
+
+    def test_endpoint_reports_view_latency(self):
+        self.client.get('/api/route/', {'start': '5.30,-4.05', 'end': '5.33,-4.02', 'hour': 24})
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        body = response.content.decode()
+        self.assertIn('smarttrans_requests_total{method="GET",status="400",view="route"}', body)
+        self.assertIn('smarttrans_request_duration_seconds_count{method="GET",view="route"}', body)
+
+
+class ResponseTests(SimpleTestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.revision = 'v1'
+        self.view = mock.Mock(side_effect=lambda request: responses.JsonResponse({'trend': [1, 2, 3]}))
+        self.conditional_view = responses.conditional(lambda request: self.revision)(self.view)
+
+    def test_matching_etag_gets_304_without_running_the_view(self):
+        response = self.conditional_view(self.factory.get('/api/predict-trend/'))
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        self.assertIn('private', response['Cache-Control'])
+
+        response = self.conditional_view(self.factory.get('/api/predict-trend/', headers={'If-None-Match': etag}))
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(self.view.call_count, 1)
+        # The tag of a compressed copy matches too, and is echoed back as sent
+        gzip_tag = f'{etag[:-1]}-gzip"'
+        response = self.conditional_view(self.factory.get('/api/predict-trend/', headers={'If-None-Match': gzip_tag}))
+        self.assertEqual((response.status_code, response['ETag']), (304, gzip_tag))
+
+        self.revision = 'v2'
+        response = self.conditional_view(self.factory.get('/api/predict-trend/', headers={'If-None-Match': etag}))
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(self.view.call_count, 2)
+
+    def test_encoding_negotiation(self):
+        with mock.patch.object(responses, 'ENCODINGS', ('br', 'gzip')):
+            self.assertEqual(responses.negotiate_encoding('gzip, deflate, br'), 'br')
+            self.assertEqual(responses.negotiate_encoding('br;q=0.5, gzip'), 'gzip')
+            self.assertEqual(responses.negotiate_encoding('*'), 'br')
+            self.assertEqual(responses.negotiate_encoding('*, br;q=0'), 'gzip')
+            self.assertIsNone(responses.negotiate_encoding('gzip;q=0, deflate'))
+            self.assertIsNone(responses.negotiate_encoding(''))
+        with mock.patch.object(responses, 'ENCODINGS', ('gzip',)):
+            self.assertIsNone(responses.negotiate_encoding('br'))
+
+    def _compressed(self, data, accept):
+        response = responses.JsonResponse(data)
+        response.headers['ETag'] = '"abc"'
+        return responses.compress_response(self.factory.get('/', headers={'Accept-Encoding': accept}), response)
+
+    @override_settings(API_COMPRESS_MIN_SIZE=1024)
+    def test_gzip_above_the_threshold(self):
+        data = {'week': [[float(hour) for hour in range(24)]] * 7 * 10}
+        body = responses.dumps(data)
+        response = self._compressed(data, 'gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(response.content), body)
+        self.assertEqual(response['ETag'], '"abc-gzip"')
+        self.assertIn('Accept-Encoding', response['Vary'])
+
+        response = self._compressed({'trend': [1, 2, 3]}, 'gzip')
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(response['ETag'], '"abc"')
+        self.assertIn('Accept-Encoding', response['Vary'])
+
+    @unittest.skipIf(responses.brotli is None, "brotli is not installed")
+    def test_brotli_preferred_when_installed(self):
+        data = {'week': [[float(hour) for hour in range(24)]] * 7 * 10}
+        response = self._compressed(data, 'gzip, br')
+        self.assertEqual(response['Content-Encoding'], 'br')
+        self.assertEqual(responses.brotli.decompress(response.content), responses.dumps(data))
+
+
+@override_settings(STORAGES={
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+})
+class StaticAssetTests(SimpleTestCase):
+    ENTRY = {'width': 1920, 'height': 1080, 'sources': {
+        'image/webp': [['traffic/images/variants/slide1-640.webp', 640, 20000],
+                       ['traffic/images/variants/slide1-1920.webp', 1920, 90000]],
+    }}
+
+    def _render(self, entry):
+        with mock.patch.object(responsive_images_tags, 'get_variants', return_value=entry), \
+                mock.patch.dict(responsive_images_tags._rendered, clear=True):
+            return Template(
+                "{% load responsive_images %}{% picture 'traffic/images/slide1.jpg' 'hero' '50vw' 'Abidjan' %}"
+            ).render(Context())
+
+    def test_picture_offers_the_variants(self):
+        html = self._render(self.ENTRY)
+        self.assertInHTML(
+            '<picture class="hero">'
+            '<source type="image/webp" sizes="50vw" srcset="/static/traffic/images/variants/slide1-640.webp 640w, '
+            '/static/traffic/images/variants/slide1-1920.webp 1920w">'
+            '<img src="/static/traffic/images/slide1.jpg" sizes="50vw" width="1920" height="1080" alt="Abidjan" '
+            'decoding="async"></picture>',
+            html,
+        )
+
+    def test_picture_without_variants_is_the_image(self):
+        self.assertInHTML(
+            '<picture class="hero"><img src="/static/traffic/images/slide1.jpg" alt="Abidjan" decoding="async"></picture>',
+            self._render(None),
+        )
+
+    def test_storage_hashes_the_minified_copy(self):
+        sources = FileSystemStorage(location=tempfile.mkdtemp())
+        files = {
+            'traffic/js/app.js': 'function  add(a, b) {\n  // sum\n  return a + b;\n}\n',
+            'traffic/css/app.css': 'body {\n  color: red; /* x */\n}\n',
+            'traffic/js/lib.min.js': 'var  a = 1;\n',
+            'admin/js/core.js': 'var  a = 1;\n',
+        }
+        storage = MinifiedManifestStaticFilesStorage(location=tempfile.mkdtemp())
+        for name, content in files.items():
+            sources.save(name, ContentFile(content.encode()))
+            storage.save(name, ContentFile(content.encode()))
+        list(storage.post_process({name: (sources, name) for name in files}))
+
+        def collected(name):
+            with storage.open(storage.stored_name(name)) as f:
+                return f.read().decode()
+        self.assertEqual(collected('traffic/js/app.js'), 'function add(a,b){return a + b;}')
+        self.assertEqual(collected('traffic/css/app.css'), 'body{color:red}')
+        # Hashed after minifying
+        self.assertIn(hashlib.md5(b'body{color:red}').hexdigest()[:12], storage.stored_name('traffic/css/app.css'))
+        for name in ('traffic/js/lib.min.js', 'admin/js/core.js'):
+            self.assertEqual(collected(name), files[name])
+
+
+class TelemetryAuthTests(SimpleTestCase):
+    def _post(self, **headers):
+        return self.client.post('/api/telemetry/', 'not json', content_type='application/json', headers=headers)
+
+    @override_settings(TELEMETRY_TOKEN=None)
+    def test_refused_without_a_configured_token(self):
+        self.assertEqual(self._post().status_code, 503)
+
+    @override_settings(TELEMETRY_TOKEN='secret')
+    def test_token_required(self):
+        self.assertEqual(self._post().status_code, 403)
+        self.assertEqual(self._post(**{'X-Telemetry-Token': 'wrong'}).status_code, 403)
+        # Past authentication, on to the body
+        self.assertEqual(self._post(**{'X-Telemetry-Token': 'secret'}).status_code, 400)
+
+
+class ReverseGeocodeTests(SimpleTestCase):
+    def setUp(self):
+        cache = geocoding.ResultCache(Path(tempfile.mkdtemp()) / 'cache.sqlite3')
+        patcher = mock.patch('traffic.views.get_geocoder', return_value=geocoding.Geocoder(cache))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_rejects_out_of_range_coordinates(self):
+        for lat, lng in (('91', '0'), ('-90.5', '0'), ('0', '181'), ('nan', '0'), ('inf', '0')):
+            response = self.client.get('/api/geocode/reverse/', {'lat': lat, 'lng': lng})
+            self.assertEqual(response.status_code, 400)
+
+    def test_gazetteer_at_the_poles(self):
+        gazetteer = geocoding.Gazetteer([
+            {'name': 'Pole', 'city': '', 'type': 'city', 'lat': 89.999, 'lng': 10.0},
+        ])
+        for lat in (90.0, -90.0, 89.9999):
+            place = gazetteer.reverse(lat, 0.0, 1500)
+            self.assertEqual(place is not None, lat > 0)
+
+    @override_settings(GEOCODING_UPSTREAM_URL='http://upstream.invalid', GEOCODING_UPSTREAM_INTERVAL=0)
+    def test_bad_upstream_json_is_a_bad_gateway(self):
+        with mock.patch.object(geocoding.urllib.request, 'urlopen', return_value=io.BytesIO(b'<html>busy</html>')):
+            response = self.client.get('/api/geocode/reverse/', {'lat': '0', 'lng': '-20'})
+        self.assertEqual(response.status_code, 502)
+
+
+class FleetHubTests(SimpleTestCase):
+    def _apply_delta(self, body, lat, lng, level):
+        """
+        Decode a delta frame the way the dashboard does.
+        """
+        n = len(lat)
+        offset = -(-n // 8)
+        moved = np.flatnonzero(np.unpackbits(np.frombuffer(body[:offset], np.uint8), count=n, bitorder='little'))
+        k = len(moved)
+        lat[moved] += np.frombuffer(body[offset:offset + k], np.int8)
+        lng[moved] += np.frombuffer(body[offset + k:offset + 2 * k], np.int8)
+        level[moved] = np.frombuffer(body[offset + 2 * k:offset + 3 * k], np.uint8)
+        offset += 3 * k
+        jumps = int.from_bytes(body[offset:offset + 4], 'little')
+        offset += 4
+        ids = np.frombuffer(body[offset:offset + 4 * jumps], np.uint32)
+        lat[ids] = np.frombuffer(body[offset + 4 * jumps:offset + 8 * jumps], np.int32)
+        lng[ids] = np.frombuffer(body[offset + 8 * jumps:offset + 12 * jumps], np.int32)
+        level[ids] = np.frombuffer(body[offset + 12 * jumps:offset + 13 * jumps], np.uint8)
+
+    def test_deltas_rebuild_the_positions(self):
+        n = 50
+        rng = np.random.default_rng(0)
+        encoder = fleet_simulation.FrameEncoder(n)
+        lat, lng = rng.uniform(5.30, 5.40, n), rng.uniform(-4.05, -3.95, n)
+        encoder.encode(lat, lng, np.zeros(n))
+        kind, body = encoder.keyframe()
+        self.assertEqual(kind, fleet_simulation.KEYFRAME)
+        client_lat = np.frombuffer(body[:4 * n], np.int32).copy()
+        client_lng = np.frombuffer(body[4 * n:8 * n], np.int32).copy()
+        client_level = np.frombuffer(body[8 * n:], np.uint8).copy()
+
+        for _ in range(20):
+            # Mostly small moves, a few vehicles jumping to a new route
+            lat = lat + rng.normal(0, 2e-4, n)
+            lng = lng + rng.normal(0, 2e-4, n)
+            jump = rng.random(n) < 0.05
+            lat[jump] = rng.uniform(5.30, 5.40, jump.sum())
+            level = rng.integers(0, 3, n)
+            kind, body = encoder.encode(lat, lng, level)
+            self.assertEqual(kind, fleet_simulation.DELTA)
+            self._apply_delta(body, client_lat, client_lng, client_level)
+            np.testing.assert_array_equal(client_lat, np.rint(lat * fleet_simulation.QUANTUM))
+            np.testing.assert_array_equal(client_lng, np.rint(lng * fleet_simulation.QUANTUM))
+            np.testing.assert_array_equal(client_level, level)
+
+    async def test_hour_change_is_computed_off_the_loop(self):
+        graph = routing.synthetic_grid(bbox=(5.30, -4.05, 5.33, -4.02), step=0.0025)
+        free_flow = (graph.length / graph.speed).tolist()
+
+        def slow_travel_times(hour, day_of_week):
+            time.sleep(0.3)
+            return 'test', free_flow
+
+        hub = fleet_simulation.FleetHub(200, 16, 0.02, 64)
+        with mock.patch.object(fleet_simulation, 'get_road_graph', return_value=graph), \
+                mock.patch.object(graph, 'travel_times', return_value=('test', free_flow)):
+            queue = await hub.subscribe()
+        simulation = hub.simulation
+        # As if the clock had just moved to another hour
+        simulation.hour = (simulation.hour + 1) % 24
+        hub._requested_time = (simulation.hour, simulation.day_of_week)
+
+        with mock.patch.object(graph, 'travel_times', side_effect=slow_travel_times):
+            started = time.perf_counter()
+            while hub._retime is None or time.perf_counter() - started < 0.15:
+                await asyncio.sleep(0.01)
+            # The loop kept ticking while the travel times were computed
+            self.assertIsNotNone(hub._retime)
+            self.assertGreater(queue.qsize(), 3)
+            while hub._retime is not None:
+                await asyncio.sleep(0.01)
+        task = hub._task
+        hub.unsubscribe(queue)
+        await task
+        now = fleet_simulation.timezone.localtime()
+        self.assertEqual((simulation.hour, simulation.day_of_week), (now.hour, now.weekday()))
+        self.assertEqual(hub._keyframe()[:1], bytes([fleet_simulation.KEYFRAME]))
+
+    def test_vehicle_clusters_need_asgi(self):
+        with mock.patch('traffic.views.get_fleet_hub') as get_fleet_hub:
+            for path, params in (('/api/clusters/', {'layer': 'vehicles', 'bbox': '5.30,-4.05,5.40,-3.95', 'zoom': 12}),
+                                 ('/api/fleet/stream/', {})):
+                response = self.client.get(path, params)
+                self.assertEqual(response.status_code, 501)
+                self.assertEqual(response.json(), {'error': 'Flux disponible uniquement via ASGI.'})
+        get_fleet_hub.assert_not_called()
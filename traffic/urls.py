@@ -6,13 +6,28 @@ urlpatterns = [
     path('', views.home, name='home'),
     path('dashboard/', views.index, name='index'),
     path('predict/', views.predict, name='predict'),
+    path('api/predict-batch/', views.predict_batch, name='predict_batch'),
     path('simulate/', views.simulate, name='simulate'),
+    path('api/jobs/<str:job_id>/', views.job_status, name='job_status'),
     path('login/', views.login_view, name='login'),
     path('logout/', views.logout_view, name='logout'),
     path('register/', views.register_view, name='register'),
     path('api/add-favorite/', views.add_favorite, name='add_favorite'),
     path('api/user-data/', views.get_user_data, name='get_user_data'),
     path('api/predict-trend/', views.predict_trend, name='predict_trend'),
+    path('api/congestion/', views.congestion, name='congestion'),
+    path('api/route/', views.route, name='route'),
+    path('api/route/score/', views.score_routes, name='score_routes'),
+    path('api/geocode/', views.geocode, name='geocode'),
+    path('api/geocode/reverse/', views.reverse_geocode, name='reverse_geocode'),
+    path('api/fleet/stream/', views.fleet_stream, name='fleet_stream'),
+    path('api/fleet/', views.fleet_status, name='fleet_status'),
+    path('api/incidents/', views.incidents, name='incidents'),
+    path('api/incidents/<int:incident_id>/resolve/', views.resolve_incident, name='resolve_incident'),
+    path('api/clusters/', views.clusters, name='clusters'),
+    path('api/telemetry/', views.ingest_telemetry, name='ingest_telemetry'),
+    path('api/telemetry/stats/', views.telemetry_stats, name='telemetry_stats'),
+    path('metrics', views.metrics, name='metrics'),
     path('api/delete-favorite/<int:fav_id>/', views.delete_favorite, name='delete_favorite'),
     # Pasword Reset URLs
     path('password_reset/', auth_views.PasswordResetView.as_view(template_name='traffic/password_reset.html'), name='password_reset'),
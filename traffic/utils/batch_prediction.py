@@ -0,0 +1,103 @@
+import io
+import json
+import numpy as np
+import pandas as pd
+from .features import build_feature_matrix, LEVELS
+from .inference import predict_by_region
+
+INPUT_COLUMNS = ['lat', 'lng', 'hour', 'day_of_week']
+LEVEL_NAMES = np.array([LEVELS[level] for level in sorted(LEVELS)], dtype=object)
+
+NDJSON_TYPES = ('application/x-ndjson', 'application/ndjson', 'application/jsonl', 'application/jsonlines')
+CSV_TYPES = ('text/csv', 'application/csv')
+
+
+class InvalidInput(ValueError):
+    pass
+
+
+def _validate(df):
+    missing = [column for column in INPUT_COLUMNS if column not in df.columns]
+    if missing:
+        raise InvalidInput(f"Colonnes manquantes : {', '.join(missing)}")
+    df = df[INPUT_COLUMNS].apply(pd.to_numeric, errors='coerce')
+    if df.isna().any().any():
+        raise InvalidInput("Valeurs manquantes ou non numériques")
+    # The features would encode anything; out-of-range rows must not get a prediction
+    bad = ~(df['hour'].between(0, 23) & df['day_of_week'].between(0, 6)
+            & (df['hour'] % 1 == 0) & (df['day_of_week'] % 1 == 0))
+    if bad.any():
+        raise InvalidInput("Heure (0-23) ou jour (0-6) invalide")
+    return df
+
+
+def _iter_ndjson(stream, chunk_size):
+    lines = []
+    for line in stream:
+        if line.strip():
+            lines.append(line)
+        if len(lines) >= chunk_size:
+            yield pd.read_json(io.StringIO(b''.join(lines).decode('utf-8')), lines=True)
+            lines = []
+    if lines:
+        yield pd.read_json(io.StringIO(b''.join(lines).decode('utf-8')), lines=True)
+
+
+def iter_input_chunks(stream, content_type, chunk_size):
+    """
+    Yield the request body as validated DataFrames of at most chunk_size rows.
+    CSV and NDJSON bodies are parsed incrementally from the stream; a JSON
+    array (of objects or [lat, lng, hour, day_of_week] lists) is parsed whole.
+    """
+    if content_type in CSV_TYPES:
+        chunks = pd.read_csv(stream, chunksize=chunk_size)
+    elif content_type in NDJSON_TYPES:
+        chunks = _iter_ndjson(stream, chunk_size)
+    else:
+        try:
+            rows = json.loads(stream.read())
+        except ValueError:
+            raise InvalidInput("JSON invalide")
+        if not isinstance(rows, list):
+            raise InvalidInput("Un tableau JSON est attendu")
+        if rows and isinstance(rows[0], list):
+            df = pd.DataFrame(rows, columns=INPUT_COLUMNS)
+        else:
+            df = pd.DataFrame(rows)
+        chunks = (df.iloc[start:start + chunk_size] for start in range(0, len(df), chunk_size))
+
+    for chunk in chunks:
+        yield _validate(chunk)
+
+
+def score_chunk(df):
+    """
+    Add 'level' and 'prediction' columns, scoring the whole chunk at once.
+    """
+    X = build_feature_matrix(df['lat'], df['lng'], df['hour'], df['day_of_week'])
+    levels = np.asarray(predict_by_region(X), dtype=np.intp)
+    df = df.assign(level=levels, prediction=LEVEL_NAMES[levels])
+    return df
+
+
+def render_chunk(df, output_format, first):
+    if output_format == 'csv':
+        return df.to_csv(index=False, header=first, lineterminator='\n')
+    text = df.to_json(orient='records', lines=True, force_ascii=False)
+    return text if text.endswith('\n') else text + '\n'
+
+
+def stream_predictions(chunks, output_format, first=True):
+    """
+    Score and render chunk by chunk so memory stays flat whatever the input
+    size. Errors after the first chunk can only be reported in-band.
+    """
+    try:
+        for chunk in chunks:
+            yield render_chunk(score_chunk(chunk), output_format, first)
+            first = False
+    except Exception as e:
+        if output_format == 'csv':
+            yield f"# error: {e}\n"
+        else:
+            yield json.dumps({'error': str(e)}, ensure_ascii=False) + '\n'
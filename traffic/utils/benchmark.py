@@ -0,0 +1,245 @@
+import http.client
+import json
+import socket
+import threading
+import time
+from socketserver import ThreadingMixIn
+from urllib.parse import urlencode
+from wsgiref.simple_server import WSGIServer, WSGIRequestHandler, make_server
+import numpy as np
+from django.test import Client
+
+# Fixed CSRF secret sent as cookie and header, so POSTs pass CsrfViewMiddleware over HTTP
+BENCH_CSRF_TOKEN = 'benchmarkbenchmarkbenchmarkbench'
+
+
+def summarize(latencies, errors, elapsed):
+    """
+    Throughput and latency percentiles (ms) of one load run.
+    """
+    latencies = np.asarray(latencies) * 1000
+    summary = {
+        'requests': int(latencies.size),
+        'errors': errors,
+        'elapsed_s': round(elapsed, 3),
+        'throughput_per_s': round(latencies.size / elapsed, 1) if elapsed else 0.0,
+    }
+    if latencies.size:
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+        summary.update({
+            'mean_ms': round(float(latencies.mean()), 3),
+            'p50_ms': round(float(p50), 3),
+            'p95_ms': round(float(p95), 3),
+            'p99_ms': round(float(p99), 3),
+        })
+    return summary
+
+
+def run_load(send, requests, concurrency, warmup=0):
+    """
+    Call send(i) for i in range(requests) from `concurrency` threads, each
+    taking the next request as soon as its previous one is answered. send
+    returns the HTTP status; 4xx/5xx and exceptions count as errors. The
+    first `warmup` calls are made up front and not measured.
+    """
+    for i in range(warmup):
+        send(i)
+
+    counter = iter(range(requests))
+    counter_lock = threading.Lock()
+    latencies = []
+    errors = []
+
+    def worker():
+        own, failed = [], 0
+        while True:
+            with counter_lock:
+                i = next(counter, None)
+            if i is None:
+                break
+            started = time.perf_counter()
+            try:
+                status = send(i)
+            except Exception:
+                status = 599
+            own.append(time.perf_counter() - started)
+            failed += status >= 400
+        latencies.extend(own)
+        errors.append(failed)
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return summarize(latencies, sum(errors), time.perf_counter() - started)
+
+
+class ClientTransport:
+    """
+    Requests through django.test.Client, one client per thread.
+    """
+
+    name = 'client'
+
+    def __init__(self, user=None):
+        self.user = user
+        self._local = threading.local()
+
+    def _client(self):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = Client(HTTP_HOST='localhost')
+            if self.user is not None:
+                client.force_login(self.user)
+            self._local.client = client
+        return client
+
+    def request(self, method, path, params=None):
+        client = self._client()
+        if method == 'POST':
+            return client.post(path, params).status_code
+        return client.get(path, params).status_code
+
+    def close(self):
+        pass
+
+
+class _ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+class _QuietHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+class ServerTransport:
+    """
+    Requests over HTTP to a server started in this process on a free port:
+    wsgiref with a thread per request for 'wsgi', uvicorn for 'asgi' (only if
+    installed). Each load thread keeps its own connection.
+    """
+
+    def __init__(self, kind, session_key=None):
+        self.name = kind
+        cookies = [f"csrftoken={BENCH_CSRF_TOKEN}"]
+        if session_key:
+            cookies.append(f"sessionid={session_key}")
+        self.headers = {'Cookie': '; '.join(cookies), 'X-CSRFToken': BENCH_CSRF_TOKEN}
+        self._local = threading.local()
+        if kind == 'asgi':
+            self._start_asgi()
+        else:
+            self._start_wsgi()
+
+    def _start_wsgi(self):
+        from django.core.wsgi import get_wsgi_application
+
+        self._server = make_server(
+            '127.0.0.1', 0, get_wsgi_application(),
+            server_class=_ThreadingWSGIServer, handler_class=_QuietHandler,
+        )
+        self.port = self._server.server_port
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def _start_asgi(self):
+        import uvicorn
+        from django.core.asgi import get_asgi_application
+
+        # An explicit protocol, or asyncio leaves Nagle on for accepted
+        # connections and keep-alive requests pay a ~40 ms delayed ACK
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM, socket.IPPROTO_TCP)
+        sock.bind(('127.0.0.1', 0))
+        self.port = sock.getsockname()[1]
+        config = uvicorn.Config(get_asgi_application(), log_level='warning', lifespan='off')
+        self._server = uvicorn.Server(config)
+        self._thread = threading.Thread(target=self._server.run, kwargs={'sockets': [sock]}, daemon=True)
+        self._thread.start()
+        deadline = time.monotonic() + 10
+        while not self._server.started:
+            if time.monotonic() > deadline or not self._thread.is_alive():
+                raise RuntimeError("uvicorn did not start")
+            time.sleep(0.01)
+
+    def request(self, method, path, params=None):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = self._local.connection = http.client.HTTPConnection('127.0.0.1', self.port, timeout=60)
+        headers = dict(self.headers)
+        body = None
+        if params and method == 'POST':
+            body = urlencode(params)
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        elif params:
+            path = f"{path}?{urlencode(params)}"
+        try:
+            connection.request(method, path, body, headers)
+            response = connection.getresponse()
+            response.read()
+        except (http.client.HTTPException, OSError):
+            # wsgiref closes after every response; reconnect and retry once
+            connection.close()
+            connection.request(method, path, body, headers)
+            response = connection.getresponse()
+            response.read()
+        if response.will_close:
+            connection.close()
+        return response.status
+
+    def close(self):
+        if self.name == 'asgi':
+            self._server.should_exit = True
+        else:
+            self._server.shutdown()
+            self._server.server_close()
+        self._thread.join(timeout=10)
+
+
+def flatten_metrics(results, prefix=''):
+    """
+    {dotted.key: value} for every number in a results document whose key says
+    which way is better: *_ms / *_us (lower) and *_per_s (higher).
+    """
+    metrics = {}
+    for key, value in results.items():
+        name = f"{prefix}.{key}" if prefix else key
+        if isinstance(value, dict):
+            metrics.update(flatten_metrics(value, name))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool) and _direction(key):
+            metrics[name] = value
+    return metrics
+
+
+def _direction(key):
+    if key.endswith('_per_s'):
+        return 1
+    if key.endswith(('_ms', '_us')) or key in ('ms', 'us'):
+        return -1
+    return 0
+
+
+def compare_results(current, baseline, threshold=0.1):
+    """
+    Rows (metric, baseline, current, relative change, regressed) for the metrics
+    both documents share. A change counts as a regression when the metric got
+    worse by more than `threshold` (0.1 = 10 %).
+    """
+    current_metrics = flatten_metrics(current)
+    baseline_metrics = flatten_metrics(baseline)
+    rows = []
+    for name in sorted(current_metrics.keys() & baseline_metrics.keys()):
+        before, after = baseline_metrics[name], current_metrics[name]
+        if not before:
+            continue
+        change = (after - before) / before
+        worse = -change if _direction(name.rsplit('.', 1)[-1]) > 0 else change
+        rows.append((name, before, after, change, worse > threshold))
+    return rows
+
+
+def load_results(path):
+    with open(path) as f:
+        return json.load(f)
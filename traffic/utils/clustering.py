@@ -0,0 +1,269 @@
+import itertools
+import threading
+from collections import OrderedDict
+import numpy as np
+from django.conf import settings
+from django.utils import timezone
+from .hotspots import get_hotspot_index
+from .incidents import get_incident_store, SEVERITY_LEVELS
+from .metrics import register_collector
+from .regions import prediction_grid, split_by_region
+
+LAYERS = ('vehicles', 'incidents', 'hotspots')
+TILE_SIZE = 256
+# Cluster cells per tile side: 4 makes 64 px cells
+DEFAULT_CELLS_PER_TILE = 4
+# From this zoom on, points are returned one by one
+DEFAULT_MAX_ZOOM = 16
+MAX_ZOOM = 22
+DEFAULT_TILE_CACHE = 4096
+DEFAULT_MAX_TILES = 256
+# Web Mercator stops short of the poles
+MAX_LATITUDE = 85.05112878
+
+_versions = itertools.count(1)
+
+
+class InvalidViewport(ValueError):
+    pass
+
+
+def project(lats, lngs):
+    """
+    Web Mercator position of each point, scaled to [0, 1) at zoom 0.
+    """
+    lats = np.clip(np.asarray(lats, dtype=np.float64), -MAX_LATITUDE, MAX_LATITUDE)
+    x = (np.asarray(lngs, dtype=np.float64) + 180.0) / 360.0
+    y = 0.5 - np.log(np.tan(np.pi / 4 + np.radians(lats) / 2)) / (2 * np.pi)
+    return np.clip(x, 0.0, np.nextafter(1.0, 0.0)), np.clip(y, 0.0, np.nextafter(1.0, 0.0))
+
+
+def tile_range(south, west, north, east, zoom):
+    """
+    (first x, last x, first y, last y) of the slippy-map tiles covering a bbox.
+    """
+    x, y = project([north, south], [west, east])
+    n = 1 << zoom
+    return int(x[0] * n), int(x[1] * n), int(y[0] * n), int(y[1] * n)
+
+
+class ClusterIndex:
+    """
+    One snapshot of a point layer clustered on a hierarchical grid: at zoom
+    z the map is cut into cells_per_tile x cells_per_tile cells per tile,
+    and each non-empty cell becomes a cluster at its points' centroid, with
+    their count and mean and worst congestion class. Cells nest inside tiles,
+    so a tile's clusters are one slice of the zoom's arrays.
+
+    A zoom is built on its first request and tiles are cached in an LRU
+    keyed by (zoom, x, y): panning and zooming cost the visible tiles, not
+    the layer size. A new snapshot gets a new index, so nothing is stale.
+    """
+
+    def __init__(self, lats, lngs, levels, ids=None, cells_per_tile=DEFAULT_CELLS_PER_TILE,
+                 max_zoom=DEFAULT_MAX_ZOOM, cache_size=DEFAULT_TILE_CACHE):
+        self.lat = np.asarray(lats, dtype=np.float64)
+        self.lng = np.asarray(lngs, dtype=np.float64)
+        self.level = np.asarray(levels, dtype=np.float64)
+        self.ids = np.arange(self.lat.size) if ids is None else np.asarray(ids)
+        self.x, self.y = project(self.lat, self.lng)
+        self.cells_per_tile = cells_per_tile
+        self.max_zoom = max_zoom
+        self.cache_size = cache_size
+        self.version = next(_versions)
+        self._zooms = {}
+        self._tiles = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return self.lat.size
+
+    def _build(self, zoom):
+        """
+        Clusters of one zoom, sorted by tile.
+        """
+        n = 1 << zoom
+        if zoom >= self.max_zoom:
+            tiles = (self.y * n).astype(np.int64) * n + (self.x * n).astype(np.int64)
+            order = np.argsort(tiles, kind='stable')
+            return {
+                'tiles': tiles[order], 'lat': self.lat[order], 'lng': self.lng[order],
+                'count': np.ones(order.size, dtype=np.int64), 'level': self.level[order],
+                'max_level': self.level[order], 'id': self.ids[order],
+            }
+        scale = n * self.cells_per_tile
+        cx = (self.x * scale).astype(np.int64)
+        cy = (self.y * scale).astype(np.int64)
+        cells, inverse, counts = np.unique(cy * scale + cx, return_inverse=True, return_counts=True)
+        max_level = np.full(cells.size, -np.inf)
+        np.maximum.at(max_level, inverse, self.level)
+        tiles = (cells // scale // self.cells_per_tile) * n + (cells % scale) // self.cells_per_tile
+        order = np.argsort(tiles, kind='stable')
+        return {
+            'tiles': tiles[order],
+            'lat': (np.bincount(inverse, self.lat) / counts)[order],
+            'lng': (np.bincount(inverse, self.lng) / counts)[order],
+            'count': counts[order],
+            'level': (np.bincount(inverse, self.level) / counts)[order],
+            'max_level': max_level[order],
+            'id': None,
+        }
+
+    def _zoom(self, zoom):
+        built = self._zooms.get(zoom)
+        if built is None:
+            with self._lock:
+                built = self._zooms.get(zoom)
+                if built is None:
+                    built = self._zooms[zoom] = self._build(zoom)
+        return built
+
+    def tile(self, zoom, x, y):
+        """
+        Clusters (or single points) of one tile, as JSON-ready dicts.
+        """
+        key = (zoom, x, y)
+        with self._lock:
+            cached = self._tiles.get(key)
+            if cached is not None:
+                self._tiles.move_to_end(key)
+                self.hits += 1
+                return cached
+        built = self._zoom(zoom)
+        tile = y * (1 << zoom) + x
+        start, stop = np.searchsorted(built['tiles'], [tile, tile + 1])
+        window = slice(start, stop)
+        clusters = [
+            {
+                'lat': round(lat, 6),
+                'lng': round(lng, 6),
+                'count': count,
+                'level': int(round(level)),
+                'mean_level': round(level, 2),
+                'max_level': int(max_level),
+            }
+            for lat, lng, count, level, max_level in zip(
+                built['lat'][window].tolist(), built['lng'][window].tolist(), built['count'][window].tolist(),
+                built['level'][window].tolist(), built['max_level'][window].tolist(),
+            )
+        ]
+        if built['id'] is not None:
+            for cluster, pk in zip(clusters, built['id'][window].tolist()):
+                cluster['id'] = pk
+        with self._lock:
+            self.misses += 1
+            self._tiles[key] = clusters
+            while len(self._tiles) > self.cache_size:
+                self._tiles.popitem(last=False)
+        return clusters
+
+    def query(self, south, west, north, east, zoom, max_tiles=DEFAULT_MAX_TILES):
+        """
+        Clusters of every tile the bbox touches at this zoom; a cluster may
+        lie slightly outside the bbox when its tile straddles the edge.
+        """
+        x0, x1, y0, y1 = tile_range(south, west, north, east, zoom)
+        n_tiles = (x1 - x0 + 1) * (y1 - y0 + 1)
+        if n_tiles > max_tiles:
+            raise InvalidViewport(f"Zone trop grande pour le zoom {zoom} ({n_tiles} tuiles).")
+        clusters = []
+        for y in range(y0, y1 + 1):
+            for x in range(x0, x1 + 1):
+                clusters.extend(self.tile(zoom, x, y))
+        return clusters, n_tiles
+
+
+# Per layer: the source the current index was built from, and the index
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def _index_for(layer, source, build):
+    """
+    The layer's cluster index, rebuilt when `source` (the identity of the
+    data snapshot) changes.
+    """
+    current = _indexes.get(layer)
+    if current is not None and current[0] == source:
+        return current[1]
+    with _indexes_lock:
+        current = _indexes.get(layer)
+        if current is None or current[0] != source:
+            lats, lngs, levels, ids = build()
+            current = _indexes[layer] = (source, ClusterIndex(
+                lats, lngs, levels, ids,
+                getattr(settings, 'CLUSTER_CELLS_PER_TILE', DEFAULT_CELLS_PER_TILE),
+                getattr(settings, 'CLUSTER_MAX_ZOOM', DEFAULT_MAX_ZOOM),
+                getattr(settings, 'CLUSTER_TILE_CACHE', DEFAULT_TILE_CACHE),
+            ))
+    return current[1]
+
+
+def vehicle_index(simulation):
+    """
+    Clusters of the fleet at its current tick.
+    """
+    def build():
+        lat, lng, level = simulation.positions()
+        return lat, lng, level, None
+    return _index_for('vehicles', (simulation, simulation.ticks), build)
+
+
+def incident_index():
+    """
+    Clusters of the active incidents, levelled by the class they force.
+    """
+    index = get_incident_store().index
+
+    def build():
+        levels = np.array([SEVERITY_LEVELS.get(s, 2) for s in index.severity.tolist()], dtype=np.float64)
+        return index.lat, index.lng, levels, index.id
+    return _index_for('incidents', index, build)
+
+
+def hotspot_index():
+    """
+    Clusters of the hotspots, levelled by the prediction grid of their region
+    for this hour.
+    """
+    hotspots = get_hotspot_index()
+    now = timezone.localtime()
+    hour, day_of_week = now.hour, now.weekday()
+    grids = [(mask, prediction_grid(region)) for region, mask in split_by_region(hotspots.lats, hotspots.lngs)]
+    versions = tuple(grid.version if grid else None for _, grid in grids)
+
+    def build():
+        levels = np.zeros(len(hotspots))
+        for mask, grid in grids:
+            if grid is not None:
+                levels[mask] = np.maximum(grid.lookup_many(hotspots.lats[mask], hotspots.lngs[mask], hour, day_of_week), 0)
+        return hotspots.lats, hotspots.lngs, levels, np.array(hotspots.ids, dtype=object)
+    return _index_for('hotspots', (hotspots, versions, hour, day_of_week), build)
+
+
+def cluster_viewport(index, south, west, north, east, zoom):
+    if not (0 <= zoom <= MAX_ZOOM) or not (south <= north and west <= east):
+        raise InvalidViewport("Zone ou zoom invalide.")
+    clusters, n_tiles = index.query(
+        south, west, north, east, zoom, getattr(settings, 'CLUSTER_MAX_TILES', DEFAULT_MAX_TILES),
+    )
+    return {
+        'version': index.version,
+        'zoom': zoom,
+        'points': len(index),
+        'clustered': zoom < index.max_zoom,
+        'tiles': n_tiles,
+        'clusters': clusters,
+    }
+
+
+def _collect():
+    for layer, (_, index) in list(_indexes.items()):
+        labels = {'layer': layer}
+        yield 'cluster_tile_hits', 'gauge', "Tile cache hits of the layer's current cluster index.", labels, index.hits
+        yield 'cluster_tile_misses', 'gauge', "Tiles built by the layer's current cluster index.", labels, index.misses
+
+
+register_collector(_collect)
@@ -2,63 +2,133 @@ import pandas as pd
 import numpy as np
 import os
 from django.conf import settings
+from .dataset_store import write_dataset, read_manifest
+from .hotspots import load_hotspots
 
-def generate_traffic_data(n_samples=3000):
-    """
-    Generates realistic traffic data with location-based hotspots.
-    Features: lat, lng, hour, day_of_week, avg_speed, is_weekend
-    """
-    np.random.seed(42)
-    
-    # Simulate Abidjan area roughly [5.3, -4.0]
-    lat = np.random.uniform(5.30, 5.40, n_samples)
-    lng = np.random.uniform(-4.05, -3.95, n_samples)
-    hour = np.random.randint(0, 24, n_samples)
-    day_of_week = np.random.randint(0, 7, n_samples)
+# Simulate Abidjan area roughly [5.3, -4.0]
+LAT_RANGE = (5.30, 5.40)
+LNG_RANGE = (-4.05, -3.95)
+
+# Cumulative probabilities of levels 0/1 for each regime; level 2 takes the rest
+REGIME_CDF = np.array([
+    [0.05, 0.30],  # Peak hours near a hotspot: mostly high
+    [0.20, 0.60],  # Peak hours elsewhere
+    [0.00, 0.40],  # Busy areas stay dense during the day
+    [0.50, 0.90],  # Normal hours: mostly low or medium
+    [0.90, 1.00],  # Night/Early morning: mostly low
+])
+
+# Average speed range (km/h) for each traffic level
+SPEED_RANGES = np.array([[50, 80], [20, 50], [5, 20]])
+
+# Rows are generated in fixed blocks, each with its own seed derived from
+# (seed, block index), so the output for a seed does not depend on chunk size.
+BLOCK_SIZE = 1 << 16
+DEFAULT_CHUNK_SIZE = 1 << 20
+
+
+def _simulate_block(seed, block_index, n, with_speed, bbox, hotspots):
+    rng = np.random.default_rng(np.random.SeedSequence(seed, spawn_key=(block_index,)))
+    south, west, north, east = bbox or (LAT_RANGE[0], LNG_RANGE[0], LAT_RANGE[1], LNG_RANGE[1])
+
+    lat = rng.uniform(south, north, n)
+    lng = rng.uniform(west, east, n)
+    hour = rng.integers(0, 24, n)
+    day_of_week = rng.integers(0, 7, n)
     is_weekend = (day_of_week >= 5).astype(int)
-    
-    # Define Hotspots (City centers/Main bridges)
-    hotspots = [
-        {'lat': 5.33, 'lng': -4.02}, # Plateau
-        {'lat': 5.37, 'lng': -3.99}  # Cocody/Hervé
-    ]
-    
-    traffic_level = []
-    
-    for i in range(n_samples):
-        h = hour[i]
-        d_w = day_of_week[i]
-        l1, l2 = lat[i], lng[i]
-        
-        # Distance to nearest hotspot
-        min_dist = min([np.sqrt((l1-hs['lat'])**2 + (l2-hs['lng'])**2) for hs in hotspots])
-        is_near_hotspot = min_dist < 0.015
-        
-        # Base logic with higher variance
-        if (7 <= h <= 9 or 17 <= h <= 19) and d_w < 5:
-            # Peak hours: mostly high, some medium
-            level = np.random.choice([0, 1, 2], p=[0.05, 0.25, 0.7]) if is_near_hotspot else np.random.choice([0, 1, 2], p=[0.2, 0.4, 0.4])
-        elif is_near_hotspot and (8 <= h <= 20):
-            # Busy areas stay dense during the day
-            level = np.random.choice([1, 2], p=[0.4, 0.6])
-        elif (10 <= h <= 16 or 20 <= h <= 22) or (d_w >= 5 and 10 <= h <= 18):
-            # Normal hours: mostly low or medium
-            level = np.random.choice([0, 1, 2], p=[0.5, 0.4, 0.1])
-        else:
-            # Night/Early morning: mostly low
-            level = np.random.choice([0, 1], p=[0.9, 0.1])
-            
-        traffic_level.append(level)
-        
-    df = pd.DataFrame({
+
+    # Within the radius of the nearest hotspot (City centers/Main bridges)
+    is_near_hotspot = hotspots.near(lat, lng)
+
+    is_peak = (((7 <= hour) & (hour <= 9)) | ((17 <= hour) & (hour <= 19))) & (day_of_week < 5)
+    is_day = (8 <= hour) & (hour <= 20)
+    is_normal = ((10 <= hour) & (hour <= 16)) | ((20 <= hour) & (hour <= 22)) | ((day_of_week >= 5) & (10 <= hour) & (hour <= 18))
+
+    regime = np.select(
+        [is_peak & is_near_hotspot, is_peak, is_near_hotspot & is_day, is_normal],
+        [0, 1, 2, 3],
+        default=4,
+    )
+    u = rng.random(n)
+    cdf = REGIME_CDF[regime]
+    traffic_level = (u >= cdf[:, 0]).astype(int) + (u >= cdf[:, 1])
+
+    data = {
         'lat': lat,
         'lng': lng,
         'hour': hour,
         'day_of_week': day_of_week,
         'is_weekend': is_weekend,
-        'traffic_level': traffic_level
-    })
-    
-    data_path = settings.DATA_ROOT / 'traffic_data.csv'
-    df.to_csv(data_path, index=False)
+    }
+    if with_speed:
+        low, high = SPEED_RANGES[traffic_level].T
+        data['avg_speed'] = low + (high - low) * rng.random(n)
+    data['traffic_level'] = traffic_level
+    return data
+
+
+def iter_traffic_chunks(n_samples, seed=42, chunk_size=DEFAULT_CHUNK_SIZE, with_speed=False, bbox=None, hotspots=None):
+    """
+    Yield the simulated dataset as DataFrames of about chunk_size rows
+    (rounded up to whole blocks), holding one chunk in memory at a time.
+    bbox (south, west, north, east) defaults to Abidjan; hotspots is a
+    GeoJSON path or (lat, lng) pairs and defaults to HOTSPOTS_PATH.
+    """
+    hotspots = load_hotspots(hotspots)
+    blocks_per_chunk = max(1, -(-chunk_size // BLOCK_SIZE))
+    n_blocks = -(-n_samples // BLOCK_SIZE)
+    for first in range(0, n_blocks, blocks_per_chunk):
+        parts = []
+        for block_index in range(first, min(first + blocks_per_chunk, n_blocks)):
+            n = min(BLOCK_SIZE, n_samples - block_index * BLOCK_SIZE)
+            parts.append(_simulate_block(seed, block_index, n, with_speed, bbox, hotspots))
+        yield pd.DataFrame({
+            column: np.concatenate([part[column] for part in parts]) for column in parts[0]
+        })
+
+
+def generate_traffic_data(n_samples=3000, seed=42, with_speed=False, append=False, path=None, bbox=None, hotspots=None):
+    """
+    Generates realistic traffic data with location-based hotspots.
+    Features: lat, lng, hour, day_of_week, is_weekend (+ avg_speed if with_speed)
+    With append=True the rows are added to the stored dataset as new observations.
+    path, bbox and hotspots select another dataset and area (see regions).
+    """
+    if append:
+        manifest = read_manifest(path)
+        if manifest is not None:
+            # Offset the seed so appended observations differ from existing rows
+            seed += manifest['rows']
+
+    df = pd.concat(
+        iter_traffic_chunks(n_samples, seed, n_samples, with_speed, bbox, hotspots),
+        ignore_index=True,
+    )
+
+    write_dataset([df], path, seed=seed, append=append)
     return df
+
+
+def write_traffic_dataset(n_samples, path=None, seed=42, chunk_size=DEFAULT_CHUNK_SIZE, with_speed=False):
+    """
+    Write a dataset of any size to the columnar store chunk by chunk, in
+    bounded memory. Returns the dataset manifest.
+    """
+    return write_dataset(iter_traffic_chunks(n_samples, seed, chunk_size, with_speed), path, seed)
+
+
+def stream_traffic_data(n_samples, path=None, seed=42, chunk_size=DEFAULT_CHUNK_SIZE, with_speed=False):
+    """
+    Write a dataset of any size to CSV chunk by chunk, in bounded memory.
+    Produces the same rows as generate_traffic_data for the same seed.
+    Returns the number of rows written.
+    """
+    path = path or settings.DATA_ROOT / 'traffic_data.csv'
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    written = 0
+    with open(tmp_path, 'w', newline='') as f:
+        for chunk in iter_traffic_chunks(n_samples, seed, chunk_size, with_speed):
+            chunk.to_csv(f, header=(written == 0), index=False)
+            written += len(chunk)
+    os.replace(tmp_path, path)
+    return written
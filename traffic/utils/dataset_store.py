@@ -0,0 +1,225 @@
+import json
+import os
+import time
+import numpy as np
+import pandas as pd
+from django.conf import settings
+
+# Training data is stored as one .npy file per column plus a manifest.
+# Column files carry a per-write token and the manifest is replaced last, so
+# readers always see a complete dataset and can memory-map it.
+DATASET_DIRNAME = 'traffic_data'
+CSV_FILENAME = 'traffic_data.csv'
+MANIFEST_FILENAME = 'manifest.json'
+
+SCHEMA = {
+    'lat': 'float32',
+    'lng': 'float32',
+    'hour': 'uint8',
+    'day_of_week': 'uint8',
+    'is_weekend': 'uint8',
+    'avg_speed': 'float32',
+    'traffic_level': 'uint8',
+}
+
+# Fixed-size .npy header, rewritten with the final row count on close
+NPY_HEADER_SIZE = 128
+
+
+def default_path():
+    return settings.DATA_ROOT / DATASET_DIRNAME
+
+
+def _npy_header(dtype, rows):
+    header = repr({'descr': np.dtype(dtype).str, 'fortran_order': False, 'shape': (rows,)})
+    header = header.ljust(NPY_HEADER_SIZE - 10 - 1) + '\n'
+    return b'\x93NUMPY\x01\x00' + len(header).to_bytes(2, 'little') + header.encode('latin1')
+
+
+class DatasetWriter:
+    """
+    Append DataFrame chunks to a columnar dataset in bounded memory.
+    Columns are those of the first chunk, cast to the compact SCHEMA dtypes.
+    With append=True, rows are added to the existing dataset, which keeps its id.
+    """
+
+    def __init__(self, path=None, seed=None, append=False):
+        self.path = path or default_path()
+        self.seed = seed
+        self.token = f"{time.time_ns():x}"
+        self.dataset_id = self.token
+        self.rows = 0
+        self.columns = None
+        self._files = {}
+        os.makedirs(self.path, exist_ok=True)
+
+        previous = read_manifest(self.path) if append else None
+        if previous and previous['columns']:
+            self.dataset_id = previous.get('id', self.token)
+            self.seed = previous.get('seed')
+            self.rows = previous['rows']
+            self.columns = list(previous['columns'])
+            for column, spec in previous['columns'].items():
+                self.token = spec['file'].split('.')[-2]
+                f = open(os.path.join(self.path, spec['file']), 'r+b')
+                # Past the committed rows only: an aborted append may have
+                # left rows after them
+                f.seek(NPY_HEADER_SIZE + self.rows * np.dtype(spec['dtype']).itemsize)
+                f.truncate()
+                self._files[column] = f
+
+    def _file_name(self, column):
+        return f"{column}.{self.token}.npy"
+
+    def append(self, df):
+        if self.columns is None:
+            self.columns = [c for c in df.columns]
+            for column in self.columns:
+                f = open(os.path.join(self.path, self._file_name(column)), 'wb')
+                f.write(_npy_header(SCHEMA.get(column, 'float64'), 0))
+                self._files[column] = f
+
+        for column in self.columns:
+            values = np.ascontiguousarray(df[column].to_numpy(), dtype=SCHEMA.get(column, 'float64'))
+            self._files[column].write(values.tobytes())
+        self.rows += len(df)
+
+    def close(self):
+        """
+        Finalize the column files and publish the manifest. Returns the manifest.
+        """
+        for column, f in self._files.items():
+            f.flush()
+            f.seek(0)
+            f.write(_npy_header(SCHEMA.get(column, 'float64'), self.rows))
+            f.close()
+
+        manifest = {
+            'id': self.dataset_id,
+            'rows': self.rows,
+            'seed': self.seed,
+            'created_at': time.time(),
+            'columns': {
+                column: {'dtype': SCHEMA.get(column, 'float64'), 'file': self._file_name(column)}
+                for column in self.columns or []
+            },
+        }
+        manifest_path = os.path.join(self.path, MANIFEST_FILENAME)
+        tmp_path = f"{manifest_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_path, manifest_path)
+
+        # Drop the files of previous writes; open memory maps keep working
+        keep = {spec['file'] for spec in manifest['columns'].values()} | {MANIFEST_FILENAME}
+        for name in os.listdir(self.path):
+            if name.endswith('.npy') and name not in keep:
+                os.remove(os.path.join(self.path, name))
+        return manifest
+
+    def abort(self):
+        """
+        Discard a new dataset. Rows already appended to an existing one stay
+        on disk past the committed rows until the next append truncates them;
+        the header and manifest are unchanged.
+        """
+        for f in self._files.values():
+            f.close()
+            if f.mode == 'wb':
+                os.remove(f.name)
+
+
+def write_dataset(chunks, path=None, seed=None, append=False):
+    """
+    Write an iterable of DataFrame chunks as a dataset, or append them to the
+    existing one. Returns the manifest.
+    """
+    writer = DatasetWriter(path, seed, append)
+    try:
+        for chunk in chunks:
+            writer.append(chunk)
+    except BaseException:
+        writer.abort()
+        raise
+    return writer.close()
+
+
+def read_manifest(path=None):
+    """
+    Return the dataset manifest, or None if no dataset has been written.
+    """
+    try:
+        with open(os.path.join(path or default_path(), MANIFEST_FILENAME)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def open_dataset(path=None, columns=None, mmap_mode='r'):
+    """
+    Return {column: array} for the dataset, memory-mapped by default.
+    """
+    path = path or default_path()
+    manifest = read_manifest(path)
+    if manifest is None:
+        raise FileNotFoundError(f"No dataset at {path}")
+    columns = columns or list(manifest['columns'])
+    return {
+        column: np.load(os.path.join(path, manifest['columns'][column]['file']), mmap_mode=mmap_mode)
+        for column in columns
+    }
+
+
+def load_dataframe(path=None, columns=None):
+    """
+    Load the dataset (or some columns of it) into a DataFrame.
+    """
+    return pd.DataFrame(open_dataset(path, columns, mmap_mode=None))
+
+
+def iter_dataset_chunks(path=None, columns=None, chunk_size=1 << 20, start=0):
+    """
+    Yield the dataset from row `start` on as DataFrames of chunk_size rows
+    read from the memory map. Each DataFrame is indexed by global row number.
+    """
+    arrays = open_dataset(path, columns)
+    rows = len(next(iter(arrays.values()))) if arrays else 0
+    for offset in range(start, rows, chunk_size):
+        stop = min(offset + chunk_size, rows)
+        yield pd.DataFrame(
+            {column: np.array(values[offset:stop]) for column, values in arrays.items()},
+            index=pd.RangeIndex(offset, stop),
+        )
+
+
+def import_csv(csv_path=None, path=None, chunk_size=1 << 20, seed=None):
+    """
+    Convert a CSV written by the previous simulator into a dataset.
+    """
+    csv_path = csv_path or settings.DATA_ROOT / CSV_FILENAME
+    return write_dataset(pd.read_csv(csv_path, chunksize=chunk_size), path, seed)
+
+
+def export_csv(csv_path=None, path=None, chunk_size=1 << 20):
+    """
+    Write the dataset out as CSV, chunk by chunk. Returns the number of rows.
+    """
+    csv_path = csv_path or settings.DATA_ROOT / CSV_FILENAME
+    tmp_path = f"{csv_path}.{os.getpid()}.tmp"
+    written = 0
+    with open(tmp_path, 'w', newline='') as f:
+        for chunk in iter_dataset_chunks(path, chunk_size=chunk_size):
+            chunk.to_csv(f, header=(written == 0), index=False)
+            written += len(chunk)
+    os.replace(tmp_path, csv_path)
+    return written
+
+
+def ensure_dataset(path=None):
+    """
+    Return the manifest, importing the legacy CSV first if only that exists.
+    """
+    manifest = read_manifest(path)
+    if manifest is None and path is None and (settings.DATA_ROOT / CSV_FILENAME).exists():
+        manifest = import_csv()
+    return manifest
@@ -0,0 +1,94 @@
+import numpy as np
+import pandas as pd
+from .hotspots import HotspotIndex, load_hotspots
+
+# Raw inputs, as stored in the dataset and built by build_feature_matrix
+FEATURE_COLUMNS = ['lat', 'lng', 'hour', 'day_of_week', 'is_weekend']
+# Derived from lat/lng by FeatureSchema: metres to the nearest hotspot and its position in the hotspot set
+HOTSPOT_COLUMNS = ['hotspot_distance', 'hotspot_id']
+MODEL_COLUMNS = FEATURE_COLUMNS + HOTSPOT_COLUMNS
+
+LEVELS = {0: 'Faible', 1: 'Moyen', 2: 'Elevé'}
+
+
+def build_feature_matrix(lat, lng, hour, day_of_week):
+    """
+    Build the model input for many points at once.
+    Arguments are scalars or arrays and are broadcast against each other;
+    is_weekend is derived from day_of_week exactly as in the simulator.
+    """
+    lat, lng, hour, day_of_week = np.broadcast_arrays(
+        np.asarray(lat, dtype=np.float64),
+        np.asarray(lng, dtype=np.float64),
+        np.asarray(hour, dtype=np.float64),
+        np.asarray(day_of_week, dtype=np.float64),
+    )
+    X = np.empty((lat.size, len(FEATURE_COLUMNS)), dtype=np.float64)
+    X[:, 0] = lat.ravel()
+    X[:, 1] = lng.ravel()
+    X[:, 2] = hour.ravel()
+    X[:, 3] = day_of_week.ravel()
+    X[:, 4] = day_of_week.ravel() >= 5
+    return X
+
+
+class FeatureSchema:
+    """
+    The columns a model is fitted on, and the hotspot set its hotspot
+    columns are derived from. Saved with the model (and in features.joblib
+    and the forest export), so inference derives them exactly as training
+    did, whatever happens to the hotspot file afterwards.
+    """
+
+    def __init__(self, columns=MODEL_COLUMNS, hotspots=None):
+        self.columns = list(columns)
+        self.hotspots = hotspots
+        if hotspots is None and set(HOTSPOT_COLUMNS) & set(self.columns):
+            self.hotspots = load_hotspots()
+
+    def transform(self, X):
+        """
+        Model input from a build_feature_matrix matrix (FEATURE_COLUMNS order).
+        """
+        X = np.asarray(X, dtype=np.float64)
+        if X.ndim == 1:
+            X = X[np.newaxis, :]
+        if self.columns == FEATURE_COLUMNS:
+            return X
+        derived = {}
+        if self.hotspots is not None:
+            distance, index = self.hotspots.nearest(X[:, 0], X[:, 1])
+            derived = {'hotspot_distance': distance, 'hotspot_id': index}
+        out = np.empty((len(X), len(self.columns)), dtype=np.float64)
+        for j, column in enumerate(self.columns):
+            out[:, j] = derived[column] if column in derived else X[:, FEATURE_COLUMNS.index(column)]
+        return out
+
+    def frame(self, df):
+        """
+        transform() for a DataFrame with the raw columns, keeping its index.
+        """
+        return pd.DataFrame(self.transform(df[FEATURE_COLUMNS].to_numpy()), columns=self.columns, index=df.index)
+
+    def to_dict(self):
+        return {'columns': self.columns, 'hotspots': self.hotspots.to_dict() if self.hotspots is not None else None}
+
+    @classmethod
+    def from_dict(cls, data):
+        hotspots = HotspotIndex.from_dict(data['hotspots']) if data.get('hotspots') else None
+        return cls(data['columns'], hotspots)
+
+
+def as_model_input(model, X):
+    """
+    Wrap a feature matrix with the column names the model was fitted on,
+    which keeps sklearn from warning on every call. Models trained with a
+    FeatureSchema get their derived columns added first.
+    """
+    schema = getattr(model, 'feature_schema_', None)
+    if schema is not None:
+        X = schema.transform(X)
+    columns = getattr(model, 'feature_names_in_', None)
+    if columns is None:
+        return X
+    return pd.DataFrame(X, columns=list(columns))
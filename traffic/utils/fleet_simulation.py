@@ -0,0 +1,375 @@
+import asyncio
+import base64
+import logging
+import struct
+import threading
+import time
+import weakref
+import numpy as np
+from django.conf import settings
+from django.utils import timezone
+from .routing import get_road_graph
+from .metrics import register_collector
+
+# One record per vehicle: the route it follows, the segment it is on (global
+# index into the concatenated route segments), metres travelled along that
+# segment, current speed (m/s) and a per-driver pace multiplier.
+VEHICLE_DTYPE = np.dtype([
+    ('route', np.int32),
+    ('segment', np.int32),
+    ('offset', np.float32),
+    ('speed', np.float32),
+    ('pace', np.float32),
+])
+
+# Positions go over the wire as integer 1e-5 degree steps (~1.1 m)
+QUANTUM = 1e5
+KEYFRAME, DELTA = 0, 1
+# kind, reserved, tick, vehicle count, tick compute time (µs)
+FRAME_HEADER = struct.Struct('<BxxxIII')
+
+logger = logging.getLogger(__name__)
+
+
+class FleetSimulation:
+    """
+    Vehicles driving along a pool of road-graph routes, advanced together
+    with array operations at every tick. Segment speeds follow the predicted
+    congestion for the current hour; a vehicle reaching the end of its route
+    starts a new random one.
+    """
+
+    def __init__(self, n_vehicles, n_routes=256, seed=0, graph=None, hour=None, day_of_week=None):
+        self.graph = graph or get_road_graph()
+        # Ticks run in an executor thread while readers take positions
+        self._lock = threading.Lock()
+        self.rng = np.random.default_rng(seed)
+        now = timezone.localtime()
+        self.hour = now.hour if hour is None else hour
+        self.day_of_week = now.weekday() if day_of_week is None else day_of_week
+        _, weights = self.graph.travel_times(self.hour, self.day_of_week)
+        self._build_routes(n_routes, weights)
+        self._update_speeds(weights)
+
+        self.state = np.zeros(n_vehicles, dtype=VEHICLE_DTYPE)
+        self.state['pace'] = self.rng.uniform(0.8, 1.2, n_vehicles)
+        routes = self.rng.integers(0, len(self.route_start), n_vehicles)
+        self.state['route'] = routes
+        # Spread the fleet along its routes instead of starting everyone at the origin
+        lengths = self.route_end[routes] - self.route_start[routes]
+        self.state['segment'] = self.route_start[routes] + (self.rng.random(n_vehicles) * lengths).astype(np.int32)
+        self.state['offset'] = self.rng.random(n_vehicles) * self.seg_length[self.state['segment']]
+        self.state['speed'] = self.seg_speed[self.state['segment']] * self.state['pace']
+        self.ticks = 0
+
+    def _build_routes(self, n_routes, weights):
+        graph = self.graph
+        paths = []
+        attempts = 0
+        while len(paths) < n_routes and attempts < 4 * n_routes:
+            attempts += 1
+            source, target = self.rng.integers(0, graph.node_count, 2)
+            path = graph.shortest_path(int(source), int(target), weights)
+            if path:
+                paths.append(path)
+        if not paths:
+            raise ValueError("No route could be built on the road graph")
+
+        counts = np.array([len(path) for path in paths], dtype=np.int32)
+        self.route_end = np.cumsum(counts, dtype=np.int32)
+        self.route_start = self.route_end - counts
+        self.seg_edge = np.concatenate(paths).astype(np.int32)
+        sources, targets = graph.sources[self.seg_edge], graph.indices[self.seg_edge]
+        self.seg_lat = np.stack((graph.lat[sources], graph.lat[targets]))
+        self.seg_lng = np.stack((graph.lng[sources], graph.lng[targets]))
+        self.seg_length = graph.length[self.seg_edge]
+
+    def _update_speeds(self, weights):
+        weights = np.asarray(weights)[self.seg_edge]
+        self.seg_speed = (self.seg_length / weights).astype(np.float32)
+        self.seg_level = np.digitize(
+            self.graph.speed[self.seg_edge] / self.seg_speed, [1.2, 2.0],
+        ).astype(np.uint8)
+
+    def set_weights(self, hour, day_of_week, weights):
+        """
+        Switch to the graph's travel times for another hour, computed by the caller.
+        """
+        with self._lock:
+            self.hour, self.day_of_week = hour, day_of_week
+            self._update_speeds(weights)
+            self.state['speed'] = self.seg_speed[self.state['segment']] * self.state['pace']
+
+    def step(self, dt):
+        with self._lock:
+            self._step(dt)
+
+    def _step(self, dt):
+        state = self.state
+        state['offset'] += state['speed'] * dt
+        while True:
+            moving_on = np.flatnonzero(state['offset'] >= self.seg_length[state['segment']])
+            if not moving_on.size:
+                break
+            segment = state['segment'][moving_on]
+            offset = state['offset'][moving_on] - self.seg_length[segment]
+            segment = segment + 1
+
+            finished = segment >= self.route_end[state['route'][moving_on]]
+            if finished.any():
+                routes = self.rng.integers(0, len(self.route_start), int(finished.sum()))
+                state['route'][moving_on[finished]] = routes
+                segment[finished] = self.route_start[routes]
+                offset[finished] = 0.0
+
+            state['segment'][moving_on] = segment
+            state['offset'][moving_on] = offset
+            state['speed'][moving_on] = self.seg_speed[segment] * state['pace'][moving_on]
+        self.ticks += 1
+
+    def positions(self):
+        """
+        Current (lat, lng, level) of every vehicle.
+        """
+        with self._lock:
+            segment = self.state['segment'].copy()
+            offset = self.state['offset'].copy()
+        t = offset / self.seg_length[segment]
+        lat = self.seg_lat[0, segment] + (self.seg_lat[1, segment] - self.seg_lat[0, segment]) * t
+        lng = self.seg_lng[0, segment] + (self.seg_lng[1, segment] - self.seg_lng[0, segment]) * t
+        return lat, lng, self.seg_level[segment]
+
+
+class FrameEncoder:
+    """
+    Binary position frames. A keyframe carries every quantized position.
+    A delta carries a bitmask of the vehicles that moved by at most 127
+    steps since the last frame, their int8 position change and level, then
+    the vehicles that jumped further (a new route) with absolute values.
+    Deltas are taken against what clients already hold, so rounding never
+    accumulates.
+    """
+
+    def __init__(self, n_vehicles):
+        self.n = n_vehicles
+        self.lat = np.zeros(n_vehicles, dtype=np.int32)
+        self.lng = np.zeros(n_vehicles, dtype=np.int32)
+        self.level = np.zeros(n_vehicles, dtype=np.uint8)
+
+    def keyframe(self):
+        return KEYFRAME, self.lat.tobytes() + self.lng.tobytes() + self.level.tobytes()
+
+    def encode(self, lat, lng, level):
+        lat = np.rint(lat * QUANTUM).astype(np.int32)
+        lng = np.rint(lng * QUANTUM).astype(np.int32)
+        level = np.asarray(level, dtype=np.uint8)
+        d_lat, d_lng = lat - self.lat, lng - self.lng
+        changed = (d_lat != 0) | (d_lng != 0) | (level != self.level)
+        jumped = np.maximum(np.abs(d_lat), np.abs(d_lng)) > np.iinfo(np.int8).max
+        moved = changed & ~jumped
+        self.lat, self.lng, self.level = lat, lng, level
+
+        jumps = np.flatnonzero(jumped).astype(np.uint32)
+        body = b''.join((
+            np.packbits(moved, bitorder='little').tobytes(),
+            d_lat[moved].astype(np.int8).tobytes(),
+            d_lng[moved].astype(np.int8).tobytes(),
+            level[moved].tobytes(),
+            struct.pack('<I', len(jumps)),
+            jumps.tobytes(), lat[jumps].tobytes(), lng[jumps].tobytes(), level[jumps].tobytes(),
+        ))
+        return DELTA, body
+
+
+def pack_frame(kind, tick, count, tick_us, body):
+    return FRAME_HEADER.pack(kind, tick, count, tick_us) + body
+
+
+class FleetHub:
+    """
+    Runs one simulation for every SSE client on an event loop and fans the
+    frames out. The simulation only ticks while someone is listening. A
+    client that falls behind has its queue replaced by a fresh keyframe.
+    """
+
+    def __init__(self, n_vehicles, n_routes, tick, queue_size):
+        self.n_vehicles = n_vehicles
+        self.n_routes = n_routes
+        self.tick = tick
+        self.queue_size = queue_size
+        self.simulation = None
+        self.encoder = FrameEncoder(n_vehicles)
+        self.subscribers = set()
+        self._task = None
+        self._start_lock = asyncio.Lock()
+        # Positions clients hold after the last frame sent: (tick, lat, lng, level)
+        self._sent = None
+        # Hour whose travel times are being computed or were last asked for
+        self._requested_time = None
+        self._retime = None
+        self.last_tick_ms = 0.0
+        self.last_frame_bytes = 0
+        self.total_tick_ms = 0.0
+        self.total_frame_bytes = 0
+        self.frames = 0
+        self.resyncs = 0
+
+    async def _start(self):
+        async with self._start_lock:
+            if self.simulation is None:
+                # Route building takes a moment; keep it off the event loop
+                loop = asyncio.get_running_loop()
+                simulation = await loop.run_in_executor(None, FleetSimulation, self.n_vehicles, self.n_routes)
+                self.encoder.encode(*simulation.positions())
+                self.simulation = simulation
+                self._requested_time = (simulation.hour, simulation.day_of_week)
+                self._mark_sent()
+
+    async def snapshot(self):
+        """
+        The running simulation, started if needed, for readers of its positions.
+        """
+        await self._start()
+        return self.simulation
+
+    def _mark_sent(self):
+        encoder = self.encoder
+        self._sent = (self.simulation.ticks, encoder.lat, encoder.lng, encoder.level)
+
+    def _keyframe(self):
+        # From the last frame sent, not the encoder: a tick may be encoding
+        # the next one in the executor
+        tick, lat, lng, level = self._sent
+        body = lat.tobytes() + lng.tobytes() + level.tobytes()
+        return pack_frame(KEYFRAME, tick, self.n_vehicles, 0, body)
+
+    async def subscribe(self):
+        await self._start()
+        queue = asyncio.Queue(self.queue_size)
+        queue.put_nowait(self._keyframe())
+        self.subscribers.add(queue)
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+        return queue
+
+    def unsubscribe(self, queue):
+        self.subscribers.discard(queue)
+
+    def _tick(self):
+        """
+        Advance and encode one frame. Runs in the executor.
+        """
+        started = time.perf_counter()
+        self.simulation.step(self.tick)
+        kind, body = self.encoder.encode(*self.simulation.positions())
+        return kind, body, int((time.perf_counter() - started) * 1e6)
+
+    def _follow_clock(self, loop):
+        """
+        Start computing the travel times when the hour changes (possibly a
+        prediction over every edge) in the executor, and swap them in once
+        ready; vehicles keep the previous speeds meanwhile.
+        """
+        if self._retime is not None and self._retime.done():
+            retime, self._retime = self._retime, None
+            try:
+                _, weights = retime.result()
+            except Exception:
+                # Not retried before the next hour
+                logger.exception("Fleet travel times for %s failed", self._requested_time)
+            else:
+                self.simulation.set_weights(*self._requested_time, weights)
+
+        now = timezone.localtime()
+        current = (now.hour, now.weekday())
+        if self._retime is None and current != self._requested_time:
+            self._requested_time = current
+            self._retime = loop.run_in_executor(None, self.simulation.graph.travel_times, *current)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time()
+        try:
+            while self.subscribers:
+                self._follow_clock(loop)
+                # Stepping thousands of vehicles is CPU work too: keep the loop free
+                kind, body, tick_us = await loop.run_in_executor(None, self._tick)
+                frame = pack_frame(kind, self.simulation.ticks, self.n_vehicles, tick_us, body)
+                self._mark_sent()
+                self._record(tick_us, len(frame))
+                self._broadcast(frame)
+
+                deadline += self.tick
+                await asyncio.sleep(max(0.0, deadline - loop.time()))
+        finally:
+            self._task = None
+
+    def _broadcast(self, frame):
+        keyframe = None
+        for queue in list(self.subscribers):
+            if queue.full():
+                while not queue.empty():
+                    queue.get_nowait()
+                keyframe = keyframe or self._keyframe()
+                queue.put_nowait(keyframe)
+                self.resyncs += 1
+            else:
+                queue.put_nowait(frame)
+
+    def _record(self, tick_us, frame_bytes):
+        self.last_tick_ms = tick_us / 1000
+        self.last_frame_bytes = frame_bytes
+        self.total_tick_ms += self.last_tick_ms
+        self.total_frame_bytes += frame_bytes
+        self.frames += 1
+
+    def stats(self):
+        return {
+            'vehicles': self.n_vehicles,
+            'routes': len(self.simulation.route_start) if self.simulation is not None else 0,
+            'tick': self.tick,
+            'clients': len(self.subscribers),
+            'frames': self.frames,
+            'resyncs': self.resyncs,
+            'last_tick_ms': self.last_tick_ms,
+            'last_frame_bytes': self.last_frame_bytes,
+            'avg_tick_ms': self.total_tick_ms / self.frames if self.frames else 0.0,
+            'avg_frame_bytes': self.total_frame_bytes / self.frames if self.frames else 0.0,
+        }
+
+
+def encode_event(frame):
+    return f"event: frame\ndata: {base64.b64encode(frame).decode('ascii')}\n\n"
+
+
+# One hub per event loop, like the prediction batcher
+_hubs = weakref.WeakKeyDictionary()
+
+
+def get_fleet_hub():
+    loop = asyncio.get_running_loop()
+    hub = _hubs.get(loop)
+    if hub is None:
+        hub = FleetHub(
+            getattr(settings, 'FLEET_VEHICLES', 2000),
+            getattr(settings, 'FLEET_ROUTES', 256),
+            getattr(settings, 'FLEET_TICK', 0.5),
+            getattr(settings, 'FLEET_CLIENT_QUEUE', 16),
+        )
+        _hubs[loop] = hub
+    return hub
+
+
+def fleet_stats():
+    return [hub.stats() for hub in list(_hubs.values())]
+
+
+def _collect():
+    hubs = list(_hubs.values())
+    yield 'fleet_clients', 'gauge', "Clients of the fleet streams.", {}, sum(len(hub.subscribers) for hub in hubs)
+    yield 'fleet_frames_total', 'counter', "Fleet frames broadcast.", {}, sum(hub.frames for hub in hubs)
+    yield 'fleet_resyncs_total', 'counter', "Keyframes sent to clients that fell behind.", {}, sum(hub.resyncs for hub in hubs)
+    yield 'fleet_tick_seconds_total', 'counter', "Time spent computing fleet ticks.", {}, sum(hub.total_tick_ms for hub in hubs) / 1000
+
+
+register_collector(_collect)
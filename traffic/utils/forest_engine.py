@@ -0,0 +1,247 @@
+import json
+import os
+import threading
+import numpy as np
+import sklearn
+from django.conf import settings
+from sklearn.utils.fixes import parse_version
+from .features import FeatureSchema
+from .metrics import span
+
+# The fitted forest is flattened into contiguous node arrays shared by all
+# trees. Leaves point to themselves, so at most max_depth vectorized steps
+# walk every tree for every row at once.
+MANIFEST_FILENAME = 'forest.json'
+ARRAYS = ('feature', 'threshold', 'left', 'right', 'value', 'roots', 'classes')
+# scikit-learn 1.4+ stores class fractions in tree_.value and returns them as
+# they are; earlier versions store weighted counts and normalize on predict
+TREE_VALUES_NORMALIZED = parse_version(sklearn.__version__) >= parse_version('1.4')
+
+
+def _float32_floor(values):
+    """
+    Largest float32 <= each value. For float32 inputs, x <= t holds exactly
+    when x <= floor32(t), so rounding thresholds this way keeps splits exact.
+    """
+    rounded = values.astype(np.float32)
+    too_big = rounded.astype(np.float64) > values
+    rounded[too_big] = np.nextafter(rounded[too_big], np.float32(-np.inf))
+    return rounded
+
+
+def flatten_forest(model, quantized=False):
+    """
+    Return the forest as a dict of flat arrays plus its max depth.
+    In the quantized variant thresholds are float32 (still exact), features
+    int16 and leaf probabilities float32 (within float32 rounding of sklearn).
+    """
+    features, thresholds, lefts, rights, values, roots = [], [], [], [], [], []
+    offset = 0
+    max_depth = 0
+    for estimator in model.estimators_:
+        tree = estimator.tree_
+        n_nodes = tree.node_count
+        node_ids = np.arange(offset, offset + n_nodes)
+        is_leaf = tree.children_left == -1
+
+        feature = np.where(is_leaf, 0, tree.feature)
+        threshold = np.where(is_leaf, np.inf, tree.threshold)
+        left = np.where(is_leaf, node_ids, tree.children_left + offset)
+        right = np.where(is_leaf, node_ids, tree.children_right + offset)
+
+        # Same values as DecisionTreeClassifier.predict_proba, bit for bit:
+        # renormalizing fractions that already sum to ~1 would move the last bit
+        value = tree.value[:, 0, :model.n_classes_].astype(np.float64)
+        if not TREE_VALUES_NORMALIZED:
+            normalizer = value.sum(axis=1)[:, np.newaxis]
+            normalizer[normalizer == 0.0] = 1.0
+            value = value / normalizer
+
+        features.append(feature)
+        thresholds.append(threshold)
+        lefts.append(left)
+        rights.append(right)
+        values.append(value)
+        roots.append(offset)
+        offset += n_nodes
+        max_depth = max(max_depth, tree.max_depth)
+
+    arrays = {
+        'feature': np.concatenate(features).astype(np.int16 if quantized else np.int32),
+        'threshold': np.concatenate(thresholds),
+        'left': np.concatenate(lefts).astype(np.int32),
+        'right': np.concatenate(rights).astype(np.int32),
+        'value': np.concatenate(values),
+        'roots': np.array(roots, dtype=np.int32),
+        'classes': np.asarray(model.classes_),
+    }
+    if quantized:
+        arrays['threshold'] = _float32_floor(arrays['threshold'])
+        arrays['value'] = arrays['value'].astype(np.float32)
+    return arrays, max_depth
+
+
+class FlatForest:
+    """
+    Pure-NumPy evaluator over flattened forest arrays.
+    predict/predict_proba match the sklearn model they were exported from.
+    With the model's FeatureSchema, inputs are raw build_feature_matrix rows.
+    """
+
+    def __init__(self, arrays, max_depth, version=None, schema=None):
+        for name in ARRAYS:
+            setattr(self, name, arrays[name])
+        self.max_depth = max_depth
+        self.version = version
+        self.schema = schema
+        self.n_trees = len(self.roots)
+
+    def apply(self, X):
+        """
+        Leaf node of every tree for every row, shape (n_rows, n_trees).
+        Only (row, tree) pairs that have not reached a leaf are advanced.
+        """
+        if self.schema is not None:
+            X = self.schema.transform(X)
+        X = np.asarray(X, dtype=np.float32)
+        if X.ndim == 1:
+            X = X[np.newaxis, :]
+        n_rows, n_features = X.shape
+        flat_X = X.ravel()
+        node = np.tile(self.roots, n_rows)
+        base = np.repeat(np.arange(n_rows, dtype=np.intp) * n_features, self.n_trees)
+        active = np.arange(node.size)
+        for _ in range(self.max_depth):
+            current = node[active]
+            go_left = flat_X[base[active] + self.feature[current]] <= self.threshold[current]
+            following = np.where(go_left, self.left[current], self.right[current])
+            node[active] = following
+            active = active[following != current]
+            if not active.size:
+                break
+        return node.reshape(n_rows, self.n_trees)
+
+    def predict_proba(self, X):
+        leaves = self.apply(X)
+        # Trees summed one after another in estimator order, like sklearn
+        proba = np.add.reduce(self.value[leaves.T], axis=0, dtype=np.float64)
+        proba /= self.n_trees
+        return proba
+
+    def predict(self, X):
+        return self.classes.take(np.argmax(self.predict_proba(X), axis=1))
+
+
+def export_forest(model, version, models_root=None, quantized=None):
+    """
+    Write the flattened forest next to the model as .npy files, tagged with
+    the model version. The manifest is replaced last; old files are removed.
+    """
+    models_root = models_root or settings.MODELS_ROOT
+    if quantized is None:
+        quantized = getattr(settings, 'FOREST_QUANTIZED', False)
+
+    arrays, max_depth = flatten_forest(model, quantized)
+    files = {}
+    for name, array in arrays.items():
+        files[name] = f"forest_{name}.{version}.npy"
+        np.save(models_root / files[name], array)
+
+    manifest = {'version': version, 'max_depth': int(max_depth), 'quantized': quantized, 'files': files}
+    schema = getattr(model, 'feature_schema_', None)
+    if schema is not None:
+        manifest['schema'] = schema.to_dict()
+    manifest_path = models_root / MANIFEST_FILENAME
+    tmp_path = f"{manifest_path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, manifest_path)
+
+    for name in os.listdir(models_root):
+        if name.startswith('forest_') and name.endswith('.npy') and name not in files.values():
+            os.remove(models_root / name)
+    return manifest
+
+
+def remove_forest(models_root=None):
+    """
+    Delete the exported forest, manifest first so no reader opens a half-removed export.
+    """
+    models_root = models_root or settings.MODELS_ROOT
+    try:
+        os.remove(models_root / MANIFEST_FILENAME)
+    except FileNotFoundError:
+        pass
+    for name in os.listdir(models_root):
+        if name.startswith('forest_') and name.endswith('.npy'):
+            os.remove(models_root / name)
+
+
+def load_forest(models_root=None, mmap_mode='r'):
+    """
+    Open the exported forest; memory-mapped so workers share the same pages.
+    """
+    models_root = models_root or settings.MODELS_ROOT
+    with open(models_root / MANIFEST_FILENAME) as f:
+        manifest = json.load(f)
+    arrays = {name: np.load(models_root / manifest['files'][name], mmap_mode=mmap_mode) for name in ARRAYS}
+    schema = FeatureSchema.from_dict(manifest['schema']) if manifest.get('schema') else None
+    return FlatForest(arrays, manifest['max_depth'], manifest['version'], schema)
+
+
+class ForestLoader:
+    """
+    The forest exported under one models_root, reopened when a new export
+    lands. get() returns None while the current model has no export.
+    """
+
+    def __init__(self, models_root):
+        self.models_root = models_root
+        self.nbytes = 0
+        self._forest = None
+        self._signature = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        try:
+            st = os.stat(self.models_root / MANIFEST_FILENAME)
+        except FileNotFoundError:
+            return None
+        signature = (st.st_ino, st.st_mtime_ns)
+        if signature != self._signature:
+            with self._lock:
+                if signature != self._signature:
+                    try:
+                        with span('forest_load'):
+                            forest = load_forest(self.models_root)
+                    except (FileNotFoundError, ValueError, KeyError):
+                        return None
+                    self._forest = forest
+                    self.nbytes = sum(getattr(forest, name).nbytes for name in ARRAYS)
+                    self._signature = signature
+        return self._forest
+
+    def clear(self):
+        with self._lock:
+            self._forest = None
+            self._signature = None
+            self.nbytes = 0
+
+
+_loader = None
+_loader_lock = threading.Lock()
+
+
+def get_forest():
+    """
+    The exported forest for this worker, reopened when a new export lands.
+    Returns None if the current model has not been exported.
+    """
+    global _loader
+    loader = _loader
+    if loader is None or loader.models_root != settings.MODELS_ROOT:
+        with _loader_lock:
+            if _loader is None or _loader.models_root != settings.MODELS_ROOT:
+                _loader = ForestLoader(settings.MODELS_ROOT)
+            loader = _loader
+    return loader.get()
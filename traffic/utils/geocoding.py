@@ -0,0 +1,387 @@
+import bisect
+import csv
+import json
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+import urllib.parse
+import urllib.request
+from collections import Counter, OrderedDict
+from django.conf import settings
+from .metrics import span, register_collector
+
+# Search order: in-process LRU -> offline gazetteer -> SQLite cache of
+# upstream answers -> upstream Nominatim (throttled, answers persisted).
+TYPE_RANK = {'city': 0, 'commune': 1, 'quartier': 2, 'landmark': 3}
+MIN_SIMILARITY = 0.45
+REVERSE_CELL = 0.01
+DEFAULT_REVERSE_DISTANCE = 1500
+DEFAULT_TTL = 30 * 86400
+DEFAULT_NEGATIVE_TTL = 86400
+USER_AGENT = 'SmartTrans/1.0 (geocoding proxy)'
+
+
+def normalize(text):
+    """
+    Lower-case, accent-free, punctuation collapsed to single spaces.
+    """
+    text = unicodedata.normalize('NFKD', str(text)).encode('ascii', 'ignore').decode('ascii')
+    return ' '.join(re.sub(r'[^a-z0-9]+', ' ', text.lower()).split())
+
+
+def trigrams(text):
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _distance(lat1, lng1, lat2, lng2):
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * 6371008.8 * math.asin(math.sqrt(a))
+
+
+class Gazetteer:
+    """
+    Offline place index. Names are searchable by prefix (of the full name or
+    of any word in it) through a sorted key list, and by trigram similarity
+    for typos; reverse lookups go through a uniform lat/lng grid.
+    """
+
+    def __init__(self, places, version=None):
+        self.places = places
+        self.version = version
+        keys = []
+        self.postings = {}
+        self.cells = {}
+        for place_id, place in enumerate(places):
+            name = normalize(place['name'])
+            place['key'] = name
+            words = name.split(' ')
+            for i in range(len(words)):
+                keys.append((' '.join(words[i:]), i, place_id))
+            for gram in trigrams(name):
+                self.postings.setdefault(gram, []).append(place_id)
+            self.cells.setdefault(self._cell(place['lat'], place['lng']), []).append(place_id)
+        keys.sort()
+        self.keys = [key for key, _, _ in keys]
+        self.key_entries = [(word, place_id) for _, word, place_id in keys]
+
+    @staticmethod
+    def _cell(lat, lng):
+        return int(math.floor(lat / REVERSE_CELL)), int(math.floor(lng / REVERSE_CELL))
+
+    def _rank(self, place_id):
+        place = self.places[place_id]
+        return TYPE_RANK.get(place.get('type'), len(TYPE_RANK)), len(place['key'])
+
+    def search(self, query, limit=5):
+        """
+        Best matches for a query: exact name, then name/word prefix, then
+        trigram similarity above MIN_SIMILARITY.
+        """
+        query = normalize(query)
+        if not query:
+            return []
+
+        scored = {}
+        start = bisect.bisect_left(self.keys, query)
+        for i in range(start, len(self.keys)):
+            if not self.keys[i].startswith(query):
+                break
+            word, place_id = self.key_entries[i]
+            exact = self.places[place_id]['key'] == query
+            score = 3.0 if exact else (2.0 if word == 0 else 1.5)
+            scored[place_id] = max(scored.get(place_id, 0.0), score)
+
+        if len(scored) < limit:
+            grams = trigrams(query)
+            counts = Counter(place_id for gram in grams for place_id in self.postings.get(gram, ()))
+            for place_id, shared in counts.items():
+                if place_id in scored:
+                    continue
+                similarity = shared / (len(grams) + len(trigrams(self.places[place_id]['key'])) - shared)
+                if similarity >= MIN_SIMILARITY:
+                    scored[place_id] = similarity
+
+        ranked = sorted(scored, key=lambda place_id: (-scored[place_id],) + self._rank(place_id))
+        return [self.places[place_id] for place_id in ranked[:limit]]
+
+    def reverse(self, lat, lng, max_distance):
+        """
+        Nearest place within max_distance metres, searching grid rings outward.
+        """
+        ci, cj = self._cell(lat, lng)
+        cell_m = REVERSE_CELL * 110000 * math.cos(math.radians(lat))
+        best, best_distance = None, max_distance
+        if cell_m <= 0 or (max_distance / cell_m) ** 2 > len(self.places):
+            # Cells narrow to slivers towards the poles: comparing with every
+            # place is then cheaper than visiting the rings
+            for place in self.places:
+                distance = _distance(lat, lng, place['lat'], place['lng'])
+                if distance <= best_distance:
+                    best, best_distance = place, distance
+            return best
+        for ring in range(int(max_distance / cell_m) + 2):
+            # Anything in this ring or beyond is at least (ring - 1) cells away
+            if best is not None and best_distance <= (ring - 1) * cell_m:
+                break
+            for di in range(-ring, ring + 1):
+                for dj in range(-ring, ring + 1):
+                    if max(abs(di), abs(dj)) != ring:
+                        continue
+                    for place_id in self.cells.get((ci + di, cj + dj), ()):
+                        place = self.places[place_id]
+                        distance = _distance(lat, lng, place['lat'], place['lng'])
+                        if distance <= best_distance:
+                            best, best_distance = place, distance
+        return best
+
+
+def load_gazetteer(path):
+    """
+    Places from a CSV (name, lat, lng[, type, city]) or a GeoJSON file of
+    named Points.
+    """
+    places = []
+    if str(path).endswith(('.json', '.geojson')):
+        with open(path, encoding='utf-8') as f:
+            data = json.load(f)
+        for feature in data.get('features', []):
+            geometry = feature.get('geometry') or {}
+            properties = feature.get('properties') or {}
+            if geometry.get('type') != 'Point' or not properties.get('name'):
+                continue
+            lng, lat = geometry['coordinates'][:2]
+            places.append({'name': properties['name'], 'lat': float(lat), 'lng': float(lng),
+                           'type': properties.get('type', ''), 'city': properties.get('city', '')})
+    else:
+        with open(path, encoding='utf-8', newline='') as f:
+            for row in csv.DictReader(f):
+                places.append({'name': row['name'], 'lat': float(row['lat']), 'lng': float(row['lng']),
+                               'type': row.get('type') or '', 'city': row.get('city') or ''})
+    return places
+
+
+class ResultCache:
+    """
+    Two-level cache of geocoding answers: a bounded in-process LRU in front
+    of a SQLite table shared by every worker, with a per-entry expiry.
+    """
+
+    def __init__(self, path, max_size=4096):
+        self.path = str(path)
+        self.max_size = max_size
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.hits = 0
+        self.db_hits = 0
+        self.misses = 0
+
+    def _db(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS geocode_cache '
+                '(key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)'
+            )
+            self._local.connection = connection
+        return connection
+
+    def get(self, key, persistent=True):
+        now = time.time()
+        with self._lock:
+            entry = self._lru.get(key)
+            if entry is not None and entry[1] > now:
+                self._lru.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+        if persistent:
+            row = self._db().execute(
+                'SELECT value, expires_at FROM geocode_cache WHERE key = ? AND expires_at > ?', (key, now)
+            ).fetchone()
+            if row is not None:
+                value = json.loads(row[0])
+                self._remember(key, value, row[1])
+                self.db_hits += 1
+                return value
+        self.misses += 1
+        return None
+
+    def set(self, key, value, ttl, persistent=True):
+        expires_at = time.time() + ttl
+        self._remember(key, value, expires_at)
+        if persistent:
+            db = self._db()
+            with db:
+                db.execute('INSERT OR REPLACE INTO geocode_cache VALUES (?, ?, ?)',
+                           (key, json.dumps(value), expires_at))
+
+    def _remember(self, key, value, expires_at):
+        with self._lock:
+            self._lru[key] = (value, expires_at)
+            self._lru.move_to_end(key)
+            while len(self._lru) > self.max_size:
+                self._lru.popitem(last=False)
+
+    def purge(self):
+        """
+        Drop expired rows; returns how many were removed.
+        """
+        db = self._db()
+        with db:
+            return db.execute('DELETE FROM geocode_cache WHERE expires_at <= ?', (time.time(),)).rowcount
+
+    def stats(self):
+        return {'size': len(self._lru), 'hits': self.hits, 'db_hits': self.db_hits, 'misses': self.misses}
+
+
+class Geocoder:
+    def __init__(self, cache):
+        self.cache = cache
+        self._gazetteer = None
+        self._signature = None
+        self._gazetteer_lock = threading.Lock()
+        self._upstream_lock = threading.Lock()
+        self._last_upstream = 0.0
+
+    @property
+    def gazetteer(self):
+        """
+        The gazetteer from GAZETTEER_PATH, reloaded when the file changes.
+        """
+        path = getattr(settings, 'GAZETTEER_PATH', None)
+        try:
+            st = os.stat(path) if path else None
+        except FileNotFoundError:
+            st = None
+        signature = (st.st_ino, st.st_mtime_ns) if st else None
+        if signature != self._signature:
+            with self._gazetteer_lock:
+                if signature != self._signature:
+                    places = load_gazetteer(path) if st else []
+                    self._gazetteer = Gazetteer(places, f"{signature[0]:x}-{signature[1]:x}" if st else None)
+                    self._signature = signature
+        return self._gazetteer
+
+    def _upstream(self, endpoint, params):
+        base_url = getattr(settings, 'GEOCODING_UPSTREAM_URL', None)
+        if not base_url:
+            return None
+        # Nominatim's usage policy allows one request per second
+        with self._upstream_lock:
+            wait = self._last_upstream + getattr(settings, 'GEOCODING_UPSTREAM_INTERVAL', 1.0) - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            self._last_upstream = time.monotonic()
+            url = f"{base_url.rstrip('/')}/{endpoint}?{urllib.parse.urlencode(dict(params, format='json'))}"
+            request = urllib.request.Request(url, headers={'User-Agent': USER_AGENT})
+            with span('geocoding_upstream', endpoint=endpoint), \
+                    urllib.request.urlopen(request, timeout=getattr(settings, 'GEOCODING_UPSTREAM_TIMEOUT', 5)) as response:
+                return json.loads(response.read().decode('utf-8'))
+
+    def _store_upstream(self, key, value):
+        ttl = getattr(settings, 'GEOCODING_CACHE_TTL', DEFAULT_TTL) if value else \
+            getattr(settings, 'GEOCODING_NEGATIVE_TTL', DEFAULT_NEGATIVE_TTL)
+        self.cache.set(key, value, ttl)
+
+    def search(self, query, limit=5):
+        """
+        Places matching the query, in Nominatim's /search result shape.
+        """
+        gazetteer = self.gazetteer
+        local_key = f"local:{gazetteer.version}:search:{limit}:{normalize(query)}"
+        result = self.cache.get(local_key, persistent=False)
+        if result is not None:
+            return result
+
+        places = gazetteer.search(query, limit)
+        if not places and ',' in query:
+            # "Plateau, Abidjan": the leading part usually names the place
+            places = gazetteer.search(query.split(',')[0], limit)
+        result = [_as_result(place, 'gazetteer') for place in places]
+        if not result:
+            key = f"search:{limit}:{normalize(query)}"
+            result = self.cache.get(key)
+            if result is None:
+                found = self._upstream('search', {'q': query, 'limit': limit})
+                if found is None:
+                    return []
+                result = [
+                    {'lat': float(item['lat']), 'lon': float(item['lon']), 'display_name': item.get('display_name', ''),
+                     'type': item.get('type', ''), 'source': 'nominatim'}
+                    for item in found
+                ]
+                self._store_upstream(key, result)
+        self.cache.set(local_key, result, getattr(settings, 'GEOCODING_CACHE_TTL', DEFAULT_TTL), persistent=False)
+        return result
+
+    def reverse(self, lat, lng):
+        """
+        Name of the place at a point, in Nominatim's /reverse result shape,
+        or None.
+        """
+        place = self.gazetteer.reverse(lat, lng, getattr(settings, 'GEOCODING_REVERSE_DISTANCE', DEFAULT_REVERSE_DISTANCE))
+        if place is not None:
+            return _as_result(place, 'gazetteer')
+
+        # ~11 m buckets: nearby clicks share one upstream answer
+        key = f"reverse:{lat:.4f},{lng:.4f}"
+        result = self.cache.get(key)
+        if result is None:
+            found = self._upstream('reverse', {'lat': f"{lat:.4f}", 'lon': f"{lng:.4f}", 'zoom': 18, 'addressdetails': 1})
+            if found is None:
+                return None
+            result = {} if 'error' in found else {
+                'lat': float(found['lat']), 'lon': float(found['lon']), 'display_name': found.get('display_name', ''),
+                'address': found.get('address', {}), 'source': 'nominatim',
+            }
+            self._store_upstream(key, result)
+        return result or None
+
+
+def _as_result(place, source):
+    display_name = place['name'] if not place['city'] or place['city'] == place['name'] else f"{place['name']}, {place['city']}"
+    return {
+        'lat': place['lat'],
+        'lon': place['lng'],
+        'display_name': display_name,
+        'type': place['type'],
+        'address': {'city': place['city'] or place['name']},
+        'source': source,
+    }
+
+
+_geocoder = None
+_geocoder_lock = threading.Lock()
+
+
+def get_geocoder():
+    global _geocoder
+    if _geocoder is None:
+        with _geocoder_lock:
+            if _geocoder is None:
+                cache = ResultCache(
+                    getattr(settings, 'GEOCODING_CACHE_PATH', settings.DATA_ROOT / 'geocode_cache.sqlite3'),
+                    getattr(settings, 'GEOCODING_CACHE_SIZE', 4096),
+                )
+                _geocoder = Geocoder(cache)
+    return _geocoder
+
+
+def _collect():
+    if _geocoder is None:
+        return
+    stats = _geocoder.cache.stats()
+    for key in ('hits', 'db_hits', 'misses'):
+        yield f'geocoding_cache_{key}_total', 'counter', f"Geocoding cache {key.replace('_', ' ')}.", {}, stats[key]
+    yield 'geocoding_cache_entries', 'gauge', "Entries in the in-process geocoding LRU.", {}, stats['size']
+
+
+register_collector(_collect)
@@ -0,0 +1,140 @@
+import base64
+import json
+import logging
+import threading
+from datetime import datetime
+from django.conf import settings
+from django.db.models import Count, Max, Q
+from django.utils import timezone
+from ..models import SearchHistory, Favorite
+from .write_behind import WriteBehindBuffer, BufferFull
+
+HISTORY_FIELDS = ('user_id', 'source', 'destination', 'timestamp')
+DEFAULT_PAGE_SIZE = 10
+MAX_PAGE_SIZE = 100
+
+logger = logging.getLogger(__name__)
+
+
+class InvalidPage(ValueError):
+    pass
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_history_buffer():
+    global _buffer
+    if _buffer is None:
+        with _buffer_lock:
+            if _buffer is None:
+                _buffer = WriteBehindBuffer(
+                    SearchHistory, HISTORY_FIELDS,
+                    getattr(settings, 'HISTORY_FLUSH_SIZE', 500),
+                    getattr(settings, 'HISTORY_FLUSH_INTERVAL', 1.0),
+                    getattr(settings, 'HISTORY_MAX_PENDING', 50000),
+                )
+    return _buffer
+
+
+def record_search(user_id, source, destination):
+    """
+    Queue a history entry; it is stamped now, not when it reaches the database.
+    Returns False if the buffer is full and the entry was dropped.
+    """
+    try:
+        get_history_buffer().add([(user_id, source, destination, timezone.now())])
+    except BufferFull:
+        return False
+    return True
+
+
+def encode_cursor(stamp, pk):
+    raw = json.dumps([stamp.isoformat(), pk]).encode()
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        stamp, pk = json.loads(raw)
+        stamp = datetime.fromisoformat(stamp)
+        if timezone.is_naive(stamp) or not (pk is None or isinstance(pk, int)):
+            raise ValueError(cursor)
+    except (ValueError, TypeError):
+        raise InvalidPage(cursor)
+    return stamp, pk
+
+
+def parse_limit(value):
+    if value in (None, ''):
+        return DEFAULT_PAGE_SIZE
+    try:
+        limit = int(value)
+    except ValueError:
+        raise InvalidPage(value)
+    return max(1, min(limit, MAX_PAGE_SIZE))
+
+
+def _after(field, stamp, pk):
+    # Rows that sort after (stamp, pk) in (field DESC, id DESC) order. The
+    # redundant upper bound lets the index seek instead of scanning from the
+    # newest row. A cursor left on a not-yet-written row has no id: everything
+    # at that instant was already shown.
+    if pk is None:
+        return Q(**{f'{field}__lt': stamp})
+    return Q(**{f'{field}__lte': stamp}) & (Q(**{f'{field}__lt': stamp}) | Q(id__lt=pk))
+
+
+def _fetch(queryset, field, columns, cursor, limit):
+    if cursor:
+        queryset = queryset.filter(_after(field, *decode_cursor(cursor)))
+    return list(queryset.order_by(f'-{field}', '-id').values('id', *columns)[:limit + 1])
+
+
+def _cut(rows, field, limit):
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(rows[-1][field], rows[-1]['id'])
+
+
+def keyset_page(queryset, field, columns, cursor=None, limit=DEFAULT_PAGE_SIZE):
+    """
+    One page of `queryset` ordered by (field DESC, id DESC), starting after
+    the opaque cursor. Served from a (user, -field) index, so the cost does
+    not depend on how deep the page is. Returns (rows, next cursor or None).
+    """
+    return _cut(_fetch(queryset, field, columns, cursor, limit), field, limit)
+
+
+def user_data_revision(user):
+    """
+    Changes whenever get_user_data's answer may: a favorite added or
+    removed, a search written, or one still pending in this process. Read
+    from the same indexes as the pages, newest row only.
+    """
+    favorites = Favorite.objects.filter(user=user).aggregate(count=Count('id'), last=Max('id'))
+    last_search = (
+        SearchHistory.objects.filter(user=user).order_by('-timestamp', '-id').values_list('id', flat=True).first()
+    )
+    pending = get_history_buffer().pending_rows(lambda row: row[0] == user.id)
+    return favorites['count'], favorites['last'], last_search, len(pending), pending[-1][3] if pending else None
+
+
+def history_page(user, cursor=None, limit=DEFAULT_PAGE_SIZE):
+    """
+    A page of the user's search history. Entries this process has not
+    written yet and that belong on the page are flushed first, so a search
+    shows up straight away and every row has its id. If the flush fails,
+    they are left out until it succeeds.
+    """
+    stamp = decode_cursor(cursor)[0] if cursor else None
+    buffer = get_history_buffer()
+    if buffer.pending_rows(lambda row: row[0] == user.id and (stamp is None or row[3] <= stamp)):
+        try:
+            buffer.flush()
+        except Exception:
+            logger.exception("Flush of search history before paging failed")
+    return keyset_page(SearchHistory.objects.filter(user=user), 'timestamp', ('source', 'destination', 'timestamp'), cursor, limit)
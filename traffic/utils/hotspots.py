@@ -0,0 +1,174 @@
+import json
+import os
+import threading
+import numpy as np
+from django.conf import settings
+from scipy.spatial import cKDTree
+
+EARTH_RADIUS = 6371008.8
+# Metres around a hotspot where traffic is simulated as dense (~0.015°)
+DEFAULT_RADIUS = 1650.0
+# Used while HOTSPOTS_PATH does not exist
+DEFAULT_HOTSPOTS = [
+    {'id': 'plateau', 'name': 'Plateau', 'lat': 5.33, 'lng': -4.02},
+    {'id': 'cocody', 'name': 'Cocody/Hervé', 'lat': 5.37, 'lng': -3.99},
+]
+
+
+def _radius():
+    # The simulator also runs standalone, without Django settings
+    return getattr(settings, 'HOTSPOT_RADIUS', DEFAULT_RADIUS) if settings.configured else DEFAULT_RADIUS
+
+
+class HotspotIndex:
+    """
+    Hotspots in a KD-tree over a local equirectangular projection, in
+    metres, so nearest-hotspot queries run over whole arrays in compiled
+    code: O(log k) per point instead of a distance to every hotspot.
+    """
+
+    def __init__(self, lats, lngs, ids=None, radii=None, origin_lat=None):
+        self.lats = np.asarray(lats, dtype=np.float64).ravel()
+        self.lngs = np.asarray(lngs, dtype=np.float64).ravel()
+        if not self.lats.size:
+            raise ValueError("At least one hotspot is needed")
+        self.ids = [str(i) for i in ids] if ids is not None else [str(i) for i in range(self.lats.size)]
+        self.radii = np.full(self.lats.size, DEFAULT_RADIUS) if radii is None else np.asarray(radii, dtype=np.float64)
+        self.origin_lat = float(self.lats.mean()) if origin_lat is None else float(origin_lat)
+        self._tree = cKDTree(self._project(self.lats, self.lngs))
+
+    def __len__(self):
+        return self.lats.size
+
+    def _project(self, lats, lngs):
+        scale = np.radians(1.0) * EARTH_RADIUS
+        return np.column_stack((lats * scale, lngs * (scale * np.cos(np.radians(self.origin_lat)))))
+
+    def nearest(self, lats, lngs, chunk_size=1 << 20):
+        """
+        Distance in metres to the nearest hotspot, and that hotspot's
+        position in the index, for every point. Queried chunk by chunk so the
+        projected copy stays bounded.
+        """
+        lats = np.asarray(lats, dtype=np.float64).ravel()
+        lngs = np.asarray(lngs, dtype=np.float64).ravel()
+        distance = np.empty(lats.size, dtype=np.float64)
+        index = np.empty(lats.size, dtype=np.intp)
+        for start in range(0, lats.size, chunk_size):
+            stop = min(start + chunk_size, lats.size)
+            # Spreading a handful of points over threads costs more than it saves
+            distance[start:stop], index[start:stop] = self._tree.query(
+                self._project(lats[start:stop], lngs[start:stop]), workers=-1 if stop - start > 4096 else 1,
+            )
+        return distance, index
+
+    def near(self, lats, lngs):
+        """
+        True where a point lies within the radius of its nearest hotspot.
+        """
+        distance, index = self.nearest(lats, lngs)
+        return distance < self.radii[index]
+
+    def to_dict(self):
+        return {
+            'ids': self.ids,
+            'lat': self.lats.tolist(),
+            'lng': self.lngs.tolist(),
+            'radius': self.radii.tolist(),
+            'origin_lat': self.origin_lat,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['lat'], data['lng'], data['ids'], data['radius'], data['origin_lat'])
+
+    # Pickled as its coordinates; the tree is rebuilt on load
+    def __getstate__(self):
+        return self.to_dict()
+
+    def __setstate__(self, state):
+        self.__init__(state['lat'], state['lng'], state['ids'], state['radius'], state['origin_lat'])
+
+
+def read_geojson(path):
+    """
+    Hotspot records from a GeoJSON FeatureCollection: Point features, or the
+    vertex mean of Polygon/MultiPolygon ones. The optional properties id,
+    name and radius (metres) are kept.
+    """
+    with open(path, encoding='utf-8') as f:
+        collection = json.load(f)
+    hotspots = []
+    for i, feature in enumerate(collection.get('features', [])):
+        geometry = feature.get('geometry') or {}
+        kind, coordinates = geometry.get('type'), geometry.get('coordinates')
+        if kind == 'Point':
+            lng, lat = coordinates[:2]
+        elif kind in ('Polygon', 'MultiPolygon'):
+            rings = coordinates if kind == 'Polygon' else [ring for polygon in coordinates for ring in polygon]
+            # Rings repeat their first vertex at the end; count it once
+            lng, lat = np.concatenate([np.asarray(ring, dtype=np.float64)[:-1, :2] for ring in rings]).mean(axis=0)
+        else:
+            continue
+        properties = feature.get('properties') or {}
+        hotspots.append({
+            'id': str(properties.get('id', feature.get('id', i))),
+            'name': properties.get('name'),
+            'lat': float(lat),
+            'lng': float(lng),
+            'radius': float(properties.get('radius') or _radius()),
+        })
+    return hotspots
+
+
+def _index_from_records(records):
+    radius = _radius()
+    return HotspotIndex(
+        [record['lat'] for record in records],
+        [record['lng'] for record in records],
+        [record['id'] for record in records],
+        [record.get('radius') or radius for record in records],
+    )
+
+
+def load_hotspots(source=None):
+    """
+    A HotspotIndex from a GeoJSON path or a list of (lat, lng) pairs; for
+    None, the shared index of HOTSPOTS_PATH (or the built-in hotspots).
+    """
+    if source is None:
+        return get_hotspot_index()
+    if isinstance(source, (str, os.PathLike)):
+        return _index_from_records(read_geojson(source))
+    points = np.asarray(source, dtype=np.float64).reshape(-1, 2)
+    radius = _radius()
+    return HotspotIndex(points[:, 0], points[:, 1], radii=np.full(len(points), radius))
+
+
+_index = None
+_index_signature = None
+_index_lock = threading.Lock()
+
+
+def get_hotspot_index():
+    """
+    The hotspots of HOTSPOTS_PATH, reloaded when the file changes, or the
+    built-in ones while it does not exist or settings are not configured.
+    """
+    global _index, _index_signature
+    signature = None
+    if settings.configured:
+        path = getattr(settings, 'HOTSPOTS_PATH', settings.DATA_ROOT / 'hotspots.geojson')
+        try:
+            st = os.stat(path)
+            signature = (str(path), st.st_ino, st.st_mtime_ns)
+        except FileNotFoundError:
+            pass
+    if _index is not None and signature == _index_signature:
+        return _index
+    with _index_lock:
+        if _index is None or signature != _index_signature:
+            records = read_geojson(path) if signature is not None else DEFAULT_HOTSPOTS
+            _index = _index_from_records(records)
+            _index_signature = signature
+    return _index
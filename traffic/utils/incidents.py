@@ -0,0 +1,454 @@
+import logging
+import math
+import threading
+import time
+from datetime import timedelta
+import numpy as np
+from django.conf import settings
+from django.db import close_old_connections, DatabaseError
+from django.utils import timezone
+from ..models import Incident
+from .hotspots import HotspotIndex
+from .metrics import register_collector
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CELL_SIZE = 0.01
+DEFAULT_SYNC_INTERVAL = 5.0
+DEFAULT_RETENTION = 3600
+DEFAULT_TTL = 3600
+MAX_TTL = 7 * 86400
+DEFAULT_QUERY_LIMIT = 1000
+# Metres around an incident where it overrides the predicted class, by severity
+DEFAULT_RADII = {1: 150, 2: 300, 3: 500}
+# Traffic class forced around an incident, by severity
+SEVERITY_LEVELS = {1: 1, 2: 2, 3: 2}
+KINDS = dict(Incident.KIND_CHOICES)
+SEVERITIES = dict(Incident.SEVERITY_CHOICES)
+
+# Cells are keyed row * _ROW_SPAN + column, so the cells of one grid row
+# sort next to each other and a bbox is one slice of the sorted keys per row
+_ROW_SPAN = 1 << 32
+_COL_OFFSET = 1 << 31
+_COLUMNS = ('id', 'kind', 'severity', 'lat', 'lng', 'description', 'created', 'expires')
+_FIELDS = ('id', 'kind', 'severity', 'lat', 'lng', 'description', 'created_at', 'expires_at')
+_METRES_PER_DEGREE = 111320.0
+
+
+class InvalidIncident(ValueError):
+    pass
+
+
+def parse_incidents(payload):
+    """
+    Validate reported incidents: one {kind, severity, lat, lng, description,
+    ttl} object or a list of them. ttl is the lifetime in seconds. Returns
+    unsaved Incident instances; the whole report is rejected on a bad entry.
+    """
+    items = payload if isinstance(payload, list) else [payload]
+    if not items or not all(isinstance(item, dict) for item in items):
+        raise InvalidIncident("Un incident ou une liste d'incidents est attendu.")
+    now = timezone.now()
+    incidents = []
+    for n, item in enumerate(items, start=1):
+        try:
+            lat, lng = float(item['lat']), float(item['lng'])
+            severity = int(item.get('severity', 2))
+            ttl = float(item.get('ttl', getattr(settings, 'INCIDENT_DEFAULT_TTL', DEFAULT_TTL)))
+        except (KeyError, TypeError, ValueError):
+            raise InvalidIncident(f"Incident {n} : position, gravité ou durée invalide.")
+        kind = item.get('kind', 'other')
+        description = str(item.get('description') or '')
+        if not (-90 <= lat <= 90 and -180 <= lng <= 180) or severity not in SEVERITIES:
+            raise InvalidIncident(f"Incident {n} : position ou gravité invalide.")
+        if kind not in KINDS:
+            raise InvalidIncident(f"Incident {n} : type inconnu ({', '.join(KINDS)}).")
+        if not 0 < ttl <= MAX_TTL or len(description) > 255:
+            raise InvalidIncident(f"Incident {n} : durée ou description invalide.")
+        incidents.append(Incident(
+            kind=kind, severity=severity, lat=lat, lng=lng, description=description,
+            created_at=now, expires_at=now + timedelta(seconds=ttl), updated_at=now,
+        ))
+    return incidents
+
+
+def _epoch(stamp):
+    return stamp.timestamp()
+
+
+def _iso(seconds):
+    return np.datetime_as_string(np.asarray(seconds * 1e3).astype('datetime64[ms]'), timezone='UTC').tolist()
+
+
+class IncidentIndex:
+    """
+    Active incidents as columns, sorted by their cell on a uniform lat/lng
+    grid. A viewport query reads one contiguous slice per grid row it spans,
+    found by binary search, then filters those candidates exactly: cost
+    follows the cells and incidents in view, not the total.
+
+    Immutable: changes build a new index, which the store swaps in, so
+    readers never lock.
+    """
+
+    def __init__(self, columns, cell_size=DEFAULT_CELL_SIZE):
+        self.cell_size = cell_size
+        keys = self._keys(columns['lat'], columns['lng'])
+        order = np.argsort(keys, kind='stable')
+        self.keys = keys[order]
+        for name in _COLUMNS:
+            setattr(self, name, columns[name][order])
+        self._zones = None
+        self._zones_lock = threading.Lock()
+
+    @classmethod
+    def from_rows(cls, rows, cell_size=DEFAULT_CELL_SIZE):
+        """
+        Index of (id, kind, severity, lat, lng, description, created_at, expires_at) rows.
+        """
+        rows = list(rows)
+        ids, kinds, severities, lats, lngs, descriptions, created, expires = zip(*rows) if rows else ([],) * 8
+        return cls({
+            'id': np.array(ids, dtype=np.int64),
+            'kind': np.array(kinds, dtype=object),
+            'severity': np.array(severities, dtype=np.int8),
+            'lat': np.array(lats, dtype=np.float64),
+            'lng': np.array(lngs, dtype=np.float64),
+            'description': np.array(descriptions, dtype=object),
+            'created': np.array([_epoch(t) for t in created], dtype=np.float64),
+            'expires': np.array([_epoch(t) for t in expires], dtype=np.float64),
+        }, cell_size)
+
+    def __len__(self):
+        return self.id.size
+
+    def _keys(self, lats, lngs):
+        rows = np.floor(np.asarray(lats) / self.cell_size).astype(np.int64)
+        cols = np.floor(np.asarray(lngs) / self.cell_size).astype(np.int64)
+        return rows * _ROW_SPAN + (cols + _COL_OFFSET)
+
+    def updated(self, rows=(), removed=(), now=None):
+        """
+        A new index with `rows` added or replaced, the ids in `removed` and
+        the incidents expired by `now` left out; self when nothing changes.
+        """
+        rows = list(rows)
+        now = time.time() if now is None else now
+        changed = np.array([row[0] for row in rows] + list(removed), dtype=np.int64)
+        keep = self.expires > now
+        if changed.size:
+            keep &= ~np.isin(self.id, changed)
+        if not rows and keep.all():
+            return self
+        added = IncidentIndex.from_rows([row for row in rows if _epoch(row[7]) > now], self.cell_size)
+        return IncidentIndex({
+            name: np.concatenate((getattr(self, name)[keep], getattr(added, name))) for name in _COLUMNS
+        }, self.cell_size)
+
+    def query(self, south, west, north, east, now=None):
+        """
+        Positions of the active incidents inside the bbox, most severe then
+        most recent first.
+        """
+        if not len(self):
+            return np.empty(0, dtype=np.intp)
+        now = time.time() if now is None else now
+        first_row, last_row = (math.floor(v / self.cell_size) for v in (south, north))
+        first_col, last_col = (math.floor(v / self.cell_size) + _COL_OFFSET for v in (west, east))
+        rows = np.arange(first_row, last_row + 1, dtype=np.int64) * _ROW_SPAN
+        starts = np.searchsorted(self.keys, rows + first_col, side='left')
+        stops = np.searchsorted(self.keys, rows + last_col, side='right')
+        spans = [np.arange(a, b) for a, b in zip(starts.tolist(), stops.tolist()) if b > a]
+        if not spans:
+            return np.empty(0, dtype=np.intp)
+        candidates = np.concatenate(spans)
+        lat, lng = self.lat[candidates], self.lng[candidates]
+        inside = (
+            (lat >= south) & (lat <= north) & (lng >= west) & (lng <= east)
+            & (self.expires[candidates] > now)
+        )
+        positions = candidates[inside]
+        return positions[np.lexsort((-self.created[positions], -self.severity[positions]))]
+
+    def records(self, positions):
+        positions = np.asarray(positions, dtype=np.intp)
+        kinds = self.kind[positions].tolist()
+        return [
+            {
+                'id': pk,
+                'kind': kind,
+                'label': KINDS.get(kind, kind),
+                'severity': severity,
+                'lat': lat,
+                'lng': lng,
+                'description': description,
+                'created_at': created,
+                'expires_at': expires,
+            }
+            for pk, kind, severity, lat, lng, description, created, expires in zip(
+                self.id[positions].tolist(), kinds, self.severity[positions].tolist(),
+                self.lat[positions].tolist(), self.lng[positions].tolist(), self.description[positions].tolist(),
+                _iso(self.created[positions]), _iso(self.expires[positions]),
+            )
+        ]
+
+    def _zone_indexes(self):
+        """
+        One KD-tree per severity over its incidents, radius from INCIDENT_RADII,
+        built on the first override after the index changes.
+        """
+        if self._zones is None:
+            with self._zones_lock:
+                if self._zones is None:
+                    radii = getattr(settings, 'INCIDENT_RADII', DEFAULT_RADII)
+                    zones = []
+                    for severity in np.unique(self.severity).tolist():
+                        positions = np.flatnonzero(self.severity == severity)
+                        radius = float(radii.get(severity, DEFAULT_RADII.get(severity, 300)))
+                        lat, lng = self.lat[positions], self.lng[positions]
+                        # Degrees covered by the radius, for a cheap bbox pre-filter
+                        pad_lat = radius / _METRES_PER_DEGREE
+                        pad_lng = pad_lat / max(math.cos(math.radians(float(np.abs(lat).max()) + pad_lat)), 1e-6)
+                        bbox = (lat.min() - pad_lat, lng.min() - pad_lng, lat.max() + pad_lat, lng.max() + pad_lng)
+                        tree = HotspotIndex(lat, lng, radii=np.full(positions.size, radius))
+                        zones.append((SEVERITY_LEVELS.get(severity, 2), bbox, tree, positions))
+                    self._zones = zones
+        return self._zones
+
+    def override(self, lats, lngs, levels, now=None):
+        """
+        Raise each predicted class to the one forced by an active incident
+        within its radius of the point (the nearest of each severity counts).
+        """
+        if not len(self):
+            return levels
+        now = time.time() if now is None else now
+        lats = np.asarray(lats, dtype=np.float64)
+        lngs = np.asarray(lngs, dtype=np.float64)
+        levels = np.array(levels, copy=True)
+        for level, (south, west, north, east), tree, positions in self._zone_indexes():
+            rows = np.flatnonzero((lats >= south) & (lats <= north) & (lngs >= west) & (lngs <= east))
+            if not rows.size:
+                continue
+            distance, nearest = tree.nearest(lats[rows], lngs[rows])
+            hit = (distance <= tree.radii[nearest]) & (self.expires[positions[nearest]] > now)
+            levels[rows[hit]] = np.maximum(levels[rows[hit]], level)
+        return levels
+
+
+def _empty_index(cell_size):
+    return IncidentIndex.from_rows([], cell_size)
+
+
+class IncidentStore:
+    """
+    The worker's copy of the active incidents. Reports made through this
+    worker are written to the database and indexed at once; a background
+    thread pulls the changes other workers made every INCIDENT_SYNC_INTERVAL
+    seconds (rows whose updated_at moved), drops expired incidents from the
+    index and deletes rows expired for more than INCIDENT_RETENTION seconds
+    in one statement. Queries and overrides only read the in-memory index.
+    """
+
+    def __init__(self):
+        self.cell_size = getattr(settings, 'INCIDENT_CELL_SIZE', DEFAULT_CELL_SIZE)
+        self.sync_interval = getattr(settings, 'INCIDENT_SYNC_INTERVAL', DEFAULT_SYNC_INTERVAL)
+        self.retention = getattr(settings, 'INCIDENT_RETENTION', DEFAULT_RETENTION)
+        self.index = _empty_index(self.cell_size)
+        self.loaded = False
+        self._watermark = None
+        # updated_at of the rows seen in the overlap window, so re-reading it is a no-op
+        self._seen = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self.syncs = 0
+        self.deleted = 0
+        self.last_sync_ms = 0.0
+
+    def _apply(self, rows=(), removed=()):
+        with self._lock:
+            self.index = self.index.updated(rows, removed)
+
+    def load(self):
+        """
+        Index every incident still active in the database.
+        """
+        now = timezone.now()
+        since = now - timedelta(seconds=2 * self.sync_interval)
+        active = Incident.objects.filter(expires_at__gt=now).values_list(*_FIELDS, 'updated_at')
+        rows, seen = [], {}
+        for *row, updated_at in active.iterator(chunk_size=10000):
+            rows.append(row)
+            if updated_at >= since:
+                seen[row[0]] = updated_at
+        index = IncidentIndex.from_rows(rows, self.cell_size)
+        with self._lock:
+            self.index = index
+            self._watermark = now
+            self._seen = seen
+            self.loaded = True
+
+    def sync(self):
+        """
+        Fold in the incidents created, changed or resolved since the last sync.
+        A window of two intervals is re-read, so rows committed late are not missed.
+        """
+        if not self.loaded:
+            self.load()
+            return 0
+        started = time.perf_counter()
+        since = self._watermark - timedelta(seconds=2 * self.sync_interval)
+        changed = Incident.objects.filter(updated_at__gte=since).values_list(*_FIELDS, 'updated_at')
+        rows, removed = [], []
+        watermark = self._watermark
+        now = timezone.now()
+        changed = list(changed.iterator(chunk_size=10000))
+        # report() and resolve() record what they indexed from request threads;
+        # the rows are read first so the lock is not held over the query
+        with self._lock:
+            for *row, updated_at in changed:
+                watermark = max(watermark, updated_at)
+                if self._seen.get(row[0]) == updated_at:
+                    continue
+                self._seen[row[0]] = updated_at
+                if row[7] > now:
+                    rows.append(tuple(row))
+                else:
+                    removed.append(row[0])
+            self._seen = {pk: stamp for pk, stamp in self._seen.items() if stamp >= since}
+        if rows or removed:
+            self._apply(rows, removed)
+        self._watermark = watermark
+        self.syncs += 1
+        self.last_sync_ms = (time.perf_counter() - started) * 1000
+        return len(rows) + len(removed)
+
+    def sweep(self):
+        """
+        Drop expired incidents from the index and purge old ones from the database.
+        """
+        self._apply()
+        cutoff = timezone.now() - timedelta(seconds=self.retention)
+        deleted, _ = Incident.objects.filter(expires_at__lt=cutoff).delete()
+        self.deleted += deleted
+        return deleted
+
+    def report(self, incidents, user=None):
+        """
+        Save parsed incidents and index them. Returns their records.
+        """
+        for incident in incidents:
+            incident.reported_by = user
+        Incident.objects.bulk_create(incidents)
+        rows = [tuple(getattr(incident, field) for field in _FIELDS) for incident in incidents]
+        self._apply(rows)
+        # Already indexed: the next sync needn't reindex them
+        with self._lock:
+            self._seen.update((incident.pk, incident.updated_at) for incident in incidents)
+        index = IncidentIndex.from_rows(rows, self.cell_size)
+        return index.records(np.arange(len(index)))
+
+    def resolve(self, incident_id, user=None):
+        """
+        End an active incident now. With a user who is not staff, only one
+        they reported. Returns False if there was no such incident.
+        """
+        now = timezone.now()
+        incidents = Incident.objects.filter(pk=incident_id, expires_at__gt=now)
+        if user is not None and not user.is_staff:
+            incidents = incidents.filter(reported_by=user)
+        if not incidents.update(expires_at=now, updated_at=now):
+            return False
+        self._apply(removed=[incident_id])
+        with self._lock:
+            self._seen[incident_id] = now
+        return True
+
+    def query(self, south, west, north, east, limit=None):
+        """
+        Active incidents in the bbox, most severe first, at most `limit`
+        (INCIDENT_QUERY_LIMIT); total counts them all.
+        """
+        limit = limit or getattr(settings, 'INCIDENT_QUERY_LIMIT', DEFAULT_QUERY_LIMIT)
+        index = self.index
+        positions = index.query(south, west, north, east)
+        return {
+            'incidents': index.records(positions[:limit]),
+            'total': int(positions.size),
+            'truncated': positions.size > limit,
+            'active': len(index),
+        }
+
+    def override(self, lats, lngs, levels):
+        return self.index.override(lats, lngs, levels)
+
+    def start(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name='incident-sync', daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.sync_interval)
+            try:
+                self.sync()
+                self.sweep()
+            except Exception:
+                logger.exception("Incident sync failed")
+            finally:
+                close_old_connections()
+
+    def stats(self):
+        return {
+            'active': len(self.index),
+            'loaded': self.loaded,
+            'syncs': self.syncs,
+            'deleted': self.deleted,
+            'last_sync_ms': self.last_sync_ms,
+        }
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_incident_store():
+    """
+    The worker's incident store, loaded and syncing from the first call. If
+    the database can't be read yet, it starts empty and the sync retries.
+    """
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                store = IncidentStore()
+                try:
+                    store.load()
+                except DatabaseError:
+                    logger.exception("Incidents not loaded, retrying in the background")
+                store.start()
+                _store = store
+    return _store
+
+
+def override_levels(lats, lngs, levels):
+    """
+    Predicted classes with active incidents applied, unless INCIDENT_OVERRIDE is off.
+    """
+    if not getattr(settings, 'INCIDENT_OVERRIDE', True):
+        return levels
+    return get_incident_store().override(lats, lngs, levels)
+
+
+def _collect():
+    if _store is None:
+        return
+    stats = _store.stats()
+    yield 'incidents_active', 'gauge', "Active incidents in the worker's index.", {}, stats['active']
+    yield 'incident_syncs_total', 'counter', "Incident syncs with the database.", {}, stats['syncs']
+    yield 'incidents_deleted_total', 'counter', "Expired incidents purged from the database.", {}, stats['deleted']
+
+
+register_collector(_collect)
@@ -0,0 +1,204 @@
+import asyncio
+import functools
+import weakref
+import numpy as np
+from django.conf import settings
+from .features import as_model_input
+from .forest_engine import get_forest
+from .model_registry import get_model
+from .metrics import span, observe, register_collector
+from .regions import get_region_registry, OutsideRegions
+from .incidents import override_levels
+
+
+class ModelNotTrained(Exception):
+    pass
+
+
+class Overloaded(Exception):
+    pass
+
+
+def predict_levels(X, region=None):
+    """
+    Traffic class for each row of a feature matrix, by the model of `region`
+    (the single model for None). Small batches use the flattened forest when
+    it has been exported; beyond FOREST_BATCH_LIMIT rows sklearn's compiled
+    traversal is faster. Active incidents then override the classes around them.
+    """
+    observe('inference_batch_rows', len(X))
+    if region is None:
+        forest, load_model = get_forest(), get_model
+    else:
+        registry = get_region_registry()
+        forest, load_model = registry.forest(region), lambda: registry.model_entry(region)[1]
+    if forest is not None and len(X) <= getattr(settings, 'FOREST_BATCH_LIMIT', 256):
+        with span('inference', engine='forest'):
+            levels = forest.predict(X)
+    else:
+        model = load_model()
+        if model is None:
+            if forest is None:
+                raise ModelNotTrained()
+            with span('inference', engine='forest'):
+                levels = forest.predict(X)
+        else:
+            with span('inference', engine='sklearn'):
+                levels = model.predict(as_model_input(model, X))
+    with span('incident_override'):
+        return override_levels(X[:, 0], X[:, 1], levels)
+
+
+def predict_by_region(X):
+    """
+    predict_levels for rows that may lie in different regions: each region
+    scores its own rows. Raises OutsideRegions if a row is in none.
+    """
+    registry = get_region_registry()
+    if registry is None:
+        return predict_levels(X)
+    owners = registry.index.locate_many(X[:, 0], X[:, 1])
+    if (owners < 0).any():
+        raise OutsideRegions(f"Position hors des zones couvertes (ligne {int(np.argmax(owners < 0)) + 1}).")
+    levels = np.empty(len(X), dtype=np.int64)
+    for i in np.unique(owners):
+        rows = owners == i
+        levels[rows] = predict_levels(X[rows], registry.index.regions[i].name)
+    return levels
+
+
+class PredictionBatcher:
+    """
+    Collects single-row predictions from concurrent requests on one event loop
+    and runs them as one batched inference in a worker thread.
+
+    A batch is flushed when it reaches max_batch rows or `window` seconds after
+    its first row. While a batch is running, new rows keep accumulating, so
+    batches grow with load. Once max_queue rows are waiting or in flight, new
+    requests are rejected with Overloaded.
+    """
+
+    def __init__(self, predict_fn, max_batch=64, window=0.002, max_queue=1024):
+        self.predict_fn = predict_fn
+        self.max_batch = max_batch
+        self.window = window
+        self.max_queue = max_queue
+        self._pending = []
+        self._timer = None
+        self._running = False
+        self.queue_depth = 0
+        self.requests = 0
+        self.batches = 0
+        self.rows = 0
+        self.rejected = 0
+        self.max_queue_depth = 0
+
+    async def predict(self, row):
+        if self.queue_depth >= self.max_queue:
+            self.rejected += 1
+            raise Overloaded()
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((row, future))
+        self.queue_depth += 1
+        self.requests += 1
+        self.max_queue_depth = max(self.max_queue_depth, self.queue_depth)
+
+        if not self._running:
+            if len(self._pending) >= self.max_batch or self.window <= 0:
+                self._flush()
+            elif self._timer is None:
+                self._timer = loop.call_later(self.window, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._running or not self._pending:
+            return
+        batch, self._pending = self._pending[:self.max_batch], self._pending[self.max_batch:]
+        self._running = True
+        asyncio.get_running_loop().create_task(self._run(batch))
+
+    async def _run(self, batch):
+        loop = asyncio.get_running_loop()
+        try:
+            X = np.vstack([row for row, _ in batch])
+            result = await loop.run_in_executor(None, self.predict_fn, X)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        else:
+            for (_, future), value in zip(batch, result):
+                if not future.done():
+                    future.set_result(value)
+        finally:
+            self.queue_depth -= len(batch)
+            self.batches += 1
+            self.rows += len(batch)
+            self._running = False
+            # Rows that arrived meanwhile go out right away as the next batch
+            if self._pending:
+                self._flush()
+
+    def stats(self):
+        return {
+            'queue_depth': self.queue_depth,
+            'max_queue_depth': self.max_queue_depth,
+            'requests': self.requests,
+            'batches': self.batches,
+            'rows': self.rows,
+            'rejected': self.rejected,
+            'avg_batch_size': self.rows / self.batches if self.batches else 0.0,
+        }
+
+
+# One batcher per event loop (futures and timers cannot cross loops) and
+# region, so that every batch goes to a single model
+_batchers = weakref.WeakKeyDictionary()
+
+
+def get_batcher(region=None):
+    loop = asyncio.get_running_loop()
+    batchers = _batchers.get(loop)
+    if batchers is None:
+        batchers = _batchers[loop] = {}
+    batcher = batchers.get(region)
+    if batcher is None:
+        batcher = batchers[region] = PredictionBatcher(
+            functools.partial(predict_levels, region=region),
+            max_batch=getattr(settings, 'PREDICTION_BATCH_SIZE', 64),
+            window=getattr(settings, 'PREDICTION_BATCH_WINDOW', 0.002),
+            max_queue=getattr(settings, 'PREDICTION_QUEUE_LIMIT', 1024),
+        )
+    return batcher
+
+
+def batcher_stats():
+    """
+    Counters summed over the batchers of every live event loop and region.
+    """
+    totals = {}
+    for batchers in list(_batchers.values()):
+        for batcher in list(batchers.values()):
+            for key, value in batcher.stats().items():
+                if key == 'max_queue_depth':
+                    totals[key] = max(totals.get(key, 0), value)
+                else:
+                    totals[key] = totals.get(key, 0) + value
+    if totals.get('batches'):
+        totals['avg_batch_size'] = totals['rows'] / totals['batches']
+    return totals
+
+
+def _collect():
+    stats = batcher_stats()
+    for key in ('requests', 'batches', 'rows', 'rejected'):
+        yield f'batcher_{key}_total', 'counter', f"Prediction batcher {key}, all event loops.", {}, stats.get(key, 0)
+    yield 'batcher_queue_depth', 'gauge', "Rows waiting or in flight in the prediction batchers.", {}, stats.get('queue_depth', 0)
+
+
+register_collector(_collect)
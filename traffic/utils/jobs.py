@@ -0,0 +1,337 @@
+import functools
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import CancelledError, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from django.conf import settings
+from .metrics import observe
+
+logger = logging.getLogger(__name__)
+
+# Job records live on disk so any web worker can answer a status poll and the
+# pool process can report progress without talking back to its parent.
+LOCK_FILENAME = 'training.lock'
+TERMINAL_STATES = ('done', 'failed')
+# Finished job records are kept this long (seconds) for status polls
+DEFAULT_JOB_RETENTION = 7 * 86400
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _jobs_root():
+    root = settings.JOBS_ROOT
+    root.mkdir(parents=True, exist_ok=True)
+    return root
+
+
+def _job_path(job_id):
+    return _jobs_root() / f"{job_id}.json"
+
+
+def _write_job(job):
+    job['updated_at'] = time.time()
+    path = _job_path(job['id'])
+    tmp_path = str(path) + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(job, f)
+    os.replace(tmp_path, path)
+
+
+def get_job(job_id):
+    """
+    Return the job record, or None for an unknown id or unreadable record.
+    """
+    try:
+        uuid.UUID(job_id)
+        with open(_job_path(job_id)) as f:
+            return json.load(f)
+    except (ValueError, OSError):
+        return None
+
+
+def job_revision(job_id):
+    """
+    Changes with every write of the job record (each one replaces the
+    file), without reading it; None for an unknown id.
+    """
+    try:
+        uuid.UUID(job_id)
+        st = os.stat(_job_path(job_id))
+    except (ValueError, FileNotFoundError):
+        return None
+    return st.st_ino, st.st_mtime_ns, st.st_size
+
+
+def _update_job(job_id, **fields):
+    """
+    Merge fields into the job record. Returns None, writing nothing, when
+    the record was removed or cannot be read.
+    """
+    job = get_job(job_id)
+    if job is None:
+        logger.warning("Job %s has no readable record; dropping update %s", job_id, fields)
+        return None
+    job.update(fields)
+    _write_job(job)
+    return job
+
+
+def _init_worker():
+    import django
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'smart_transport.settings')
+    django.setup()
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ProcessPoolExecutor(
+                    max_workers=getattr(settings, 'TRAINING_WORKERS', 1),
+                    initializer=_init_worker,
+                )
+    return _executor
+
+
+def _discard_executor(executor):
+    """
+    Drop a pool whose worker died (BrokenProcessPool): it refuses every
+    later submit, so the next one gets a fresh pool.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is executor:
+            _executor = None
+    executor.shutdown(wait=False)
+
+
+def run_training_pipeline(job_id, n_samples, incremental=False, select=False, regions=None):
+    """
+    Simulate data, train the model and rebuild the prediction grid,
+    recording progress on the job. Runs inside a pool process.
+    In incremental mode the new rows are appended and the forest is grown;
+    with select, candidate models are compared (see model_selection).
+    With a list of regions, those are built in parallel instead.
+    """
+    from .data_simulator import generate_traffic_data
+    from .model_trainer import train_model
+    from .model_registry import get_registry
+    from .prediction_grid import build_prediction_grid
+
+    if regions:
+        _run_region_builds(job_id, regions, n_samples, incremental, select)
+        return
+
+    # Seconds per phase, kept on the job: the pool process has no /metrics of its own
+    timings = {}
+    try:
+        _update_job(job_id, state='running', phase='simulating', progress=0.05)
+        started = time.perf_counter()
+        generate_traffic_data(n_samples, append=incremental)
+        timings['simulating'] = time.perf_counter() - started
+
+        _update_job(job_id, phase='training', progress=0.3, timings=timings)
+        started = time.perf_counter()
+        report = train_model(incremental=incremental, select=select)
+        if 'error' in report:
+            raise RuntimeError(report['error'])
+        timings['training'] = time.perf_counter() - started
+
+        _update_job(job_id, phase='building_grid', progress=0.8, timings=timings)
+        started = time.perf_counter()
+        version, model = get_registry().get_entry()
+        build_prediction_grid(model, version)
+        timings['building_grid'] = time.perf_counter() - started
+
+        _update_job(job_id, state='done', phase='done', progress=1.0, version=version, report=report, timings=timings)
+    except Exception as e:
+        _update_job(job_id, state='failed', error=str(e))
+    finally:
+        _release_lock(job_id)
+
+
+def _run_region_builds(job_id, regions, n_samples, incremental, select):
+    """
+    Build each region in its own process, recording every region's outcome
+    on the job as it finishes. The job's report carries the mean accuracy
+    and each region's report.
+    """
+    from .regions import build_regions
+
+    started = time.perf_counter()
+    outcomes = {}
+    try:
+        _update_job(job_id, state='running', phase='building_regions', progress=0.05)
+        reports = {}
+        for name, report, error in build_regions(regions, n_samples, incremental, select):
+            if error is None:
+                reports[name] = report
+                outcomes[name] = {'state': 'done', 'accuracy': report['accuracy']}
+            else:
+                outcomes[name] = {'state': 'failed', 'error': str(error)}
+            _update_job(job_id, progress=0.05 + 0.95 * len(outcomes) / len(regions), region_states=outcomes)
+
+        timings = {'building_regions': time.perf_counter() - started}
+        failed = [name for name, outcome in outcomes.items() if outcome['state'] == 'failed']
+        if failed:
+            _update_job(job_id, state='failed', error=f"Échec des régions : {', '.join(failed)}", timings=timings)
+        else:
+            accuracy = sum(report['accuracy'] for report in reports.values()) / len(reports)
+            report = {'accuracy': accuracy, 'regions': reports}
+            _update_job(job_id, state='done', phase='done', progress=1.0, report=report, timings=timings)
+    except Exception as e:
+        _update_job(job_id, state='failed', error=str(e), region_states=outcomes)
+    finally:
+        _release_lock(job_id)
+
+
+def _lock_path():
+    return _jobs_root() / LOCK_FILENAME
+
+
+def _acquire_lock(job_id):
+    try:
+        fd = os.open(_lock_path(), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        return False
+    with os.fdopen(fd, 'w') as f:
+        f.write(job_id)
+    return True
+
+
+def _release_lock(job_id):
+    try:
+        with open(_lock_path()) as f:
+            if f.read().strip() != job_id:
+                return
+        os.remove(_lock_path())
+    except FileNotFoundError:
+        pass
+
+
+def _active_job():
+    """
+    The job holding the training lock, clearing the lock if its job is
+    finished, missing or has not reported within TRAINING_JOB_TIMEOUT.
+    """
+    try:
+        with open(_lock_path()) as f:
+            job_id = f.read().strip()
+    except FileNotFoundError:
+        return None
+
+    job = get_job(job_id) if job_id else None
+    timeout = getattr(settings, 'TRAINING_JOB_TIMEOUT', 3600)
+    if job is None or job['state'] in TERMINAL_STATES or time.time() - job['updated_at'] > timeout:
+        _release_lock(job_id)
+        return None
+    return job
+
+
+def _job_finished(job_id, executor, future):
+    """
+    Done callback of a job's future. The pipeline records its own errors;
+    this catches the pool failing under it (a worker killed or out of
+    memory), which would otherwise leave the job running and the lock held.
+    """
+    try:
+        error = future.exception()
+    except CancelledError as e:
+        error = e
+    if error is not None:
+        if isinstance(error, BrokenProcessPool):
+            _discard_executor(executor)
+        logger.error("Training job %s failed in the pool: %r", job_id, error)
+        job = get_job(job_id)
+        if job is not None and job['state'] not in TERMINAL_STATES:
+            _update_job(job_id, state='failed', error=str(error) or type(error).__name__)
+        _release_lock(job_id)
+    _record_timings(job_id)
+
+
+def prune_jobs(max_age=None):
+    """
+    Delete the records of jobs finished (or abandoned past
+    TRAINING_JOB_TIMEOUT) more than max_age seconds ago (JOB_RETENTION).
+    Returns how many were removed.
+    """
+    if max_age is None:
+        max_age = getattr(settings, 'JOB_RETENTION', DEFAULT_JOB_RETENTION)
+    now = time.time()
+    timeout = getattr(settings, 'TRAINING_JOB_TIMEOUT', 3600)
+    removed = 0
+    for path in _jobs_root().glob('*.json'):
+        try:
+            if now - path.stat().st_mtime < max_age:
+                continue
+        except FileNotFoundError:
+            continue
+        job = get_job(path.stem)
+        if job is None or job['state'] in TERMINAL_STATES or now - job['updated_at'] > timeout:
+            try:
+                path.unlink()
+                removed += 1
+            except FileNotFoundError:
+                pass
+    return removed
+
+
+def _record_timings(job_id):
+    """
+    Report a finished job's phase durations in this process's metrics.
+    """
+    job = get_job(job_id) or {}
+    for phase, seconds in job.get('timings', {}).items():
+        observe('span_seconds', seconds, span='training', phase=phase)
+
+
+def submit_training_job(n_samples=3000, incremental=False, select=False, regions=None):
+    """
+    Start a simulation + training job (of the given regions, or of the
+    single model), or return the one already in progress.
+    Returns (job, created).
+    """
+    prune_jobs()
+    for _ in range(2):
+        job = _active_job()
+        if job is not None:
+            return job, False
+
+        job_id = str(uuid.uuid4())
+        if not _acquire_lock(job_id):
+            continue
+
+        job = {
+            'id': job_id,
+            'state': 'queued',
+            'phase': 'queued',
+            'progress': 0.0,
+            'n_samples': n_samples,
+            'incremental': incremental,
+            'select': select,
+            'regions': regions,
+            'created_at': time.time(),
+        }
+        _write_job(job)
+        try:
+            executor = _get_executor()
+            try:
+                future = executor.submit(run_training_pipeline, job_id, n_samples, incremental, select, regions)
+            except BrokenProcessPool:
+                # Broken since the last job finished: retry on a fresh pool
+                _discard_executor(executor)
+                executor = _get_executor()
+                future = executor.submit(run_training_pipeline, job_id, n_samples, incremental, select, regions)
+            future.add_done_callback(functools.partial(_job_finished, job_id, executor))
+        except Exception as e:
+            _release_lock(job_id)
+            job = _update_job(job_id, state='failed', error=str(e))
+        return job, True
+
+    return _active_job(), False
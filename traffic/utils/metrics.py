@@ -0,0 +1,261 @@
+import bisect
+import collections
+import math
+import os
+import sys
+import threading
+import time
+
+PREFIX = 'smarttrans_'
+# Seconds, from sub-millisecond inference up to training runs
+DURATION_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+    1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0,
+)
+ROW_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 1024, 4096, 16384, 65536)
+
+HISTOGRAMS = {
+    'request_duration_seconds': ("Time from request to response object, per view.", DURATION_BUCKETS),
+    'span_seconds': ("Time spent in instrumented sections of the hot path.", DURATION_BUCKETS),
+    'inference_batch_rows': ("Rows per model inference call.", ROW_BUCKETS),
+}
+COUNTERS = {
+    'requests_total': "Requests answered, per view, method and status.",
+    'db_rows_written_total': "Rows written by the write-behind buffers.",
+    'profiles_written_total': "Stack profiles dumped for slow requests.",
+}
+
+
+class Histogram:
+    """
+    Cumulative-bucket histogram as Prometheus expects it. observe() is a
+    bisect and three additions under a lock.
+    """
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+            self.count += 1
+
+    def snapshot(self):
+        with self._lock:
+            counts, total, count = list(self.counts), self.sum, self.count
+        cumulative = []
+        running = 0
+        for bound, n in zip(self.buckets + (math.inf,), counts):
+            running += n
+            cumulative.append((bound, running))
+        return cumulative, total, count
+
+
+class Metrics:
+    """
+    In-process histograms and counters, keyed by name and label set, plus
+    collectors: callables registered by other modules that report their own
+    counters (model registry, batchers, buffers...) at scrape time.
+    """
+
+    def __init__(self):
+        # Keyed by (name, sorted labels); _series maps the labels in call
+        # order to the same objects, so the hot path never sorts
+        self._histograms = {}
+        self._counters = {}
+        self._series = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def _histogram(self, name, labels):
+        key = (name, tuple(labels.items()))
+        histogram = self._series.get(key)
+        if histogram is None:
+            with self._lock:
+                canonical = (name, tuple(sorted(labels.items())))
+                histogram = self._histograms.get(canonical)
+                if histogram is None:
+                    histogram = self._histograms[canonical] = Histogram(HISTOGRAMS[name][1])
+                self._series[key] = histogram
+        return histogram
+
+    def observe(self, name, value, **labels):
+        self._histogram(name, labels).observe(value)
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(labels.items()))
+        with self._lock:
+            canonical = self._series.get(key)
+            if canonical is None:
+                canonical = self._series[key] = (name, tuple(sorted(labels.items())))
+            self._counters[canonical] = self._counters.get(canonical, 0) + value
+
+    def register_collector(self, collector):
+        """
+        collector() yields (name, type, help, labels, value) samples.
+        """
+        self._collectors.append(collector)
+
+    def render(self):
+        """
+        Everything in the Prometheus text exposition format.
+        """
+        families = collections.OrderedDict()
+
+        def family(name, kind, help_text):
+            return families.setdefault(name, (kind, help_text, []))[2]
+
+        for (name, labels), histogram in sorted(self._histograms.items()):
+            cumulative, total, count = histogram.snapshot()
+            samples = family(name, 'histogram', HISTOGRAMS[name][0])
+            for bound, n in cumulative:
+                samples.append(('_bucket', labels + (('le', _format_bound(bound)),), n))
+            samples.append(('_sum', labels, total))
+            samples.append(('_count', labels, count))
+        with self._lock:
+            counters = sorted(self._counters.items())
+        for (name, labels), value in counters:
+            family(name, 'counter', COUNTERS[name]).append(('', labels, value))
+        for collector in self._collectors:
+            for name, kind, help_text, labels, value in collector():
+                family(name, kind, help_text).append(('', tuple(sorted(labels.items())), value))
+
+        lines = []
+        for name, (kind, help_text, samples) in families.items():
+            lines.append(f"# HELP {PREFIX}{name} {help_text}")
+            lines.append(f"# TYPE {PREFIX}{name} {kind}")
+            for suffix, labels, value in samples:
+                lines.append(f"{PREFIX}{name}{suffix}{_format_labels(labels)} {_format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+
+def _format_bound(bound):
+    return '+Inf' if bound == math.inf else repr(float(bound))
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in labels) + '}'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_value(value):
+    if value is None:
+        return 'NaN'
+    return repr(float(value)) if isinstance(value, float) else str(int(value))
+
+
+_metrics = Metrics()
+
+
+def observe(name, value, **labels):
+    _metrics.observe(name, value, **labels)
+
+
+def inc(name, value=1, **labels):
+    _metrics.inc(name, value, **labels)
+
+
+class span:
+    """
+    Time a block into span_seconds{span=name, ...}:
+
+        with span('inference', engine='forest'):
+            ...
+    """
+
+    __slots__ = ('histogram', 'started')
+
+    def __init__(self, name, **labels):
+        self.histogram = _metrics._histogram('span_seconds', dict(span=name, **labels))
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.started)
+
+
+def register_collector(collector):
+    _metrics.register_collector(collector)
+
+
+def render_metrics():
+    return _metrics.render()
+
+
+class SamplingProfiler:
+    """
+    Samples the stack of every thread each `interval` seconds while at least
+    one request is being profiled, and hands each request the stacks seen
+    during its lifetime as folded "frame;frame;frame count" lines, the input
+    of flamegraph.pl and speedscope. Concurrent requests share samples, so a
+    profile shows everything the process was doing, the request included.
+    """
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self._active = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def begin(self):
+        token = object()
+        with self._lock:
+            self._active[token] = collections.Counter()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+                self._thread.start()
+        self._wakeup.set()
+        return token
+
+    def end(self, token):
+        with self._lock:
+            return self._active.pop(token)
+
+    def _run(self):
+        own = threading.get_ident()
+        while True:
+            if not self._active:
+                self._wakeup.wait()
+                self._wakeup.clear()
+                continue
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            stacks = [
+                _fold(names.get(ident, str(ident)), frame)
+                for ident, frame in sys._current_frames().items() if ident != own
+            ]
+            with self._lock:
+                for counter in self._active.values():
+                    counter.update(stacks)
+            time.sleep(self.interval)
+
+
+def _fold(thread_name, frame):
+    frames = []
+    while frame is not None:
+        code = frame.f_code
+        frames.append(f"{code.co_qualname} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    frames.append(thread_name)
+    return ';'.join(reversed(frames))
+
+
+def write_folded(stacks, path):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        for stack, count in stacks.most_common():
+            f.write(f"{stack} {count}\n")
+    os.replace(tmp_path, path)
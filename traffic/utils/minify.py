@@ -0,0 +1,206 @@
+import re
+
+# Punctuation next to which whitespace carries no meaning. + - / and . are
+# left out: "a + +b" and "a / /re/" need their spaces
+JS_PUNCTUATION = set('{}()[];,:=<>?!&|*%^~')
+# After these, a '/' starts a regular expression rather than a division
+JS_REGEX_PRECEDERS = set('(,=:[!&|?{};+-*%<>~^')
+JS_REGEX_KEYWORDS = {'return', 'typeof', 'case', 'do', 'else', 'in', 'of', 'new', 'delete', 'void', 'throw', 'yield', 'await'}
+# A line break after these can be dropped without changing where statements end
+JS_JOINERS = set('{([,;:=&|?*%<>!')
+
+CSS_TOKEN_RE = re.compile(r'''("(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*')|/\*.*?\*/''', re.S)
+CSS_SPACE_RE = re.compile(r'\s*([{};,>])\s*')
+
+
+def minify_css(source):
+    """
+    Drop comments and the whitespace around CSS punctuation, leaving
+    strings untouched. Spaces before ':' stay: "a :hover" is not "a:hover".
+    """
+    parts = []
+    for i, chunk in enumerate(CSS_TOKEN_RE.split(source)):
+        if chunk is None:
+            continue
+        if i % 2:
+            parts.append(chunk)
+        else:
+            chunk = CSS_SPACE_RE.sub(r'\1', re.sub(r'\s+', ' ', chunk))
+            parts.append(re.sub(r':\s+', ':', chunk))
+    return ''.join(parts).replace(';}', '}').strip()
+
+
+class _JsScanner:
+    """
+    Splits a script into code, where whitespace and comments may go, and
+    literals (strings, template text, regular expressions), kept verbatim.
+    Template substitutions are code again, scanned recursively.
+    """
+
+    def __init__(self, source):
+        self.source = source
+        self.pos = 0
+        self.out = []
+        # Last significant code character and word, for the regex/division call
+        self.last = ''
+        self.word = ''
+
+    def emit_code(self, text):
+        self.out.append(('code', text))
+        stripped = text.rstrip()
+        if stripped:
+            self.last = stripped[-1]
+            match = re.search(r'[\w$]+$', stripped)
+            self.word = match.group(0) if match else ''
+
+    def emit_literal(self, text):
+        self.out.append(('literal', text))
+        self.last, self.word = 'a', ''
+
+    def scan_quoted(self, quote):
+        src, start = self.source, self.pos
+        i = start + 1
+        while i < len(src) and src[i] != quote:
+            i += 2 if src[i] == '\\' else 1
+        self.pos = i + 1
+        self.emit_literal(src[start:self.pos])
+
+    def scan_regex(self):
+        src, start = self.source, self.pos
+        i, in_class = start + 1, False
+        while i < len(src):
+            c = src[i]
+            if c == '\\':
+                i += 2
+                continue
+            if c == '[':
+                in_class = True
+            elif c == ']':
+                in_class = False
+            elif c == '/' and not in_class:
+                break
+            i += 1
+        i += 1
+        while i < len(src) and (src[i].isalnum() or src[i] == '_'):
+            i += 1
+        self.pos = i
+        self.emit_literal(src[start:i])
+
+    def scan_template(self):
+        src = self.source
+        start = self.pos
+        i = start + 1
+        while i < len(src):
+            c = src[i]
+            if c == '\\':
+                i += 2
+            elif c == '`':
+                i += 1
+                break
+            elif c == '$' and src[i + 1:i + 2] == '{':
+                self.emit_literal(src[start:i + 2])
+                self.pos = i + 2
+                self.scan_code(in_template=True)
+                # scan_code stops on the closing brace
+                start = i = self.pos
+                continue
+            else:
+                i += 1
+        self.pos = i
+        self.emit_literal(src[start:i])
+
+    def scan_code(self, in_template=False):
+        src = self.source
+        depth = 0
+        start = self.pos
+        while self.pos < len(src):
+            c = src[self.pos]
+            if c in '\'"`' or c == '/':
+                nxt = src[self.pos + 1:self.pos + 2]
+                if c == '/' and nxt == '/':
+                    self.emit_code(src[start:self.pos])
+                    end = src.find('\n', self.pos)
+                    self.pos = len(src) if end < 0 else end
+                    start = self.pos
+                    continue
+                if c == '/' and nxt == '*':
+                    self.emit_code(src[start:self.pos])
+                    end = src.find('*/', self.pos + 2)
+                    comment = src[self.pos:len(src) if end < 0 else end + 2]
+                    self.pos += len(comment)
+                    # A comment spanning lines still ends a statement
+                    self.out.append(('code', '\n' if '\n' in comment else ' '))
+                    start = self.pos
+                    continue
+                self.emit_code(src[start:self.pos])
+                if c == '/':
+                    if self.last in JS_REGEX_PRECEDERS or not self.last or self.word in JS_REGEX_KEYWORDS:
+                        self.scan_regex()
+                    else:
+                        self.emit_code('/')
+                        self.pos += 1
+                elif c == '`':
+                    self.scan_template()
+                else:
+                    self.scan_quoted(c)
+                start = self.pos
+                continue
+            if c == '{':
+                depth += 1
+            elif c == '}':
+                if in_template and depth == 0:
+                    self.emit_code(src[start:self.pos])
+                    self.pos += 1
+                    self.emit_literal('}')
+                    return
+                depth -= 1
+            self.pos += 1
+        self.emit_code(src[start:self.pos])
+
+
+def _squeeze(code):
+    """
+    Whitespace of a code run: a run with a line break becomes one line
+    break (statements may end there), any other a single space; both go
+    where punctuation makes them useless.
+    """
+    return re.sub(r'\s+', lambda m: '\n' if '\n' in m.group(0) else ' ', code)
+
+
+def minify_js(source):
+    """
+    Strip comments, indentation and redundant whitespace from a script.
+    Line breaks are kept wherever automatic semicolon insertion could rely
+    on them, and literals are copied as they are, so the script behaves the
+    same; it is not renamed or rewritten.
+    """
+    scanner = _JsScanner(source)
+    scanner.scan_code()
+    # Merge adjacent code runs so whitespace is judged on its real neighbours
+    parts = []
+    for kind, text in scanner.out:
+        if parts and kind == 'code' and parts[-1][0] == 'code':
+            parts[-1] = ('code', parts[-1][1] + text)
+        elif text:
+            parts.append((kind, text))
+
+    out = []
+    for kind, text in parts:
+        if kind == 'literal':
+            out.append(text)
+            continue
+        code = _squeeze(text)
+        chars = []
+        for i, c in enumerate(code):
+            if c not in ' \n':
+                chars.append(c)
+                continue
+            before = chars[-1] if chars else (out[-1][-1] if out and out[-1] else '')
+            after = code[i + 1] if i + 1 < len(code) else ''
+            if not before or before in JS_PUNCTUATION and c == ' ' or after in JS_PUNCTUATION and c == ' ':
+                continue
+            if c == '\n' and (before in JS_JOINERS or after and after in '})];,.'):
+                continue
+            chars.append(c)
+        out.append(''.join(chars))
+    return ''.join(out).strip()
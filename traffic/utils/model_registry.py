@@ -0,0 +1,176 @@
+import os
+import threading
+import time
+import joblib
+from django.conf import settings
+from .metrics import observe, register_collector
+
+MODEL_FILENAME = 'traffic_model.pkl'
+VERSION_FILENAME = 'traffic_model.version'
+
+
+class ModelRegistry:
+    """
+    Keeps the trained model in memory for the lifetime of the worker.
+    The model file (and the version stamp written by train_model) is stat'ed on
+    each access; a new artifact is loaded once and swapped in atomically.
+    """
+
+    def __init__(self, model_path, version_path=None):
+        self.model_path = model_path
+        self.version_path = version_path
+        self._lock = threading.Lock()
+        # (signature, version, model) replaced as a whole so readers never see a mix
+        self._entry = None
+        self.hits = 0
+        self.misses = 0
+        self.loads = 0
+        # Size of the loaded artifact, as an estimate of the memory it holds
+        self.loaded_bytes = 0
+        self.last_load_time = 0.0
+        self.total_load_time = 0.0
+
+    def _signature(self):
+        try:
+            st = os.stat(self.model_path)
+        except FileNotFoundError:
+            return None
+        signature = (st.st_ino, st.st_mtime_ns, st.st_size)
+        if self.version_path is not None:
+            try:
+                vst = os.stat(self.version_path)
+                signature += (vst.st_ino, vst.st_mtime_ns)
+            except FileNotFoundError:
+                pass
+        return signature
+
+    def _read_version(self, signature):
+        if self.version_path is not None:
+            try:
+                with open(self.version_path) as f:
+                    version = f.read().strip()
+                if version:
+                    return version
+            except FileNotFoundError:
+                pass
+        return f"{signature[0]:x}-{signature[1]:x}"
+
+    def get(self):
+        """
+        Return the current model, or None if it has not been trained yet.
+        """
+        return self.get_entry()[1]
+
+    def get_entry(self):
+        """
+        Return (version, model), reloading from disk only when the artifact changed.
+        """
+        signature = self._signature()
+        if signature is None:
+            return None, None
+
+        entry = self._entry
+        if entry is not None and entry[0] == signature:
+            self.hits += 1
+            return entry[1], entry[2]
+
+        with self._lock:
+            entry = self._entry
+            if entry is not None and entry[0] == signature:
+                self.hits += 1
+                return entry[1], entry[2]
+
+            self.misses += 1
+            start = time.perf_counter()
+            model = joblib.load(self.model_path)
+            elapsed = time.perf_counter() - start
+            observe('span_seconds', elapsed, span='model_load')
+
+            self.loads += 1
+            self.last_load_time = elapsed
+            self.total_load_time += elapsed
+            self.loaded_bytes = signature[2]
+            self._entry = (signature, self._read_version(signature), model)
+            return self._entry[1], self._entry[2]
+
+    @property
+    def version(self):
+        return self.get_entry()[0]
+
+    def clear(self):
+        with self._lock:
+            self._entry = None
+            self.loaded_bytes = 0
+
+    def stats(self):
+        entry = self._entry
+        return {
+            'loaded': entry is not None,
+            'version': entry[1] if entry is not None else None,
+            'hits': self.hits,
+            'misses': self.misses,
+            'loads': self.loads,
+            'last_load_time': self.last_load_time,
+            'total_load_time': self.total_load_time,
+        }
+
+
+def atomic_dump(obj, path):
+    """
+    joblib.dump to a side file then rename, so readers never open a partial pickle.
+    """
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    joblib.dump(obj, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def new_version():
+    return f"{time.time_ns():x}"
+
+
+def write_version_stamp(models_root=None, version=None):
+    """
+    Record a new model version next to the artifact so every worker picks it up.
+    """
+    models_root = models_root or settings.MODELS_ROOT
+    version = version or new_version()
+    tmp_path = models_root / f"{VERSION_FILENAME}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        f.write(version)
+    os.replace(tmp_path, models_root / VERSION_FILENAME)
+    return version
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry():
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = ModelRegistry(
+                    settings.MODELS_ROOT / MODEL_FILENAME,
+                    settings.MODELS_ROOT / VERSION_FILENAME,
+                )
+    return _registry
+
+
+def _collect():
+    if _registry is None:
+        return
+    stats = _registry.stats()
+    for key in ('hits', 'misses', 'loads'):
+        yield f'model_registry_{key}_total', 'counter', f"Model registry {key}.", {}, stats[key]
+    yield 'model_loaded', 'gauge', "1 once a model is in memory.", {}, int(stats['loaded'])
+
+
+register_collector(_collect)
+
+
+def get_model():
+    """
+    Shortcut used by the views: the cached model, or None if not trained.
+    """
+    return get_registry().get()
@@ -0,0 +1,201 @@
+import json
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+import joblib
+import numpy as np
+import pandas as pd
+from django.conf import settings
+from django.utils import timezone
+from sklearn.ensemble import RandomForestClassifier, ExtraTreesClassifier, HistGradientBoostingClassifier
+from sklearn.metrics import f1_score
+from threadpoolctl import threadpool_limits
+from .features import as_model_input
+from .forest_engine import FlatForest, flatten_forest
+
+SELECTION_FILENAME = 'model_selection.json'
+ESTIMATORS = {
+    'random_forest': RandomForestClassifier,
+    'extra_trees': ExtraTreesClassifier,
+    'hist_gradient_boosting': HistGradientBoostingClassifier,
+}
+# rf-100 is what train_model fits without selection
+DEFAULT_CANDIDATES = [
+    {'name': 'rf-100', 'estimator': 'random_forest', 'params': {'n_estimators': 100}},
+    {'name': 'rf-200', 'estimator': 'random_forest', 'params': {'n_estimators': 200}},
+    {'name': 'rf-100-d16', 'estimator': 'random_forest', 'params': {'n_estimators': 100, 'max_depth': 16}},
+    {'name': 'rf-50-d12', 'estimator': 'random_forest', 'params': {'n_estimators': 50, 'max_depth': 12}},
+    {'name': 'rf-30-d10', 'estimator': 'random_forest', 'params': {'n_estimators': 30, 'max_depth': 10}},
+    {'name': 'rf-20-d8', 'estimator': 'random_forest', 'params': {'n_estimators': 20, 'max_depth': 8}},
+    {'name': 'et-100-d16', 'estimator': 'extra_trees', 'params': {'n_estimators': 100, 'max_depth': 16}},
+    {'name': 'hgb-100', 'estimator': 'hist_gradient_boosting', 'params': {'max_iter': 100}},
+    {'name': 'hgb-200-d6', 'estimator': 'hist_gradient_boosting', 'params': {'max_iter': 200, 'max_depth': 6}},
+]
+# What "fastest or smallest" means: the column minimised among eligible candidates
+OBJECTIVES = {
+    'latency': 'single_row_ms',
+    'batch_latency': 'batch_1000_ms',
+    'size': 'size_bytes',
+}
+
+
+def build_estimator(candidate):
+    params = {'random_state': 42, **candidate.get('params', {})}
+    return ESTIMATORS[candidate['estimator']](**params)
+
+
+def _fit_candidate(candidate, columns, scratch):
+    """
+    Fit one candidate on the memory-mapped training set and dump it. Runs in
+    a pool process; estimators stay single-threaded so that candidates, not
+    trees, are spread over the cores.
+    """
+    X = pd.DataFrame(np.load(os.path.join(scratch, 'X.npy'), mmap_mode='r'), columns=columns)
+    y = np.load(os.path.join(scratch, 'y.npy'), mmap_mode='r')
+    model = build_estimator(candidate)
+    started = time.perf_counter()
+    # HistGradientBoosting would otherwise start one OpenMP thread per core in every worker
+    with threadpool_limits(1):
+        model.fit(X, y)
+    fit_seconds = time.perf_counter() - started
+    path = os.path.join(scratch, f"{candidate['name']}.joblib")
+    joblib.dump(model, path)
+    return path, fit_seconds
+
+
+def serving_predict(model):
+    """
+    predict() as predict_levels would serve this model: forests go through
+    the flattened engine up to FOREST_BATCH_LIMIT rows, everything else
+    through sklearn.
+    """
+    def sklearn_predict(X):
+        return model.predict(as_model_input(model, X))
+
+    if not hasattr(model, 'estimators_'):
+        return sklearn_predict
+    forest = FlatForest(*flatten_forest(model, getattr(settings, 'FOREST_QUANTIZED', False)))
+    limit = getattr(settings, 'FOREST_BATCH_LIMIT', 256)
+    return lambda X: forest.predict(X) if len(X) <= limit else sklearn_predict(X)
+
+
+def _median_ms(fn, batches):
+    fn(batches[0])
+    timings = []
+    for batch in batches:
+        started = time.perf_counter()
+        fn(batch)
+        timings.append(time.perf_counter() - started)
+    return float(np.median(timings)) * 1000
+
+
+def _measure(name, path, fit_seconds, X_test, y_test, repeat):
+    started = time.perf_counter()
+    model = joblib.load(path)
+    load_ms = (time.perf_counter() - started) * 1000
+
+    y_pred = model.predict(as_model_input(model, X_test))
+    predict = serving_predict(model)
+    rows = [X_test[i:i + 1] for i in range(min(repeat, len(X_test)))]
+    batch_1000 = X_test[:1000]
+    return {
+        'name': name,
+        'estimator': type(model).__name__,
+        'accuracy': round(float(np.mean(y_pred == y_test)), 5),
+        'macro_f1': round(float(f1_score(y_test, y_pred, average='macro')), 5),
+        'fit_s': round(fit_seconds, 3),
+        'size_bytes': os.path.getsize(path),
+        'load_ms': round(load_ms, 3),
+        'single_row_ms': round(_median_ms(predict, rows), 4),
+        'batch_64_ms': round(_median_ms(predict, [X_test[:64]] * max(3, repeat // 10)), 4),
+        'batch_1000_ms': round(_median_ms(predict, [batch_1000] * max(3, repeat // 20)), 4),
+    }
+
+
+def select_model(X_train, y_train, X_test, y_test, candidates=None, objective=None, tolerance=None, workers=None, repeat=200):
+    """
+    Fit every candidate in parallel, then measure each one in turn (so the
+    timings don't compete for cores): hold-out accuracy, single-row and
+    batched latency on the serving path, load time and pickle size.
+
+    Among the candidates within `tolerance` of the best accuracy, the one
+    minimising the objective wins. Returns (model, trade-off table).
+    """
+    candidates = candidates or getattr(settings, 'MODEL_SELECTION_CANDIDATES', None) or DEFAULT_CANDIDATES
+    objective = objective or getattr(settings, 'MODEL_SELECTION_OBJECTIVE', 'latency')
+    tolerance = getattr(settings, 'MODEL_SELECTION_TOLERANCE', 0.005) if tolerance is None else tolerance
+    workers = workers or getattr(settings, 'MODEL_SELECTION_WORKERS', None) or os.cpu_count()
+    if objective not in OBJECTIVES:
+        raise ValueError(f"Unknown objective {objective!r}, expected one of {', '.join(OBJECTIVES)}")
+
+    columns = list(X_train.columns)
+    X_test_array = X_test.to_numpy(np.float64)
+    y_test = np.asarray(y_test)
+    scratch = tempfile.mkdtemp(prefix='model-selection-')
+    try:
+        np.save(os.path.join(scratch, 'X.npy'), X_train.to_numpy(np.float64))
+        np.save(os.path.join(scratch, 'y.npy'), np.asarray(y_train))
+        with ProcessPoolExecutor(max_workers=min(workers, len(candidates))) as pool:
+            futures = [pool.submit(_fit_candidate, candidate, columns, scratch) for candidate in candidates]
+            fitted = [future.result() for future in futures]
+
+        rows = []
+        paths = {}
+        for candidate, (path, fit_seconds) in zip(candidates, fitted):
+            row = _measure(candidate['name'], path, fit_seconds, X_test_array, y_test, repeat)
+            row['params'] = candidate.get('params', {})
+            paths[row['name']] = path
+            rows.append(row)
+
+        key = OBJECTIVES[objective]
+        best_accuracy = max(row['accuracy'] for row in rows)
+        for row in rows:
+            row['eligible'] = row['accuracy'] >= best_accuracy - tolerance
+        rows.sort(key=lambda row: (not row['eligible'], row[key], -row['accuracy']))
+        selected = rows[0]['name']
+        model = joblib.load(paths[selected])
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    table = {
+        'created_at': timezone.now().isoformat(),
+        'objective': objective,
+        'tolerance': tolerance,
+        'best_accuracy': best_accuracy,
+        'train_rows': len(X_train),
+        'test_rows': len(X_test),
+        'selected': selected,
+        'candidates': rows,
+    }
+    return model, table
+
+
+def write_selection_table(table, models_root=None):
+    models_root = models_root or settings.MODELS_ROOT
+    path = models_root / SELECTION_FILENAME
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(table, f, indent=2)
+    os.replace(tmp_path, path)
+    return path
+
+
+def format_selection_table(table):
+    """
+    The trade-off table as aligned text, selected model marked with *.
+    """
+    lines = [
+        f"objective={table['objective']} tolerance={table['tolerance']} best accuracy={table['best_accuracy']:.4f}",
+        f"  {'model':<12} {'accuracy':>9} {'macro f1':>9} {'fit s':>7} {'size KB':>9} {'load ms':>8} "
+        f"{'1 row ms':>9} {'64 rows ms':>11} {'1000 rows ms':>13}",
+    ]
+    for row in table['candidates']:
+        mark = '*' if row['name'] == table['selected'] else (' ' if row['eligible'] else 'x')
+        lines.append(
+            f"{mark} {row['name']:<12} {row['accuracy']:>9.4f} {row['macro_f1']:>9.4f} {row['fit_s']:>7.2f} "
+            f"{row['size_bytes'] / 1024:>9,.0f} {row['load_ms']:>8.1f} {row['single_row_ms']:>9.3f} "
+            f"{row['batch_64_ms']:>11.3f} {row['batch_1000_ms']:>13.3f}"
+        )
+    return '\n'.join(lines)
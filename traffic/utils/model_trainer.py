@@ -1,33 +1,290 @@
+import json
 import pandas as pd
+import numpy as np
 import joblib
 import os
-from sklearn.model_selection import train_test_split
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.metrics import classification_report
 from django.conf import settings
+from .dataset_store import ensure_dataset, load_dataframe, iter_dataset_chunks
+from .features import FEATURE_COLUMNS, MODEL_COLUMNS, FeatureSchema, as_model_input
+from .hotspots import load_hotspots
+from .forest_engine import export_forest, remove_forest
+from .model_registry import atomic_dump, new_version, write_version_stamp, MODEL_FILENAME
 
-def train_model():
-    data_path = settings.DATA_ROOT / 'traffic_data.csv'
-    if not data_path.exists():
+TARGET = 'traffic_level'
+TARGET_NAMES = ['Low', 'Medium', 'High']
+CLASSES = np.arange(len(TARGET_NAMES))
+TEST_FRACTION = 0.2
+STATE_FILENAME = 'training_state.json'
+MIN_TREES_PER_CHUNK = 10
+# Rows per class kept from the last fitted chunk (as a share of the chunk
+# size) and lent to a following chunk in which that class is missing
+CARRY_FRACTION = 0.05
+
+
+def _publish(model, state, models_root):
+    model_path = models_root / MODEL_FILENAME
+    atomic_dump(model, model_path)
+
+    features_path = models_root / 'features.joblib'
+    atomic_dump(model.feature_schema_.to_dict(), features_path)
+
+    version = new_version()
+    if hasattr(model, 'estimators_'):
+        export_forest(model, version, models_root)
+    else:
+        # Not a forest: predict_levels must not keep serving the previous export
+        remove_forest(models_root)
+    write_version_stamp(models_root, version)
+
+    state_path = models_root / STATE_FILENAME
+    tmp_path = f"{state_path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f)
+    os.replace(tmp_path, state_path)
+
+
+def _read_state(models_root):
+    try:
+        with open(models_root / STATE_FILENAME) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def train_model(incremental=False, chunk_size=None, select=False, models_root=None, dataset_path=None, hotspots=None):
+    """
+    Fit the model on the stored dataset and publish it. With select=True a
+    set of candidate configurations is compared and the fastest (or smallest)
+    one within MODEL_SELECTION_TOLERANCE of the best accuracy is published,
+    with the trade-off table next to it.
+
+    Besides the raw columns, the model sees the distance to the nearest
+    hotspot and which one it is (see FeatureSchema).
+
+    models_root, dataset_path and hotspots default to the single model's;
+    regions pass their own.
+    """
+    models_root = models_root or settings.MODELS_ROOT
+    if incremental:
+        return train_model_incremental(chunk_size, models_root, dataset_path, hotspots)
+
+    manifest = ensure_dataset(dataset_path)
+    if manifest is None:
         return {"error": "Data file not found."}
 
-    df = pd.read_csv(data_path)
-    
-    X = df[['lat', 'lng', 'hour', 'day_of_week', 'is_weekend']]
-    y = df['traffic_level']
-    
-    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
-    
-    model = RandomForestClassifier(n_estimators=100, random_state=42)
-    model.fit(X_train, y_train)
-    
+    df = load_dataframe(dataset_path, columns=FEATURE_COLUMNS + [TARGET])
+
+    schema = FeatureSchema(MODEL_COLUMNS, load_hotspots(hotspots))
+    X = schema.frame(df)
+    y = df[TARGET]
+
+    # Same hold-out as incremental training, so later warm starts don't leak test rows
+    test = is_test_row(df.index)
+    X_train, X_test, y_train, y_test = X[~test], X[test], y[~test], y[test]
+
+    selection = None
+    if select:
+        from .model_selection import select_model, write_selection_table
+
+        model, selection = select_model(X_train, y_train, X_test, y_test)
+    else:
+        model = RandomForestClassifier(n_estimators=100, random_state=42)
+        model.fit(X_train, y_train)
+
     y_pred = model.predict(X_test)
-    report = classification_report(y_test, y_pred, target_names=['Low', 'Medium', 'High'], output_dict=True)
-    
-    model_path = settings.MODELS_ROOT / 'traffic_model.pkl'
-    joblib.dump(model, model_path)
-    
-    features_path = settings.MODELS_ROOT / 'features.joblib'
-    joblib.dump(list(X.columns), features_path)
-    
+    report = classification_report(y_test, y_pred, target_names=TARGET_NAMES, output_dict=True)
+
+    model.feature_schema_ = schema
+    state = {'dataset_id': manifest.get('id'), 'rows_seen': len(df), 'report': report}
+    if selection is not None:
+        state['selected'] = selection['selected']
+    _publish(model, state, models_root)
+    if selection is not None:
+        write_selection_table(selection, models_root)
+
+    return report
+
+
+def is_test_row(index):
+    """
+    Deterministic hold-out membership by global row number, so the split is
+    the same whichever chunk a row is read in.
+    """
+    hashed = (np.asarray(index, dtype=np.uint64) * np.uint64(2654435761)) % np.uint64(1 << 32)
+    return hashed < np.uint64(TEST_FRACTION * (1 << 32))
+
+
+def report_from_confusion(cm, target_names=TARGET_NAMES):
+    """
+    Same structure as classification_report(output_dict=True), built from an
+    accumulated confusion matrix (rows: true class, columns: predicted class).
+    """
+    cm = np.asarray(cm, dtype=np.float64)
+    tp = np.diag(cm)
+    support = cm.sum(axis=1)
+    predicted = cm.sum(axis=0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        precision = np.where(predicted > 0, tp / predicted, 0.0)
+        recall = np.where(support > 0, tp / support, 0.0)
+        f1 = np.where(precision + recall > 0, 2 * precision * recall / (precision + recall), 0.0)
+
+    report = {}
+    for i, name in enumerate(target_names):
+        report[name] = {
+            'precision': float(precision[i]),
+            'recall': float(recall[i]),
+            'f1-score': float(f1[i]),
+            'support': int(support[i]),
+        }
+    total = support.sum()
+    report['accuracy'] = float(tp.sum() / total) if total else 0.0
+    report['macro avg'] = {
+        'precision': float(precision.mean()),
+        'recall': float(recall.mean()),
+        'f1-score': float(f1.mean()),
+        'support': int(total),
+    }
+    weights = support / total if total else support
+    report['weighted avg'] = {
+        'precision': float(precision @ weights),
+        'recall': float(recall @ weights),
+        'f1-score': float(f1 @ weights),
+        'support': int(total),
+    }
+    return report
+
+
+def evaluate_streaming(model, chunk_size, dataset_path=None):
+    """
+    Classification report over the hold-out rows, one chunk at a time.
+    """
+    cm = np.zeros((len(CLASSES), len(CLASSES)), dtype=np.int64)
+    for chunk in iter_dataset_chunks(dataset_path, columns=FEATURE_COLUMNS + [TARGET], chunk_size=chunk_size):
+        test = chunk[is_test_row(chunk.index)]
+        if test.empty:
+            continue
+        y_pred = model.predict(as_model_input(model, test[FEATURE_COLUMNS].to_numpy()))
+        np.add.at(cm, (test[TARGET].to_numpy().astype(np.intp), y_pred.astype(np.intp)), 1)
+    return report_from_confusion(cm)
+
+
+def _class_sample(train, per_class):
+    """
+    The last per_class training rows of each class.
+    """
+    return train[~is_test_row(train.index)].groupby(TARGET, sort=False).tail(per_class)
+
+
+def _carry_before(dataset_path, columns, chunk_size, start, per_class, limit):
+    """
+    The last per_class training rows of each class before row `start`,
+    read backwards a chunk at a time until every class is found or `limit`
+    rows were read. None if there are none.
+    """
+    carry = None
+    stop = start
+    while stop > 0 and start - stop < limit:
+        offset = max(0, stop - chunk_size)
+        previous = next(iter_dataset_chunks(dataset_path, columns, chunk_size, offset)).loc[:stop - 1]
+        sample = _class_sample(previous, per_class)
+        carry = sample if carry is None else pd.concat([sample, carry]).groupby(TARGET, sort=False).tail(per_class)
+        if np.isin(CLASSES, carry[TARGET].unique()).all():
+            break
+        stop = offset
+    return carry
+
+
+def train_model_incremental(chunk_size=None, models_root=None, dataset_path=None, hotspots=None):
+    """
+    Grow the forest with warm_start, streaming the dataset chunk by chunk so
+    memory stays bounded by the chunk size. Each chunk adds its own trees.
+
+    The previous model is reused: only rows appended since the last training
+    are streamed. If the dataset was replaced, its rows are all new and the
+    new trees are added to the existing forest. The forest keeps at most
+    MAX_FOREST_ESTIMATORS trees, dropping the oldest. Each fit is seeded from
+    the count of trees grown so far, kept in the training state, so trees
+    added after a trim do not repeat the seeds of earlier ones.
+    """
+    chunk_size = chunk_size or getattr(settings, 'TRAINING_CHUNK_SIZE', 1 << 20)
+    max_estimators = getattr(settings, 'MAX_FOREST_ESTIMATORS', 300)
+
+    models_root = models_root or settings.MODELS_ROOT
+    manifest = ensure_dataset(dataset_path)
+    if manifest is None:
+        return {"error": "Data file not found."}
+
+    state = _read_state(models_root)
+    model_path = models_root / MODEL_FILENAME
+    has_model = state is not None and model_path.exists()
+    start = state['rows_seen'] if has_model and state.get('dataset_id') == manifest.get('id') else 0
+
+    if has_model and start >= manifest['rows']:
+        return state['report']
+
+    model = joblib.load(model_path) if has_model else None
+    schema = getattr(model, 'feature_schema_', None)
+    if model is not None and (not isinstance(model, RandomForestClassifier) or schema is None or schema.columns != MODEL_COLUMNS):
+        # Only a random forest on the current columns can be grown (new
+        # trees keep the hotspots of the old ones); start one over the whole dataset
+        model, start = None, 0
+
+    if model is None:
+        model = RandomForestClassifier(n_estimators=0, random_state=42)
+        model.feature_schema_ = FeatureSchema(MODEL_COLUMNS, load_hotspots(hotspots))
+        trees_grown = 0
+    else:
+        trees_grown = state.get('trees_grown', len(model.estimators_))
+    model.warm_start = True
+    schema = model.feature_schema_
+
+    n_chunks = -(-(manifest['rows'] - start) // chunk_size)
+    trees_per_chunk = max(MIN_TREES_PER_CHUNK, -(-100 // n_chunks))
+
+    max_pending = getattr(settings, 'TRAINING_MAX_PENDING_ROWS', 4 * chunk_size)
+    per_class = max(1, int(chunk_size * CARRY_FRACTION))
+    columns = FEATURE_COLUMNS + [TARGET]
+    carry = _carry_before(dataset_path, columns, chunk_size, start, per_class, max_pending) if start else None
+
+    rows_seen = start
+    pending = []
+    for chunk in iter_dataset_chunks(dataset_path, columns, chunk_size, start):
+        pending.append(chunk[~is_test_row(chunk.index)])
+        train = pd.concat(pending) if len(pending) > 1 else pending[0]
+        # Every fit must see all classes or the trees' outputs won't line up.
+        # A class missing here is borrowed from the rows carried over; only
+        # if there are none do chunks pile up, and then only up to max_pending
+        missing = np.setdiff1d(CLASSES, train[TARGET].unique())
+        if missing.size and carry is not None:
+            train = pd.concat([train, carry[carry[TARGET].isin(missing)]])
+            missing = np.setdiff1d(CLASSES, train[TARGET].unique())
+        if missing.size:
+            if len(train) >= max_pending:
+                names = ', '.join(TARGET_NAMES[level] for level in missing)
+                return {"error": f"No '{names}' rows within {len(train)} rows from row {int(pending[0].index[0])}; cannot train on them."}
+            continue
+
+        # warm_start seeds new trees by their position in the forest, which
+        # stops moving once the forest is trimmed
+        model.random_state = 42 + trees_grown
+        model.n_estimators = len(getattr(model, 'estimators_', [])) + trees_per_chunk
+        model.fit(schema.frame(train), train[TARGET])
+        trees_grown += trees_per_chunk
+        if len(model.estimators_) > max_estimators:
+            model.estimators_ = model.estimators_[-max_estimators:]
+            model.n_estimators = max_estimators
+
+        rows_seen = int(chunk.index[-1]) + 1
+        carry = _class_sample(train, per_class)
+        pending = []
+
+    if rows_seen == start:
+        return {"error": "Not enough data to train on."}
+
+    report = evaluate_streaming(model, chunk_size, dataset_path)
+    _publish(model, {
+        'dataset_id': manifest.get('id'), 'rows_seen': rows_seen, 'trees_grown': trees_grown, 'report': report,
+    }, models_root)
     return report
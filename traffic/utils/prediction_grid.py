@@ -0,0 +1,225 @@
+import json
+import os
+import threading
+import numpy as np
+from django.conf import settings
+from .features import build_feature_matrix, as_model_input
+from .trend_engine import intensity_from_proba
+
+# Coverage of the simulator: (south, west, north, east)
+DEFAULT_BBOX = (5.30, -4.05, 5.40, -3.95)
+DEFAULT_STEP = 0.0025
+
+GRID_FILENAME = 'prediction_grid.npy'
+META_FILENAME = 'prediction_grid.json'
+
+
+def _paths(models_root):
+    return (
+        models_root / GRID_FILENAME,
+        models_root / META_FILENAME,
+        models_root / (GRID_FILENAME + '.partial'),
+        models_root / (META_FILENAME + '.partial'),
+    )
+
+
+def _axes(bbox, step):
+    south, west, north, east = bbox
+    lats = south + step * np.arange(int(round((north - south) / step)) + 1)
+    lngs = west + step * np.arange(int(round((east - west) / step)) + 1)
+    return lats, lngs
+
+
+def _read_json(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def _write_json(path, data):
+    tmp_path = str(path) + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def build_prediction_grid(model, version, bbox=None, step=None, models_root=None):
+    """
+    Evaluate the model over a lat/lng grid for every hour of every day and store
+    the result as a (2, 7, 24, n_lat, n_lng) uint8 array: traffic class in
+    plane 0, intensity (0-100) in plane 1.
+
+    The build is skipped when the published grid already matches the model
+    version, and proceeds one day at a time into a side file, so an
+    interrupted build resumes where it stopped. A new version may change any
+    cell, so it is always evaluated in full. Readers keep the previous grid
+    until the new one is complete and swapped in.
+    """
+    bbox = tuple(bbox or getattr(settings, 'PREDICTION_GRID_BBOX', DEFAULT_BBOX))
+    step = step or getattr(settings, 'PREDICTION_GRID_STEP', DEFAULT_STEP)
+    models_root = models_root or settings.MODELS_ROOT
+    grid_path, meta_path, partial_grid_path, partial_meta_path = _paths(models_root)
+
+    meta = {'version': version, 'bbox': list(bbox), 'step': step}
+    current = _read_json(meta_path)
+    if current and grid_path.exists() and all(current.get(k) == v for k, v in meta.items()):
+        return current
+
+    lats, lngs = _axes(bbox, step)
+    shape = (2, 7, 24, len(lats), len(lngs))
+
+    partial = _read_json(partial_meta_path)
+    if partial and partial_grid_path.exists() and all(partial.get(k) == v for k, v in meta.items()):
+        grid = np.lib.format.open_memmap(partial_grid_path, mode='r+')
+        days_done = set(partial['days_done'])
+    else:
+        grid = np.lib.format.open_memmap(partial_grid_path, mode='w+', dtype=np.uint8, shape=shape)
+        days_done = set()
+
+    lat_grid, lng_grid = np.meshgrid(lats, lngs, indexing='ij')
+    hours = np.arange(24)
+    for day_of_week in range(7):
+        if day_of_week in days_done:
+            continue
+        X = build_feature_matrix(
+            lat_grid[np.newaxis, :, :], lng_grid[np.newaxis, :, :],
+            hours[:, np.newaxis, np.newaxis], day_of_week,
+        )
+        proba = model.predict_proba(as_model_input(model, X))
+        levels = model.classes_[np.argmax(proba, axis=1)]
+        intensity = intensity_from_proba(model, proba)
+        grid[0, day_of_week] = levels.reshape(24, len(lats), len(lngs))
+        grid[1, day_of_week] = np.rint(intensity).reshape(24, len(lats), len(lngs))
+        grid.flush()
+
+        days_done.add(day_of_week)
+        _write_json(partial_meta_path, dict(meta, days_done=sorted(days_done)))
+
+    del grid
+    # The meta names the grid file it describes, so a reader between the
+    # two replaces keeps the grid it has rather than pairing old and new
+    meta.update(
+        shape=list(shape), lat_count=len(lats), lng_count=len(lngs),
+        grid_inode=os.stat(partial_grid_path).st_ino,
+    )
+    os.replace(partial_grid_path, grid_path)
+    _write_json(meta_path, meta)
+    os.remove(partial_meta_path)
+    return meta
+
+
+class PredictionGrid:
+    """
+    Read-only, memory-mapped view of the published grid.
+    """
+
+    def __init__(self, grid_path, meta):
+        self.data = np.load(grid_path, mmap_mode='r')
+        self.version = meta['version']
+        self.south, self.west, self.north, self.east = meta['bbox']
+        self.step = meta['step']
+        self.lat_count = meta['lat_count']
+        self.lng_count = meta['lng_count']
+
+    def _index_range(self, low, high, origin, count):
+        start = int(np.ceil((low - origin) / self.step - 1e-9))
+        stop = int(np.floor((high - origin) / self.step + 1e-9)) + 1
+        return max(start, 0), min(stop, count)
+
+    def query_bbox(self, south, west, north, east, hour, day_of_week):
+        """
+        Grid cells inside the bbox for one hour, as (lat0, lng0, levels, intensity)
+        where lat0/lng0 is the coordinate of the first row/column returned.
+        """
+        i0, i1 = self._index_range(south, north, self.south, self.lat_count)
+        j0, j1 = self._index_range(west, east, self.west, self.lng_count)
+        levels = self.data[0, day_of_week, hour, i0:i1, j0:j1]
+        intensity = self.data[1, day_of_week, hour, i0:i1, j0:j1]
+        return self.south + i0 * self.step, self.west + j0 * self.step, levels, intensity
+
+    def lookup(self, lat, lng, hour, day_of_week):
+        """
+        Class and intensity of the nearest grid point, or None outside coverage.
+        """
+        i = int(round((lat - self.south) / self.step))
+        j = int(round((lng - self.west) / self.step))
+        if not (0 <= i < self.lat_count and 0 <= j < self.lng_count):
+            return None
+        return int(self.data[0, day_of_week, hour, i, j]), int(self.data[1, day_of_week, hour, i, j])
+
+    def lookup_many(self, lats, lngs, hour, day_of_week):
+        """
+        Vectorized lookup of the class at the nearest grid point, -1 outside coverage.
+        """
+        i = np.rint((np.asarray(lats) - self.south) / self.step).astype(np.intp)
+        j = np.rint((np.asarray(lngs) - self.west) / self.step).astype(np.intp)
+        inside = (i >= 0) & (i < self.lat_count) & (j >= 0) & (j < self.lng_count)
+        levels = np.full(i.shape, -1, dtype=np.int8)
+        levels[inside] = self.data[0, day_of_week, hour][i[inside], j[inside]]
+        return levels
+
+
+class GridLoader:
+    """
+    The grid published under one models_root, remapped when a rebuild is
+    published. get() returns None until a grid has been built.
+    """
+
+    def __init__(self, models_root):
+        self.models_root = models_root
+        self.nbytes = 0
+        self._grid = None
+        self._signature = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        grid_path, meta_path, _, _ = _paths(self.models_root)
+        try:
+            st = os.stat(meta_path)
+        except FileNotFoundError:
+            return None
+        signature = (st.st_ino, st.st_mtime_ns)
+        if signature == self._signature:
+            return self._grid
+
+        with self._lock:
+            if signature != self._signature:
+                meta = _read_json(meta_path)
+                try:
+                    grid_inode = os.stat(grid_path).st_ino
+                except FileNotFoundError:
+                    grid_inode = None
+                if meta is None or grid_inode is None or meta.get('grid_inode', grid_inode) != grid_inode:
+                    # Mid-publish: keep the current grid until meta and grid match
+                    return self._grid
+                self._grid = PredictionGrid(grid_path, meta)
+                self.nbytes = self._grid.data.nbytes
+                self._signature = signature
+        return self._grid
+
+    def clear(self):
+        with self._lock:
+            self._grid = None
+            self._signature = None
+            self.nbytes = 0
+
+
+_loader = None
+_loader_lock = threading.Lock()
+
+
+def get_prediction_grid():
+    """
+    The current grid for this worker, remapped when a rebuild is published.
+    Returns None until a grid has been built.
+    """
+    global _loader
+    loader = _loader
+    if loader is None or loader.models_root != settings.MODELS_ROOT:
+        with _loader_lock:
+            if _loader is None or _loader.models_root != settings.MODELS_ROOT:
+                _loader = GridLoader(settings.MODELS_ROOT)
+            loader = _loader
+    return loader.get()
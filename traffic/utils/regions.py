@@ -0,0 +1,365 @@
+import math
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from .dataset_store import DATASET_DIRNAME
+from .forest_engine import ForestLoader
+from .metrics import register_collector
+from .model_registry import ModelRegistry, get_registry, MODEL_FILENAME, VERSION_FILENAME
+from .prediction_grid import GridLoader, get_prediction_grid
+
+# Each region of settings.REGIONS has its own dataset, model, forest export and
+# prediction grid under DATA_ROOT/regions/<name> and MODELS_ROOT/regions/<name>.
+# Without REGIONS, a single model under MODELS_ROOT serves every point.
+REGIONS_DIRNAME = 'regions'
+DEFAULT_INDEX_CELL = 0.25
+DEFAULT_MEMORY_BUDGET = 1 << 30
+
+
+class OutsideRegions(ValueError):
+    pass
+
+
+def _inside_polygon(lats, lngs, polygon):
+    """
+    Even-odd ray casting, vectorized over points: one pass per polygon edge.
+    """
+    inside = np.zeros(lats.shape, dtype=bool)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for (lat_a, lng_a), (lat_b, lng_b) in zip(polygon, np.roll(polygon, -1, axis=0)):
+            crosses = (lat_a > lats) != (lat_b > lats)
+            lng_at = lng_a + (lats - lat_a) * (lng_b - lng_a) / (lat_b - lat_a)
+            inside ^= crosses & (lngs < lng_at)
+    return inside
+
+
+class Region:
+    """
+    A served area: its bbox (south, west, north, east), optionally refined by
+    a polygon of (lat, lng) vertices (the bbox is then derived if omitted),
+    and the hotspots its data is simulated around and its model measures
+    distances to.
+    """
+
+    def __init__(self, name, bbox=None, polygon=None, hotspots=None):
+        self.name = name
+        self.polygon = np.asarray(polygon, dtype=np.float64) if polygon is not None else None
+        if bbox is None:
+            if self.polygon is None:
+                raise ImproperlyConfigured(f"Region {name!r} needs a bbox or a polygon")
+            bbox = (*self.polygon.min(axis=0), *self.polygon.max(axis=0))
+        self.bbox = tuple(float(v) for v in bbox)
+        south, west, north, east = self.bbox
+        if not (south < north and west < east):
+            raise ImproperlyConfigured(f"Region {name!r}: bbox must be (south, west, north, east)")
+        # A GeoJSON path or (lat, lng) pairs; without, congestion is simulated around the centre
+        self.hotspots = hotspots or [((south + north) / 2, (west + east) / 2)]
+        self.models_root = settings.MODELS_ROOT / REGIONS_DIRNAME / name
+        self.data_root = settings.DATA_ROOT / REGIONS_DIRNAME / name
+        self.dataset_path = self.data_root / DATASET_DIRNAME
+
+    def contains_many(self, lats, lngs):
+        south, west, north, east = self.bbox
+        inside = (lats >= south) & (lats <= north) & (lngs >= west) & (lngs <= east)
+        if self.polygon is not None and inside.any():
+            inside[inside] = _inside_polygon(lats[inside], lngs[inside], self.polygon)
+        return inside
+
+    def contains(self, lat, lng):
+        south, west, north, east = self.bbox
+        if not (south <= lat <= north and west <= lng <= east):
+            return False
+        return self.polygon is None or bool(_inside_polygon(np.array([lat]), np.array([lng]), self.polygon)[0])
+
+
+class RegionIndex:
+    """
+    Uniform grid over the regions: each cell lists the regions whose bbox
+    overlaps it, so locating a point tests only the one or two regions near
+    it, however many are configured. Where regions overlap, the first
+    declared wins.
+    """
+
+    def __init__(self, regions, cell_size=DEFAULT_INDEX_CELL):
+        self.regions = list(regions)
+        self.cell_size = cell_size
+        self.cells = {}
+        for i, region in enumerate(self.regions):
+            south, west, north, east = region.bbox
+            for row in range(self._cell(south), self._cell(north) + 1):
+                for col in range(self._cell(west), self._cell(east) + 1):
+                    self.cells.setdefault((row, col), []).append(i)
+
+    def _cell(self, value):
+        return math.floor(value / self.cell_size)
+
+    def locate(self, lat, lng):
+        """
+        The region containing the point, or None.
+        """
+        for i in self.cells.get((self._cell(lat), self._cell(lng)), ()):
+            if self.regions[i].contains(lat, lng):
+                return self.regions[i]
+        return None
+
+    def locate_many(self, lats, lngs):
+        """
+        Index in self.regions of the region containing each point, -1 outside all.
+        """
+        lats = np.asarray(lats, dtype=np.float64)
+        lngs = np.asarray(lngs, dtype=np.float64)
+        owners = np.full(lats.shape, -1, dtype=np.intp)
+        rows = np.floor(lats / self.cell_size).astype(np.int64)
+        cols = np.floor(lngs / self.cell_size).astype(np.int64)
+        candidates = set()
+        for cell in set(zip(rows.tolist(), cols.tolist())):
+            candidates.update(self.cells.get(cell, ()))
+        for i in sorted(candidates):
+            free = owners < 0
+            owners[free] = np.where(self.regions[i].contains_many(lats[free], lngs[free]), i, -1)
+        return owners
+
+
+class RegionShard:
+    """
+    One region's model, flattened forest and prediction grid, each loaded
+    on first use and reloaded when the region is rebuilt.
+    """
+
+    def __init__(self, region):
+        self.region = region
+        self.models = ModelRegistry(region.models_root / MODEL_FILENAME, region.models_root / VERSION_FILENAME)
+        self.forests = ForestLoader(region.models_root)
+        self.grids = GridLoader(region.models_root)
+
+    def nbytes(self):
+        return self.models.loaded_bytes + self.forests.nbytes + self.grids.nbytes
+
+    def clear(self):
+        self.models.clear()
+        self.forests.clear()
+        self.grids.clear()
+
+
+class RegionRegistry:
+    """
+    Routes points to regions and keeps the shards in use in memory. Shards
+    load lazily; once the loaded ones add up to more than memory_budget
+    bytes, the least recently used are dropped (the one just used stays,
+    even alone over budget). Requests still holding an evicted model finish
+    with it.
+    """
+
+    def __init__(self, regions, memory_budget=DEFAULT_MEMORY_BUDGET, cell_size=DEFAULT_INDEX_CELL):
+        self.regions = {region.name: region for region in regions}
+        self.index = RegionIndex(regions, cell_size)
+        self.memory_budget = memory_budget
+        self._shards = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def locate(self, lat, lng):
+        return self.index.locate(lat, lng)
+
+    def shard(self, name):
+        with self._lock:
+            shard = self._shards.get(name)
+            if shard is None:
+                shard = self._shards[name] = RegionShard(self.regions[name])
+            else:
+                self._shards.move_to_end(name)
+        return shard
+
+    def _evict(self):
+        with self._lock:
+            total = sum(shard.nbytes() for shard in self._shards.values())
+            while total > self.memory_budget and len(self._shards) > 1:
+                _, shard = self._shards.popitem(last=False)
+                total -= shard.nbytes()
+                shard.clear()
+                self.evictions += 1
+
+    def model_entry(self, name):
+        """
+        (version, model) of a region, (None, None) until it is built.
+        """
+        entry = self.shard(name).models.get_entry()
+        self._evict()
+        return entry
+
+    def forest(self, name):
+        forest = self.shard(name).forests.get()
+        self._evict()
+        return forest
+
+    def grid(self, name):
+        grid = self.shard(name).grids.get()
+        self._evict()
+        return grid
+
+    def stats(self):
+        with self._lock:
+            shards = list(self._shards.values())
+        return {
+            'regions': len(self.regions),
+            'loaded': [shard.region.name for shard in shards],
+            'memory_bytes': sum(shard.nbytes() for shard in shards),
+            'memory_budget': self.memory_budget,
+            'evictions': self.evictions,
+        }
+
+
+def load_regions():
+    """
+    The regions declared in settings.REGIONS, in declaration order.
+    """
+    return [Region(name, **spec) for name, spec in (getattr(settings, 'REGIONS', None) or {}).items()]
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_region_registry():
+    """
+    The worker's region registry, or None when REGIONS is not configured.
+    """
+    global _registry
+    if _registry is None and getattr(settings, 'REGIONS', None):
+        with _registry_lock:
+            if _registry is None:
+                _registry = RegionRegistry(
+                    load_regions(),
+                    getattr(settings, 'REGION_MEMORY_BUDGET', DEFAULT_MEMORY_BUDGET),
+                    getattr(settings, 'REGION_INDEX_CELL', DEFAULT_INDEX_CELL),
+                )
+    return _registry
+
+
+def locate_region(lat, lng):
+    """
+    Name of the region serving a point; None when there are no regions and
+    the single model serves everything. Raises OutsideRegions otherwise.
+    """
+    registry = get_region_registry()
+    if registry is None:
+        return None
+    region = registry.locate(lat, lng)
+    if region is None:
+        raise OutsideRegions("Position hors des zones couvertes.")
+    return region.name
+
+
+def model_entry(region):
+    """
+    (version, model) serving a region, or the single model for region None.
+    """
+    if region is None:
+        return get_registry().get_entry()
+    return get_region_registry().model_entry(region)
+
+
+def prediction_grid(region):
+    """
+    Prediction grid serving a region, or the single grid for region None.
+    None until it is built.
+    """
+    if region is None:
+        return get_prediction_grid()
+    return get_region_registry().grid(region)
+
+
+def split_by_region(lats, lngs):
+    """
+    (region, mask) for each region holding some of the points, or a single
+    (None, all points) when there are no regions. Points outside every
+    region are in no mask.
+    """
+    registry = get_region_registry()
+    if registry is None:
+        return [(None, np.ones(len(lats), dtype=bool))]
+    owners = registry.index.locate_many(lats, lngs)
+    return [(registry.index.regions[i].name, owners == i) for i in np.unique(owners[owners >= 0]).tolist()]
+
+
+def build_region(name, n_samples, incremental=False, select=False):
+    """
+    Simulate, train and grid one region into its own directories, as
+    run_training_pipeline does for the single model. Returns the report.
+    """
+    from .data_simulator import generate_traffic_data
+    from .model_trainer import train_model
+    from .prediction_grid import build_prediction_grid
+
+    region = next((region for region in load_regions() if region.name == name), None)
+    if region is None:
+        raise KeyError(f"Unknown region {name!r}")
+    region.models_root.mkdir(parents=True, exist_ok=True)
+    region.data_root.mkdir(parents=True, exist_ok=True)
+
+    generate_traffic_data(
+        n_samples, append=incremental, path=region.dataset_path, bbox=region.bbox, hotspots=region.hotspots,
+    )
+    report = train_model(
+        incremental=incremental, select=select,
+        models_root=region.models_root, dataset_path=region.dataset_path, hotspots=region.hotspots,
+    )
+    if 'error' in report:
+        raise RuntimeError(f"{name}: {report['error']}")
+    version, model = ModelRegistry(region.models_root / MODEL_FILENAME, region.models_root / VERSION_FILENAME).get_entry()
+    build_prediction_grid(model, version, bbox=region.bbox, models_root=region.models_root)
+    return report
+
+
+def _build_in_worker(name, n_samples, incremental, select, selection_workers):
+    # Regions built side by side share the cores between their candidate fits
+    if selection_workers and not getattr(settings, 'MODEL_SELECTION_WORKERS', None):
+        settings.MODEL_SELECTION_WORKERS = selection_workers
+    return build_region(name, n_samples, incremental, select)
+
+
+def build_regions(names=None, n_samples=3000, incremental=False, select=False, workers=None):
+    """
+    Build several regions (all by default) in parallel, one process each.
+    Yields (name, report, error) as each one finishes; a failed region
+    doesn't stop the others.
+    """
+    from .jobs import _init_worker
+
+    names = names or [region.name for region in load_regions()]
+    workers = min(workers or getattr(settings, 'REGION_BUILD_WORKERS', None) or os.cpu_count(), len(names))
+    if workers <= 1:
+        for name in names:
+            try:
+                yield name, build_region(name, n_samples, incremental, select), None
+            except Exception as e:
+                yield name, None, e
+        return
+
+    selection_workers = max(1, os.cpu_count() // workers)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+        futures = {
+            pool.submit(_build_in_worker, name, n_samples, incremental, select, selection_workers): name
+            for name in names
+        }
+        for future in as_completed(futures):
+            try:
+                yield futures[future], future.result(), None
+            except Exception as e:
+                yield futures[future], None, e
+
+
+def _collect():
+    if _registry is None:
+        return
+    stats = _registry.stats()
+    yield 'region_shards_loaded', 'gauge', "Region shards held in memory.", {}, len(stats['loaded'])
+    yield 'region_memory_bytes', 'gauge', "Estimated bytes held by the loaded region shards.", {}, stats['memory_bytes']
+    yield 'region_evictions_total', 'counter', "Region shards evicted to stay under the memory budget.", {}, stats['evictions']
+
+
+register_collector(_collect)
@@ -0,0 +1,217 @@
+import functools
+import gzip
+import hashlib
+import json
+import numpy as np
+from django import http
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils.cache import patch_cache_control, patch_vary_headers
+
+# Both optional: without orjson bodies go through the json module, without
+# brotli only gzip is offered
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+if orjson is not None:
+    OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS
+
+DEFAULT_COMPRESS_MIN_SIZE = 1024
+DEFAULT_GZIP_LEVEL = 6
+DEFAULT_BROTLI_QUALITY = 5
+DEFAULT_CACHE_MAX_AGE = 60
+# Most preferred first, when the client weighs them equally
+ENCODINGS = ('br', 'gzip') if brotli is not None else ('gzip',)
+
+
+class ApiJSONEncoder(DjangoJSONEncoder):
+    """
+    DjangoJSONEncoder that also takes numpy scalars and arrays.
+    """
+
+    def default(self, o):
+        if isinstance(o, (np.generic, np.ndarray)):
+            return o.tolist()
+        return super().default(o)
+
+
+def _default(o):
+    # What orjson leaves out: Decimal, UUID subclasses, lazy strings...
+    return ApiJSONEncoder().default(o)
+
+
+def dumps(data):
+    """
+    Compact UTF-8 JSON. Datetimes are ISO 8601, aware ones in UTC end in Z
+    as with DjangoJSONEncoder, but keep their microseconds; non-string keys
+    are turned into strings as json.dumps does.
+    """
+    if orjson is not None:
+        return orjson.dumps(data, default=_default, option=OPTIONS)
+    return json.dumps(data, cls=ApiJSONEncoder, ensure_ascii=False, separators=(',', ':')).encode()
+
+
+class JsonResponse(http.JsonResponse):
+    """
+    Drop-in for django.http.JsonResponse, encoded by dumps().
+    """
+
+    def __init__(self, data, encoder=None, safe=True, json_dumps_params=None, **kwargs):
+        if safe and not isinstance(data, dict):
+            raise TypeError("In order to allow non-dict objects to be serialized set the safe parameter to False.")
+        kwargs.setdefault('content_type', 'application/json')
+        http.HttpResponse.__init__(self, content=dumps(data), **kwargs)
+
+
+def make_etag(*parts):
+    """
+    Strong ETag of a response known to be the same whenever `parts` are.
+    """
+    return '"%s"' % hashlib.blake2b(repr(parts).encode(), digest_size=12).hexdigest()
+
+
+def _matching_tag(header, etag):
+    """
+    The If-None-Match entry naming this ETag, whatever encoding suffix the
+    compressed copy added to it (weak comparison, as RFC 9110 asks).
+    """
+    value = etag.strip('"')
+    for tag in header.split(','):
+        tag = tag.strip()
+        if tag == '*':
+            return etag
+        name = tag.removeprefix('W/').strip('"')
+        for encoding in ('br', 'gzip'):
+            name = name.removesuffix(f'-{encoding}')
+        if name == value:
+            return tag
+    return None
+
+
+def conditional(validator, cache_control=None):
+    """
+    View decorator for GET requests: validator(request, *args, **kwargs)
+    returns what the response depends on (model version, data revision...)
+    or None when it cannot tell. The ETag derived from it and the request
+    path is checked before the view runs, so a client holding the current
+    copy gets a 304 without the response being built or encoded.
+    cache_control is a dict of Cache-Control directives, or a callable
+    returning one; by default clients revalidate every time.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return view(request, *args, **kwargs)
+            try:
+                parts = validator(request, *args, **kwargs)
+            except Exception:
+                # Let the view report what is wrong with the request
+                parts = None
+            if parts is None:
+                return view(request, *args, **kwargs)
+
+            etag = make_etag(request.get_full_path(), parts)
+            matched = _matching_tag(request.headers.get('If-None-Match', ''), etag)
+            if matched:
+                response = http.HttpResponseNotModified()
+                # The client's own tag, which names the encoding it holds
+                response.headers['ETag'] = matched
+            else:
+                response = view(request, *args, **kwargs)
+                if response.status_code != 200:
+                    return response
+                response.headers['ETag'] = etag
+            directives = cache_control() if callable(cache_control) else cache_control
+            patch_cache_control(response, **(directives or {'private': True, 'no_cache': True}))
+            return response
+        return wrapper
+    return decorator
+
+
+def model_cache_control():
+    """
+    Cache-Control of responses derived from a trained model only.
+    """
+    return {'private': True, 'max_age': getattr(settings, 'API_CACHE_MAX_AGE', DEFAULT_CACHE_MAX_AGE)}
+
+
+def _accepted(header):
+    """
+    Content codings the client takes, by quality.
+    """
+    accepted = {}
+    for item in header.split(','):
+        name, _, params = item.strip().partition(';')
+        quality = 1.0
+        for param in params.split(';'):
+            key, _, value = param.strip().partition('=')
+            if key.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if name:
+            accepted[name.strip().lower()] = quality
+    return accepted
+
+
+def negotiate_encoding(header):
+    """
+    The best coding this server offers under an Accept-Encoding header, or
+    None for identity.
+    """
+    accepted = _accepted(header or '')
+    wildcard = accepted.get('*', 0.0)
+    best, best_quality = None, 0.0
+    for encoding in ENCODINGS:
+        quality = accepted.get(encoding, wildcard)
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def compress(body, encoding):
+    if encoding == 'br':
+        return brotli.compress(body, quality=getattr(settings, 'API_BROTLI_QUALITY', DEFAULT_BROTLI_QUALITY))
+    # mtime=0 keeps the output identical for identical bodies
+    return gzip.compress(body, getattr(settings, 'API_GZIP_LEVEL', DEFAULT_GZIP_LEVEL), mtime=0)
+
+
+def compress_response(request, response):
+    """
+    Compress a JSON response in place with the coding the client prefers,
+    when it is big enough for that to pay. A strong ETag gets the coding as
+    a suffix: the compressed bytes are a different representation.
+    """
+    if response.status_code == 304:
+        if response.has_header('ETag'):
+            patch_vary_headers(response, ('Accept-Encoding',))
+        return response
+    if response.streaming or response.has_header('Content-Encoding'):
+        return response
+    if not response.get('Content-Type', '').startswith('application/json'):
+        return response
+    patch_vary_headers(response, ('Accept-Encoding',))
+    if len(response.content) < getattr(settings, 'API_COMPRESS_MIN_SIZE', DEFAULT_COMPRESS_MIN_SIZE):
+        return response
+    encoding = negotiate_encoding(request.headers.get('Accept-Encoding'))
+    if encoding is None:
+        return response
+
+    compressed = compress(response.content, encoding)
+    if len(compressed) >= len(response.content):
+        return response
+    response.content = compressed
+    response.headers['Content-Length'] = str(len(compressed))
+    response.headers['Content-Encoding'] = encoding
+    etag = response.get('ETag')
+    if etag and not etag.startswith('W/'):
+        response.headers['ETag'] = f'{etag[:-1]}-{encoding}"'
+    return response
@@ -0,0 +1,97 @@
+import functools
+import json
+import os
+import threading
+from pathlib import Path
+from django.contrib.staticfiles import finders
+
+# Next to the source images, as static files of their own
+VARIANTS_DIR = 'variants'
+MANIFEST_NAME = 'variants.json'
+DEFAULT_WIDTHS = (640, 1280, 1920)
+# Most compact first: a browser takes the first <source> it supports. JPEG
+# copies are only built on request; without them <img> keeps the original
+FORMATS = {
+    'image/avif': ('avif', 'AVIF', {'quality': 50}),
+    'image/webp': ('webp', 'WEBP', {'quality': 75, 'method': 6}),
+    'image/jpeg': ('jpg', 'JPEG', {'quality': 80, 'optimize': True, 'progressive': True}),
+}
+
+
+@functools.lru_cache(maxsize=None)
+def _manifest_path(static_name):
+    """
+    Manifest of the variants of the images in static_name's directory.
+    Looking the image up walks the static directories: done once per name.
+    """
+    source = finders.find(static_name)
+    if source is None:
+        return None
+    return Path(source).parent / VARIANTS_DIR / MANIFEST_NAME
+
+
+def build_variants(static_name, widths=DEFAULT_WIDTHS, formats=None):
+    """
+    Resized copies of a static image in each format, none wider than the
+    original, recorded in the manifest of its directory. Needs Pillow;
+    formats default to AVIF (when this Pillow can write it) and WebP.
+    Returns the entry.
+    """
+    from PIL import Image, features
+
+    source = finders.find(static_name)
+    if source is None:
+        raise FileNotFoundError(static_name)
+    if formats is None:
+        formats = ['image/avif', 'image/webp'] if features.check('avif') else ['image/webp']
+    source = Path(source)
+    out_dir = source.parent / VARIANTS_DIR
+    out_dir.mkdir(exist_ok=True)
+    static_dir = static_name.rsplit('/', 1)[0] + '/' + VARIANTS_DIR if '/' in static_name else VARIANTS_DIR
+
+    with Image.open(source) as image:
+        image = image.convert('RGB')
+        width, height = image.size
+        sizes = sorted({min(w, width) for w in widths})
+        entry = {'width': width, 'height': height, 'sources': {}}
+        for size in sizes:
+            resized = image if size == width else image.resize((size, round(height * size / width)), Image.LANCZOS)
+            for mime in formats:
+                extension, pil_format, params = FORMATS[mime]
+                name = f"{source.stem}-{size}.{extension}"
+                resized.save(out_dir / name, pil_format, **params)
+                entry['sources'].setdefault(mime, []).append([f"{static_dir}/{name}", size, (out_dir / name).stat().st_size])
+
+    manifest_path = out_dir / MANIFEST_NAME
+    manifest = {}
+    if manifest_path.exists():
+        manifest = json.loads(manifest_path.read_text())
+    manifest[static_name] = entry
+    manifest_path.write_text(json.dumps(manifest, indent=1, sort_keys=True))
+    return entry
+
+
+_manifests = {}
+_manifests_lock = threading.Lock()
+
+
+def get_variants(static_name):
+    """
+    Manifest entry of a static image, or None until its variants are built.
+    Manifests are reread when they change.
+    """
+    path = _manifest_path(static_name)
+    if path is None:
+        return None
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+    cached = _manifests.get(path)
+    if cached is None or cached[0] != mtime:
+        with _manifests_lock:
+            cached = _manifests.get(path)
+            if cached is None or cached[0] != mtime:
+                with open(path) as f:
+                    cached = _manifests[path] = (mtime, json.load(f))
+    return cached[1].get(static_name)
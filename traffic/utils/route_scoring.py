@@ -0,0 +1,218 @@
+import itertools
+import numpy as np
+from django.conf import settings
+from .features import build_feature_matrix, LEVELS
+from .incidents import override_levels
+from .inference import predict_levels
+from .prediction_grid import get_prediction_grid
+from .regions import get_region_registry
+from .routing import EARTH_RADIUS, congestion_factors, DEFAULT_SPEED
+
+DEFAULT_SPACING = 50
+MIN_SPACING = 5
+DEFAULT_MAX_SAMPLES = 100000
+DEFAULT_MAX_ROUTES = 10
+
+
+class InvalidRoute(ValueError):
+    pass
+
+
+def decode_polyline(encoded, precision=5):
+    """
+    (lat, lng) array from a Google/OSRM encoded polyline, decoded with array
+    operations rather than character by character.
+    """
+    values = np.frombuffer(encoded.encode('ascii'), dtype=np.uint8).astype(np.int64) - 63
+    if values.size == 0:
+        return np.empty((0, 2))
+    if values.min() < 0 or values[-1] >= 0x20:
+        raise InvalidRoute("Polyline invalide.")
+    # Each number is a run of 5-bit chunks, little end first; the last chunk has no 0x20 flag
+    ends = np.flatnonzero(values < 0x20)
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    if len(ends) % 2:
+        raise InvalidRoute("Polyline invalide.")
+    shift = 5 * (np.arange(values.size) - np.repeat(starts, ends - starts + 1))
+    if shift.max() > 30:
+        raise InvalidRoute("Polyline invalide.")
+    numbers = np.add.reduceat((values & 0x1f) << shift, starts)
+    numbers = np.where(numbers & 1, ~(numbers >> 1), numbers >> 1)
+    return np.cumsum(numbers.reshape(-1, 2), axis=0) / 10.0 ** precision
+
+
+def parse_route(route, precision=5):
+    """
+    One alternative as ((lat, lng) vertices, free-flow duration or None).
+    Accepts a route object of OSRM or /api/route/ (GeoJSON or encoded
+    geometry), a GeoJSON LineString, an encoded polyline or a list of
+    [lng, lat] pairs.
+    """
+    duration = None
+    if isinstance(route, dict):
+        # The local router's duration already includes congestion
+        duration = route.get('free_flow_duration', route.get('duration'))
+        route = route.get('geometry', route.get('coordinates'))
+        if isinstance(route, dict):
+            route = route.get('coordinates')
+    if isinstance(route, str):
+        points = decode_polyline(route, precision)
+    else:
+        try:
+            points = _coordinates(route)
+        except (TypeError, ValueError, IndexError):
+            raise InvalidRoute("Coordonnées d'itinéraire invalides.")
+    if points.ndim != 2 or len(points) < 2 or not np.isfinite(points).all():
+        raise InvalidRoute("Un itinéraire doit compter au moins deux points.")
+    if duration is not None:
+        try:
+            duration = float(duration)
+        except (TypeError, ValueError):
+            raise InvalidRoute("Durée invalide.")
+    return points, duration
+
+
+def _coordinates(pairs):
+    """
+    (lat, lng) array from [lng, lat] pairs. Flattening the pairs is about
+    twice as fast as np.asarray on nested lists; pairs carrying an altitude
+    take the slow path.
+    """
+    flat = np.fromiter(itertools.chain.from_iterable(pairs), dtype=np.float64)
+    if flat.size != 2 * len(pairs):
+        return np.asarray(pairs, dtype=np.float64)[:, [1, 0]]
+    return flat.reshape(-1, 2)[:, ::-1]
+
+
+def resample(points, spacing):
+    """
+    Cut a polyline into pieces of `spacing` metres (the last one shorter).
+    Returns the piece boundaries as (lat, lng), the midpoint of every piece
+    and the piece lengths, all by interpolation along the cumulative length.
+    """
+    lat, lng = points[:, 0], points[:, 1]
+    # Vertices are metres apart: a flat projection at the route's latitude is
+    # as exact as haversine here, at a fraction of the trigonometry
+    scale = np.radians(EARTH_RADIUS)
+    lengths = np.hypot(np.diff(lat) * scale, np.diff(lng) * (scale * np.cos(np.radians(lat.mean()))))
+    cumulative = np.concatenate(([0.0], np.cumsum(lengths)))
+    total = cumulative[-1]
+    stops = np.append(np.arange(0.0, total, spacing), total) if total > 0 else np.array([0.0, 0.0])
+    middles = (stops[:-1] + stops[1:]) / 2
+
+    def at(distance):
+        return np.column_stack((np.interp(distance, cumulative, lat), np.interp(distance, cumulative, lng)))
+
+    return at(stops), at(middles), np.diff(stops)
+
+
+def _levels(lats, lngs, hour, day_of_week):
+    """
+    Traffic class at each point: read from the prediction grid where it
+    covers the point, from the model for the rest, all in one batch per
+    region, then raised around active incidents. -1 where no region covers
+    the point.
+    """
+    levels = np.full(lats.shape, -1, dtype=np.int64)
+    registry = get_region_registry()
+    if registry is None:
+        groups = [(None, np.ones(lats.shape, dtype=bool), get_prediction_grid())]
+    else:
+        owners = registry.index.locate_many(lats, lngs)
+        groups = [
+            (registry.index.regions[i].name, owners == i, registry.grid(registry.index.regions[i].name))
+            for i in np.unique(owners[owners >= 0])
+        ]
+
+    version = None
+    for region, rows, grid in groups:
+        if grid is not None:
+            levels[rows] = grid.lookup_many(lats[rows], lngs[rows], hour, day_of_week)
+            version = version or grid.version
+        missing = rows & (levels < 0)
+        if missing.any():
+            X = build_feature_matrix(lats[missing], lngs[missing], hour, day_of_week)
+            levels[missing] = predict_levels(X, region)
+    # Model predictions already carry the incidents; grid reads don't
+    return override_levels(lats, lngs, levels), version
+
+
+def score_routes(routes, hour, day_of_week, spacing=None, precision=5):
+    """
+    Congestion along each alternative and the resulting ETA and ranking.
+    Every route is resampled every `spacing` metres and all pieces of all
+    routes are scored together. A piece's free-flow time is its share of the
+    route's duration (or DEFAULT_SPEED when none is given), scaled by the
+    congestion factor of its class.
+    """
+    spacing = max(float(spacing or getattr(settings, 'ROUTE_SCORING_SPACING', DEFAULT_SPACING)), MIN_SPACING)
+    if not routes or len(routes) > getattr(settings, 'ROUTE_SCORING_MAX_ROUTES', DEFAULT_MAX_ROUTES):
+        raise InvalidRoute("Nombre d'itinéraires invalide.")
+
+    parsed = [parse_route(route, precision) for route in routes]
+    pieces = [resample(points, spacing) for points, _ in parsed]
+    counts = [len(lengths) for _, _, lengths in pieces]
+    if sum(counts) > getattr(settings, 'ROUTE_SCORING_MAX_SAMPLES', DEFAULT_MAX_SAMPLES):
+        raise InvalidRoute("Itinéraires trop longs pour cet espacement.")
+
+    middles = np.concatenate([middle for _, middle, _ in pieces])
+    levels, version = _levels(middles[:, 0], middles[:, 1], hour, day_of_week)
+    factors = np.asarray(congestion_factors(), dtype=np.float64)
+    known = (levels >= 0) & (levels < len(factors))
+    piece_factors = np.where(known, factors[np.clip(levels, 0, len(factors) - 1)], 1.0)
+
+    results = []
+    offset = 0
+    for i, ((_, duration), (stops, _, lengths), count) in enumerate(zip(parsed, pieces, counts)):
+        route_levels = levels[offset:offset + count]
+        distance = float(lengths.sum())
+        if duration is None:
+            duration = distance / (DEFAULT_SPEED / 3.6)
+        free_flow = lengths * (duration / distance) if distance else np.zeros(count)
+        adjusted = free_flow * piece_factors[offset:offset + count]
+        offset += count
+        results.append({
+            'index': i,
+            'distance': round(distance, 1),
+            'free_flow_duration': round(float(duration), 1),
+            'duration': round(float(adjusted.sum()), 1),
+            'delay': round(float(adjusted.sum() - duration), 1),
+            'congestion': {
+                LEVELS[level]: round(float(lengths[route_levels == level].sum() / distance), 3) if distance else 0.0
+                for level in LEVELS
+            },
+            'segments': _segments(stops, route_levels, lengths, adjusted),
+        })
+
+    ranking = sorted(range(len(results)), key=lambda i: results[i]['duration'])
+    for rank, i in enumerate(ranking):
+        results[i]['rank'] = rank
+    return {
+        'version': version,
+        'hour': hour,
+        'day_of_week': day_of_week,
+        'spacing': spacing,
+        'ranking': ranking,
+        'routes': results,
+    }
+
+
+def _segments(stops, levels, lengths, durations):
+    """
+    Runs of consecutive pieces with the same class, each with its
+    [lng, lat] coordinates, so a route is drawn with a handful of polylines.
+    """
+    change = np.flatnonzero(np.diff(levels)) + 1
+    starts = np.concatenate(([0], change))
+    ends = np.concatenate((change, [len(levels)]))
+    segments = []
+    for start, end in zip(starts.tolist(), ends.tolist()):
+        level = int(levels[start])
+        segments.append({
+            'level': level,
+            'label': LEVELS.get(level),
+            'distance': round(float(lengths[start:end].sum()), 1),
+            'duration': round(float(durations[start:end].sum()), 1),
+            'coordinates': np.round(stops[start:end + 1][:, ::-1], 6).tolist(),
+        })
+    return segments
@@ -0,0 +1,470 @@
+import heapq
+import json
+import math
+import os
+import threading
+import xml.etree.ElementTree as ET
+from collections import OrderedDict
+import numpy as np
+from django.conf import settings
+from .features import build_feature_matrix, as_model_input
+from .prediction_grid import DEFAULT_BBOX, DEFAULT_STEP
+from .regions import get_region_registry, model_entry, prediction_grid, split_by_region
+
+EARTH_RADIUS = 6371008.8
+
+# Free-flow speed (km/h) by OSM highway class, for edges without a maxspeed
+HIGHWAY_SPEEDS = {
+    'motorway': 90, 'trunk': 70, 'primary': 50, 'secondary': 40, 'tertiary': 35,
+    'unclassified': 30, 'residential': 25, 'service': 15, 'living_street': 10,
+}
+DEFAULT_SPEED = 30
+
+# Travel-time multiplier per predicted traffic class (Faible, Moyen, Elevé)
+DEFAULT_CONGESTION_FACTORS = (1.0, 1.6, 2.8)
+# Alternatives: weight multiplier on the edges of routes already found, and
+# the largest share of a new route's length that may overlap a previous one
+ALTERNATIVE_PENALTY = 1.4
+MAX_OVERLAP = 0.8
+WEIGHT_CACHE_SIZE = 32
+
+
+class NoRoute(Exception):
+    pass
+
+
+def haversine(lat1, lng1, lat2, lng2):
+    """
+    Great-circle distance in metres, broadcast over arrays.
+    """
+    lat1, lng1, lat2, lng2 = map(np.radians, (lat1, lng1, lat2, lng2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(a))
+
+
+class RoadGraph:
+    """
+    Directed road graph in CSR form: the edges leaving node u are
+    indptr[u]:indptr[u + 1], heading to indices[...], with a length in metres
+    and a free-flow speed in m/s. A two-way road is two edges.
+    """
+
+    def __init__(self, lat, lng, indptr, indices, length, speed):
+        self.lat = np.asarray(lat, dtype=np.float64)
+        self.lng = np.asarray(lng, dtype=np.float64)
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.indices = np.asarray(indices, dtype=np.int32)
+        self.length = np.asarray(length, dtype=np.float32)
+        self.speed = np.asarray(speed, dtype=np.float32)
+        self.sources = np.repeat(np.arange(len(self.lat), dtype=np.int32), np.diff(self.indptr))
+        self.max_speed = float(self.speed.max()) if len(self.speed) else 1.0
+        # Plain lists are much faster than array indexing inside the search loop
+        self._indptr = self.indptr.tolist()
+        self._targets = self.indices.tolist()
+        self._sources = self.sources.tolist()
+        self._lengths = self.length.tolist()
+        self._weights = OrderedDict()
+        self._weights_lock = threading.Lock()
+
+    @property
+    def node_count(self):
+        return len(self.lat)
+
+    @property
+    def edge_count(self):
+        return len(self.indices)
+
+    @classmethod
+    def from_edges(cls, lat, lng, sources, targets, speed_kmh):
+        lat = np.asarray(lat, dtype=np.float64)
+        lng = np.asarray(lng, dtype=np.float64)
+        sources = np.asarray(sources, dtype=np.int64)
+        targets = np.asarray(targets, dtype=np.int64)
+        order = np.argsort(sources, kind='stable')
+        sources, targets = sources[order], targets[order]
+        speed = np.asarray(speed_kmh, dtype=np.float64)[order] / 3.6
+
+        indptr = np.zeros(len(lat) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(sources, minlength=len(lat)), out=indptr[1:])
+        length = haversine(lat[sources], lng[sources], lat[targets], lng[targets])
+        return cls(lat, lng, indptr, targets, length, speed)
+
+    def save(self, path):
+        tmp_path = f"{path}.{os.getpid()}.tmp.npz"
+        np.savez(tmp_path, lat=self.lat, lng=self.lng, indptr=self.indptr,
+                 indices=self.indices, length=self.length, speed=self.speed)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data['lat'], data['lng'], data['indptr'], data['indices'], data['length'], data['speed'])
+
+    def nearest_node(self, lat, lng):
+        """
+        Closest node to a point, and its distance in metres.
+        """
+        scale = math.cos(math.radians(lat))
+        d2 = (self.lat - lat) ** 2 + ((self.lng - lng) * scale) ** 2
+        node = int(np.argmin(d2))
+        return node, float(haversine(lat, lng, self.lat[node], self.lng[node]))
+
+    def edge_midpoints(self):
+        return (
+            (self.lat[self.sources] + self.lat[self.indices]) / 2,
+            (self.lng[self.sources] + self.lng[self.indices]) / 2,
+        )
+
+    def travel_times(self, hour, day_of_week):
+        """
+        Per-edge travel time in seconds for one hour of one day: free-flow time
+        scaled by the congestion predicted at the edge midpoint. Each edge is
+        read from the prediction grid of its region when built, otherwise from
+        the region's model; free flow if neither exists or the edge lies
+        outside every region. Returns (version, weights) and caches per version.
+        """
+        mid_lat, mid_lng = self.edge_midpoints()
+        sources = []
+        for region, mask in split_by_region(mid_lat, mid_lng):
+            grid = prediction_grid(region)
+            if grid is not None:
+                sources.append((region, mask, grid.version, grid, None))
+            else:
+                version, model = model_entry(region)
+                sources.append((region, mask, version, None, model))
+        if get_region_registry() is None:
+            version = sources[0][2]
+        else:
+            version = ';'.join(f'{region}:{v}' for region, _, v, _, _ in sources if v is not None) or None
+
+        key = (version, hour, day_of_week)
+        with self._weights_lock:
+            if key in self._weights:
+                self._weights.move_to_end(key)
+                return version, self._weights[key]
+
+        free_flow = self.length.astype(np.float64) / self.speed
+        levels = np.full(self.edge_count, -1, dtype=np.intp)
+        for _, mask, _, grid, model in sources:
+            if grid is not None:
+                levels[mask] = grid.lookup_many(mid_lat[mask], mid_lng[mask], hour, day_of_week)
+            elif model is not None:
+                X = build_feature_matrix(mid_lat[mask], mid_lng[mask], hour, day_of_week)
+                levels[mask] = model.predict(as_model_input(model, X))
+        factors = np.asarray(congestion_factors(), dtype=np.float64)
+        known = (levels >= 0) & (levels < len(factors))
+        weights = free_flow * np.where(known, factors[np.clip(levels, 0, len(factors) - 1)], 1.0)
+        weights = weights.tolist()
+
+        with self._weights_lock:
+            self._weights[key] = weights
+            while len(self._weights) > getattr(settings, 'ROUTING_WEIGHT_CACHE_SIZE', WEIGHT_CACHE_SIZE):
+                self._weights.popitem(last=False)
+        return version, weights
+
+    def shortest_path(self, source, target, weights, heuristic=None):
+        """
+        A* search; returns the list of edge ids from source to target, or None.
+        The heuristic must never overestimate the remaining cost.
+        """
+        if heuristic is None:
+            heuristic = self.heuristic(target)
+        indptr, targets, sources = self._indptr, self._targets, self._sources
+        best = {source: 0.0}
+        via = {}
+        closed = set()
+        heap = [(heuristic[source], 0.0, source)]
+        while heap:
+            _, cost, node = heapq.heappop(heap)
+            if node == target:
+                break
+            if node in closed:
+                continue
+            closed.add(node)
+            for edge in range(indptr[node], indptr[node + 1]):
+                following = targets[edge]
+                new_cost = cost + weights[edge]
+                if new_cost < best.get(following, math.inf):
+                    best[following] = new_cost
+                    via[following] = edge
+                    heapq.heappush(heap, (new_cost + heuristic[following], new_cost, following))
+        else:
+            return None
+
+        path = []
+        node = target
+        while node != source:
+            edge = via[node]
+            path.append(edge)
+            node = sources[edge]
+        path.reverse()
+        return path
+
+    def heuristic(self, target):
+        """
+        Straight-line time to target at the top speed of the graph. Congestion
+        and alternative penalties only slow edges down, so it stays admissible.
+        """
+        floor = min(1.0, min(congestion_factors()))
+        distance = haversine(self.lat, self.lng, self.lat[target], self.lng[target])
+        return (distance * floor / self.max_speed).tolist()
+
+    def routes(self, source, target, weights, alternatives=1):
+        """
+        Up to `alternatives` distinct routes, best first. Alternatives are found
+        by penalizing the edges of the routes already found and searching again;
+        a candidate sharing more than MAX_OVERLAP of its length with a previous
+        route is discarded.
+        """
+        heuristic = self.heuristic(target)
+        found = []
+        current = weights
+        for _ in range(2 * alternatives):
+            path = self.shortest_path(source, target, current, heuristic)
+            if path is None:
+                break
+            if all(self._overlap(path, previous) <= MAX_OVERLAP for previous in found):
+                found.append(path)
+                if len(found) >= alternatives:
+                    break
+            if current is weights:
+                current = list(weights)
+            for edge in path:
+                current[edge] *= ALTERNATIVE_PENALTY
+
+        routes = [self._route(path, weights, source) for path in found]
+        routes.sort(key=lambda route: route['duration'])
+        return routes
+
+    def _overlap(self, path, other):
+        total = sum(self._lengths[edge] for edge in path)
+        if not total:
+            return 1.0
+        shared = set(path).intersection(other)
+        return sum(self._lengths[edge] for edge in shared) / total
+
+    def _route(self, path, weights, source):
+        nodes = [source] + [self._targets[edge] for edge in path]
+        return {
+            'nodes': nodes,
+            'distance': sum(self._lengths[edge] for edge in path),
+            'duration': sum(weights[edge] for edge in path),
+            'free_flow_duration': float((self.length[path].astype(np.float64) / self.speed[path]).sum()) if path else 0.0,
+        }
+
+    def to_geojson_route(self, route):
+        """
+        A route in the shape returned by OSRM with geometries=geojson.
+        """
+        nodes = route['nodes']
+        return {
+            'geometry': {
+                'type': 'LineString',
+                'coordinates': np.round(np.column_stack((self.lng[nodes], self.lat[nodes])), 6).tolist(),
+            },
+            'distance': round(route['distance'], 1),
+            'duration': round(route['duration'], 1),
+            'free_flow_duration': round(route['free_flow_duration'], 1),
+            'weight': round(route['duration'], 1),
+            'weight_name': 'congestion',
+        }
+
+
+def congestion_factors():
+    """
+    Travel time multiplier of each traffic class, free flow first.
+    """
+    return getattr(settings, 'ROUTING_CONGESTION_FACTORS', DEFAULT_CONGESTION_FACTORS)
+
+
+def _speed_kmh(properties):
+    maxspeed = str(properties.get('maxspeed') or '').strip()
+    digits = ''.join(c for c in maxspeed.split(';')[0] if c.isdigit() or c == '.')
+    if digits:
+        speed = float(digits)
+        return speed * 1.609 if 'mph' in maxspeed else speed
+    highway = str(properties.get('highway') or '').replace('_link', '')
+    return HIGHWAY_SPEEDS.get(highway, DEFAULT_SPEED)
+
+
+def _direction(properties):
+    oneway = str(properties.get('oneway') or '').lower()
+    if oneway in ('yes', 'true', '1'):
+        return 1
+    if oneway == '-1':
+        return -1
+    return 0
+
+
+class _GraphBuilder:
+    """
+    Accumulates polylines; every vertex becomes a node, shared vertices are merged.
+    """
+
+    def __init__(self):
+        self.node_ids = {}
+        self.lat = []
+        self.lng = []
+        self.sources = []
+        self.targets = []
+        self.speeds = []
+
+    def node(self, lat, lng):
+        key = (round(lat, 7), round(lng, 7))
+        node = self.node_ids.get(key)
+        if node is None:
+            node = self.node_ids[key] = len(self.lat)
+            self.lat.append(key[0])
+            self.lng.append(key[1])
+        return node
+
+    def add_line(self, points, properties):
+        speed = _speed_kmh(properties)
+        direction = _direction(properties)
+        nodes = [self.node(lat, lng) for lat, lng in points]
+        for a, b in zip(nodes, nodes[1:]):
+            if a == b:
+                continue
+            if direction >= 0:
+                self.sources.append(a)
+                self.targets.append(b)
+                self.speeds.append(speed)
+            if direction <= 0:
+                self.sources.append(b)
+                self.targets.append(a)
+                self.speeds.append(speed)
+
+    def build(self):
+        if not self.sources:
+            raise ValueError("No road found in the extract")
+        return RoadGraph.from_edges(self.lat, self.lng, self.sources, self.targets, self.speeds)
+
+
+def load_geojson(path):
+    """
+    Road graph from a GeoJSON FeatureCollection of (Multi)LineStrings.
+    Optional properties: highway, maxspeed, oneway (OSM conventions).
+    """
+    with open(path) as f:
+        data = json.load(f)
+    builder = _GraphBuilder()
+    for feature in data.get('features', []):
+        geometry = feature.get('geometry') or {}
+        properties = feature.get('properties') or {}
+        if geometry.get('type') == 'LineString':
+            lines = [geometry['coordinates']]
+        elif geometry.get('type') == 'MultiLineString':
+            lines = geometry['coordinates']
+        else:
+            continue
+        for line in lines:
+            builder.add_line([(point[1], point[0]) for point in line], properties)
+    return builder.build()
+
+
+def load_osm(path):
+    """
+    Road graph from an OSM XML extract: every way with a highway tag.
+    """
+    builder = _GraphBuilder()
+    coordinates = {}
+    for _, element in ET.iterparse(path):
+        if element.tag == 'node':
+            coordinates[element.get('id')] = (float(element.get('lat')), float(element.get('lon')))
+            element.clear()
+        elif element.tag == 'way':
+            tags = {tag.get('k'): tag.get('v') for tag in element.iter('tag')}
+            if 'highway' in tags:
+                refs = [nd.get('ref') for nd in element.iter('nd')]
+                builder.add_line([coordinates[ref] for ref in refs if ref in coordinates], tags)
+            element.clear()
+    return builder.build()
+
+
+def synthetic_grid(bbox=None, step=None, arterial_every=4):
+    """
+    Two-way grid of streets over the bbox, with a faster arterial every few
+    rows and columns. Stands in for a real extract.
+    """
+    south, west, north, east = bbox or getattr(settings, 'PREDICTION_GRID_BBOX', DEFAULT_BBOX)
+    step = step or getattr(settings, 'PREDICTION_GRID_STEP', DEFAULT_STEP)
+    n_lat = int(round((north - south) / step)) + 1
+    n_lng = int(round((east - west) / step)) + 1
+    rows, cols = np.meshgrid(np.arange(n_lat), np.arange(n_lng), indexing='ij')
+    ids = rows * n_lng + cols
+
+    horizontal = (ids[:, :-1].ravel(), ids[:, 1:].ravel(), np.repeat(np.arange(n_lat), n_lng - 1))
+    vertical = (ids[:-1, :].ravel(), ids[1:, :].ravel(), np.tile(np.arange(n_lng), n_lat - 1))
+    sources, targets, speeds = [], [], []
+    for a, b, line in (horizontal, vertical):
+        speed = np.where(line % arterial_every == 0, HIGHWAY_SPEEDS['primary'], HIGHWAY_SPEEDS['residential'])
+        sources += [a, b]
+        targets += [b, a]
+        speeds += [speed, speed]
+
+    return RoadGraph.from_edges(
+        (south + step * rows).ravel(), (west + step * cols).ravel(),
+        np.concatenate(sources), np.concatenate(targets), np.concatenate(speeds),
+    )
+
+
+def load_road_graph(path):
+    suffix = os.path.splitext(str(path))[1].lower()
+    if suffix == '.npz':
+        return RoadGraph.load(path)
+    if suffix in ('.osm', '.xml'):
+        return load_osm(path)
+    return load_geojson(path)
+
+
+_graph = None
+_graph_signature = None
+_graph_lock = threading.Lock()
+
+
+def get_road_graph():
+    """
+    The road graph for this worker, from ROAD_GRAPH_PATH (compiled .npz, OSM
+    XML or GeoJSON), reloaded when the file changes. Falls back to a synthetic
+    grid over the prediction area when no extract is installed.
+    """
+    global _graph, _graph_signature
+    path = getattr(settings, 'ROAD_GRAPH_PATH', None)
+    try:
+        st = os.stat(path) if path else None
+    except FileNotFoundError:
+        st = None
+    signature = (str(path), st.st_ino, st.st_mtime_ns) if st else 'synthetic'
+    if signature != _graph_signature:
+        with _graph_lock:
+            if signature != _graph_signature:
+                _graph = load_road_graph(path) if st else synthetic_grid()
+                _graph_signature = signature
+    return _graph
+
+
+def find_routes(start, end, hour, day_of_week, alternatives=1, graph=None):
+    """
+    Congestion-aware routes between two (lat, lng) points, as an OSRM-style
+    response dict.
+    """
+    graph = graph or get_road_graph()
+    max_snap = getattr(settings, 'ROUTING_MAX_SNAP_DISTANCE', 1000)
+    source, source_gap = graph.nearest_node(*start)
+    target, target_gap = graph.nearest_node(*end)
+    if source_gap > max_snap or target_gap > max_snap:
+        raise NoRoute("Point hors du réseau routier couvert.")
+
+    version, weights = graph.travel_times(hour, day_of_week)
+    routes = graph.routes(source, target, weights, alternatives)
+    if not routes:
+        raise NoRoute("Aucun itinéraire trouvé.")
+    return {
+        'code': 'Ok',
+        'version': version,
+        'routes': [graph.to_geojson_route(route) for route in routes],
+        'waypoints': [
+            {'location': [round(float(graph.lng[node]), 6), round(float(graph.lat[node]), 6)], 'distance': round(gap, 1)}
+            for node, gap in ((source, source_gap), (target, target_gap))
+        ],
+    }
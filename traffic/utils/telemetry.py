@@ -0,0 +1,227 @@
+import math
+import threading
+import time
+from datetime import timedelta
+import numpy as np
+import pandas as pd
+from django.conf import settings
+from django.utils import timezone
+from ..models import VehicleObservation
+from .prediction_grid import DEFAULT_BBOX
+from .write_behind import WriteBehindBuffer, BufferFull
+
+DEFAULT_CELL_SIZE = 0.01
+# Points stamped further ahead than this are treated as clock errors
+MAX_CLOCK_SKEW = 60
+
+
+class InvalidTelemetry(ValueError):
+    pass
+
+
+def parse_points(points):
+    """
+    Validate a batch of {id, lat, lng, speed, timestamp} points. timestamp is
+    epoch seconds or ISO 8601. Returns a DataFrame with vehicle_id, lat, lng,
+    speed (km/h) and timestamp (UTC); the whole batch is rejected on bad rows.
+    """
+    if not isinstance(points, list) or not points:
+        raise InvalidTelemetry("Une liste de points non vide est attendue")
+    df = pd.DataFrame(points).rename(columns={'id': 'vehicle_id'})
+    missing = [c for c in ('vehicle_id', 'lat', 'lng', 'speed', 'timestamp') if c not in df.columns]
+    if missing:
+        raise InvalidTelemetry(f"Champs manquants : {', '.join(missing)}")
+
+    for column in ('lat', 'lng', 'speed'):
+        df[column] = pd.to_numeric(df[column], errors='coerce')
+    if pd.api.types.is_numeric_dtype(df['timestamp']):
+        df['timestamp'] = pd.to_datetime(df['timestamp'], unit='s', utc=True, errors='coerce')
+    else:
+        df['timestamp'] = pd.to_datetime(df['timestamp'], utc=True, errors='coerce', format='ISO8601')
+    df['vehicle_id'] = df['vehicle_id'].astype(str)
+
+    invalid = (
+        df[['lat', 'lng', 'speed', 'timestamp']].isna().any(axis=1)
+        | ~df['lat'].between(-90, 90) | ~df['lng'].between(-180, 180) | (df['speed'] < 0)
+        | (df['vehicle_id'].str.len() > 64)
+    )
+    if invalid.any():
+        raise InvalidTelemetry(f"{int(invalid.sum())} point(s) invalide(s)")
+    return df[['vehicle_id', 'lat', 'lng', 'speed', 'timestamp']]
+
+
+class CellGrid:
+    """
+    Uniform lat/lng grid over the covered area; cell ids are row-major.
+    """
+
+    def __init__(self, bbox, size):
+        self.south, self.west, self.north, self.east = bbox
+        self.size = size
+        self.lat_count = int(math.ceil(round((self.north - self.south) / size, 9)))
+        self.lng_count = int(math.ceil(round((self.east - self.west) / size, 9)))
+        self.count = self.lat_count * self.lng_count
+
+    def cell_ids(self, lats, lngs):
+        i = np.floor((np.asarray(lats) - self.south) / self.size).astype(np.int64)
+        j = np.floor((np.asarray(lngs) - self.west) / self.size).astype(np.int64)
+        inside = (i >= 0) & (i < self.lat_count) & (j >= 0) & (j < self.lng_count)
+        return np.where(inside, i * self.lng_count + j, -1)
+
+    def center(self, cell):
+        i, j = divmod(int(cell), self.lng_count)
+        return self.south + (i + 0.5) * self.size, self.west + (j + 0.5) * self.size
+
+
+class RollingAggregates:
+    """
+    Point count and speed sum per grid cell over a sliding time window, kept
+    in a ring of fixed-width time buckets: a bucket is zeroed when its slot is
+    reused, so reads cost O(buckets x cells) whatever the traffic volume.
+    Also tracks when each vehicle was last seen.
+    """
+
+    def __init__(self, n_cells, window=900, bucket=60):
+        self.window = window
+        self.bucket = bucket
+        self.n_buckets = int(math.ceil(window / bucket))
+        self.epochs = np.full(self.n_buckets, -1, dtype=np.int64)
+        self.counts = np.zeros((self.n_buckets, n_cells), dtype=np.int64)
+        self.speed_sums = np.zeros((self.n_buckets, n_cells), dtype=np.float64)
+        self.last_seen = {}
+        self._lock = threading.Lock()
+
+    def add(self, cells, speeds, seconds, vehicle_ids, now=None):
+        now = time.time() if now is None else now
+        seconds = np.asarray(seconds, dtype=np.float64)
+        buckets = np.floor(seconds / self.bucket).astype(np.int64)
+        current = int(now // self.bucket)
+        keep = (cells >= 0) & (buckets > current - self.n_buckets) & (seconds <= now + MAX_CLOCK_SKEW)
+
+        with self._lock:
+            for bucket in np.unique(buckets[keep]):
+                slot = bucket % self.n_buckets
+                if self.epochs[slot] > bucket:
+                    continue
+                if self.epochs[slot] != bucket:
+                    self.epochs[slot] = bucket
+                    self.counts[slot] = 0
+                    self.speed_sums[slot] = 0.0
+                selected = keep & (buckets == bucket)
+                np.add.at(self.counts[slot], cells[selected], 1)
+                np.add.at(self.speed_sums[slot], cells[selected], speeds[selected])
+
+            # Latest point last, so it wins in the update
+            order = np.argsort(seconds, kind='stable')
+            self.last_seen.update(zip(np.asarray(vehicle_ids)[order].tolist(), seconds[order].tolist()))
+
+    def snapshot(self, now=None):
+        """
+        (counts, speed sums) per cell over the window, and active vehicles.
+        """
+        now = time.time() if now is None else now
+        current = int(now // self.bucket)
+        with self._lock:
+            valid = (self.epochs > current - self.n_buckets) & (self.epochs <= current)
+            counts = self.counts[valid].sum(axis=0)
+            speed_sums = self.speed_sums[valid].sum(axis=0)
+            horizon = now - self.window
+            stale = [vehicle for vehicle, seen in self.last_seen.items() if seen < horizon]
+            for vehicle in stale:
+                del self.last_seen[vehicle]
+            vehicles = len(self.last_seen)
+        return counts, speed_sums, vehicles
+
+
+class TelemetryStore:
+    def __init__(self):
+        self.grid = CellGrid(
+            getattr(settings, 'PREDICTION_GRID_BBOX', DEFAULT_BBOX),
+            getattr(settings, 'TELEMETRY_CELL_SIZE', DEFAULT_CELL_SIZE),
+        )
+        self.aggregates = RollingAggregates(
+            self.grid.count,
+            getattr(settings, 'TELEMETRY_WINDOW', 900),
+            getattr(settings, 'TELEMETRY_BUCKET', 60),
+        )
+        self.buffer = WriteBehindBuffer(
+            VehicleObservation, ('vehicle_id', 'lat', 'lng', 'speed', 'timestamp', 'cell'),
+            getattr(settings, 'TELEMETRY_FLUSH_SIZE', 5000),
+            getattr(settings, 'TELEMETRY_FLUSH_INTERVAL', 2.0),
+            getattr(settings, 'TELEMETRY_MAX_PENDING', 200000),
+        )
+
+    def ingest(self, df):
+        """
+        Queue a parsed batch for the database and fold it into the aggregates.
+        """
+        cells = self.grid.cell_ids(df['lat'].to_numpy(), df['lng'].to_numpy())
+        timestamps = df['timestamp'].dt.to_pydatetime()
+        self.buffer.add(list(zip(
+            df['vehicle_id'].tolist(), df['lat'].tolist(), df['lng'].tolist(),
+            df['speed'].tolist(), timestamps, cells.tolist(),
+        )))
+        seconds = (df['timestamp'] - pd.Timestamp(0, tz='UTC')).dt.total_seconds().to_numpy()
+        self.aggregates.add(cells, df['speed'].to_numpy(np.float64), seconds, df['vehicle_id'].to_numpy())
+        return len(df)
+
+    def warm_up(self):
+        """
+        Rebuild the aggregates from the observations still inside the window,
+        so a restarted worker doesn't report an empty city.
+        """
+        since = timezone.now() - timedelta(seconds=self.aggregates.window)
+        rows = VehicleObservation.objects.filter(timestamp__gte=since).values_list('vehicle_id', 'speed', 'timestamp', 'cell')
+        batch = []
+        for row in rows.iterator(chunk_size=10000):
+            batch.append(row)
+            if len(batch) >= 10000:
+                self._fold(batch)
+                batch = []
+        if batch:
+            self._fold(batch)
+
+    def _fold(self, rows):
+        vehicle_ids, speeds, timestamps, cells = zip(*rows)
+        seconds = np.array([t.timestamp() for t in timestamps])
+        self.aggregates.add(np.array(cells, dtype=np.int64), np.array(speeds, dtype=np.float64), seconds, np.array(vehicle_ids))
+
+    def stats(self, now=None):
+        """
+        Dashboard figures over the window, read from the aggregates only.
+        """
+        counts, speed_sums, vehicles = self.aggregates.snapshot(now)
+        total = int(counts.sum())
+        cells = []
+        for cell in np.flatnonzero(counts):
+            lat, lng = self.grid.center(cell)
+            cells.append({
+                'cell': int(cell),
+                'lat': round(lat, 6),
+                'lng': round(lng, 6),
+                'observations': int(counts[cell]),
+                'avg_speed': round(float(speed_sums[cell] / counts[cell]), 1),
+            })
+        return {
+            'window': self.aggregates.window,
+            'vehicles': vehicles,
+            'observations': total,
+            'avg_speed': round(float(speed_sums.sum() / total), 1) if total else None,
+            'cells': cells,
+            'buffer': self.buffer.stats(),
+        }
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_telemetry_store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                store = TelemetryStore()
+                store.warm_up()
+                _store = store
+    return _store
@@ -0,0 +1,114 @@
+import threading
+from collections import OrderedDict
+import numpy as np
+from django.conf import settings
+from .features import build_feature_matrix, as_model_input
+
+# Intensity anchor (0-100) of each traffic class, as drawn by the dashboard chart
+CLASS_INTENSITY = {0: 20.0, 1: 50.0, 2: 80.0}
+PEAK_HOURS = np.array([7, 8, 9, 17, 18, 19])
+PEAK_FLOOR = 70.0
+COORD_PRECISION = 3  # ~110 m, the resolution users can click on the map
+
+
+class InvalidDay(ValueError):
+    pass
+
+
+class TrendCache:
+    """
+    Size-bounded LRU cache for computed trends.
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            value = self._data.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+_cache = TrendCache(getattr(settings, 'TREND_CACHE_SIZE', 2048))
+
+
+def get_cache():
+    return _cache
+
+
+def intensity_from_proba(model, proba):
+    """
+    Expected intensity under the predicted class distribution.
+    """
+    weights = np.array([CLASS_INTENSITY[int(c)] for c in model.classes_])
+    return proba @ weights
+
+
+def compute_trend(model, lat, lng, days):
+    """
+    Intensity for every hour of the given days in a single predict_proba call.
+    Returns an array of shape (len(days), 24).
+    """
+    days = np.asarray(days)
+    hours = np.arange(24)
+    X = build_feature_matrix(lat, lng, hours[np.newaxis, :], days[:, np.newaxis])
+    proba = model.predict_proba(as_model_input(model, X))
+    intensity = intensity_from_proba(model, proba).reshape(len(days), 24)
+
+    # Keep rush hours visible even where the model is unsure
+    intensity[:, PEAK_HOURS] = np.maximum(intensity[:, PEAK_HOURS], PEAK_FLOOR)
+    return np.round(intensity, 1)
+
+
+def get_daily_trend(model, version, lat, lng, day_of_week):
+    """
+    24 hourly intensities for one day, served from the cache when possible.
+    """
+    # Checked before the lookup: an out-of-range day would get its own cache entry
+    if isinstance(day_of_week, bool) or not isinstance(day_of_week, (int, np.integer)) or not 0 <= day_of_week <= 6:
+        raise InvalidDay("Jour invalide (0 = lundi ... 6 = dimanche).")
+    lat, lng = round(lat, COORD_PRECISION), round(lng, COORD_PRECISION)
+    key = (lat, lng, day_of_week, version)
+    trend = _cache.get(key)
+    if trend is None:
+        trend = compute_trend(model, lat, lng, [day_of_week])[0].tolist()
+        _cache.set(key, trend)
+    return trend
+
+
+def get_weekly_trend(model, version, lat, lng):
+    """
+    7x24 intensity matrix (Monday first), served from the cache when possible.
+    """
+    lat, lng = round(lat, COORD_PRECISION), round(lng, COORD_PRECISION)
+    key = (lat, lng, 'week', version)
+    week = _cache.get(key)
+    if week is None:
+        week = compute_trend(model, lat, lng, range(7)).tolist()
+        _cache.set(key, week)
+        for day_of_week, trend in enumerate(week):
+            _cache.set((lat, lng, day_of_week, version), trend)
+    return week
@@ -0,0 +1,145 @@
+import atexit
+import logging
+import threading
+import time
+import weakref
+from django.db import close_old_connections, transaction, OperationalError
+from .metrics import span, inc, register_collector
+
+logger = logging.getLogger(__name__)
+# Every live buffer, for the metrics collector
+_buffers = weakref.WeakSet()
+
+
+class BufferFull(Exception):
+    pass
+
+
+class WriteBehindBuffer:
+    """
+    Rows waiting to be inserted into `model`, written by a background thread
+    with bulk_create every flush_interval seconds, or as soon as flush_size
+    rows are waiting. Rows are tuples of values for `fields`. Beyond
+    max_pending rows new ones are refused with BufferFull.
+
+    A flush that fails on a transient database error (e.g. a locked SQLite
+    file) keeps its rows for the next attempt; any other error drops them.
+    """
+
+    def __init__(self, model, fields, flush_size=5000, flush_interval=2.0, max_pending=200000, batch_size=2000):
+        self.model = model
+        self.fields = tuple(fields)
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.batch_size = batch_size
+        self._rows = []
+        # Rows taken by a flush that has not committed yet
+        self._inflight = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self.flushed = 0
+        self.flushes = 0
+        self.rejected = 0
+        self.dropped = 0
+        self.last_flush_ms = 0.0
+        _buffers.add(self)
+
+    @property
+    def pending(self):
+        return len(self._rows)
+
+    def add(self, rows):
+        with self._lock:
+            if len(self._rows) + len(rows) > self.max_pending:
+                self.rejected += len(rows)
+                raise BufferFull()
+            self._rows.extend(rows)
+            full = len(self._rows) >= self.flush_size
+        self._ensure_thread()
+        if full:
+            self._wakeup.set()
+
+    def pending_rows(self, predicate):
+        """
+        Rows not yet written that match predicate(row), oldest first.
+        """
+        with self._lock:
+            return [row for row in self._inflight + self._rows if predicate(row)]
+
+    def flush(self):
+        """
+        Write everything pending; returns the number of rows written.
+        """
+        with self._flush_lock:
+            with self._lock:
+                rows, self._rows = self._rows, []
+                self._inflight = rows
+            if not rows:
+                return 0
+            started = time.perf_counter()
+            table = self.model._meta.db_table
+            try:
+                with span('db_write', table=table), transaction.atomic():
+                    self.model.objects.bulk_create(
+                        [self.model(**dict(zip(self.fields, row))) for row in rows],
+                        batch_size=self.batch_size,
+                    )
+            except OperationalError:
+                with self._lock:
+                    self._rows[:0] = rows
+                raise
+            except Exception:
+                self.dropped += len(rows)
+                raise
+            finally:
+                with self._lock:
+                    self._inflight = []
+            self.last_flush_ms = (time.perf_counter() - started) * 1000
+            self.flushed += len(rows)
+            self.flushes += 1
+            inc('db_rows_written_total', len(rows), table=table)
+            return len(rows)
+
+    def _ensure_thread(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    name = f"{self.model._meta.model_name}-flush"
+                    self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+                    self._thread.start()
+                    atexit.register(self.flush)
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Flush of %s rows failed", self.model._meta.label)
+            finally:
+                close_old_connections()
+
+    def stats(self):
+        return {
+            'pending': self.pending,
+            'flushed': self.flushed,
+            'flushes': self.flushes,
+            'rejected': self.rejected,
+            'dropped': self.dropped,
+            'last_flush_ms': self.last_flush_ms,
+        }
+
+
+def _collect():
+    for buffer in list(_buffers):
+        labels = {'table': buffer.model._meta.db_table}
+        yield 'write_behind_pending_rows', 'gauge', "Rows waiting in a write-behind buffer.", labels, buffer.pending
+        yield 'write_behind_rejected_total', 'counter', "Rows refused by a full write-behind buffer.", labels, buffer.rejected
+        yield 'write_behind_dropped_total', 'counter', "Rows lost to a failed flush.", labels, buffer.dropped
+
+
+register_collector(_collect)
@@ -1,21 +1,38 @@
 from django.shortcuts import render
-from django.http import JsonResponse
-from .utils.data_simulator import generate_traffic_data
-from .utils.model_trainer import train_model
-import joblib
-import os
+from django.http import StreamingHttpResponse, HttpResponse
+from .utils.responses import JsonResponse, conditional, model_cache_control
+from .utils.trend_engine import get_daily_trend, get_weekly_trend
+from .utils.jobs import submit_training_job, get_job, job_revision
+from .utils.features import build_feature_matrix, LEVELS
+from .utils.inference import get_batcher, ModelNotTrained, Overloaded
+from .utils.regions import get_region_registry, locate_region, model_entry, prediction_grid, OutsideRegions
+from .utils.batch_prediction import iter_input_chunks, score_chunk, render_chunk, stream_predictions, InvalidInput
+from .utils.routing import find_routes, NoRoute
+from .utils.route_scoring import score_routes as score_route_alternatives, InvalidRoute
+from .utils.incidents import get_incident_store, parse_incidents, InvalidIncident
+from .utils.clustering import LAYERS, vehicle_index, incident_index, hotspot_index, cluster_viewport, InvalidViewport
+from asgiref.sync import sync_to_async
+import functools
+from .utils.geocoding import get_geocoder
+from .utils.fleet_simulation import get_fleet_hub, fleet_stats, encode_event
+from django.core.handlers.asgi import ASGIRequest
+from .utils.telemetry import get_telemetry_store, parse_points, BufferFull
+from .utils.history import record_search, history_page, keyset_page, parse_limit, user_data_revision, InvalidPage
+from .utils.metrics import span, render_metrics
+from django.views.decorators.csrf import csrf_exempt
 from django.conf import settings
-import pandas as pd
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.decorators import login_required
 from django.shortcuts import redirect, render
 from django.contrib.auth.models import User
-from django.contrib import messages
-from django.urls import reverse_lazy
-from django.contrib.auth import views as auth_views
-from .models import SearchHistory, Favorite
+from .models import Favorite
+import hmac
 import json
+import logging
 from django.views.decorators.http import require_POST
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
 
 def home(request):
     """
@@ -28,55 +45,98 @@ def index(request):
     """
     Dashboard view.
     """
-    model_path = settings.MODELS_ROOT / 'traffic_model.pkl'
-    model_exists = model_path.exists()
+    regions = get_region_registry()
+    if regions is None:
+        model_exists = (settings.MODELS_ROOT / 'traffic_model.pkl').exists()
+    else:
+        model_exists = any((region.models_root / 'traffic_model.pkl').exists() for region in regions.regions.values())
     
     context = {
         'model_exists': model_exists,
+        # Not cached while DEBUG, so template edits show straight away
+        'fragment_timeout': 0 if settings.DEBUG else getattr(settings, 'DASHBOARD_FRAGMENT_TIMEOUT', 3600),
     }
     return render(request, 'traffic/index.html', context)
 
 def simulate(request):
     """
-    Trigger data simulation and model training.
+    Start data simulation and model training in the background.
+    Returns the job id immediately; concurrent calls share the running job.
+    With ?incremental=1 the new samples are appended and the existing forest grown.
+    With ?select=1 candidate models are compared and the fastest accurate one kept.
+    When REGIONS are configured, every region is built in parallel, or only
+    the one named by ?region=.
+    """
+    try:
+        n_samples = int(request.GET.get('n_samples', 3000))
+    except ValueError:
+        return JsonResponse({'status': 'error', 'message': 'n_samples invalide'}, status=400)
+    max_samples = getattr(settings, 'SIMULATE_MAX_SAMPLES', 1000000)
+    if not 1 <= n_samples <= max_samples:
+        return JsonResponse({'status': 'error', 'message': f'n_samples doit être compris entre 1 et {max_samples}'}, status=400)
+    incremental = request.GET.get('incremental') == '1'
+    select = request.GET.get('select') == '1'
+
+    regions = None
+    registry = get_region_registry()
+    if registry is not None:
+        region = request.GET.get('region')
+        if region and region not in registry.regions:
+            return JsonResponse({'status': 'error', 'message': 'Région inconnue'}, status=400)
+        regions = [region] if region else list(registry.regions)
+
+    job, created = submit_training_job(n_samples, incremental, select, regions)
+    if job is None:
+        return JsonResponse({'status': 'error', 'message': 'Impossible de lancer l\'entraînement'}, status=503)
+    return JsonResponse({'status': job['state'], 'job_id': job['id'], 'created': created}, status=202)
+
+@conditional(lambda request, job_id: job_revision(job_id))
+def job_status(request, job_id):
+    """
+    Progress of a training job, with the classification report once done.
     """
-    generate_traffic_data()
-    report = train_model()
-    return JsonResponse({'status': 'success', 'report': report})
+    job = get_job(job_id)
+    if job is None:
+        return JsonResponse({'status': 'error', 'message': 'Tâche introuvable'}, status=404)
+    return JsonResponse(job)
 
-def predict(request):
+async def predict(request):
     """
     Get traffic prediction.
+    Async so that, under ASGI, concurrent calls are micro-batched into one inference.
     """
     if request.method == 'POST':
         try:
-            coords_str = request.POST.get('coords-display')
-            hour_str = request.POST.get('hour')
-            day_of_week_str = request.POST.get('day_of_week')
-            avg_speed_str = request.POST.get('avg_speed')
-            
-            if not all([coords_str, hour_str, day_of_week_str]):
-                return JsonResponse({'error': 'Veuillez remplir tous les champs (Localisation, Heure, Jour).'}, status=400)
+            with span('predict_parse'):
+                coords_str = request.POST.get('coords-display')
+                hour_str = request.POST.get('hour')
+                day_of_week_str = request.POST.get('day_of_week')
+                avg_speed_str = request.POST.get('avg_speed')
 
-            lat, lng = map(float, coords_str.split(','))
-            hour = int(hour_str)
-            day_of_week = int(day_of_week_str)
-            is_weekend = 1 if day_of_week >= 5 else 0
-            
-            features = [lat, lng, hour, day_of_week, is_weekend]
-            print(f"DEBUG: Predicting with features (len={len(features)}): {features}")
-            
-            model_path = settings.MODELS_ROOT / 'traffic_model.pkl'
-            if not model_path.exists():
+                if not all([coords_str, hour_str, day_of_week_str]):
+                    return JsonResponse({'error': 'Veuillez remplir tous les champs (Localisation, Heure, Jour).'}, status=400)
+
+                lat, lng = map(float, coords_str.split(','))
+                hour = int(hour_str)
+                day_of_week = int(day_of_week_str)
+                features = build_feature_matrix(lat, lng, hour, day_of_week)
+                try:
+                    region = locate_region(lat, lng)
+                except OutsideRegions as e:
+                    return JsonResponse({'error': str(e)}, status=400)
+
+            try:
+                # Queueing in the batcher included; inference itself is its own span
+                with span('predict_wait'):
+                    prediction = await get_batcher(region).predict(features)
+            except ModelNotTrained:
                 return JsonResponse({'error': 'Model not trained yet. Please click "Train Model".'}, status=400)
-                
-            model = joblib.load(model_path)
-            prediction = model.predict([features])[0]
-            
-            levels = {0: 'Faible', 1: 'Moyen', 2: 'Elevé'}
+            except Overloaded:
+                return JsonResponse({'error': 'Service surchargé, veuillez réessayer.'}, status=503)
             
             # Save history if user is authenticated
-            if request.user.is_authenticated:
+            user = await request.auser()
+            if user.is_authenticated:
                 try:
                     # Get source and destination from request if available (we need to update frontend to send them)
                     # For now, we'll store the coordinates as source
@@ -88,59 +148,363 @@ def predict(request):
                     dest_name = request.POST.get('dest_name')
                     
                     if source_name and dest_name:
-                        SearchHistory.objects.create(
-                            user=request.user,
-                            source=source_name,
-                            destination=dest_name
-                        )
-                except Exception as e:
-                    print(f"Error saving history: {e}")
-
-            return JsonResponse({'prediction': levels[int(prediction)]})
+                        # Written behind by a background thread, off the request path
+                        with span('history_write'):
+                            queued = record_search(user.id, source_name, dest_name)
+                        if not queued:
+                            logger.warning("Search history buffer full; search of user %s dropped", user.id)
+                except Exception:
+                    logger.exception("Error saving history")
+
+            with span('predict_encode'):
+                return JsonResponse({'prediction': LEVELS[int(prediction)]})
         except Exception as e:
             return JsonResponse({'error': f'Erreur de traitement : {str(e)}'}, status=400)
     
     return JsonResponse({'error': 'Invalid request'}, status=400)
 
 @login_required
+@require_POST
+def predict_batch(request):
+    """
+    Score many (lat, lng, hour, day_of_week) points at once.
+    Accepts a JSON array, NDJSON or CSV body; streams NDJSON back, or CSV
+    with ?format=csv (or Accept: text/csv), one chunk at a time.
+    """
+    output_format = request.GET.get('format')
+    if output_format is None:
+        output_format = 'csv' if 'text/csv' in request.headers.get('Accept', '') else 'ndjson'
+    if output_format not in ('ndjson', 'csv'):
+        return JsonResponse({'error': 'Format inconnu (ndjson ou csv).'}, status=400)
+
+    chunk_size = getattr(settings, 'BATCH_PREDICTION_CHUNK_SIZE', 10000)
+    chunks = iter_input_chunks(request, request.content_type, chunk_size)
+    # Parse and score the first chunk up front so bad input gets a proper 400
+    try:
+        first = score_chunk(next(chunks))
+    except StopIteration:
+        first = None
+    except InvalidInput as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    except ModelNotTrained:
+        return JsonResponse({'error': 'Model not trained'}, status=400)
+    except Exception as e:
+        return JsonResponse({'error': f'Erreur de traitement : {str(e)}'}, status=400)
+
+    def body():
+        if first is not None:
+            yield render_chunk(first, output_format, True)
+            yield from stream_predictions(chunks, output_format, first=False)
+
+    content_type = 'text/csv; charset=utf-8' if output_format == 'csv' else 'application/x-ndjson; charset=utf-8'
+    return StreamingHttpResponse(body(), content_type=content_type)
+
+def _trend_revision(request):
+    # The model serving the point: a retrain changes every trend
+    version, model = model_entry(locate_region(float(request.GET.get('lat')), float(request.GET.get('lng'))))
+    return version if model is not None else None
+
+@login_required
+@conditional(_trend_revision, model_cache_control)
 def predict_trend(request):
     """
     Get 24h traffic trend prediction for a specific location.
+    With ?mode=week, return the full 7x24 matrix (Monday first) instead.
     """
     try:
         lat = float(request.GET.get('lat'))
         lng = float(request.GET.get('lng'))
         day_of_week = int(request.GET.get('day_of_week', 4)) # Default to Friday
-        
-        model_path = settings.MODELS_ROOT / 'traffic_model.pkl'
-        if not model_path.exists():
+        mode = request.GET.get('mode', 'day')
+        if mode not in ('day', 'week'):
+            return JsonResponse({'error': 'Mode inconnu (day ou week).'}, status=400)
+
+        version, model = model_entry(locate_region(lat, lng))
+        if model is None:
             return JsonResponse({'error': 'Model not trained'}, status=400)
-            
-        model = joblib.load(model_path)
-        is_weekend = 1 if day_of_week >= 5 else 0
-        
-        trend_data = []
-        for hour in range(24):
-            features = [lat, lng, hour, day_of_week, is_weekend]
-            # Probabilities if available, or just the class
-            # Many classifiers don't support predict_proba by default depending on training
-            # We'll use the class and add some noise for a smoother visualization if it's class-only
-            pred_class = int(model.predict([features])[0])
-            # Map classes to intensity scores (0-100)
-            # Low=20, Moyen=50, High=80
-            intensity = 20 if pred_class == 0 else (50 if pred_class == 1 else 80)
-            
-            # Add a bit of peak hour bias manually if the model is too simple
-            # (In a real system, the model should learn this, but here it helps stability)
-            if (hour >= 7 and hour <= 9) or (hour >= 17 and hour <= 19):
-                intensity = max(intensity, 70)
-                
-            trend_data.append(intensity)
-            
-        return JsonResponse({'trend': trend_data})
+
+        if mode == 'week':
+            return JsonResponse({'week': get_weekly_trend(model, version, lat, lng)})
+
+        return JsonResponse({'trend': get_daily_trend(model, version, lat, lng, day_of_week)})
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+def congestion(request):
+    """
+    Precomputed congestion levels inside a bbox for one hour, read from the
+    prediction grid without calling the model. With regions, the grid of the
+    region holding the bbox centre answers.
+    bbox is "south,west,north,east".
+    """
+    try:
+        south, west, north, east = map(float, request.GET.get('bbox').split(','))
+        hour = int(request.GET.get('hour'))
+        day_of_week = int(request.GET.get('day_of_week'))
+        if not (0 <= hour < 24 and 0 <= day_of_week < 7):
+            return JsonResponse({'error': 'Heure ou jour invalide.'}, status=400)
+
+        try:
+            region = locate_region((south + north) / 2, (west + east) / 2)
+        except OutsideRegions as e:
+            return JsonResponse({'error': str(e)}, status=400)
+        grid = prediction_grid(region)
+        if grid is None:
+            return JsonResponse({'error': 'Prediction grid not built'}, status=400)
+
+        lat0, lng0, levels, intensity = grid.query_bbox(south, west, north, east, hour, day_of_week)
+        return JsonResponse({
+            'version': grid.version,
+            'origin': [round(lat0, 6), round(lng0, 6)],
+            'step': grid.step,
+            'levels': levels.tolist(),
+            'intensity': intensity.tolist(),
+        })
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=400)
 
+def route(request):
+    """
+    Congestion-aware itinerary on the local road graph, in the same shape as
+    an OSRM response with geometries=geojson.
+    start and end are "lat,lng"; hour and day_of_week default to now.
+    """
+    try:
+        start = tuple(map(float, request.GET.get('start').split(',')))
+        end = tuple(map(float, request.GET.get('end').split(',')))
+        now = timezone.localtime()
+        hour = int(request.GET.get('hour', now.hour))
+        day_of_week = int(request.GET.get('day_of_week', now.weekday()))
+        alternatives = min(int(request.GET.get('alternatives', 1)), 5)
+        if len(start) != 2 or len(end) != 2:
+            return JsonResponse({'error': 'Coordonnées invalides.'}, status=400)
+        if not (0 <= hour < 24 and 0 <= day_of_week < 7) or alternatives < 1:
+            return JsonResponse({'error': 'Heure ou jour invalide.'}, status=400)
+
+        return JsonResponse(find_routes(start, end, hour, day_of_week, alternatives))
+    except NoRoute as e:
+        return JsonResponse({'code': 'NoRoute', 'error': str(e)}, status=404)
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+@require_POST
+def score_routes(request):
+    """
+    Rank candidate itineraries by predicted congestion. JSON body:
+    {"routes": [...], "hour": 8, "day_of_week": 0, "spacing": 50}, each route
+    an OSRM route object, a GeoJSON LineString, an encoded polyline or a list
+    of [lng, lat]. Returns per-segment congestion, adjusted ETA and ranking.
+    """
+    try:
+        payload = json.loads(request.body)
+    except ValueError:
+        return JsonResponse({'error': 'JSON invalide'}, status=400)
+    if not isinstance(payload, dict):
+        return JsonResponse({'error': 'JSON invalide'}, status=400)
+    try:
+        now = timezone.localtime()
+        hour = int(payload.get('hour', now.hour))
+        day_of_week = int(payload.get('day_of_week', now.weekday()))
+        spacing = payload.get('spacing')
+        spacing = float(spacing) if spacing is not None else None
+        precision = int(payload.get('precision', 5))
+    except (TypeError, ValueError):
+        return JsonResponse({'error': 'Paramètres invalides.'}, status=400)
+    if not (0 <= hour < 24 and 0 <= day_of_week < 7):
+        return JsonResponse({'error': 'Heure ou jour invalide.'}, status=400)
+
+    try:
+        with span('route_scoring'):
+            return JsonResponse(score_route_alternatives(payload.get('routes'), hour, day_of_week, spacing, precision))
+    except InvalidRoute as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    except ModelNotTrained:
+        return JsonResponse({'error': 'Model not trained'}, status=400)
+
+def incidents(request):
+    """
+    GET: active incidents in bbox=south,west,north,east, most severe first,
+    read from the worker's in-memory index. POST (signed in): report one
+    incident or a list, as {kind, severity, lat, lng, description, ttl}.
+    """
+    store = get_incident_store()
+    if request.method == 'POST':
+        if not request.user.is_authenticated:
+            return JsonResponse({'error': 'Connexion requise.'}, status=403)
+        try:
+            reported = parse_incidents(json.loads(request.body))
+        except InvalidIncident as e:
+            return JsonResponse({'error': str(e)}, status=400)
+        except ValueError:
+            return JsonResponse({'error': 'JSON invalide'}, status=400)
+        return JsonResponse({'incidents': store.report(reported, request.user)}, status=201)
+
+    try:
+        south, west, north, east = map(float, request.GET.get('bbox', '').split(','))
+        limit = int(request.GET['limit']) if request.GET.get('limit') else None
+    except ValueError:
+        return JsonResponse({'error': 'Paramètre bbox invalide (sud,ouest,nord,est).'}, status=400)
+    if not (south <= north and west <= east) or (limit is not None and limit < 1):
+        return JsonResponse({'error': 'Paramètre bbox invalide (sud,ouest,nord,est).'}, status=400)
+    with span('incident_query'):
+        return JsonResponse(store.query(south, west, north, east, limit))
+
+@login_required
+@require_POST
+def resolve_incident(request, incident_id):
+    """
+    End an active incident before its expiry: one the user reported, or any for staff.
+    """
+    if not get_incident_store().resolve(incident_id, request.user):
+        return JsonResponse({'error': 'Incident introuvable ou déjà terminé.'}, status=404)
+    return JsonResponse({'status': 'success'})
+
+async def clusters(request):
+    """
+    Markers of one layer (vehicles, incidents or hotspots) for the map
+    viewport: bbox=south,west,north,east and zoom. Below CLUSTER_MAX_ZOOM
+    points are grouped per grid cell, with their count and congestion level;
+    tiles are cached per snapshot. Vehicles need ASGI, like the fleet stream.
+    """
+    layer = request.GET.get('layer', 'incidents')
+    if layer not in LAYERS:
+        return JsonResponse({'error': f"Couche inconnue ({', '.join(LAYERS)})."}, status=400)
+    try:
+        south, west, north, east = map(float, request.GET.get('bbox', '').split(','))
+        zoom = int(request.GET.get('zoom', ''))
+    except ValueError:
+        return JsonResponse({'error': 'Paramètres bbox (sud,ouest,nord,est) et zoom requis.'}, status=400)
+
+    if layer == 'vehicles':
+        if not isinstance(request, ASGIRequest):
+            return JsonResponse({'error': 'Flux disponible uniquement via ASGI.'}, status=501)
+        build = functools.partial(vehicle_index, await get_fleet_hub().snapshot())
+    else:
+        build = incident_index if layer == 'incidents' else hotspot_index
+    try:
+        with span('clustering', layer=layer):
+            # Building a zoom is CPU work and incidents may need the database: off the loop
+            result = await sync_to_async(lambda: cluster_viewport(build(), south, west, north, east, zoom))()
+    except InvalidViewport as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    result['layer'] = layer
+    return JsonResponse(result)
+
+def geocode(request):
+    """
+    Place search for the address fields, answered from the local gazetteer
+    and cache before asking Nominatim. Same result shape as Nominatim /search.
+    """
+    query = request.GET.get('q', '').strip()
+    if not query:
+        return JsonResponse({'error': 'Paramètre q manquant.'}, status=400)
+    try:
+        limit = min(max(int(request.GET.get('limit', 1)), 1), 10)
+    except ValueError:
+        return JsonResponse({'error': 'Limite invalide.'}, status=400)
+    try:
+        return JsonResponse(get_geocoder().search(query, limit), safe=False)
+    except (OSError, ValueError) as e:
+        return JsonResponse({'error': f'Service de géocodage indisponible : {e}'}, status=502)
+
+def reverse_geocode(request):
+    """
+    Name of the place at lat/lng. Same result shape as Nominatim /reverse.
+    """
+    try:
+        lat = float(request.GET.get('lat'))
+        lng = float(request.GET.get('lng'))
+    except (TypeError, ValueError):
+        return JsonResponse({'error': 'Coordonnées invalides.'}, status=400)
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        return JsonResponse({'error': 'Coordonnées invalides.'}, status=400)
+    try:
+        place = get_geocoder().reverse(lat, lng)
+    except (OSError, ValueError) as e:
+        # ValueError: an upstream answer that is not JSON
+        return JsonResponse({'error': f'Service de géocodage indisponible : {e}'}, status=502)
+    if place is None:
+        return JsonResponse({'error': 'Lieu inconnu'}, status=404)
+    return JsonResponse(place)
+
+async def fleet_stream(request):
+    """
+    Server-sent events from the shared fleet simulation: a keyframe, then one
+    delta frame per tick (base64 binary, see fleet_simulation.FrameEncoder).
+    Only served by the ASGI application.
+    """
+    if not isinstance(request, ASGIRequest):
+        return JsonResponse({'error': 'Flux disponible uniquement via ASGI.'}, status=501)
+    hub = get_fleet_hub()
+    queue = await hub.subscribe()
+
+    async def events():
+        try:
+            yield "retry: 3000\n\n"
+            while True:
+                yield encode_event(await queue.get())
+        finally:
+            hub.unsubscribe(queue)
+
+    response = StreamingHttpResponse(events(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+def fleet_status(request):
+    """
+    Tick time and frame size of the running fleet simulations.
+    """
+    return JsonResponse({'simulations': fleet_stats()})
+
+@csrf_exempt
+@require_POST
+def ingest_telemetry(request):
+    """
+    Batched vehicle telemetry: a JSON array of {id, lat, lng, speed, timestamp}
+    points (or {"points": [...]}). Points are buffered and written in bulk;
+    answers 202 once they are queued. Devices authenticate with the
+    X-Telemetry-Token header; without a TELEMETRY_TOKEN, ingestion is only
+    open while DEBUG.
+    """
+    token = getattr(settings, 'TELEMETRY_TOKEN', None)
+    if not token:
+        if not settings.DEBUG:
+            return JsonResponse({'error': 'Ingestion de télémétrie non configurée.'}, status=503)
+    elif not hmac.compare_digest(request.headers.get('X-Telemetry-Token', '').encode(), token.encode()):
+        return JsonResponse({'error': 'Jeton de télémétrie invalide.'}, status=403)
+    try:
+        payload = json.loads(request.body)
+    except ValueError:
+        return JsonResponse({'error': 'JSON invalide'}, status=400)
+    try:
+        if isinstance(payload, dict):
+            payload = payload.get('points')
+        df = parse_points(payload)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    store = get_telemetry_store()
+    try:
+        accepted = store.ingest(df)
+    except BufferFull:
+        return JsonResponse({'error': 'Serveur surchargé, réessayez.'}, status=503)
+    return JsonResponse({'accepted': accepted, 'pending': store.buffer.pending}, status=202)
+
+def telemetry_stats(request):
+    """
+    Live figures over the telemetry window (vehicles, average speed, per-cell
+    counts), read from in-memory rolling aggregates.
+    """
+    return JsonResponse(get_telemetry_store().stats())
+
+def metrics(request):
+    """
+    Latency histograms, spans and component counters of this worker, in the
+    Prometheus text format.
+    """
+    return HttpResponse(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
 def login_view(request):
     if request.method == 'POST':
         import json
@@ -201,16 +565,30 @@ def add_favorite(request):
         return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
 
 @login_required
+@conditional(lambda request: user_data_revision(request.user))
 def get_user_data(request):
+    """
+    Favorites and search history, newest first, one page each. Pass back
+    favorites_next / history_next as favorites_cursor / history_cursor for
+    the following page.
+    """
     try:
-        favorites = Favorite.objects.filter(user=request.user).order_by('-created_at').values('id', 'name', 'source', 'destination')
-        history = SearchHistory.objects.filter(user=request.user).order_by('-timestamp')[:10].values('id', 'source', 'destination', 'timestamp')
-        
+        limit = parse_limit(request.GET.get('limit'))
+        favorites, favorites_next = keyset_page(
+            Favorite.objects.filter(user=request.user), 'created_at', ('name', 'source', 'destination', 'created_at'),
+            request.GET.get('favorites_cursor'), limit,
+        )
+        history, history_next = history_page(request.user, request.GET.get('history_cursor'), limit)
+
         return JsonResponse({
             'status': 'success',
-            'favorites': list(favorites),
-            'history': list(history)
+            'favorites': favorites,
+            'favorites_next': favorites_next,
+            'history': history,
+            'history_next': history_next,
         })
+    except InvalidPage:
+        return JsonResponse({'status': 'error', 'message': 'Curseur ou limite invalide'}, status=400)
     except Exception as e:
         return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
 